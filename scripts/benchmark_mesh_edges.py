@@ -0,0 +1,62 @@
+"""
+Compares vectorized Mesh edge extraction against the original python set loop.
+
+usage: python benchmark_mesh_edges.py [--grid N] [--legacy-grid N]
+"""
+
+import argparse
+import time
+
+import numpy
+
+from wiggle.geometry.mesh import Mesh
+
+
+def grid_mesh(grid):
+    """A grid x grid sheet of quads"""
+    mesh = Mesh('grid')
+    i, j = numpy.meshgrid(numpy.arange(grid + 1), numpy.arange(grid + 1))
+    mesh.append_vertexes(numpy.stack((i.ravel(), j.ravel(), numpy.zeros(i.size)), axis=1))
+    a = (numpy.arange(grid)[None, :] + (grid + 1) * numpy.arange(grid)[:, None]).ravel()
+    mesh.append_faces(numpy.stack((a, a + 1, a + grid + 2, a + grid + 1), axis=1))
+    return mesh
+
+
+def legacy_edges(mesh):
+    """The per-corner set loop formerly used by Mesh.edges"""
+    e = set()
+    for f in mesh.faces:
+        f = f.tolist()
+        prev = f[-1]
+        for i in range(len(f)):
+            v = f[i]
+            e.add(tuple(sorted((v, prev))))
+            prev = v
+    return sorted(e)
+
+
+def measure(label, function, mesh):
+    start = time.perf_counter()
+    result = function(mesh)
+    elapsed = time.perf_counter() - start
+    print(f'{label:>12}: {len(mesh.faces):9d} faces, {len(result):9d} edges, {elapsed:8.3f} s')
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--grid', type=int, default=1000, help='quads per side for the vectorized run')
+    parser.add_argument('--legacy-grid', type=int, default=300, help='quads per side for the slow legacy run')
+    args = parser.parse_args()
+    small = grid_mesh(args.legacy_grid)
+    legacy = measure('legacy', legacy_edges, small)
+    vectorized = measure('vectorized', lambda m: m.edges, small)
+    print(f'speedup: {legacy / vectorized:.1f}x')
+    large = grid_mesh(args.grid)
+    measure('vectorized', lambda m: m.edges, large)
+    measure('adjacency', lambda m: m.adjacency.edge_faces, large)
+    measure('cached', lambda m: m.edges, large)
+
+
+if __name__ == '__main__':
+    main()
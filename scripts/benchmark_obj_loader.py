@@ -0,0 +1,102 @@
+"""
+Compares the bulk numpy OBJ reader against the original line-by-line parser.
+
+usage: python benchmark_obj_loader.py [--grid N] [file.obj]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from wiggle.geometry.mesh.obj import load_obj_arrays
+
+
+def synthetic_obj(grid):
+    """OBJ text for a grid x grid sheet of quads, in v//vn format"""
+    lines = ['o sheet', 'vn 0 0 1']
+    for j in range(grid + 1):
+        for i in range(grid + 1):
+            lines.append(f'v {i / grid:.6f} {j / grid:.6f} 0.000000')
+    for j in range(grid):
+        for i in range(grid):
+            a = j * (grid + 1) + i + 1
+            b = a + 1
+            c = b + grid + 1
+            d = a + grid + 1
+            lines.append(f'f {a}//1 {b}//1 {c}//1 {d}//1')
+    lines.append('')
+    return '\n'.join(lines)
+
+
+def legacy_load_obj(stream):
+    """The per-line parser formerly used by Mesh.load_obj"""
+    vertexes = []
+    vertex_normals = []
+    normal_for_vertex = dict()
+    faces = []
+    for line in stream:
+        if line.startswith('#'):
+            continue
+        elif line.startswith('o '):
+            continue
+        elif line.startswith('v '):
+            vertexes.append([float(x) for x in line.split()[1:4]])
+        elif line.startswith('vn '):
+            vertex_normals.append([float(x) for x in line.split()[1:4]])
+        elif line.startswith('s '):
+            continue
+        elif line.startswith('f '):
+            face = list()
+            for c in line.split()[1:]:
+                v, n = [int(x) for x in c.split('/')[0:3:2]]
+                face.append(v - 1)
+                normal_for_vertex[v - 1] = vertex_normals[n - 1]
+                faces.append(face)
+    return vertexes, faces
+
+
+def bulk_load_obj(stream):
+    obj = load_obj_arrays(stream)
+    return obj.positions, obj.triangles()
+
+
+def measure(label, loader, file_name, mode):
+    start = time.perf_counter()
+    with open(file_name, mode) as stream:
+        loader(stream)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    with open(file_name, mode) as stream:
+        loader(stream)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f'{label:>8}: {elapsed:8.3f} s, peak python allocation {peak / 2**20:8.1f} MiB')
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('file_name', nargs='?', help='OBJ file to load instead of a synthetic grid')
+    parser.add_argument('--grid', type=int, default=500, help='synthetic grid size, in quads per side')
+    args = parser.parse_args()
+    file_name = args.file_name
+    if file_name is None:
+        with tempfile.NamedTemporaryFile('w', suffix='.obj', delete=False) as f:
+            f.write(synthetic_obj(args.grid))
+            file_name = f.name
+        print(f'synthetic grid with {args.grid * args.grid} quads')
+    else:
+        print(file_name)
+    try:
+        legacy = measure('legacy', legacy_load_obj, file_name, 'r')
+        bulk = measure('bulk', bulk_load_obj, file_name, 'rb')
+        print(f'speedup: {legacy / bulk:.1f}x')
+    finally:
+        if args.file_name is None:
+            os.remove(file_name)
+
+
+if __name__ == '__main__':
+    main()
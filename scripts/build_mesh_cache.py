@@ -0,0 +1,32 @@
+"""
+Precompute binary mesh caches, including triangulated draw primitives, for OBJ files.
+
+usage: python build_mesh_cache.py [--cache-dir DIR] [--optimize] file.obj [file.obj ...]
+"""
+
+import argparse
+import logging
+import time
+
+from wiggle.geometry.mesh.cache import cache_file_name, load_obj_cached
+from wiggle.geometry.mesh.optimize import face_cache_statistics
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('file_names', nargs='+', metavar='file.obj')
+    parser.add_argument('--cache-dir', default=None, help='where to write caches, instead of next to each file')
+    parser.add_argument('--optimize', action='store_true', help='reorder faces and vertexes for faster drawing')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    for file_name in args.file_names:
+        start = time.perf_counter()
+        obj = load_obj_cached(file_name, cache_dir=args.cache_dir, build_draw_primitives=True, optimize=args.optimize)
+        elapsed = time.perf_counter() - start
+        print(f'{cache_file_name(file_name, args.cache_dir)}: {len(obj.positions)} vertexes, '
+              f'{obj.face_count} faces, {len(obj.primitives)} {obj.primitives.mode} indexes, {elapsed:.2f} s')
+        print(f'  vertex cache: {face_cache_statistics(obj.face_offsets, obj.face_vertexes)}')
+
+
+if __name__ == '__main__':
+    main()
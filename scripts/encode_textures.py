@@ -0,0 +1,37 @@
+"""
+Encode JPEG or PNG images into BC1 compressed KTX sidecar files, which Texture loads instead of the images.
+
+usage: python encode_textures.py image.jpg [image.jpg ...]
+"""
+
+import argparse
+import logging
+import time
+
+from PIL import Image
+
+from wiggle.material.texture_compression import compressed_cache_file_name, encode_texture_file
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('file_names', nargs='+', metavar='image.jpg')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    Image.MAX_IMAGE_PIXELS = None  # large panoramas are the point
+    for file_name in args.file_names:
+        start = time.perf_counter()
+        try:
+            compressed = encode_texture_file(file_name)
+        except ValueError as error:
+            print(f'{file_name}: skipped, {error}')
+            continue
+        elapsed = time.perf_counter() - start
+        uncompressed = compressed.width * compressed.height * 4 * 4 // 3  # RGBA8, with mipmaps
+        print(f'{compressed_cache_file_name(file_name)}: {compressed.width}x{compressed.height}, '
+              f'{len(compressed.levels)} levels, {compressed.nbytes / 2**20:.1f} MB '
+              f'({uncompressed / compressed.nbytes:.1f}x smaller than RGBA), {elapsed:.2f} s')
+
+
+if __name__ == '__main__':
+    main()
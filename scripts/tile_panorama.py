@@ -0,0 +1,31 @@
+"""
+Cut an equirectangular panorama into a tile pyramid, for viewing as a virtual texture.
+
+usage: python tile_panorama.py [--tile-size N] [--format jpg|png] image.jpg output_directory
+"""
+
+import argparse
+import time
+
+from PIL import Image
+
+from wiggle.material.tile_pyramid import DEFAULT_TILE_SIZE, build_tile_pyramid
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('file_name', metavar='image.jpg')
+    parser.add_argument('directory', metavar='output_directory')
+    parser.add_argument('--tile-size', type=int, default=DEFAULT_TILE_SIZE, help='pixels across each tile')
+    parser.add_argument('--format', default='jpg', choices=('jpg', 'png'), help='tile image file format')
+    args = parser.parse_args()
+    Image.MAX_IMAGE_PIXELS = None  # gigapixel panoramas are the point
+    start = time.perf_counter()
+    pyramid = build_tile_pyramid(args.file_name, args.directory, tile_size=args.tile_size, format=args.format)
+    elapsed = time.perf_counter() - start
+    tile_count = sum(columns * rows for columns, rows in pyramid.grid_sizes)
+    print(f'{args.directory}: {pyramid.level_count} levels, {tile_count} tiles, {elapsed:.2f} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+Shared test scaffolding for OpenGL.
+
+GlRecorder stands in for OpenGL.GL where no context is needed. Tests that
+need real rendering run a script in a subprocess, which creates a Mesa
+context through EGL without a window, after EGL_SCRIPT_HEADER.
+"""
+
+import os
+import subprocess
+import sys
+import textwrap
+
+# Makes an OpenGL 4.3 context current, or exits with status 77, which run_gl_script() turns into a skip
+EGL_SCRIPT_HEADER = textwrap.dedent('''
+    import sys
+    from OpenGL import EGL, GL
+    display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+    if not EGL.eglInitialize(display, None, None):
+        sys.exit(77)
+    EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+    # No config and no surface, as with Mesa's surfaceless platform
+    context = EGL.eglCreateContext(display, None, EGL.EGL_NO_CONTEXT, (EGL.EGLint * 5)(
+        EGL.EGL_CONTEXT_MAJOR_VERSION, 4, EGL.EGL_CONTEXT_MINOR_VERSION, 3, EGL.EGL_NONE))
+    if not context or not EGL.eglMakeCurrent(display, None, None, context):
+        sys.exit(77)
+''')
+
+
+class GlRecorder(object):
+    """Stands in for OpenGL.GL without a context, remembering the calls"""
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        if name.startswith('GL_'):
+            return name
+        def record(*args):
+            self.calls.append((name, ) + args)
+        return record
+
+
+def run_gl_script(test_case, script, *args, skip_reason='no OpenGL 4.3 context available'):
+    """
+    Standard output of a python script, starting with EGL_SCRIPT_HEADER, run
+    with this checkout on the path. Skips test_case where EGL has no context.
+    """
+    env = dict(os.environ, PYOPENGL_PLATFORM='egl')
+    env.setdefault('EGL_PLATFORM', 'surfaceless')
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join([root, env.get('PYTHONPATH', '')])
+    result = subprocess.run(
+        [sys.executable, '-c', script] + list(args), env=env, capture_output=True, text=True, timeout=120)
+    if result.returncode == 77 or 'EGL' in result.stderr and result.returncode != 0:
+        test_case.skipTest(skip_reason)
+    test_case.assertEqual(result.returncode, 0, result.stderr)
+    return result.stdout
@@ -0,0 +1,71 @@
+import os
+import tempfile
+import unittest
+
+import numpy
+from PIL import Image
+
+from wiggle.material.cube_map import (
+    CubeMapCache, equirect_to_cube_map, face_directions, prefilter_rows, sample_equirect)
+
+
+def _quadrant_image(width=64, height=32):
+    """Equirectangular image, red in the northern hemisphere, blue in the southern, with green toward -Z"""
+    pixels = numpy.zeros((height, width, 4), dtype=numpy.uint8)
+    pixels[..., 3] = 255
+    pixels[:height // 2, :, 0] = 255
+    pixels[height // 2:, :, 2] = 255
+    pixels[:, 3 * width // 8:5 * width // 8, 1] = 255
+    return pixels
+
+
+class TestCubeMap(unittest.TestCase):
+    def test_face_centers(self):
+        zero = numpy.zeros(1)
+        expected = [(1, 0, 0), (-1, 0, 0), (0, 1, 0), (0, -1, 0), (0, 0, 1), (0, 0, -1)]
+        for face, direction in enumerate(expected):
+            self.assertEqual(tuple(float(c[0]) for c in face_directions(face, zero, zero)), direction)
+
+    def test_sample_equirect(self):
+        pixels = _quadrant_image()
+        # Straight ahead, down -Z, is the middle of the image, above the equator by a little
+        color = sample_equirect(pixels, numpy.array(0.0), numpy.array(0.1), numpy.array(-1.0))
+        self.assertEqual(tuple(color.astype(int)), (255, 255, 0, 255))
+        color = sample_equirect(pixels, numpy.array(0.0), numpy.array(-0.1), numpy.array(1.0))
+        self.assertEqual(tuple(color.astype(int)), (0, 0, 255, 255))
+
+    def test_faces(self):
+        faces = equirect_to_cube_map(_quadrant_image(), face_size=8)
+        self.assertEqual(faces.shape, (6, 8, 8, 4))
+        self.assertTrue(numpy.all(faces[2, ..., 0] == 255))  # +Y is north
+        self.assertTrue(numpy.all(faces[3, ..., 2] == 255))  # -Y is south
+        # -Z face: green in the middle, red above blue, in OpenGL row order
+        self.assertEqual(tuple(faces[5, 4, 4]), (0, 255, 255, 255))
+        self.assertEqual(tuple(faces[5, 3, 4]), (255, 255, 0, 255))
+        self.assertEqual(faces[4, 4, 4, 1], 0)
+
+    def test_prefilter_rows(self):
+        pixels = numpy.zeros((8, 16, 4), dtype=numpy.uint8)
+        pixels[:, ::2] = 200
+        filtered = prefilter_rows(pixels, footprint=0.8)
+        # The top row averages over 4 texels; rows near the equator are untouched
+        numpy.testing.assert_array_equal(filtered[3:5], pixels[3:5])
+        self.assertTrue(numpy.all(filtered[0] == 100))
+        self.assertTrue(numpy.all(prefilter_rows(numpy.full((8, 16, 4), 7, dtype=numpy.uint8), 3.0) == 7))
+
+    def test_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file_name = os.path.join(directory, 'pano.png')
+            Image.fromarray(_quadrant_image()).save(file_name)
+            cache = CubeMapCache(os.path.join(directory, 'cache'))
+            faces = cache.load(file_name)
+            self.assertEqual(faces.shape, (6, 16, 16, 4))
+            self.assertEqual((cache.hit_count, cache.miss_count), (0, 1))
+            cached = cache.load(file_name)
+            self.assertEqual((cache.hit_count, cache.miss_count), (1, 1))
+            numpy.testing.assert_array_equal(cached, faces)
+            # A changed image misses the cache
+            Image.fromarray(_quadrant_image()[::-1]).save(file_name)
+            cache.load(file_name)
+            self.assertEqual(cache.miss_count, 2)
+            del cached
@@ -0,0 +1,152 @@
+import unittest
+
+import numpy
+
+from wiggle.geometry.bounds import Bounds, boxes_in_frustum, frustum_planes, spheres_in_frustum, transform_boxes
+from wiggle.geometry.bvh import BoundingVolumeHierarchy, ray_box_distance, ray_box_distances
+from wiggle.geometry.camera import PerspectiveCamera
+from wiggle.geometry.matrix import Matrix4f
+from wiggle.geometry.mesh import CubeMesh
+from wiggle.render.base_actor import BaseActor
+from wiggle.render.mesh_actor import MeshActor
+from wiggle.render.renderer import Renderer
+from wiggle.render.skysphere_actor import SkySphereActor
+
+
+class TestBounds(unittest.TestCase):
+    def test_mesh_bounds(self):
+        mesh = CubeMesh()
+        bounds = mesh.bounds
+        numpy.testing.assert_allclose(bounds.box_min, (-0.5, -0.5, -0.5))
+        numpy.testing.assert_allclose(bounds.box_max, (0.5, 0.5, 0.5))
+        numpy.testing.assert_allclose(bounds.radius, 0.75 ** 0.5)
+        self.assertIs(mesh.bounds, bounds)
+        mesh.append_vertexes(((5, 0, 0), ))
+        self.assertEqual(mesh.bounds.box_max[0], 5)
+
+    def test_frustum(self):
+        camera = PerspectiveCamera()
+        planes = frustum_planes(numpy.dot(camera.projection, camera.view_matrix))
+        # camera is at z=10, looking toward -z; z_far is 100
+        centers = numpy.array(((0, 0, 0), (0, 0, 20), (0, 0, -200), (50, 0, 0), (0, 0, -85)))
+        numpy.testing.assert_array_equal(
+            spheres_in_frustum(planes, centers, numpy.ones(5)), (True, False, False, False, True))
+        numpy.testing.assert_array_equal(spheres_in_frustum(planes, centers[3:4], (45, )), (True, ))
+        box_mins, box_maxs = transform_boxes(
+            numpy.stack((Matrix4f.translation(0, 0, -5).m, Matrix4f.translation(0, 0, 15).m)),
+            -numpy.ones((2, 3)), numpy.ones((2, 3)))
+        numpy.testing.assert_allclose(box_mins[0], (-1, -1, -6))
+        numpy.testing.assert_array_equal(boxes_in_frustum(planes, box_mins, box_maxs), (True, False))
+
+
+class TestCulling(unittest.TestCase):
+    def test_opaque_pass_culls(self):
+        renderer = Renderer()
+        camera = PerspectiveCamera()
+        cubes = []
+        for x in range(-25, 30, 5):
+            cube = MeshActor(mesh=CubeMesh())
+            cube.model_center = (x, 0, 0)
+            renderer.add_actor(cube)
+            cubes.append(cube)
+        sky = SkySphereActor()
+        renderer.add_actor(sky)
+        unbounded = BaseActor()
+        unbounded.model_center = (1000, 0, 0)
+        renderer.add_actor(unbounded)
+        drawn = renderer.opaque_pass.visible_children(camera)
+        # The cubes at x = +-5 pass the sphere test, but not the box test
+        self.assertEqual(renderer.opaque_pass.culler.culled_count, 10)
+        self.assertEqual(drawn, [cubes[5], sky, unbounded])
+        # Moving an actor, through the scene graph, moves its bounds
+        cubes[0].model_center = (0, 0, 5)
+        self.assertIn(cubes[0], renderer.opaque_pass.visible_children(camera=camera))
+        # Without a camera, nothing is culled
+        self.assertEqual(len(renderer.opaque_pass.visible_children()), 13)
+
+    def test_culling_without_scene_graph(self):
+        camera = PerspectiveCamera()
+        renderer = Renderer()
+        near = MeshActor(mesh=CubeMesh())
+        far = MeshActor(mesh=CubeMesh())
+        far.model_center = (0, 0, -500)
+        renderer.opaque_pass.children.extend((near, far))
+        self.assertEqual(renderer.opaque_pass.visible_children(camera), [near])
+        self.assertIsInstance(near.local_bounds, Bounds)
+
+
+class TestBoundingVolumeHierarchy(unittest.TestCase):
+    def setUp(self):
+        rng = numpy.random.default_rng(3)
+        centers = rng.uniform(-50, 50, size=(500, 3))
+        sizes = rng.uniform(0.1, 3, size=(500, 3))
+        self.box_mins = centers - sizes
+        self.box_maxs = centers + sizes
+        self.bvh = BoundingVolumeHierarchy(self.box_mins, self.box_maxs)
+
+    def test_frustum_query(self):
+        camera = PerspectiveCamera()
+        for axis in ((0, 1, 0), (1, 0, 0), (0, 1, 0)):
+            camera.rotate(axis, 1.0)
+            planes = frustum_planes(numpy.dot(camera.projection, camera.view_matrix))
+            expected = numpy.flatnonzero(boxes_in_frustum(planes, self.box_mins, self.box_maxs))
+            numpy.testing.assert_array_equal(self.bvh.frustum_query(planes), expected)
+
+    def test_refit(self):
+        offset = numpy.array((0, 0, 40))
+        self.bvh.refit(self.box_mins + offset, self.box_maxs + offset)
+        numpy.testing.assert_allclose(self.bvh.node_mins[0], self.box_mins.min(axis=0) + offset)
+        planes = frustum_planes(numpy.dot(PerspectiveCamera().projection, PerspectiveCamera().view_matrix))
+        expected = numpy.flatnonzero(boxes_in_frustum(planes, self.box_mins + offset, self.box_maxs + offset))
+        numpy.testing.assert_array_equal(self.bvh.frustum_query(planes), expected)
+
+    def test_ray_cast(self):
+        rng = numpy.random.default_rng(4)
+        for _ in range(20):
+            origin = rng.uniform(-60, 60, size=3)
+            direction = rng.normal(size=3)
+            distances = [ray_box_distance(origin, direction, a, b) for a, b in zip(self.box_mins, self.box_maxs)]
+            hits = [(t, i) for i, t in enumerate(distances) if t is not None]
+            near, far = ray_box_distances(origin, direction, self.box_mins, self.box_maxs)
+            self.assertEqual(numpy.flatnonzero((near <= far) & (far >= 0)).tolist(), [i for t, i in hits])
+            hit = self.bvh.ray_cast(origin, direction)
+            if len(hits) < 1:
+                self.assertIsNone(hit)
+            else:
+                self.assertAlmostEqual(hit[1], min(hits)[0])
+        # axis aligned rays divide by zero
+        hit = self.bvh.ray_cast(self.box_mins[7] - (1, 0, 0), (1, 0, 0))
+        self.assertIsNotNone(hit)
+
+    def test_mesh_ray_cast(self):
+        mesh = CubeMesh()
+        triangle, t = mesh.ray_cast((0.2, 0.1, 5), (0, 0, -1))
+        self.assertAlmostEqual(t, 4.5)
+        self.assertIsNone(mesh.ray_cast((2, 0, 5), (0, 0, -1)))
+
+    def test_renderer_pick(self):
+        renderer = Renderer()
+        camera = PerspectiveCamera()
+        near = MeshActor(mesh=CubeMesh())
+        near.model_center = (0, 0, 2)
+        near.model_scale = 2
+        far = MeshActor(mesh=CubeMesh())
+        renderer.add_actor(far)
+        renderer.add_actor(near)
+        origin, direction = camera.ray(0, 0)
+        numpy.testing.assert_allclose(origin, (0, 0, 10))
+        numpy.testing.assert_allclose(direction, (0, 0, -1), atol=1e-7)
+        actor, t = renderer.pick(origin, direction)
+        self.assertIs(actor, near)
+        self.assertAlmostEqual(t, 7)
+        near.model_center = (10, 0, 0)  # refit, not rebuild
+        bvh = renderer.opaque_pass.culler.hierarchy(renderer.opaque_pass.children).bvh
+        actor, t = renderer.pick(origin, direction)
+        self.assertIs(actor, far)
+        self.assertAlmostEqual(t, 9.5)
+        self.assertIs(renderer.opaque_pass.culler.hierarchy(renderer.opaque_pass.children).bvh, bvh)
+        self.assertIsNone(renderer.pick(origin, (0, 1, 0)))
+        # The center ray still passes through the focus after rotating
+        camera.rotate((0, 1, 0), 0.3)
+        origin, direction = camera.ray(0, 0)
+        numpy.testing.assert_allclose(origin + 10 * direction, (0, 0, 0), atol=1e-5)
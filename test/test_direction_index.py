@@ -0,0 +1,62 @@
+import unittest
+
+import numpy
+
+from wiggle.app.panosphere.panosphere import Panosphere
+from wiggle.geometry.direction_index import DirectionIndex
+
+
+class TestDirectionIndex(unittest.TestCase):
+    def setUp(self):
+        rng = numpy.random.default_rng(6)
+        self.directions = rng.normal(size=(3000, 3))
+        self.directions /= numpy.linalg.norm(self.directions, axis=1)[:, None]
+        self.index = DirectionIndex()
+        self.keys = [self.index.add(d, i) for i, d in enumerate(self.directions)]
+
+    def _brute_nearest(self, direction, max_angle, live):
+        direction = direction / numpy.linalg.norm(direction)
+        angles = numpy.arccos(numpy.clip(self.directions @ direction, -1, 1))
+        angles[~live] = numpy.inf
+        best = int(numpy.argmin(angles))
+        return best if angles[best] <= max_angle else None
+
+    def test_nearest(self):
+        rng = numpy.random.default_rng(7)
+        live = numpy.ones(len(self.directions), dtype=bool)
+        for max_angle in (0.01, 0.05, 0.2, 2.0):
+            for query in rng.normal(size=(50, 3)):
+                key = self.index.nearest(query, max_angle)
+                expected = self._brute_nearest(query, max_angle, live)
+                self.assertEqual(key if key is None else self.index.item(key), expected)
+
+    def test_remove_and_reuse(self):
+        live = numpy.ones(len(self.directions), dtype=bool)
+        for key in self.keys[::2]:
+            self.index.remove(key)
+            live[key] = False
+        self.assertEqual(len(self.index), 1500)
+        for d in self.directions[:20]:
+            key = self.index.nearest(d, 0.1)
+            self.assertEqual(self.index.item(key), self._brute_nearest(d, 0.1, live))
+        new_key = self.index.add((0, 0, 1), 'new')
+        self.assertIn(new_key, self.keys[::2])  # reuses a removed slot
+        self.assertEqual(self.index.item(self.index.nearest((0.001, 0, 1), 0.01)), 'new')
+        moved = self.index.move(new_key, (1, 0, 0))
+        self.assertEqual(self.index.item(self.index.nearest((1, 0.001, 0), 0.01)), 'new')
+        numpy.testing.assert_allclose(self.index.direction(moved), (1, 0, 0))
+
+    def test_within(self):
+        keys, angles = self.index.within(self.directions[0], 0.3)
+        self.assertEqual(keys[0], self.keys[0])
+        self.assertTrue(numpy.all(numpy.diff(angles) >= 0))
+        self.assertEqual(
+            len(keys), numpy.count_nonzero(self.directions @ self.directions[0] >= numpy.cos(0.3) - 1e-12))
+
+    def test_panosphere_point_near(self):
+        panosphere = Panosphere()
+        panosphere.add_vertical_line((0, 0, -1), (0, -0.1, -1))
+        point = panosphere.point_near(0, 0.001, -1, 0.01)
+        numpy.testing.assert_allclose(point.direction.pack(), (0, 0, -1))
+        self.assertTrue(point.is_adjusted)
+        self.assertIsNone(panosphere.point_near(1, 0, 0, 0.01))
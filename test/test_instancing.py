@@ -0,0 +1,64 @@
+import unittest
+from unittest import mock
+
+import numpy
+
+from wiggle.geometry.bounds import frustum_planes
+from wiggle.geometry.camera import PerspectiveCamera
+from wiggle.geometry.matrix import translation_matrices
+from wiggle.geometry.mesh import CubeMesh
+from wiggle.render.culling import ActorHierarchy
+from wiggle.render.instanced_mesh_actor import InstancedMeshActor
+from wiggle.render.mesh_actor import MeshActor, MeshVbo
+
+
+class TestMeshActorLod(unittest.TestCase):
+    @mock.patch.object(MeshVbo, 'init_gl')
+    def test_viewport_from_camera(self, _):
+        actor = MeshActor(mesh=CubeMesh())
+        actor.init_gl()
+        actor.lod_vbos.append(MeshVbo(CubeMesh()))
+        actor.lod_errors = [0.0, 0.01]
+        camera = PerspectiveCamera()
+        camera.viewport_size = (800, 10)
+        # Selection reads the viewport the camera carries, rather than querying OpenGL per actor
+        with mock.patch('OpenGL.GL.glGetIntegerv', side_effect=AssertionError('viewport queried')):
+            self.assertIs(actor._select_lod_vbo(camera), actor.lod_vbos[1])
+            camera.viewport_size = (800, 100000)
+            self.assertIs(actor._select_lod_vbo(camera), actor.lod_vbos[0])
+        actor.dispose_gl()
+
+
+class TestInstancedMeshActor(unittest.TestCase):
+    def setUp(self):
+        self.offsets = numpy.array(((0, 0, 0), (5, 0, 0), (0, 3, 0)), dtype=numpy.float32)
+        self.actor = InstancedMeshActor(mesh=CubeMesh(), instance_matrices=translation_matrices(self.offsets))
+
+    def test_instance_storage(self):
+        self.assertEqual(self.actor.instance_count, 3)
+        numpy.testing.assert_array_equal(self.actor.instance_matrices[1, :3, 3], (5, 0, 0))
+        # Uploaded column major, so translation is the last four floats of each matrix
+        numpy.testing.assert_array_equal(self.actor._columns[1, 3, :3], (5, 0, 0))
+        self.actor.set_instance_matrices(translation_matrices(((1, 1, 1), )), start=2)
+        self.actor.set_instance_matrices(translation_matrices(((2, 2, 2), )), start=0)
+        self.assertEqual(self.actor._dirty_range, (0, 3))
+        numpy.testing.assert_array_equal(self.actor.instance_matrices[2, :3, 3], (1, 1, 1))
+        with self.assertRaises(IndexError):
+            self.actor.set_instance_matrices(translation_matrices(((0, 0, 0), (0, 0, 0))), start=2)
+
+    def test_bounds_and_picking(self):
+        bounds = self.actor.local_bounds
+        numpy.testing.assert_allclose(bounds.box_min, (-0.5, -0.5, -0.5))
+        numpy.testing.assert_allclose(bounds.box_max, (5.5, 3.5, 0.5))
+        self.assertAlmostEqual(self.actor.ray_intersection((5, 0, 10), (0, 0, -1)), 9.5)
+        self.assertAlmostEqual(self.actor.ray_intersection((0, 3, -10), (0, 0, 2)), 4.75)
+        self.assertIsNone(self.actor.ray_intersection((2.5, 0, 10), (0, 0, -1)))
+
+    def test_culling_follows_instances(self):
+        camera = PerspectiveCamera()
+        planes = frustum_planes(numpy.dot(camera.projection, camera.view_matrix))
+        self.actor.instance_matrices = translation_matrices(((500, 0, 0), ))
+        hierarchy = ActorHierarchy([self.actor])
+        self.assertEqual(len(hierarchy.frustum_query(planes)), 0)
+        self.actor.set_instance_matrices(translation_matrices(((0, 0, 0), )))
+        self.assertEqual(len(hierarchy.frustum_query(planes)), 1)
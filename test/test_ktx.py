@@ -0,0 +1,103 @@
+import os
+import struct
+import tempfile
+import unittest
+
+import numpy
+from PIL import Image
+
+from wiggle.material.ktx import (
+    GL_COMPRESSED_RGB_S3TC_DXT1_EXT, GL_COMPRESSED_RGBA_BPTC_UNORM, KTX2_IDENTIFIER, KtxError, KtxImage,
+    load_ktx, read_ktx, save_ktx)
+from wiggle.material.texture_compression import (
+    compress_image, decode_bc1, encode_bc1, encode_texture_file, load_compressed_cached, load_texture_image)
+
+
+def _gradient(width=50, height=36):
+    y, x = numpy.mgrid[0:height, 0:width]
+    return numpy.stack([x * 5, y * 7, (x + y) * 2], axis=-1).clip(0, 255).astype(numpy.uint8)
+
+
+def _ktx2_file(width, height, levels, orientation='rd', vk_format=131):
+    """Contents of a KTX2 file of the given mipmap levels, BC1 unless another VkFormat is given"""
+    entry = b'KTXorientation\0' + orientation.encode() + b'\0'
+    key_values = struct.pack('<I', len(entry)) + entry
+    key_values += b'\0' * (-len(key_values) % 4)
+    key_value_offset = 80 + 24 * len(levels)
+    header = struct.pack(
+        '<9I4I2Q', vk_format, 1, width, height, 0, 0, 1, len(levels), 0, 0, 0, key_value_offset, len(key_values), 0, 0)
+    level_index = b''
+    data_offset = key_value_offset + len(key_values)
+    for data in levels:
+        level_index += struct.pack('<3Q', data_offset, len(data), len(data))
+        data_offset += len(data)
+    return KTX2_IDENTIFIER + header + level_index + key_values + b''.join(levels)
+
+
+class TestKtx(unittest.TestCase):
+    def test_bc1_round_trip(self):
+        pixels = _gradient()
+        decoded = decode_bc1(encode_bc1(pixels), 50, 36)
+        self.assertEqual(decoded.shape, (36, 50, 4))
+        self.assertLess(numpy.abs(decoded[..., :3].astype(int) - pixels).mean(), 4)
+        self.assertTrue(numpy.all(decoded[..., 3] == 255))
+        # Flat colors survive exactly, where they fit in 5:6:5 bits
+        flat = numpy.full((5, 7, 3), (255, 0, 132), dtype=numpy.uint8)
+        self.assertTrue(numpy.all(decode_bc1(encode_bc1(flat), 7, 5)[..., :3] == flat))
+
+    def test_save_load(self):
+        compressed = compress_image(Image.fromarray(_gradient()))
+        self.assertEqual(len(compressed.levels), 6)
+        self.assertEqual(compressed.level_size(5), (1, 1))
+        self.assertEqual(len(compressed.levels[1]), 7 * 5 * 8)  # 25x18 pixels
+        with tempfile.TemporaryDirectory() as directory:
+            file_name = os.path.join(directory, 'gradient.ktx')
+            save_ktx(file_name, compressed)
+            loaded = load_ktx(file_name)
+        self.assertEqual((loaded.internal_format, loaded.width, loaded.height),
+                         (GL_COMPRESSED_RGB_S3TC_DXT1_EXT, 50, 36))
+        self.assertEqual(loaded.levels, compressed.levels)
+        # Top row first, in the PIL image, is last in the texture
+        top = decode_bc1(loaded.levels[0], 50, 36)[-1, :, :3]
+        self.assertLess(numpy.abs(top.astype(int) - _gradient()[0]).mean(), 4)
+
+    def test_ktx2_top_down(self):
+        # Level 1 is 12x10 pixels, whose rows could not be flipped block by block
+        levels = [encode_bc1(_gradient(24 >> i, 20 >> i)) for i in range(3)]
+        with tempfile.TemporaryDirectory() as directory:
+            file_name = os.path.join(directory, 'gradient.ktx2')
+            with open(file_name, 'wb') as f:
+                f.write(_ktx2_file(24, 20, levels))
+            loaded = load_ktx(file_name)
+            self.assertTrue(loaded.is_top_down)
+            self.assertEqual(loaded.levels, levels)  # uploaded as stored
+            # The orientation survives a round trip through a KTX 1 file
+            save_ktx(file_name, loaded)
+            self.assertTrue(load_ktx(file_name).is_top_down)
+        image = read_ktx(_ktx2_file(24, 20, levels, orientation='ru'))
+        self.assertFalse(image.is_top_down)
+        self.assertEqual(image.levels, levels)
+        # Formats without a row flip load too
+        bc7 = read_ktx(_ktx2_file(4, 4, [bytes(16)], vk_format=145))
+        self.assertEqual((bc7.internal_format, bc7.is_top_down), (GL_COMPRESSED_RGBA_BPTC_UNORM, True))
+
+    def test_not_ktx(self):
+        with self.assertRaises(KtxError):
+            read_ktx(b'\x89PNG\r\n\x1a\n' + bytes(100))
+        with self.assertRaises(ValueError):
+            compress_image(Image.new('RGBA', (4, 4), (0, 0, 0, 0)))
+
+    def test_compressed_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file_name = os.path.join(directory, 'gradient.png')
+            Image.fromarray(_gradient()).save(file_name)
+            self.assertIsNone(load_compressed_cached(file_name))
+            encoded = encode_texture_file(file_name)
+            self.assertTrue(os.path.exists(file_name + '.ktx'))
+            cached = load_compressed_cached(file_name)
+            self.assertEqual(cached.levels, encoded.levels)
+            self.assertIsInstance(load_texture_image(file_name), KtxImage)
+            # A changed image ignores its stale cache
+            Image.fromarray(_gradient()[::-1]).save(file_name)
+            self.assertIsNone(load_compressed_cached(file_name))
+            self.assertEqual(load_texture_image(file_name).shape, (36, 50, 4))
@@ -1,7 +1,16 @@
+import tracemalloc
 import unittest
 from math import radians
 
-from wiggle.geometry.matrix import Matrix4f, Matrix3f
+import numpy
+
+from wiggle.geometry.camera import PerspectiveCamera
+from wiggle.geometry.mesh import CubeMesh
+from wiggle.geometry.matrix import Matrix4f, Matrix3f, ModelMatrix, compose, inverse_matrices, perspective_matrices, \
+    rotation_matrices, scale_matrices, transform_directions, transform_points, translation_matrices
+from wiggle.geometry.quaternion import Quaternion, axis_angle_quaternions, matrix_quaternions, quaternion_matrices, \
+    quaternion_product, rotate_vectors, slerp
+from wiggle.render.mesh_actor import MeshActor
 
 
 class TestMatrix(unittest.TestCase):
@@ -32,3 +41,201 @@ class TestMatrix(unittest.TestCase):
     def test_rotation_translation(self):
         v = Matrix4f.translation(1, 0, 0) @ Matrix4f.rotation((1, 0, 0), radians(10)) @ (0, 0, 0, 1)
         self.assertAlmostEqual(v[0], 1)
+
+
+class TestBatchedMatrix(unittest.TestCase):
+    def setUp(self):
+        rng = numpy.random.default_rng(3)
+        axes = rng.normal(size=(100, 3))
+        self.axes = axes / numpy.linalg.norm(axes, axis=1)[:, None]
+        self.angles = rng.uniform(-3, 3, size=100)
+        self.offsets = rng.uniform(-10, 10, size=(100, 3))
+        self.scales = rng.uniform(0.5, 2, size=100)
+        self.points = rng.uniform(-1, 1, size=(100, 3))
+
+    def test_matches_single_matrices(self):
+        rotations = rotation_matrices(self.axes, self.angles)
+        translations = translation_matrices(self.offsets)
+        scales = scale_matrices(self.scales)
+        models = compose(translations, rotations, scales)
+        self.assertEqual(models.shape, (100, 4, 4))
+        self.assertEqual(models.dtype, numpy.float32)
+        for i in (0, 17, 99):
+            single = (Matrix4f.translation(*self.offsets[i])
+                      @ Matrix4f.rotation(self.axes[i], self.angles[i])
+                      @ Matrix4f.scale(self.scales[i]))
+            numpy.testing.assert_allclose(models[i], single.m, rtol=1e-5, atol=1e-5)
+            p = single @ self.points[i]
+            numpy.testing.assert_allclose(
+                transform_points(models, self.points)[i], p[:3], rtol=1e-4, atol=1e-4)
+
+    def test_inverse(self):
+        models = compose(
+            translation_matrices(self.offsets), rotation_matrices(self.axes, self.angles), scale_matrices(self.scales))
+        identities = compose(models, inverse_matrices(models))
+        numpy.testing.assert_allclose(identities, numpy.broadcast_to(numpy.identity(4), (100, 4, 4)), atol=1e-4)
+        moved = transform_points(models, self.points)
+        numpy.testing.assert_allclose(transform_points(inverse_matrices(models), moved), self.points, atol=1e-4)
+
+    def test_directions(self):
+        rotations = compose(translation_matrices(self.offsets), rotation_matrices(self.axes, self.angles))
+        directions = transform_directions(rotations, self.points)
+        numpy.testing.assert_allclose(
+            numpy.linalg.norm(directions, axis=1), numpy.linalg.norm(self.points, axis=1), rtol=1e-5)
+
+    def test_perspective(self):
+        fov_y = numpy.radians([30, 45, 90])
+        projections = perspective_matrices(fov_y, aspect=1.5, z_near=0.1, z_far=100)
+        for i in range(3):
+            numpy.testing.assert_allclose(projections[i], Matrix4f.perspective(fov_y[i], 1.5, 0.1, 100).m)
+        # Points on the near and far planes map to -1 and +1 depth
+        ndc = transform_points(projections, ((0, 0, -0.1), (0, 0, -100), (0, 0, -0.1)))
+        numpy.testing.assert_allclose(ndc[:, 2], (-1, 1, -1), rtol=1e-4)
+
+
+def _allocated_bytes(function, repeat=100):
+    """Peak memory allocated while calling function repeatedly, beyond an empty call"""
+    def measure(f):
+        for i in range(3):
+            f()
+        tracemalloc.start()
+        try:
+            start = tracemalloc.get_traced_memory()[0]
+            for i in range(repeat):
+                f()
+            return tracemalloc.get_traced_memory()[1] - start
+        finally:
+            tracemalloc.stop()
+    return measure(function) - measure(lambda: None)
+
+
+class TestInPlaceMatrix(unittest.TestCase):
+    def test_out_arguments(self):
+        out = Matrix4f()
+        buffer = out.m
+        self.assertIs(Matrix4f.rotation((0, 0, 1), radians(30), out=out), out)
+        self.assertIs(out.m, buffer)
+        numpy.testing.assert_allclose(out.m, Matrix4f.rotation((0, 0, 1), radians(30)).m)
+        product = numpy.empty((4, 4), dtype=numpy.float32)
+        Matrix4f.translation(1, 2, 3).dot(Matrix4f.scale(2), out=product)
+        numpy.testing.assert_allclose(product, (Matrix4f.translation(1, 2, 3) @ Matrix4f.scale(2)).m)
+
+    def test_model_matrix_dirty_flag(self):
+        model = ModelMatrix()
+        model.model_center = (1, 2, 3)
+        model.model_scale = 2
+        model.model_rotation = Matrix4f.rotation((0, 1, 0), radians(30))
+        matrix = model.matrix
+        expected = (Matrix4f.translation(1, 2, 3) @ Matrix4f.rotation((0, 1, 0), radians(30)) @ Matrix4f.scale(2)).m
+        numpy.testing.assert_allclose(matrix, expected, atol=1e-6)
+        version = model.version
+        model.matrix
+        self.assertEqual(model.version, version)  # not rebuilt on every access
+        model.model_center = (0, 0, 0)
+        self.assertIs(model.matrix, matrix)  # rebuilt in place
+        self.assertEqual(model.version, version + 1)
+        self.assertEqual(matrix[0, 3], 0)
+
+    def test_camera_matrices(self):
+        camera = PerspectiveCamera()
+        camera.focus = (1, 2, 3)
+        camera.rotate((0, 1, 0), radians(40))
+        camera.distance = 5
+        camera.z_far = 50
+        expected_view = (Matrix4f.translation(0, 0, -5) @ camera.rotation @ Matrix4f.translation(-1, -2, -3)).m
+        numpy.testing.assert_allclose(camera.view_matrix, expected_view, atol=1e-5)
+        numpy.testing.assert_allclose(camera.projection, Matrix4f.perspective(camera.fov_y, 1.0, 0.1, 50).m)
+
+    def test_zero_allocation_frame(self):
+        camera = PerspectiveCamera()
+        actor = MeshActor(mesh=CubeMesh())
+        centers = [numpy.array((1, 2, 3), dtype=numpy.float32), numpy.array((3, 2, 1), dtype=numpy.float32)]
+        scales = [1.0, 2.0]
+        model_view = actor.model_view_matrix(camera)
+        version = actor.model_matrix.version
+
+        def frame():
+            # The actor moves every frame, so its model matrix is rebuilt each time
+            actor.model_center = centers[actor.model_matrix.version & 1]
+            actor.model_scale = scales[actor.model_matrix.version & 1]
+            camera.projection
+            actor.model_view_matrix(camera)
+        self.assertEqual(_allocated_bytes(frame), 0)
+        self.assertGreater(actor.model_matrix.version, version + 100)
+        self.assertIs(actor.model_view_matrix(camera), model_view)
+        expected = camera.view_matrix @ (Matrix4f.translation(*actor.model_center) @ Matrix4f.scale(actor.model_scale)).m
+        numpy.testing.assert_allclose(model_view, expected, atol=1e-5)
+
+
+class TestQuaternion(unittest.TestCase):
+    def setUp(self):
+        rng = numpy.random.default_rng(5)
+        self.axes = rng.normal(size=(20, 3))
+        self.axes /= numpy.linalg.norm(self.axes, axis=1)[:, None]
+        self.angles = rng.uniform(-3, 3, size=20)
+
+    def test_matches_rotation_matrices(self):
+        q = axis_angle_quaternions(self.axes, self.angles)
+        numpy.testing.assert_allclose(quaternion_matrices(q), rotation_matrices(self.axes, self.angles), atol=1e-6)
+        for axis, angle, expected in zip(self.axes, self.angles, q):
+            single = Quaternion.from_axis_angle(axis, angle)
+            numpy.testing.assert_allclose(single.array(), expected)
+            numpy.testing.assert_allclose(single.matrix4(), Matrix4f.rotation(axis, angle).m, atol=1e-6)
+
+    def test_matrix_round_trip(self):
+        q = axis_angle_quaternions(self.axes, self.angles)
+        q *= numpy.where(q[:, :1] < 0, -1, 1)
+        numpy.testing.assert_allclose(matrix_quaternions(quaternion_matrices(q)), q, atol=1e-6)
+        # including half turns, where the trace is -1
+        half_turns = axis_angle_quaternions(numpy.identity(3), numpy.full(3, numpy.pi))
+        numpy.testing.assert_allclose(numpy.abs(matrix_quaternions(quaternion_matrices(half_turns))),
+                                      numpy.abs(half_turns), atol=1e-6)
+
+    def test_product_and_rotate(self):
+        a = axis_angle_quaternions(self.axes[:10], self.angles[:10])
+        b = axis_angle_quaternions(self.axes[10:], self.angles[10:])
+        numpy.testing.assert_allclose(
+            quaternion_matrices(quaternion_product(a, b)),
+            compose(rotation_matrices(self.axes[:10], self.angles[:10]),
+                    rotation_matrices(self.axes[10:], self.angles[10:])), atol=1e-5)
+        vectors = self.axes[::-1] * 2
+        q = axis_angle_quaternions(self.axes, self.angles)
+        numpy.testing.assert_allclose(rotate_vectors(q, vectors),
+                                      transform_directions(rotation_matrices(self.axes, self.angles), vectors),
+                                      atol=1e-5)
+        single = Quaternion(*q[3])
+        numpy.testing.assert_allclose(single.rotate(vectors[3]), rotate_vectors(q[3], vectors[3]))
+        numpy.testing.assert_allclose((single * single.conjugate()).array(), (1, 0, 0, 0), atol=1e-12)
+
+    def test_slerp(self):
+        a = axis_angle_quaternions((0, 0, 1), 0.2)
+        b = axis_angle_quaternions((0, 0, 1), 1.0)
+        numpy.testing.assert_allclose(slerp(a, b, 0), a, atol=1e-12)
+        numpy.testing.assert_allclose(slerp(a, b, 1), b, atol=1e-12)
+        numpy.testing.assert_allclose(slerp(a, b, 0.5), axis_angle_quaternions((0, 0, 1), 0.6), atol=1e-12)
+        # -b is the same rotation, and should take the same short path
+        numpy.testing.assert_allclose(slerp(a, -b, 0.5), axis_angle_quaternions((0, 0, 1), 0.6), atol=1e-12)
+        # batched, including identical endpoints
+        t = numpy.linspace(0, 1, 7)
+        result = slerp(numpy.stack([a] * 7), numpy.stack([a] * 6 + [b]), t)
+        numpy.testing.assert_allclose(numpy.linalg.norm(result, axis=1), 1)
+        numpy.testing.assert_allclose(result[:6], numpy.stack([a] * 6), atol=1e-12)
+
+    def test_camera_stays_orthonormal(self):
+        camera = PerspectiveCamera()
+        for axis, angle in zip(self.axes, self.angles):
+            for _ in range(50):
+                camera.rotate(axis, angle * 0.01)
+                camera.set_y_up()
+        rotation = camera.rotation[:3, :3].astype(numpy.float64)
+        numpy.testing.assert_allclose(rotation @ rotation.T, numpy.identity(3), atol=1e-6)
+        orientation = camera.orientation
+        camera.rotation = Matrix4f.rotation((1, 0, 0), radians(10))
+        self.assertNotEqual(camera.orientation.array().tolist(), orientation.array().tolist())
+        numpy.testing.assert_allclose(camera.rotation, Matrix4f.rotation((1, 0, 0), radians(10)).m, atol=1e-6)
+
+    def test_model_orientation(self):
+        model = ModelMatrix()
+        model.model_orientation = Quaternion.from_axis_angle((0, 1, 0), radians(30))
+        numpy.testing.assert_allclose(model.model_rotation.m, Matrix4f.rotation((0, 1, 0), radians(30)).m, atol=1e-6)
+        numpy.testing.assert_allclose(model.matrix[:3, :3], model.model_rotation.m[:3, :3])
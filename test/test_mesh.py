@@ -0,0 +1,431 @@
+import importlib.resources
+import io
+import os
+import tempfile
+import time
+import unittest
+
+import numpy
+
+from wiggle.geometry.mesh import CubeMesh, Mesh, ObjParseError
+from wiggle.geometry.mesh.cache import cache_file_name, load_mesh_cache, load_obj_cached
+from wiggle.geometry.mesh.lod import build_lods_async, load_lods_cached, select_lod
+from wiggle.geometry.mesh.obj import ObjGroup, load_obj_arrays
+from wiggle.geometry.mesh.optimize import face_cache_statistics, optimize_faces, tipsify
+from wiggle.geometry.mesh.primitives import TRIANGLES, TRIANGLE_STRIP, build_primitives, index_dtype, \
+    partition_elements, stripify
+
+
+_QUAD_OBJ = """# two layouts of the same unit square
+o square
+v 0 0 0
+v 1 0 0
+v 1 1 0
+v 0 1 0
+vt 0 0
+vt 1 0
+vt 1 1
+vt 0 1
+vn 0 0 1
+g front
+usemtl red
+f 1/1/1 2/2/1 3/3/1 4/4/1
+g back
+usemtl blue
+f -1//1 -2//1 -3//1
+f 4 3 1
+"""
+
+
+class TestObjReader(unittest.TestCase):
+    def test_teapot(self):
+        mesh = Mesh()
+        with importlib.resources.files('wiggle.geometry').joinpath('wt_teapot.obj').open('rb') as stream:
+            mesh.load_obj(stream)
+        self.assertEqual(mesh.name, 'teapot.005')
+        self.assertEqual(len(mesh.vertexes), 1292)
+        self.assertEqual(len(mesh.vertex_normals), 1289)
+        self.assertEqual(len(mesh.faces), 2464)
+
+    def test_face_layouts(self):
+        obj = load_obj_arrays(io.StringIO(_QUAD_OBJ))
+        self.assertEqual(obj.name, 'square')
+        self.assertEqual(obj.face_offsets.tolist(), [0, 4, 7, 10])
+        self.assertEqual(obj.face_vertexes.tolist(), [0, 1, 2, 3, 3, 2, 1, 3, 2, 0])
+        self.assertEqual(obj.face_texcoords.tolist(), [0, 1, 2, 3, -1, -1, -1, -1, -1, -1])
+        self.assertEqual(obj.face_normals.tolist(), [0, 0, 0, 0, 0, 0, 0, -1, -1, -1])
+
+    def test_groups(self):
+        obj = load_obj_arrays(io.StringIO(_QUAD_OBJ))
+        self.assertEqual(
+            [(g.name, g.material, g.first_face, g.face_count) for g in obj.groups],
+            [('front', 'red', 0, 1), ('back', 'blue', 1, 2)])
+
+    def test_fan_triangulation(self):
+        obj = load_obj_arrays(io.StringIO(_QUAD_OBJ))
+        self.assertEqual(obj.triangles().tolist(), [[0, 1, 2], [0, 2, 3], [3, 2, 1], [3, 2, 0]])
+
+    def test_chunk_boundaries(self):
+        whole = load_obj_arrays(io.StringIO(_QUAD_OBJ))
+        for chunk_size in (1, 7, 64):
+            chunked = load_obj_arrays(io.BytesIO(_QUAD_OBJ.encode()), chunk_size=chunk_size)
+            self.assertTrue(numpy.array_equal(whole.positions, chunked.positions))
+            self.assertTrue(numpy.array_equal(whole.face_vertexes, chunked.face_vertexes))
+            self.assertTrue(numpy.array_equal(whole.face_normals, chunked.face_normals))
+
+    def test_unrecognized_line(self):
+        with self.assertRaises(ObjParseError):
+            load_obj_arrays(io.StringIO('v 0 0 0\nbogus 1 2 3\n'))
+        with self.assertRaises(ObjParseError):
+            load_obj_arrays(io.StringIO('v 0 0 0\nv 1 0 0\nv 0 1 0\nf 1 2 x\n'))
+        with self.assertRaises(ObjParseError):
+            load_obj_arrays(io.StringIO('v 0 0 0\nv 1 0 zero\n'))
+
+    def test_bad_indexes(self):
+        triangle = 'v 0 0 0\nv 1 0 0\nv 0 1 0\nvn 0 0 1\n'
+        for face in ('f 1 2 9', 'f 0 1 2', 'f -4 2 3', 'f 1//1 2//2 3//1', 'f /1 2 3'):
+            with self.subTest(face=face), self.assertRaises(ObjParseError):
+                load_obj_arrays(io.StringIO(triangle + face + '\n'))
+        # Faces may only use vertexes defined before them
+        with self.assertRaises(ObjParseError):
+            load_obj_arrays(io.StringIO('f 1 2 3\n' + triangle))
+        obj = load_obj_arrays(io.StringIO(triangle + 'f -3//1 2 3\n'))
+        self.assertEqual(obj.face_vertexes.tolist(), [0, 1, 2])
+        self.assertEqual(obj.face_normals.tolist(), [0, -1, -1])
+
+    def test_trailing_comments(self):
+        obj = load_obj_arrays(io.StringIO(
+            'v 0 0 0 # origin\nv 1 0 0\nv 0 1 0\nvn 0 0 1 #up\ng tri # one face\nf 1//1 2//1 3//1 # c\n'))
+        self.assertEqual(obj.positions.tolist(), [[0, 0, 0], [1, 0, 0], [0, 1, 0]])
+        self.assertEqual(obj.face_vertexes.tolist(), [0, 1, 2])
+        self.assertEqual(obj.face_normals.tolist(), [0, 0, 0])
+        self.assertEqual(obj.groups[0].name, 'tri')
+
+
+class TestMeshStorage(unittest.TestCase):
+    def test_append(self):
+        mesh = Mesh()
+        self.assertEqual(mesh.append_vertexes(((0, 0, 0), (1, 0, 0), (1, 1, 0))), 0)
+        self.assertEqual(mesh.append_vertexes(((0, 1, 0), )), 3)
+        mesh.append_faces(((0, 1, 2), (0, 2, 3)))
+        mesh.append_face((3, 2, 1, 0))
+        self.assertEqual(mesh.vertexes.shape, (4, 3))
+        self.assertEqual(mesh.vertexes.dtype, numpy.float32)
+        self.assertEqual(len(mesh.faces), 3)
+        self.assertEqual(mesh.faces[-1].tolist(), [3, 2, 1, 0])
+        self.assertEqual(mesh.face_offsets.tolist(), [0, 3, 6, 10])
+
+    def test_bytes_per_vertex(self):
+        mesh = Mesh()
+        for i in range(1000):
+            mesh.append_vertexes(((i, 0, 0), ))
+        mesh.shrink()
+        self.assertEqual(mesh.positions.nbytes / len(mesh.vertexes), 12)
+
+    def test_normal_for_vertex(self):
+        mesh = Mesh()
+        mesh.load_obj(io.StringIO(_QUAD_OBJ))
+        self.assertEqual(sorted(mesh.normal_for_vertex.keys()), [0, 1, 2, 3])
+        self.assertEqual(mesh.normal_for_vertex[2].tolist(), [0, 0, 1])
+
+    def test_edges_update(self):
+        mesh = CubeMesh()
+        self.assertEqual(len(mesh.edges), 12)
+        mesh.append_face((0, 7, 6))
+        self.assertEqual(len(mesh.edges), 14)
+
+
+class TestMeshAdjacency(unittest.TestCase):
+    def test_edges_match_python_sets(self):
+        mesh = Mesh()
+        with importlib.resources.files('wiggle.geometry').joinpath('wt_teapot.obj').open('rb') as stream:
+            mesh.load_obj(stream)
+        expected = set()
+        for face in mesh.faces:
+            face = face.tolist()
+            for a, b in zip(face, face[1:] + face[:1]):
+                expected.add((min(a, b), max(a, b)))
+        self.assertEqual([tuple(e) for e in mesh.edges.tolist()], sorted(expected))
+
+    def test_edges_cached(self):
+        mesh = CubeMesh()
+        self.assertIs(mesh.edges, mesh.edges)
+        self.assertFalse(mesh.edges_need_update)
+
+    def test_cube_adjacency(self):
+        adjacency = CubeMesh().adjacency
+        self.assertTrue((adjacency.edge_face_counts() == 2).all())
+        self.assertEqual(len(adjacency.boundary_edges()), 0)
+        self.assertEqual(sorted(adjacency.faces_for_vertex(0).tolist()), [2, 3, 5])
+        edge = adjacency.edges.tolist().index([0, 1])
+        self.assertEqual(sorted(adjacency.faces_for_edge(edge).tolist()), [3, 5])
+
+    def test_silhouette(self):
+        adjacency = CubeMesh().adjacency
+        # Only the near face is front facing, so its four edges are the silhouette
+        is_front_facing = [True, False, False, False, False, False]
+        silhouette = adjacency.edges[adjacency.silhouette_edges(is_front_facing)]
+        self.assertEqual(silhouette.tolist(), [[4, 5], [4, 6], [5, 7], [6, 7]])
+
+
+def _canonical_triangles(triangles):
+    """Set of triangles, each rotated to start at its lowest index, so winding is preserved"""
+    result = set()
+    for t in numpy.asarray(triangles).tolist():
+        i = t.index(min(t))
+        result.add(tuple(t[i:] + t[:i]))
+    return result
+
+
+def _grid_faces(grid):
+    a = (numpy.arange(grid)[None, :] + (grid + 1) * numpy.arange(grid)[:, None]).ravel()
+    return numpy.stack((a, a + 1, a + grid + 2, a + grid + 1), axis=1)
+
+
+class TestMeshPrimitives(unittest.TestCase):
+    def test_explicit_strip(self):
+        primitives = CubeMesh().primitives
+        self.assertEqual(primitives.mode, TRIANGLE_STRIP)
+        self.assertIsNone(primitives.restart_index)
+        self.assertEqual(len(primitives), 14)
+
+    def test_triangulated_obj(self):
+        mesh = Mesh()
+        mesh.load_obj(io.StringIO(_QUAD_OBJ))
+        self.assertIsNotNone(mesh._primitives_future)  # started by the loader, not at the first draw
+        self.assertEqual(
+            _canonical_triangles(mesh.primitives.triangles()),
+            _canonical_triangles([[0, 1, 2], [0, 2, 3], [3, 2, 1], [3, 2, 0]]))
+
+    def test_strips_preserve_winding(self):
+        mesh = Mesh()
+        with importlib.resources.files('wiggle.geometry').joinpath('wt_teapot.obj').open('rb') as stream:
+            mesh.load_obj(stream)
+        triangles = mesh.primitives.triangles()
+        strips = stripify(triangles)
+        self.assertEqual(sum(len(s) - 2 for s in strips), len(triangles))
+        from_strips = build_primitives(mesh.face_offsets, mesh.face_indexes)
+        self.assertEqual(_canonical_triangles(from_strips.triangles()), _canonical_triangles(triangles))
+
+    def test_grid_prefers_strips(self):
+        faces = _grid_faces(20)
+        offsets = numpy.arange(0, faces.size + 1, 4)
+        self.assertEqual(build_primitives(offsets, faces.reshape(-1)).mode, TRIANGLE_STRIP)
+        self.assertEqual(build_primitives(offsets, faces.reshape(-1), allow_strips=False).mode, TRIANGLES)
+
+    def test_index_dtype(self):
+        self.assertEqual(index_dtype(256), numpy.uint8)
+        self.assertEqual(index_dtype(256, has_restart=True), numpy.uint16)
+        self.assertEqual(index_dtype(70000), numpy.uint32)
+        with self.assertRaises(ValueError):
+            index_dtype(1 << 33)
+
+    def test_partition_elements(self):
+        faces = _grid_faces(30)
+        offsets = numpy.arange(0, faces.size + 1, 4)
+        triangles = build_primitives(offsets, faces.reshape(-1), allow_strips=False).triangles()
+        partitions = partition_elements(triangles, 256)
+        self.assertGreater(len(partitions), 1)
+        for p in partitions:
+            self.assertLessEqual(len(p.vertex_ids), 256)
+        rebuilt = numpy.concatenate([p.vertex_ids[p.indexes] for p in partitions])
+        numpy.testing.assert_array_equal(rebuilt, triangles)
+
+
+def _simulate_vertex_cache(face_offsets, face_indexes, cache_size=16):
+    """Vertex shader runs per triangle for fan triangulated faces, through a FIFO cache"""
+    cache = []
+    runs = 0
+    triangle_count = 0
+    for f in range(len(face_offsets) - 1):
+        face = face_indexes[face_offsets[f]:face_offsets[f + 1]].tolist()
+        for i in range(1, len(face) - 1):
+            triangle_count += 1
+            for v in (face[0], face[i], face[i + 1]):
+                if v not in cache:
+                    runs += 1
+                    cache.append(v)
+                    cache = cache[-cache_size:]
+    return runs / triangle_count
+
+
+class TestMeshOptimize(unittest.TestCase):
+    def setUp(self):
+        grid = 40
+        faces = _grid_faces(grid)[numpy.random.default_rng(1).permutation(grid * grid)]
+        i, j = numpy.meshgrid(numpy.arange(grid + 1), numpy.arange(grid + 1))
+        self.mesh = Mesh('grid')
+        self.mesh.append_vertexes(numpy.stack((i.ravel(), j.ravel(), numpy.zeros(i.size)), axis=1))
+        self.mesh.append_faces(faces)
+
+    def test_cache_improvement(self):
+        mesh = self.mesh
+        before = _simulate_vertex_cache(mesh.face_offsets, mesh.face_indexes)
+        plan = mesh.optimize()
+        after = _simulate_vertex_cache(mesh.face_offsets, mesh.face_indexes)
+        self.assertAlmostEqual(plan.before.acmr, before)
+        self.assertAlmostEqual(plan.after.acmr, after)
+        self.assertLess(after, 0.75)
+        self.assertLess(after, 0.5 * before)
+        self.assertLess(plan.after.atvr, plan.before.atvr)
+
+    def test_same_geometry(self):
+        mesh = self.mesh
+        old_faces = mesh.positions[mesh.face_indexes].reshape((-1, 4, 3))
+        mesh.optimize()
+        new_faces = mesh.positions[mesh.face_indexes].reshape((-1, 4, 3))
+        self.assertEqual(
+            sorted(map(bytes, old_faces)), sorted(map(bytes, new_faces)))
+        # Vertexes are numbered in order of first use
+        _, first_use = numpy.unique(mesh.face_indexes, return_index=True)
+        self.assertTrue(numpy.all(numpy.diff(first_use) > 0))
+
+    def test_group_order(self):
+        mesh = self.mesh
+        groups = [ObjGroup('a', None, 0), ObjGroup('b', None, 600)]
+        groups[0].face_count, groups[1].face_count = 600, 1000
+        plan = optimize_faces(mesh.face_offsets, mesh.face_indexes, len(mesh.vertexes), groups=groups)
+        # Each group numbers its own vertexes, but orders faces as if it used the whole mesh numbering
+        for first, end in ((0, 600), (600, 1600)):
+            offsets = mesh.face_offsets[first:end + 1] - mesh.face_offsets[first]
+            indexes = mesh.face_indexes[mesh.face_offsets[first]:mesh.face_offsets[end]]
+            order, _ = tipsify(offsets, indexes, len(mesh.vertexes))
+            numpy.testing.assert_array_equal(plan.face_order[first:end], order + first)
+
+    def test_teapot_statistics(self):
+        mesh = Mesh()
+        with importlib.resources.files('wiggle.geometry').joinpath('wt_teapot.obj').open('rb') as stream:
+            mesh.load_obj(stream)
+        plan = mesh.optimize()
+        self.assertLess(plan.after.acmr, plan.before.acmr)
+        stats = face_cache_statistics(mesh.face_offsets, mesh.face_indexes)
+        self.assertAlmostEqual(stats.acmr, plan.after.acmr)
+
+
+class TestMeshLod(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.mesh = Mesh()
+        with importlib.resources.files('wiggle.geometry').joinpath('wt_teapot.obj').open('rb') as stream:
+            self.mesh.load_obj(stream)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_lod_chain(self):
+        lods = load_lods_cached(self.mesh, cache_dir=self.temp_dir.name)
+        self.assertIs(lods[0].mesh, self.mesh)
+        self.assertGreater(len(lods), 3)
+        face_counts = [len(lod.mesh.faces) for lod in lods]
+        errors = [lod.error for lod in lods]
+        self.assertEqual(face_counts, sorted(face_counts, reverse=True))
+        self.assertEqual(errors, sorted(errors))
+        # Simplified vertexes stay close to the original surface
+        size = numpy.ptp(self.mesh.positions, axis=0).max()
+        self.assertLess(lods[1].error, 0.01 * size)
+        coarse = lods[-1].mesh
+        self.assertIsNotNone(coarse._primitives)  # triangulated on the background thread
+        self.assertLessEqual(len(coarse.faces), 64 * 2)
+        self.assertTrue(numpy.all(coarse.face_indexes < len(coarse.vertexes)))
+
+    def test_cached_lods(self):
+        built = build_lods_async(self.mesh, cache_dir=self.temp_dir.name).result()
+        cached = load_lods_cached(self.mesh, cache_dir=self.temp_dir.name)
+        self.assertEqual(len(cached), len(built))
+        self.assertFalse(cached[-1].mesh.positions.flags.writeable)  # memory-mapped
+        self.assertIs(cached[0].mesh, self.mesh)
+        for a, b in zip(built[1:], cached[1:]):
+            self.assertIsNotNone(b.mesh._primitives)  # simplified levels keep their primitives in the cache
+            self.assertAlmostEqual(a.error, b.error)
+            numpy.testing.assert_array_equal(a.mesh.face_indexes, b.mesh.face_indexes)
+
+    def test_select_lod(self):
+        errors = [0.0, 0.01, 0.1, 1.0]
+        projection = numpy.array(((1, 0, 0, 0), (0, 1, 0, 0), (0, 0, -1, -0.2), (0, 0, -1, 0)))
+
+        def level(distance, scale=1.0):
+            model_view = numpy.diag((scale, scale, scale, 1.0))
+            model_view[2, 3] = -distance
+            return select_lod(errors, (0, 0, 0), 1.0, model_view, projection, 1000)
+        self.assertEqual(level(0.5), 0)  # inside bounding sphere
+        self.assertEqual(level(3), 0)
+        self.assertEqual(level(10), 1)
+        self.assertEqual(level(100), 2)
+        self.assertEqual(level(1000), 3)
+        self.assertEqual(level(100, scale=10), 1)
+
+
+class TestMeshCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.obj_file_name = os.path.join(self.temp_dir.name, 'square.obj')
+        with open(self.obj_file_name, 'w') as f:
+            f.write(_QUAD_OBJ)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_round_trip(self):
+        parsed = load_obj_cached(self.obj_file_name)
+        self.assertTrue(os.path.exists(cache_file_name(self.obj_file_name)))
+        cached = load_obj_cached(self.obj_file_name)
+        self.assertIsInstance(cached.positions, numpy.memmap)
+        self.assertEqual(cached.positions.dtype, numpy.float32)
+        self.assertEqual(cached.name, 'square')
+        self.assertEqual([g.name for g in cached.groups], ['front', 'back'])
+        for name in ('positions', 'texcoords', 'normals', 'face_offsets', 'face_vertexes', 'face_normals'):
+            self.assertTrue(numpy.array_equal(getattr(parsed, name), getattr(cached, name)), name)
+
+    def test_stale_cache(self):
+        load_obj_cached(self.obj_file_name)
+        with open(self.obj_file_name, 'a') as f:
+            f.write('f 1 2 4\n')
+        stamp = time.time() + 10
+        os.utime(self.obj_file_name, (stamp, stamp))
+        cache_name = cache_file_name(self.obj_file_name)
+        self.assertIsNone(load_mesh_cache(cache_name, source_file_name=self.obj_file_name))
+        self.assertEqual(load_obj_cached(self.obj_file_name).face_count, 4)
+
+    def test_cached_primitives(self):
+        built = load_obj_cached(self.obj_file_name, build_draw_primitives=True).primitives
+        cached = load_obj_cached(self.obj_file_name).primitives
+        self.assertEqual(cached.mode, built.mode)
+        self.assertTrue(numpy.array_equal(cached.indexes, built.indexes))
+
+    def test_cached_strip_setting(self):
+        grid_file_name = os.path.join(self.temp_dir.name, 'grid.obj')
+        with open(grid_file_name, 'w') as f:
+            for y in range(21):
+                f.writelines(f'v {x} {y} 0\n' for x in range(21))
+            f.writelines(f'f {a + 1} {a + 2} {a + 23} {a + 22}\n' for a in _grid_faces(20)[:, 0])
+        mesh = Mesh()
+        mesh.allow_strips = False
+        mesh.load_obj_file(grid_file_name)
+        self.assertEqual(mesh.primitives.mode, TRIANGLES)
+        # The cache of the list is stale for a mesh that allows strips, and the other way around
+        self.assertEqual(load_obj_cached(grid_file_name, build_draw_primitives=True).primitives.mode, TRIANGLE_STRIP)
+        self.assertIsNone(load_obj_cached(grid_file_name, allow_strips=False).primitives)
+        self.assertEqual(load_obj_cached(grid_file_name).primitives.mode, TRIANGLE_STRIP)
+
+    def test_cached_optimization(self):
+        optimized = load_obj_cached(self.obj_file_name, optimize=True, build_draw_primitives=True)
+        self.assertTrue(optimized.optimized)
+        cached = load_obj_cached(self.obj_file_name, optimize=True)
+        self.assertTrue(cached.optimized)
+        self.assertIsInstance(cached.face_vertexes, numpy.memmap)
+        self.assertTrue(numpy.array_equal(optimized.face_vertexes, cached.face_vertexes))
+        self.assertEqual([g.face_count for g in cached.groups], [1, 2])
+
+    def test_mesh_load_obj_file(self):
+        mesh = Mesh()
+        mesh.load_obj_file(self.obj_file_name, cache_dir=self.temp_dir.name)
+        # Primitives built in the background go into the cache, for the next load
+        self.assertEqual(len(mesh.primitives.triangles()), 4)
+        self.assertIsNotNone(load_obj_cached(self.obj_file_name, cache_dir=self.temp_dir.name).primitives)
+        mesh.load_obj_file(self.obj_file_name, cache_dir=self.temp_dir.name)
+        self.assertIsNone(mesh._primitives_future)
+        self.assertEqual(len(mesh.vertexes), 4)
+        self.assertEqual(len(mesh.faces), 3)
+        # Appending to memory-mapped storage makes a writable copy
+        mesh.append_vertexes(((2, 2, 2), ))
+        self.assertEqual(len(mesh.vertexes), 5)
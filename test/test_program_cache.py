@@ -0,0 +1,66 @@
+import os
+import tempfile
+import textwrap
+import unittest
+
+from gl_helpers import EGL_SCRIPT_HEADER, run_gl_script
+from wiggle.material.program_cache import (
+    ProgramBinaryCache, ProgramCacheError, load_program_binary, save_program_binary)
+
+# Links one material's program with Mesa, and prints the cache counts
+_GL_SCRIPT = EGL_SCRIPT_HEADER + textwrap.dedent('''
+    if GL.glGetIntegerv(GL.GL_NUM_PROGRAM_BINARY_FORMATS) < 1:
+        sys.exit(77)
+    import wiggle.material.shader
+    from wiggle.material.normal import NormalMaterial
+    from wiggle.material.program_cache import ProgramBinaryCache
+    cache = wiggle.material.shader.ShaderProgram.binary_cache = ProgramBinaryCache(sys.argv[1])
+    compiled = []
+    compile_shader = wiggle.material.shader.compileShader
+    wiggle.material.shader.compileShader = lambda *args: compiled.append(1) or compile_shader(*args)
+    material = NormalMaterial()
+    material.init_gl()
+    assert GL.glGetProgramiv(material.shader, GL.GL_LINK_STATUS)
+    assert 'model' in material.mvp_matrices
+    print(cache.hit_count, cache.miss_count, len(compiled))
+''')
+
+
+class TestProgramBinaryCache(unittest.TestCase):
+    def test_file_round_trip(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            file_name = os.path.join(cache_dir, 'a.wglprog')
+            save_program_binary(file_name, {'format': 5}, b'\x01\x02\x03')
+            self.assertEqual(load_program_binary(file_name), ({'format': 5}, b'\x01\x02\x03'))
+            with open(file_name, 'r+b') as f:
+                f.write(b'X')
+            with self.assertRaises(ProgramCacheError):
+                load_program_binary(file_name)
+
+    def test_file_name_includes_driver(self):
+        cache = ProgramBinaryCache('cache')
+        identity = {'vendor': 'Mesa', 'renderer': 'llvmpipe', 'version': '4.5 Mesa 22.3.6'}
+        name = cache.file_name('abc', identity)
+        self.assertEqual(name, cache.file_name('abc', dict(identity)))
+        self.assertNotEqual(name, cache.file_name('abd', identity))
+        self.assertNotEqual(name, cache.file_name('abc', dict(identity, version='4.5 Mesa 23.0.0')))
+
+    def _run_gl(self, cache_dir):
+        output = run_gl_script(
+            self, _GL_SCRIPT, cache_dir, skip_reason='no OpenGL 4.3 context with program binaries available')
+        return [int(c) for c in output.split()]
+
+    def test_second_launch_skips_compile(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            hits, misses, compiled = self._run_gl(cache_dir)
+            self.assertEqual((hits, misses), (0, 1))
+            self.assertGreater(compiled, 0)
+            self.assertEqual(self._run_gl(cache_dir), [1, 0, 0])
+            # A corrupted binary is detected, recompiled and replaced
+            file_name = os.path.join(cache_dir, os.listdir(cache_dir)[0])
+            header, binary = load_program_binary(file_name)
+            save_program_binary(file_name, header, bytes(len(binary)))
+            hits, misses, compiled = self._run_gl(cache_dir)
+            self.assertEqual((hits, misses), (0, 1))
+            self.assertGreater(compiled, 0)
+            self.assertEqual(self._run_gl(cache_dir), [1, 0, 0])
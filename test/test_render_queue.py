@@ -0,0 +1,138 @@
+import unittest
+
+from OpenGL import GL
+
+from gl_helpers import GlRecorder
+from wiggle.geometry.camera import PerspectiveCamera
+from wiggle.render.gl_state import gl_state
+from wiggle.render.base import RenderPassType
+from wiggle.render.render_queue import RenderQueue
+from wiggle.render.renderer import RenderPass
+from wiggle.render.skybox_actor import SkyBoxActor
+
+
+class _FakeTexture(object):
+    def __init__(self, texture_id):
+        self.texture_id = texture_id
+
+
+class _FakeMaterial(object):
+    def __init__(self, shader, texture_id):
+        self.shader = shader
+        self.texture = _FakeTexture(texture_id)
+
+    def sort_key(self):
+        return self.shader, self.texture.texture_id
+
+    def display_gl(self, camera):
+        gl_state.use_program(self.shader)
+        gl_state.bind_texture(GL.GL_TEXTURE_2D, self.texture.texture_id)
+
+    def set_camera_matrices(self, camera):
+        gl_state.uniform_matrix4(0, None)
+
+
+class _FakeVbo(object):
+    def __init__(self, vao):
+        self.vao = vao
+
+
+class _FakeActor(object):
+    def draw_gl(self, camera, material, mesh_vbo):
+        gl_state.bind_vertex_array(mesh_vbo.vao)
+        gl_state.draw_elements(GL.GL_TRIANGLES, 3, GL.GL_UNSIGNED_SHORT, None)
+
+
+class _FakeQueuedActor(_FakeActor):
+    def __init__(self, vao):
+        self.material = _FakeMaterial(1, 7)
+        self.mesh_vbo = _FakeVbo(vao)
+
+    def enqueue_gl(self, queue, camera):
+        queue.add(self, self.material, self.mesh_vbo)
+
+
+class _FakeImmediateActor(object):
+    """Draws at once, as actors without enqueue_gl do"""
+    def __init__(self, vao):
+        self.vao = vao
+
+    def display_gl(self, camera, *args, **kwargs):
+        gl_state.bind_vertex_array(self.vao)
+        gl_state.draw_elements(GL.GL_POINTS, 1, GL.GL_UNSIGNED_SHORT, None)
+
+
+class TestGlState(unittest.TestCase):
+    def setUp(self):
+        self.real_gl = gl_state.gl
+        self.recorder = GlRecorder()
+        gl_state.gl = self.recorder
+        gl_state.begin_frame()
+
+    def tearDown(self):
+        gl_state.gl = self.real_gl
+        gl_state.begin_frame()
+
+    def test_redundant_calls_skipped(self):
+        gl_state.use_program(3)
+        gl_state.use_program(3)
+        gl_state.enable(GL.GL_DEPTH_TEST)
+        gl_state.enable(GL.GL_DEPTH_TEST)
+        gl_state.disable(GL.GL_DEPTH_TEST)
+        gl_state.bind_texture(GL.GL_TEXTURE_2D, 5)
+        gl_state.bind_texture(GL.GL_TEXTURE_2D, 5)
+        gl_state.bind_texture(GL.GL_TEXTURE_2D, 6, unit=1)
+        self.assertEqual(gl_state.skipped_count, 3)
+        self.assertEqual(gl_state.call_counts['glUseProgram'], 1)
+        self.assertEqual(gl_state.call_counts['glActiveTexture'], 2)
+        self.assertEqual(gl_state.call_count, len(self.recorder.calls))
+        gl_state.reset()
+        gl_state.use_program(3)
+        self.assertEqual(gl_state.call_counts['glUseProgram'], 2)
+
+    def test_skipped_bind_activates_unit(self):
+        gl_state.bind_texture(GL.GL_TEXTURE_2D, 6, unit=1)
+        gl_state.bind_texture(GL.GL_TEXTURE_2D, 5)
+        gl_state.bind_texture(GL.GL_TEXTURE_2D, 6, unit=1)
+        self.assertEqual(gl_state.skipped_count, 1)
+        # The last bind is redundant, but the texture must still be on the active unit
+        self.assertEqual(self.recorder.calls[-1], ('glActiveTexture', GL.GL_TEXTURE0 + 1))
+
+    def _queue(self):
+        materials = [_FakeMaterial(shader, texture) for shader in (1, 2) for texture in (7, 8)]
+        queue = RenderQueue()
+        for i in range(40):
+            queue.add(_FakeActor(), materials[i % len(materials)], _FakeVbo(vao=10 + i % 5))
+        return queue
+
+    def test_sorted_queue(self):
+        queue = self._queue()
+        queue.flush(camera=None, sort=False)
+        unsorted_count = gl_state.call_count
+        self.assertEqual(len(queue), 0)
+        gl_state.begin_frame()
+        self._queue().flush(camera=None, sort=True)
+        self.assertEqual(gl_state.call_counts['glUseProgram'], 2)
+        self.assertEqual(gl_state.call_counts['glBindTexture'], 4)
+        self.assertEqual(gl_state.call_counts['glDrawElements'], 40)
+        self.assertLess(gl_state.call_count, unsorted_count)
+
+    def test_unsorted_pass_order(self):
+        children = [_FakeImmediateActor(1), _FakeQueuedActor(2), _FakeQueuedActor(3), _FakeImmediateActor(4),
+                    _FakeQueuedActor(5)]
+        RenderPass(RenderPassType.SKY).display_children_gl(children, PerspectiveCamera())
+        calls = self.recorder.calls
+        drawn = [calls[i - 1][1] for i, call in enumerate(calls) if call[0] == 'glDrawElements']
+        self.assertEqual(drawn, [1, 2, 3, 4, 5])
+
+
+class TestMeshActorQueue(unittest.TestCase):
+    def test_wireframe_sky_box(self):
+        actor = SkyBoxActor()
+        actor.wireframe = True
+        queue = RenderQueue()
+        # The wireframe material of a sky has no shader stages to link, so nothing is queued
+        actor.enqueue_gl(queue, PerspectiveCamera())
+        self.assertEqual(len(queue), 0)
+        self.assertFalse(actor.wireframe_material.is_initialized)
+        actor.dispose_gl()
@@ -0,0 +1,146 @@
+import unittest
+from unittest import mock
+
+import numpy
+from OpenGL import GL
+
+from wiggle.geometry.mesh import CubeMesh
+from wiggle.material.shader import BaseShaderStage, ShaderProgram
+from wiggle.render import resource_cache
+from wiggle.render.instanced_mesh_actor import InstancedMeshActor
+from wiggle.render.mesh_actor import MeshActor, MeshVbo
+from wiggle.render.resource_cache import ResourceCache, array_key, current_resources
+from wiggle.render.texture_upload import TextureUploader
+
+
+class _SourceStage(BaseShaderStage):
+    def __init__(self, source, stage=GL.GL_FRAGMENT_SHADER):
+        super().__init__(stage=stage)
+        self.source = source
+
+    def __str__(self):
+        return self.source
+
+    def compile(self):
+        return self.source
+
+
+class _Disposable(object):
+    def __init__(self):
+        self.is_disposed = False
+
+    def dispose_gl(self):
+        self.is_disposed = True
+
+
+class TestResourceCache(unittest.TestCase):
+    def setUp(self):
+        resource_cache.forget_context()
+        patcher = mock.patch.object(MeshVbo, 'init_gl')  # no GL context in tests
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        resource_cache.forget_context()
+
+    def test_reference_counting(self):
+        cache = ResourceCache()
+        first = cache.acquire('a', _Disposable)
+        self.assertIs(cache.acquire('a', _Disposable), first)
+        self.assertEqual(cache.reference_count('a'), 2)
+        cache.release('a')
+        self.assertFalse(first.is_disposed)
+        cache.release('a')
+        self.assertTrue(first.is_disposed)
+        self.assertNotIn('a', cache)
+        self.assertIsNot(cache.acquire('a', _Disposable), first)
+
+    def test_actors_share_mesh_vbo(self):
+        mesh = CubeMesh()
+        actors = [MeshActor(mesh=mesh) for _ in range(3)]
+        other = MeshActor(mesh=CubeMesh())
+        for a in actors + [other, ]:
+            a.init_gl()
+        self.assertTrue(all(a.mesh_vbo is actors[0].mesh_vbo for a in actors))
+        self.assertIsNot(other.mesh_vbo, actors[0].mesh_vbo)
+        mesh_vbos = current_resources().mesh_vbos
+        self.assertEqual(mesh_vbos.reference_count(id(mesh)), 3)
+        for a in actors:
+            a.dispose_gl()
+        self.assertNotIn(id(mesh), mesh_vbos)
+
+    def test_mesh_vbos_per_context(self):
+        mesh = CubeMesh()
+        actor = MeshActor(mesh=mesh)
+        self.assertIsNone(actor.mesh_vbo)  # none until a context is current
+        actor.init_gl()
+        first = actor.mesh_vbo
+        resource_cache.forget_context()
+        # Another context makes its own vertex array objects
+        MeshActor(mesh=mesh).init_gl()
+        self.assertIsNot(current_resources().mesh_vbos.acquire(id(mesh), None), first)
+
+    def test_forget_context(self):
+        mesh = CubeMesh()
+        MeshActor(mesh=mesh).init_gl()
+        self.assertIn(id(mesh), current_resources().mesh_vbos)
+        resource_cache.forget_context()
+        self.assertNotIn(id(mesh), current_resources().mesh_vbos)
+
+    def test_lod_vbos_after_dispose(self):
+        actor = InstancedMeshActor(mesh=CubeMesh())
+        actor.init_gl()
+        first = actor.mesh_vbo
+        actor.dispose_gl()
+        actor.init_gl()
+        self.assertIsNot(actor.mesh_vbo, first)
+        self.assertIs(actor.lod_vbos[0], actor.mesh_vbo)
+        self.assertIs(actor._select_lod_vbo(None), actor.mesh_vbo)
+
+
+class TestResourceManager(unittest.TestCase):
+    def setUp(self):
+        self.original_link = ShaderProgram._link
+        self.link_count = 0
+        self.deleted = []
+
+        def link(program):
+            self.link_count += 1
+            return 100 + self.link_count
+
+        ShaderProgram._link = link
+        resource_cache.forget_context()
+        current_resources().programs._dispose = self.deleted.append
+
+    def tearDown(self):
+        ShaderProgram._link = self.original_link
+        resource_cache.forget_context()
+
+    def test_array_key(self):
+        a = numpy.arange(12, dtype=numpy.float32).reshape((4, 3))
+        self.assertEqual(array_key(a), array_key(a.copy()))
+        self.assertNotEqual(array_key(a), array_key(a.astype(numpy.float64)))
+        self.assertNotEqual(array_key(a), array_key(a.reshape((3, 4))))
+        self.assertNotEqual(array_key(a, GL.GL_ARRAY_BUFFER), array_key(a, GL.GL_ELEMENT_ARRAY_BUFFER))
+
+    def test_programs_linked_once(self):
+        programs = [ShaderProgram([_SourceStage('void main() {}'), ]) for _ in range(3)]
+        other = ShaderProgram([_SourceStage('void main() {}', GL.GL_VERTEX_SHADER), ])
+        handles = [int(p) for p in programs + [other, ]]
+        self.assertEqual(handles, [101, 101, 101, 102])
+        self.assertEqual(self.link_count, 2)
+        for p in programs[:2]:
+            p.dispose_gl()
+        self.assertEqual(self.deleted, [])
+        programs[2].dispose_gl()
+        self.assertEqual(self.deleted, [101, ])
+        self.assertIs(current_resources(), current_resources())
+
+    def test_texture_uploader_per_context(self):
+        uploader = current_resources().texture_uploader
+        self.assertIs(current_resources().texture_uploader, uploader)
+        with mock.patch.object(TextureUploader, 'dispose_gl') as dispose:
+            resource_cache.dispose_context()
+        dispose.assert_called_once_with()
+        # The next context streams through its own pixel buffers
+        self.assertIsNot(current_resources().texture_uploader, uploader)
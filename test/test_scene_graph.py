@@ -0,0 +1,67 @@
+import unittest
+from math import radians
+
+import numpy
+
+from wiggle.geometry.matrix import Matrix4f
+from wiggle.render.base_actor import BaseActor
+from wiggle.render.renderer import Renderer
+from wiggle.render.scene_graph import SceneGraph
+
+
+class TestSceneGraph(unittest.TestCase):
+    def test_world_matrices(self):
+        graph = SceneGraph(capacity=2)
+        root = graph.add_node()
+        arm = root.add_child()
+        hand = arm.add_child()
+        other = graph.add_node()
+        root.model_matrix.model_center = (1, 0, 0)
+        arm.model_matrix.model_rotation = Matrix4f.rotation((0, 0, 1), radians(90))
+        hand.model_matrix.model_center = (2, 0, 0)
+        expected = (Matrix4f.translation(1, 0, 0) @ Matrix4f.rotation((0, 0, 1), radians(90))
+                    @ Matrix4f.translation(2, 0, 0)).m
+        numpy.testing.assert_allclose(hand.world_matrix, expected, atol=1e-6)
+        numpy.testing.assert_allclose(hand.world_matrix[:3, 3], (1, 2, 0), atol=1e-6)
+        numpy.testing.assert_allclose(other.world_matrix, numpy.identity(4))
+        self.assertEqual(len(graph.world_matrices()), 4)
+
+    def test_only_dirty_subtrees_update(self):
+        graph = SceneGraph()
+        roots = [graph.add_node() for _ in range(10)]
+        leaves = [r.add_child().add_child() for r in roots]
+        graph.update()
+        self.assertEqual(graph.updated_node_count, 30)
+        graph.update()
+        self.assertEqual(graph.updated_node_count, 0)
+        roots[3].model_matrix.model_scale = 2
+        graph.update()
+        self.assertEqual(graph.updated_node_count, 3)
+        self.assertEqual(leaves[3].world_matrix[0, 0], 2)
+        self.assertEqual(leaves[4].world_matrix[0, 0], 1)
+
+    def test_set_parent(self):
+        graph = SceneGraph()
+        a = graph.add_node()
+        b = graph.add_node()
+        child = a.add_child()
+        b.model_matrix.model_center = (0, 5, 0)
+        child.set_parent(b)
+        self.assertEqual(child.world_matrix[1, 3], 5)
+        self.assertEqual(a.children, [])
+        with self.assertRaises(ValueError):
+            b.set_parent(child)
+
+    def test_renderer_add_actor(self):
+        renderer = Renderer()
+        parent = BaseActor()
+        child = BaseActor()
+        renderer.add_actor(parent)
+        renderer.add_actor(child, parent=parent)
+        parent.model_center = (0, 0, -3)
+        child.model_center = (1, 0, 0)
+        numpy.testing.assert_allclose(child.world_matrix[:3, 3], (1, 0, -3))
+        # Actors outside any renderer still use their own model matrix
+        alone = BaseActor()
+        alone.model_center = (1, 0, 0)
+        self.assertIs(alone.world_matrix, alone.model_matrix.matrix)
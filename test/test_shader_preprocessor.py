@@ -0,0 +1,80 @@
+import os
+import sys
+import tempfile
+import unittest
+
+from OpenGL import GL
+
+from wiggle.material.preprocessor import ShaderPreprocessor
+from wiggle.material.shader import ShaderFileBlock, ShaderStage
+
+
+class TestShaderPreprocessor(unittest.TestCase):
+    def setUp(self):
+        self.preprocessor = ShaderPreprocessor()
+
+    def test_include(self):
+        source = self.preprocessor.expand([('wiggle.glsl', 'skybox.frag'), ])
+        lines = source.text.split('\n')
+        self.assertEqual(len(source.file_names), 2)
+        self.assertTrue(source.file_names[1].endswith('photosphere.glsl'))
+        self.assertIn('#line 1 1', lines)
+        self.assertIn('vec4 equirect_color(vec3 dir, sampler2D image)', lines)
+        # Every line of the expanded text leads back to its file
+        for line_number, line in enumerate(lines, start=1):
+            origin = source.origin(line_number)
+            if origin is None:
+                self.assertTrue(line.startswith('#line'))
+                continue
+            file_name, file_line_number = origin
+            package_file = 'skybox.frag' if file_name == source.file_names[0] else 'photosphere.glsl'
+            file_lines = self.preprocessor.read('wiggle.glsl', package_file)[0].splitlines()
+            self.assertEqual(line, file_lines[file_line_number - 1].rstrip())
+
+    def test_defines(self):
+        source = self.preprocessor.expand([('wiggle.glsl', 'skybox.frag'), ], defines={'SAMPLES': 4})
+        lines = source.text.split('\n')
+        self.assertEqual(lines[:3], ['#version 430', '#define SAMPLES 4', '#line 2 0'])
+        self.assertEqual(source.origin(4), (source.file_names[0], 2))
+        self.assertNotEqual(source.hash, self.preprocessor.expand([('wiggle.glsl', 'skybox.frag'), ]).hash)
+
+    def test_cache(self):
+        files = [('wiggle.glsl', 'plane.frag'), ]
+        source = self.preprocessor.expand(files, defines={'A': 1})
+        self.assertIs(self.preprocessor.expand(files, defines={'A': 1}), source)
+        self.preprocessor.clear()
+        self.assertIsNot(self.preprocessor.expand(files, defines={'A': 1}), source)
+
+    def test_modified_include(self):
+        with tempfile.TemporaryDirectory() as directory:
+            package = os.path.join(directory, 'wiggle_test_shaders')
+            os.mkdir(package)
+            for file_name, text in (
+                    ('__init__.py', ''),
+                    ('main.frag', '#version 430\n#pragma include "wiggle_test_shaders/common.glsl"\n'),
+                    ('common.glsl', 'float a = 1.0;\n')):
+                with open(os.path.join(package, file_name), 'w') as f:
+                    f.write(text)
+            sys.path.insert(0, directory)
+            try:
+                files = [('wiggle_test_shaders', 'main.frag'), ]
+                source = self.preprocessor.expand(files)
+                self.assertIn('float a = 1.0;', source.text)
+                # Only the included file changes, so the key of the top level file alone would miss it
+                common = os.path.join(package, 'common.glsl')
+                with open(common, 'w') as f:
+                    f.write('float a = 2.0;\n')
+                modified = os.stat(common).st_mtime_ns + 1000000
+                os.utime(common, ns=(modified, modified))
+                self.assertIn('float a = 2.0;', self.preprocessor.expand(files).text)
+            finally:
+                sys.path.remove(directory)
+                sys.modules.pop('wiggle_test_shaders', None)
+
+    def test_shader_stage(self):
+        stage = ShaderStage(
+            [ShaderFileBlock('wiggle.glsl', 'skybox.frag'), ], GL.GL_FRAGMENT_SHADER, defines={'X': 1})
+        self.assertIn('#define X 1', str(stage))
+        self.assertTrue(stage.file_name(1).endswith('photosphere.glsl'))
+        message = stage._format_warnings('1:12(3): error: syntax error')
+        self.assertIn('photosphere.glsl", line 12', message)
@@ -0,0 +1,55 @@
+import unittest
+from concurrent.futures import Future
+
+import numpy
+
+from wiggle.material.image_loader import ImageLoader, decode_image
+from wiggle.material.texture import Texture
+
+
+class TestImageLoader(unittest.TestCase):
+    def test_decode(self):
+        image = decode_image('_0010782_stitch2.jpg', 'wiggle.images')
+        proxy = decode_image('_0010782_stitch2.jpg', 'wiggle.images', max_size=256)
+        self.assertEqual(image.mode, 'RGBA')
+        self.assertEqual(proxy.mode, 'RGBA')
+        self.assertLessEqual(max(proxy.size), 256)
+        # Same aspect ratio, within rounding
+        self.assertAlmostEqual(proxy.size[0] / proxy.size[1], image.size[0] / image.size[1], places=1)
+
+    def test_shared_futures(self):
+        loader = ImageLoader()
+        future = loader.load('Point70.png', 'wiggle.app.panosphere.images')
+        self.assertIs(loader.load('Point70.png', 'wiggle.app.panosphere.images'), future)
+        self.assertIsNot(loader.load('Point70.png', 'wiggle.app.panosphere.images', max_size=8), future)
+        pixels = future.result(timeout=10)
+        self.assertEqual(pixels.dtype, numpy.uint8)
+        self.assertEqual(pixels.shape[2], 4)
+        missing = loader.load('no_such_file.png', 'wiggle.images')
+        self.assertIsNotNone(missing.exception(timeout=10))
+
+
+class TestTexture(unittest.TestCase):
+    def test_best_image_first(self):
+        texture = Texture('Point70.png', 'wiggle.app.panosphere.images')
+        texture.image_future = Future()
+        texture.proxy_future = Future()
+        self.assertIsNone(texture._ready_future())
+        texture.proxy_future.set_result(numpy.zeros((1, 2, 4), dtype=numpy.uint8))
+        self.assertIs(texture._ready_future(), texture.proxy_future)
+        texture._gl_texture.uploaded = texture.proxy_future
+        self.assertIsNone(texture._ready_future())
+        texture.image_future.set_result(numpy.zeros((2, 4, 4), dtype=numpy.uint8))
+        self.assertIs(texture._ready_future(), texture.image_future)
+        texture._gl_texture.uploaded = texture.image_future
+        self.assertTrue(texture.is_loaded)
+        self.assertIsNone(texture._ready_future())
+
+    def test_load_error(self):
+        texture = Texture('no_such_file.png', 'wiggle.images')
+        texture.image_future.exception(timeout=10)
+        texture.proxy_future.exception(timeout=10)
+        with self.assertLogs('wiggle.material.texture', 'WARNING'):
+            self.assertIsNone(texture._ready_future())
+        self.assertIsNotNone(texture.load_error)
+        self.assertFalse(texture.is_loaded)
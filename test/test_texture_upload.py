@@ -0,0 +1,102 @@
+import textwrap
+import unittest
+
+import numpy
+
+import wiggle.render.texture_upload
+from gl_helpers import EGL_SCRIPT_HEADER, GlRecorder, run_gl_script
+from wiggle.render.gl_state import gl_state
+from wiggle.render.texture_upload import TextureUploader, mipmap_level_count
+
+# Streams an image into a texture with Mesa, and checks the texels
+_GL_SCRIPT = EGL_SCRIPT_HEADER + textwrap.dedent('''
+    import numpy
+    from wiggle.render.texture_upload import TextureUploader, create_texture_storage
+    pixels = numpy.random.default_rng(3).integers(0, 256, (300, 64, 4), dtype=numpy.uint8)
+    uploader = TextureUploader(budget_bytes=64 * 4 * 100, budget_ms=1000.0, chunk_bytes=64 * 4 * 40)
+    done = []
+    upload = uploader.submit(create_texture_storage(64, 300), pixels, done.append)
+    frame_count = 0
+    while len(uploader) > 0:
+        uploader.run()
+        frame_count += 1
+    GL.glBindTexture(GL.GL_TEXTURE_2D, upload.texture_id)
+    texels = GL.glGetTexImage(GL.GL_TEXTURE_2D, 0, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, outputType=None)
+    texels = numpy.frombuffer(texels, dtype=numpy.uint8).reshape(pixels.shape)
+    assert numpy.array_equal(texels, pixels[::-1])
+    assert GL.glGetTexLevelParameteriv(GL.GL_TEXTURE_2D, 8, GL.GL_TEXTURE_HEIGHT) == 1
+    assert done == [upload]
+    small = uploader.upload_now(create_texture_storage(64, 30), pixels[:30])
+    GL.glBindTexture(GL.GL_TEXTURE_2D, small.texture_id)
+    texels = GL.glGetTexImage(GL.GL_TEXTURE_2D, 0, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, outputType=None)
+    assert numpy.array_equal(numpy.frombuffer(texels, dtype=numpy.uint8).reshape(30, 64, 4), pixels[29::-1])
+    assert small.is_done
+    uploader.dispose_gl()
+    print(frame_count)
+''')
+
+
+class _CountingUploader(TextureUploader):
+    """Sends no pixels, just advances the rows"""
+    def _send_chunk(self, upload):
+        row_count = self._chunk_row_count(upload)
+        upload.next_row += row_count
+        return row_count * upload.rows.shape[1] * 4
+
+
+class TestTextureUploader(unittest.TestCase):
+    def setUp(self):
+        self.real_gl = wiggle.render.texture_upload.GL, gl_state.gl
+        recorder = GlRecorder()
+        wiggle.render.texture_upload.GL = gl_state.gl = recorder
+
+    def tearDown(self):
+        wiggle.render.texture_upload.GL, gl_state.gl = self.real_gl
+        gl_state.reset()
+
+    def test_mipmap_level_count(self):
+        self.assertEqual(mipmap_level_count(1, 1), 1)
+        self.assertEqual(mipmap_level_count(256, 128), 9)
+        self.assertEqual(mipmap_level_count(300, 64), 9)
+
+    def test_budget(self):
+        uploader = _CountingUploader(budget_bytes=1000, budget_ms=1000.0, chunk_bytes=400)
+        done = []
+        upload = uploader.submit(1, numpy.zeros((45, 10, 4), dtype=numpy.uint8), done.append)
+        uploader.run()
+        # 10 rows per chunk, stopping once 1000 bytes are sent
+        self.assertEqual(upload.next_row, 30)
+        self.assertEqual(uploader.uploaded_bytes, 1200)
+        self.assertEqual(done, [])
+        uploader.run()
+        self.assertEqual(uploader.uploaded_bytes, 600)
+        self.assertEqual(done, [upload])
+        self.assertTrue(upload.is_done)
+        self.assertEqual(len(uploader), 0)
+
+    def test_progress_every_frame(self):
+        uploader = _CountingUploader(budget_bytes=1, budget_ms=0.0, chunk_bytes=1)
+        upload = uploader.submit(1, numpy.zeros((3, 10, 4), dtype=numpy.uint8))
+        second = uploader.submit(2, numpy.zeros((3, 10, 4), dtype=numpy.uint8))
+        uploader.run()
+        self.assertEqual(upload.next_row, 1)
+        uploader.cancel(upload)
+        self.assertTrue(upload.is_cancelled)
+        uploader.run()
+        uploader.run()
+        uploader.run()
+        self.assertTrue(second.is_done)
+        self.assertFalse(upload.is_done)
+
+    def test_upload_now(self):
+        uploader = _CountingUploader(budget_bytes=1, budget_ms=0.0, chunk_bytes=40)
+        upload = uploader.upload_now(1, numpy.zeros((45, 10, 4), dtype=numpy.uint8))
+        # Past any budget, and without joining the queue
+        self.assertTrue(upload.is_done)
+        self.assertEqual(upload.next_row, 45)
+        self.assertEqual(len(uploader), 0)
+
+    def test_streaming_with_gl(self):
+        # 40 row chunks, three to reach the 100 row budget
+        self.assertEqual(int(run_gl_script(self, _GL_SCRIPT)), 3)
+
@@ -0,0 +1,99 @@
+import math
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy
+from PIL import Image
+
+from wiggle.geometry.camera import PerspectiveCamera
+from wiggle.material.skybox import SkyBoxMaterial
+from wiggle.material.tile_pyramid import TilePyramid, build_tile_pyramid, is_tile_pyramid
+from wiggle.material.virtual_texture import TileCache, VirtualTexture, page_table, visible_tiles
+
+
+class TestTilePyramid(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        # Each pixel encodes its own column and row
+        x, y = numpy.meshgrid(numpy.arange(100), numpy.arange(50))
+        pixels = numpy.stack([x, y, numpy.zeros_like(x)], axis=2).astype(numpy.uint8)
+        self.file_name = os.path.join(self.directory.name, 'pano.png')
+        Image.fromarray(pixels).save(self.file_name)
+        self.pyramid = build_tile_pyramid(
+            self.file_name, os.path.join(self.directory.name, 'tiles'), tile_size=16, format='png')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_levels(self):
+        pyramid = TilePyramid(os.path.join(self.directory.name, 'tiles', 'tiles.json'))
+        self.assertTrue(is_tile_pyramid(pyramid.directory))
+        self.assertFalse(is_tile_pyramid(self.file_name))
+        self.assertEqual(pyramid.levels, [(100, 50), (50, 25), (25, 13), (13, 7)])
+        self.assertEqual(pyramid.grid_sizes, [(7, 4), (4, 2), (2, 1), (1, 1)])
+        self.assertEqual(pyramid.table_shape, (8, 7))
+        self.assertEqual(len(pyramid.tiles(1)), 8)
+
+    def test_image_orientation(self):
+        material = SkyBoxMaterial(VirtualTexture(self.pyramid.directory))
+        material.image_top_down_location = 7  # as if the shader kept the uniform
+        with mock.patch('OpenGL.GL.glUniform1i') as uniform:
+            material.set_image_orientation(material.texture)
+        uniform.assert_called_once_with(7, 0)
+
+    def test_tile_borders(self):
+        tile = numpy.asarray(Image.open(self.pyramid.tile_file_name(0, 0, 0)))
+        self.assertEqual(tile.shape, (18, 18, 3))
+        # Left border wraps around to the last column; top border repeats row 0
+        self.assertEqual(tuple(tile[1, 0, :2]), (99, 0))
+        self.assertEqual(tuple(tile[0, 1, :2]), (0, 0))
+        self.assertEqual(tuple(tile[17, 17, :2]), (16, 16))
+        # Last column of tiles is padded past the right edge, from the left edge
+        tile = numpy.asarray(Image.open(self.pyramid.tile_file_name(0, 6, 3)))
+        self.assertEqual(tuple(tile[1, 4, :2]), (99, 48))
+        self.assertEqual(tuple(tile[1, 5, :2]), (0, 48))
+        self.assertEqual(tuple(tile[17, 4, :2]), (99, 49))
+
+    def test_page_table(self):
+        cache = TileCache(4)
+        cache.insert((3, 0, 0), is_pinned=True)
+        cache.insert((1, 3, 1))
+        table = page_table(self.pyramid, cache, slots_across=2)
+        # Every tile of level 0 shows the coarsest tile, except under the loaded level 1 tile
+        self.assertEqual(tuple(table[0, 0]), (0, 0, 3, 1))
+        self.assertEqual(tuple(table[3, 6]), (1, 0, 1, 1))
+        self.assertEqual(tuple(table[4 + 1, 3]), (1, 0, 1, 1))
+        self.assertEqual(tuple(table[4 + 2 + 1, 0]), (0, 0, 3, 1))
+        self.assertEqual(tuple(table[0, 6]), (0, 0, 3, 1))
+
+    def test_visible_tiles(self):
+        camera = PerspectiveCamera()
+        camera.fov_y = math.radians(30)
+        tiles = visible_tiles(self.pyramid, camera, viewport_height=200)
+        # Looking down -Z is the center of the image, at full resolution
+        self.assertIn((0, 3, 1), tiles)
+        self.assertIn((1, 1, 0), tiles)
+        self.assertNotIn((0, 0, 1), tiles)
+        # Smaller on screen needs only coarser levels
+        tiles = visible_tiles(self.pyramid, camera, viewport_height=2)
+        self.assertEqual(min(level for level, column, row in tiles), 2)
+
+
+class TestTileCache(unittest.TestCase):
+    def test_least_recently_used(self):
+        cache = TileCache(3)
+        self.assertEqual(cache.insert('top', is_pinned=True), (0, None))
+        self.assertEqual(cache.insert('a'), (1, None))
+        self.assertEqual(cache.insert('b'), (2, None))
+        # All in use this frame
+        self.assertIsNone(cache.insert('c'))
+        cache.begin_frame()
+        cache.touch('a')
+        self.assertEqual(cache.insert('c'), (2, 'b'))
+        self.assertNotIn('b', cache)
+        self.assertIn('top', cache)
+        cache.begin_frame()
+        self.assertEqual(cache.insert('d'), (1, 'a'))
+        self.assertEqual(len(cache), 3)
@@ -1,8 +1,8 @@
-import pkg_resources
+import importlib.resources
 
 from PyQt5 import uic
 from PyQt5.Qt import QCoreApplication
-from PyQt5.QtCore import QMimeData, QSettings, Qt, QPoint
+from PyQt5.QtCore import QMimeData, QSettings, Qt, QPoint, pyqtSignal
 from PyQt5.QtGui import QDrag, QPixmap
 from PyQt5.QtWidgets import QMainWindow, QFileDialog
 
@@ -13,6 +13,9 @@ from wiggle.render.renderer import Renderer
 
 
 class MainWindow(QMainWindow):
+    # Emitted from image decoding threads; connections run on the GUI thread
+    image_decoded = pyqtSignal()
+
     def __init__(self, *args, **kwargs):
         QMainWindow.__init__(self, *args, **kwargs)
         self._setup_ui()
@@ -22,6 +25,7 @@ class MainWindow(QMainWindow):
         #
         self.renderer = Renderer()
         self._setup_canvas()
+        self.image_decoded.connect(self.openGLWidget.update)
         self.panosphere = Panosphere()
         self.renderer.add_actor(self.panosphere.actor)
         #
@@ -33,7 +37,7 @@ class MainWindow(QMainWindow):
         )
 
     def _setup_ui(self):
-        uic.loadUi(uifile=pkg_resources.resource_stream('wiggle.app.panosphere', 'panosphere.ui'), baseinstance=self)
+        uic.loadUi(uifile=importlib.resources.files('wiggle.app.panosphere').joinpath('panosphere.ui').open('rb'), baseinstance=self)
         self.read_settings()
         self.clear_settings()
         self.openGLWidget.main_window = self
@@ -54,7 +58,9 @@ class MainWindow(QMainWindow):
 
     def load_file(self, file_name):
         self.recent_files.add_file(file_name)
-        self.panosphere.add_image(file_name)
+        # Decoding continues in the background; repaint as the pixels arrive
+        texture = self.panosphere.add_image(file_name)
+        texture.add_done_callback(lambda future: self.image_decoded.emit())
         self.openGLWidget.update()
 
     def on_actionOpen_triggered(self, checked=None):
@@ -64,8 +70,8 @@ class MainWindow(QMainWindow):
         result = QFileDialog.getOpenFileName(
             parent=self,
             caption='Open a spherical panorama image file now',
-            filter='All Files (*.*);;Images (*.jpg *.ktx)',
-            initialFilter='Images (*.jpg *.ktx)',
+            filter='All Files (*.*);;Images (*.jpg *.png *.ktx *.ktx2);;Tiled panoramas (tiles.json)',
+            initialFilter='Images (*.jpg *.png *.ktx *.ktx2)',
         )
         if result is None:
             return
@@ -93,7 +99,7 @@ class MainWindow(QMainWindow):
         mime_data.setText(self.verticalLineButton.text())
         drag = QDrag(self.verticalLineButton)
         drag.setMimeData(mime_data)
-        pixmap = QPixmap(pkg_resources.resource_filename('wiggle.app.panosphere.images', 'VerticalLine32.png'))
+        pixmap = QPixmap(str(importlib.resources.files('wiggle.app.panosphere.images').joinpath('VerticalLine32.png')))
         drag.setHotSpot(QPoint(16, 4))
         drag.setPixmap(pixmap)
         drag.exec(Qt.CopyAction)
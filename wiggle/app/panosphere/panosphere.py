@@ -1,7 +1,10 @@
 from wiggle.geometry import normalize
 from wiggle.geometry import Vec3
+from wiggle.geometry.direction_index import DirectionIndex
 from wiggle.material.skybox import SkyBoxMaterial
 from wiggle.material.texture import Texture
+from wiggle.material.tile_pyramid import is_tile_pyramid
+from wiggle.material.virtual_texture import VirtualTexture
 from wiggle.render.base import RenderPassType
 from wiggle.render.base_actor import BaseActor
 from wiggle.render.infinite_point_actor import InfinitePointActor, PointStyle
@@ -16,10 +19,14 @@ class PanoActor(BaseActor):
         self.image_actors = []
 
     def add_image(self, file_name):
-        sky_texture = Texture(
-            file_name=file_name,
-            is_equirectangular=True)
+        if is_tile_pyramid(file_name):
+            sky_texture = VirtualTexture(file_name)
+        else:
+            sky_texture = Texture(
+                file_name=file_name,
+                is_equirectangular=True)
         self.image_actors.append(SkyBoxActor(material=SkyBoxMaterial(sky_texture)))
+        return sky_texture
 
     def display_gl(self, *args, **kwargs):
         for image in self.image_actors:
@@ -61,40 +68,31 @@ class PanoPoint(object):
 class Panosphere(object):
     def __init__(self):
         self._points = []
+        self._point_index = DirectionIndex()
         self._vertical_lines = []
         self.actor = PanoActor()
 
     def add_image(self, file_name):
-        self.actor.add_image(file_name)
+        """Start loading a panorama image, or tile pyramid, returning its Texture or VirtualTexture"""
+        return self.actor.add_image(file_name)
 
     def add_vertical_line(self, point1, point2):
         p1 = PanoPoint(*point1)
         p1.is_adjusted = True
         p2 = PanoPoint(*point2)
         self._vertical_lines.append(VerticalLine(p1, p2))
-        self._points.append(p1)
-        self._points.append(p2)
+        for p in (p1, p2):
+            self._points.append(p)
+            self._point_index.add(p.direction.pack(), p)
         self.actor.points_actor.add_point(*p1, style=p1.style)
         self.actor.points_actor.add_point(*p2, style=p2.style)
 
     def point_near(self, x, y, z, tolerance):
-        # todo: use a more sophisticated spatial index
-        d2_max = tolerance * tolerance
-        d2_min = None
-        best_point = None
-        for p in self._points:
-            dv = p - (x, y, z)
-            test2 = dv.dot(dv)
-            if test2 > d2_max:
-                continue
-            if d2_min is None:
-                d2_min = test2
-                best_point = p
-                continue
-            if test2 < d2_min:
-                d2_min = test2
-                best_point = p
-        return best_point
+        """The PanoPoint nearest to direction (x, y, z), within tolerance radians, or None"""
+        key = self._point_index.nearest((x, y, z), tolerance)
+        if key is None:
+            return None
+        return self._point_index.item(key)
 
 
 class VerticalLine(object):
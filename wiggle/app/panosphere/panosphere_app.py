@@ -1,5 +1,5 @@
 import ctypes
-import pkg_resources
+import importlib.resources
 import sys
 
 from PyQt5.QtWidgets import QApplication
@@ -31,9 +31,8 @@ class PanosphereApplication(QApplication):
         # https://stackoverflow.com/a/21330349/146574 but it did not work for me
         app_icon = QIcon()
         for s in (16, 24, 32, 48, 64, 128, 256):
-            icon_file = pkg_resources.resource_filename(
-                'wiggle.app.panosphere.images',
-                f'PanosphereIcon{s}.png')
+            icon_file = str(importlib.resources.files('wiggle.app.panosphere.images').joinpath(
+                f'PanosphereIcon{s}.png'))
             app_icon.addFile(icon_file, QSize(s, s))
         self.setWindowIcon(app_icon)
         self.main_window = MainWindow()
@@ -1,7 +1,7 @@
 import logging
 import math
-import pkg_resources
 import datetime
+import importlib.resources
 
 from PyQt5.QtCore import Qt
 from PyQt5.QtWidgets import QAction, QOpenGLWidget, QMenu
@@ -10,7 +10,7 @@ import numpy
 
 from wiggle.geometry import normalize, Vec3
 from wiggle.geometry.camera import PerspectiveCamera
-from wiggle.geometry.matrix import Matrix4f
+from wiggle.geometry.quaternion import Quaternion
 from wiggle.render.infinite_point_actor import InfinitePointActor
 
 _log_level = logging.WARN
@@ -43,7 +43,7 @@ class PanosphereSceneCanvas(QOpenGLWidget):
         self.setFormat(format_)
         self.setAcceptDrops(True)
         #
-        cursor_file_name = pkg_resources.resource_filename('wiggle.images', 'cross-hair.png')
+        cursor_file_name = str(importlib.resources.files('wiggle.images').joinpath('cross-hair.png'))
         cursor_pixmap = QPixmap(cursor_file_name)
         cross_hair_cursor = QCursor(cursor_pixmap, 15, 15)
         self.setCursor(cross_hair_cursor)
@@ -51,6 +51,7 @@ class PanosphereSceneCanvas(QOpenGLWidget):
         self.main_window = None
         self.hover_actor = None
         self.has_hover_effect = False
+        self.selected_actor = None  # scene actor last clicked on
 
     def center_on(self, position_w):
         a = position_w
@@ -61,8 +62,8 @@ class PanosphereSceneCanvas(QOpenGLWidget):
         cosangle = min(cosangle, 1.0)
         cosangle = max(cosangle, -1.0)
         rotation_angle = math.acos(cosangle)
-        rot = Matrix4f.rotation(rotation_axis, rotation_angle)
-        self.camera.rotation = self.camera.rotation @ rot
+        rot = Quaternion.from_axis_angle(rotation_axis, rotation_angle)
+        self.camera.orientation = self.camera.orientation * rot
         self.camera.set_y_up()
         self.update()
 
@@ -141,13 +142,27 @@ class PanosphereSceneCanvas(QOpenGLWidget):
                 self.has_hover_effect = True
                 self.update()
 
+    def _world_ray_from_screen_pixel(self, x, y):
+        return self.camera.ray(2 * x / self.width() - 1, -2 * y / self.height() + 1)
+
     def _world_direction_from_screen_pixel(self, x, y):
-        p_ndc = (2 * x / self.width() - 1, -2 * y / self.height() + 1)
-        p_view = numpy.linalg.inv(self.camera.projection) @ (p_ndc[0], p_ndc[1], 0.5, 1.0)
-        p_view = normalize(Vec3(*p_view[:3]))
-        # todo: rotation
-        p_world = numpy.linalg.inv(self.camera.view_matrix) @ (p_view[0], p_view[1], p_view[2], 0)
-        return p_world[:3]
+        return self._world_ray_from_screen_pixel(x, y)[1]
+
+    def actor_at_screen_pixel(self, x, y):
+        """Nearest scene actor under a mouse position, as (actor, distance), or None"""
+        if self.renderer is None:
+            return None
+        return self.renderer.pick(*self._world_ray_from_screen_pixel(x, y))
+
+    def select_actor_at(self, x, y):
+        """Select the nearest scene actor under a mouse position, if any, and name it in the status bar"""
+        hit = self.actor_at_screen_pixel(x, y)
+        if hit is None:
+            self.selected_actor = None
+            return
+        self.selected_actor, distance = hit
+        if self.main_window is not None:
+            self.main_window.statusbar.showMessage(f'selected {type(self.selected_actor).__name__}, {distance:.2f} away')
 
     def mousePressEvent(self, event):
         if self.is_dragging:
@@ -155,6 +170,7 @@ class PanosphereSceneCanvas(QOpenGLWidget):
         if event.buttons() & Qt.LeftButton:
             self.is_dragging = True
             self.mouse_location = event.pos()
+            self.select_actor_at(event.pos().x(), event.pos().y())
 
     def mouseReleaseEvent(self, event):
         if event.button() == Qt.LeftButton:
@@ -165,13 +181,14 @@ class PanosphereSceneCanvas(QOpenGLWidget):
             self.renderer.display_gl(camera=self.camera)
 
     def reset_view(self):
-        self.camera.rotation = Matrix4f.identity()
+        self.camera.orientation = Quaternion()
         self.camera.fov_y = math.radians(45)
         self.update()
 
     def resizeGL(self, width, height):
         aspect = width / float(height)
         self.camera.aspect = aspect
+        self.camera.viewport_size = (width, height)
 
     def set_canvas_size(self, width, height):
         while self.width() != width or self.height() != height:
@@ -1,4 +1,4 @@
-import pkg_resources
+import importlib.resources
 
 from PyQt5 import uic
 from PyQt5.Qt import QCoreApplication, QModelIndex
@@ -46,7 +46,7 @@ class MainWindow(QMainWindow):
         QCoreApplication.quit()
 
     def _setup_ui(self):
-        uic.loadUi(uifile=pkg_resources.resource_stream('wiggle.app.qt', 'glcube.ui'), baseinstance=self)
+        uic.loadUi(uifile=importlib.resources.files('wiggle.app.qt').joinpath('glcube.ui').open('rb'), baseinstance=self)
         self.openGLWidget.main_window = self
         self.actionQuit.triggered.connect(self._quit)
         self.actionMultisample.toggled.connect(self.toggle_multisampling)
@@ -71,6 +71,7 @@ class SceneCanvas(QOpenGLWidget):
     def resizeGL(self, width, height):
         aspect = width / float(height)
         self.camera.aspect = aspect
+        self.camera.viewport_size = (width, height)
 
     def set_canvas_size(self, width, height):
         while self.width() != width or self.height() != height:
@@ -158,6 +158,8 @@ class OpenVrGlRenderer(list):
             raise Exception("Unable to create compositor") 
         self.left_fb.init_gl()
         self.right_fb.init_gl()
+        self.left_camera.viewport_size = (w, h)
+        self.right_camera.viewport_size = (w, h)
         # Compute projection matrix
         zNear = 0.2
         zFar = 500.0
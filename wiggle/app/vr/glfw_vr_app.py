@@ -5,6 +5,7 @@ from OpenGL import GL
 
 from wiggle.app.vr import gl_renderer
 import wiggle.render.demo
+from wiggle.render.resource_cache import dispose_context
 
 
 class GlfwVrApp(object):
@@ -65,6 +66,7 @@ class GlfwVrApp(object):
             glfw.make_context_current(self.window)
             if self.renderer:
                 self.renderer.dispose_gl()
+            dispose_context()
         glfw.destroy_window(self.window)
         glfw.terminate()
         self._is_initialized = False
@@ -0,0 +1,90 @@
+"""
+Bounding volumes, and testing them against a view frustum.
+
+The test functions work on stacks of many bounds at once, shaped (N, 3)
+for box corners and sphere centers, so a whole render pass can be culled
+with a few numpy operations. Matrices follow wiggle.geometry.matrix:
+row major, transforming column vectors.
+"""
+
+import numpy
+
+from wiggle.geometry.matrix import transform_points
+
+
+def bounding_sphere(positions):
+    """Center and radius of a sphere enclosing all positions"""
+    positions = numpy.asarray(positions, dtype=numpy.float64)
+    if len(positions) < 1:
+        return numpy.zeros((3, )), 0.0
+    center = (positions.min(axis=0) + positions.max(axis=0)) / 2
+    return center, float(numpy.sqrt(((positions - center)**2).sum(axis=1).max()))
+
+
+class Bounds(object):
+    """Axis aligned bounding box and bounding sphere of some points, in the same coordinates"""
+    def __init__(self, box_min, box_max, center, radius):
+        self.box_min = box_min
+        self.box_max = box_max
+        self.center = center
+        self.radius = radius
+
+    def __repr__(self):
+        return f'Bounds({self.box_min.tolist()}, {self.box_max.tolist()}, {self.center.tolist()}, {self.radius:.3g})'
+
+    @classmethod
+    def from_positions(cls, positions):
+        positions = numpy.asarray(positions, dtype=numpy.float64).reshape((-1, 3))
+        center, radius = bounding_sphere(positions)
+        if len(positions) < 1:
+            return cls(numpy.zeros((3, )), numpy.zeros((3, )), center, radius)
+        return cls(positions.min(axis=0), positions.max(axis=0), center, radius)
+
+
+def frustum_planes(view_projection):
+    """
+    (6, 4) planes (a, b, c, d) of the frustum of a projection @ view matrix,
+    in the order left, right, bottom, top, near, far. Normals are unit
+    length, pointing inward, so a*x + b*y + c*z + d is the distance inside.
+    """
+    m = numpy.asarray(view_projection, dtype=numpy.float64)
+    planes = numpy.stack((m[3] + m[0], m[3] - m[0], m[3] + m[1], m[3] - m[1], m[3] + m[2], m[3] - m[2]))
+    return planes / numpy.linalg.norm(planes[:, :3], axis=1)[:, None]
+
+
+def transform_spheres(matrices, centers, radii):
+    """
+    Spheres enclosing (N, 3) centers and (N) radii after (N, 4, 4)
+    transforms, which may include nonuniform scale.
+    """
+    matrices = numpy.asarray(matrices, dtype=numpy.float64)
+    scales = numpy.linalg.norm(matrices[..., :3, :3], axis=-2).max(axis=-1)
+    return transform_points(matrices, centers).astype(numpy.float64), numpy.asarray(radii) * scales
+
+
+def transform_boxes(matrices, box_mins, box_maxs):
+    """Axis aligned boxes enclosing (N, 3) boxes after (N, 4, 4) affine transforms"""
+    matrices = numpy.asarray(matrices, dtype=numpy.float64)
+    box_mins = numpy.asarray(box_mins, dtype=numpy.float64)
+    box_maxs = numpy.asarray(box_maxs, dtype=numpy.float64)
+    centers = transform_points(matrices, (box_mins + box_maxs) / 2).astype(numpy.float64)
+    extents = numpy.einsum('...ij,...j->...i', numpy.abs(matrices[..., :3, :3]), (box_maxs - box_mins) / 2)
+    return centers - extents, centers + extents
+
+
+def spheres_in_frustum(planes, centers, radii):
+    """Boolean mask of the (N, 3) centers and (N) radii spheres touching the inside of all planes"""
+    distances = numpy.asarray(centers, dtype=numpy.float64) @ planes[:, :3].T + planes[:, 3]
+    return numpy.all(distances >= -numpy.asarray(radii)[..., None], axis=-1)
+
+
+def boxes_in_frustum(planes, box_mins, box_maxs):
+    """
+    Boolean mask of the (N, 3) boxes not entirely outside any plane. Boxes
+    near frustum corners can pass without actually being visible.
+    """
+    normals = planes[:, :3]
+    # The corner of each box farthest along each plane normal
+    farthest = numpy.where(normals >= 0, numpy.asarray(box_maxs)[:, None, :], numpy.asarray(box_mins)[:, None, :])
+    distances = (farthest * normals).sum(axis=-1) + planes[:, 3]
+    return numpy.all(distances >= 0, axis=-1)
@@ -0,0 +1,244 @@
+"""
+Bounding volume hierarchy over axis aligned boxes.
+
+The tree is stored in flat arrays. Primitives are reordered so each node
+covers one contiguous range of order[], which lets a query take a whole
+subtree with one slice. Queries walk the tree breadth first, testing all
+nodes of one depth with a single numpy operation, so the cost grows with
+the depth of the tree and the number of nodes actually touched rather
+than with the number of primitives. When primitives move, refit()
+recomputes the node boxes bottom up without changing the tree.
+"""
+
+import numpy
+
+DEFAULT_LEAF_SIZE = 4
+
+
+def _slab_distances(origin, inverse_direction, box_mins, box_maxs):
+    """Entry and exit ray parameters of (N, 3) boxes, by the slab method"""
+    with numpy.errstate(invalid='ignore'):
+        t0 = (box_mins - origin) * inverse_direction
+        t1 = (box_maxs - origin) * inverse_direction
+    # 0 * inf is nan, for rays parallel to a slab and starting on its plane; count that as inside
+    t0 = numpy.where(numpy.isnan(t0), -numpy.inf, t0)
+    t1 = numpy.where(numpy.isnan(t1), numpy.inf, t1)
+    near = numpy.minimum(t0, t1).max(axis=-1)
+    far = numpy.maximum(t0, t1).min(axis=-1)
+    return near, far
+
+
+def _inverse_direction(direction):
+    direction = numpy.asarray(direction, dtype=numpy.float64)
+    with numpy.errstate(divide='ignore'):
+        return 1.0 / direction
+
+
+def ray_box_distances(origin, direction, box_mins, box_maxs):
+    """
+    Entry and exit ray parameters, (near, far), of origin + t * direction
+    through (N, 3) boxes, or through one box per (N, 3) origin and direction.
+    The ray misses where near > far or far < 0.
+    """
+    return _slab_distances(
+        numpy.asarray(origin, dtype=numpy.float64), _inverse_direction(direction),
+        numpy.asarray(box_mins, dtype=numpy.float64), numpy.asarray(box_maxs, dtype=numpy.float64))
+
+
+def ray_box_distance(origin, direction, box_min, box_max):
+    """Ray parameter t >= 0 where origin + t * direction enters one box, or None for a miss"""
+    near, far = ray_box_distances(origin, direction, box_min, box_max)
+    if near > far or far < 0:
+        return None
+    return max(float(near), 0.0)
+
+
+def ray_triangle_distances(origin, direction, a, b, c):
+    """
+    Ray parameter t of the hit of origin + t * direction on each of the
+    (N, 3) corner triangles a, b, c, or inf for a miss. Both faces count.
+    """
+    origin = numpy.asarray(origin, dtype=numpy.float64)
+    direction = numpy.asarray(direction, dtype=numpy.float64)
+    # Moller and Trumbore, "Fast, Minimum Storage Ray/Triangle Intersection", 1997
+    edge1 = b - a
+    edge2 = c - a
+    p = numpy.cross(direction, edge2)
+    det = (edge1 * p).sum(axis=-1)
+    is_parallel = numpy.abs(det) < 1e-12
+    inverse_det = 1.0 / numpy.where(is_parallel, 1.0, det)
+    s = origin - a
+    u = (s * p).sum(axis=-1) * inverse_det
+    q = numpy.cross(s, edge1)
+    v = (q * direction).sum(axis=-1) * inverse_det
+    t = (q * edge2).sum(axis=-1) * inverse_det
+    is_hit = ~is_parallel & (u >= 0) & (v >= 0) & (u + v <= 1) & (t >= 0)
+    return numpy.where(is_hit, t, numpy.inf)
+
+
+class BoundingVolumeHierarchy(object):
+    """Binary tree of boxes around (N, 3) primitive boxes"""
+    def __init__(self, box_mins, box_maxs, leaf_size=DEFAULT_LEAF_SIZE):
+        box_mins = numpy.asarray(box_mins, dtype=numpy.float64).reshape((-1, 3))
+        box_maxs = numpy.asarray(box_maxs, dtype=numpy.float64).reshape((-1, 3))
+        self.leaf_size = leaf_size
+        self._build(box_mins, box_maxs)
+        self.refit(box_mins, box_maxs)
+
+    def __len__(self):
+        return len(self.order)
+
+    def _build(self, box_mins, box_maxs):
+        """Top down, splitting each node at the median centroid along its longest axis"""
+        count = len(box_mins)
+        centroids = (box_mins + box_maxs) / 2
+        order = numpy.arange(count)
+        starts = [0]
+        counts = [count]
+        children = [[-1, -1]]
+        depths = [0]
+        stack = [0] if count > self.leaf_size else []
+        while len(stack) > 0:
+            node = stack.pop()
+            start, n = starts[node], counts[node]
+            members = order[start:start + n]
+            c = centroids[members]
+            axis = int(numpy.argmax(c.max(axis=0) - c.min(axis=0)))
+            half = n // 2
+            order[start:start + n] = members[numpy.argpartition(c[:, axis], half)]
+            for side, (child_start, child_count) in enumerate(((start, half), (start + half, n - half))):
+                children[node][side] = len(starts)
+                if child_count > self.leaf_size:
+                    stack.append(len(starts))
+                starts.append(child_start)
+                counts.append(child_count)
+                children.append([-1, -1])
+                depths.append(depths[node] + 1)
+        self.order = order
+        self.starts = numpy.array(starts, dtype=numpy.int64)
+        self.counts = numpy.array(counts, dtype=numpy.int64)
+        self.children = numpy.array(children, dtype=numpy.int64).reshape((-1, 2))
+        self.is_leaf = self.children[:, 0] < 0
+        depths = numpy.array(depths, dtype=numpy.int64)
+        self._levels = [numpy.flatnonzero(depths == d) for d in range(int(depths.max()) + 1)]
+        leaves = numpy.flatnonzero(self.is_leaf & (self.counts > 0))
+        self._leaves = leaves[numpy.argsort(self.starts[leaves])]
+        self.node_mins = numpy.zeros((len(starts), 3))
+        self.node_maxs = numpy.zeros((len(starts), 3))
+
+    def refit(self, box_mins, box_maxs):
+        """Update the node boxes for moved primitives, keeping the tree structure"""
+        box_mins = numpy.asarray(box_mins, dtype=numpy.float64).reshape((-1, 3))
+        box_maxs = numpy.asarray(box_maxs, dtype=numpy.float64).reshape((-1, 3))
+        if len(box_mins) != len(self.order):
+            raise ValueError(f'{len(box_mins)} boxes given, but the hierarchy has {len(self.order)}')
+        self.box_mins = box_mins
+        self.box_maxs = box_maxs
+        if len(self._leaves) < 1:
+            return
+        leaf_starts = self.starts[self._leaves]
+        self.node_mins[self._leaves] = numpy.minimum.reduceat(box_mins[self.order], leaf_starts)
+        self.node_maxs[self._leaves] = numpy.maximum.reduceat(box_maxs[self.order], leaf_starts)
+        for level in reversed(self._levels):
+            inner = level[~self.is_leaf[level]]
+            left, right = self.children[inner, 0], self.children[inner, 1]
+            self.node_mins[inner] = numpy.minimum(self.node_mins[left], self.node_mins[right])
+            self.node_maxs[inner] = numpy.maximum(self.node_maxs[left], self.node_maxs[right])
+
+    def _subtree_primitives(self, nodes):
+        if len(nodes) < 1:
+            return numpy.zeros((0, ), dtype=numpy.int64)
+        return numpy.concatenate([self.order[s:s + n] for s, n in zip(self.starts[nodes], self.counts[nodes])])
+
+    def frustum_query(self, planes):
+        """
+        Indexes of the primitives whose boxes are not entirely outside any
+        of the (P, 4) inward facing planes, as from
+        wiggle.geometry.bounds.frustum_planes().
+        """
+        normals = planes[:, :3]
+        found = []
+        frontier = numpy.zeros((1, ), dtype=numpy.int64) if len(self.order) > 0 else []
+        while len(frontier) > 0:
+            mins = self.node_mins[frontier][:, None, :]
+            maxs = self.node_maxs[frontier][:, None, :]
+            farthest = (numpy.where(normals >= 0, maxs, mins) * normals).sum(axis=-1) + planes[:, 3]
+            nearest = (numpy.where(normals >= 0, mins, maxs) * normals).sum(axis=-1) + planes[:, 3]
+            touching = numpy.all(farthest >= 0, axis=1)
+            inside = numpy.all(nearest >= 0, axis=1)
+            # Subtrees entirely inside need no more tests
+            found.append(self._subtree_primitives(frontier[inside]))
+            partial = frontier[touching & ~inside]
+            leaves = partial[self.is_leaf[partial]]
+            if len(leaves) > 0:
+                candidates = self._subtree_primitives(leaves)
+                mins = self.box_mins[candidates][:, None, :]
+                maxs = self.box_maxs[candidates][:, None, :]
+                farthest = (numpy.where(normals >= 0, maxs, mins) * normals).sum(axis=-1) + planes[:, 3]
+                found.append(candidates[numpy.all(farthest >= 0, axis=1)])
+            frontier = self.children[partial[~self.is_leaf[partial]]].reshape(-1)
+        if len(found) < 1:
+            return numpy.zeros((0, ), dtype=numpy.int64)
+        return numpy.sort(numpy.concatenate(found))
+
+    def ray_query(self, origin, direction, max_distance=numpy.inf):
+        """
+        Indexes of the primitives whose boxes the ray origin + t * direction
+        enters, for 0 <= t <= max_distance, and the entry t of each, sorted
+        nearest first.
+        """
+        origin = numpy.asarray(origin, dtype=numpy.float64)
+        inverse_direction = _inverse_direction(direction)
+        leaves = []
+        frontier = numpy.zeros((1, ), dtype=numpy.int64) if len(self.order) > 0 else []
+        while len(frontier) > 0:
+            near, far = _slab_distances(
+                origin, inverse_direction, self.node_mins[frontier], self.node_maxs[frontier])
+            hit = frontier[(near <= far) & (far >= 0) & (near <= max_distance)]
+            leaves.append(hit[self.is_leaf[hit]])
+            frontier = self.children[hit[~self.is_leaf[hit]]].reshape(-1)
+        candidates = self._subtree_primitives(numpy.concatenate(leaves) if len(leaves) > 0 else [])
+        near, far = _slab_distances(origin, inverse_direction, self.box_mins[candidates], self.box_maxs[candidates])
+        is_hit = (near <= far) & (far >= 0) & (near <= max_distance)
+        candidates, near = candidates[is_hit], numpy.maximum(near[is_hit], 0)
+        nearest_first = numpy.argsort(near, kind='stable')
+        return candidates[nearest_first], near[nearest_first]
+
+    def ray_cast(self, origin, direction, hit_test=None, max_distance=numpy.inf):
+        """
+        Nearest primitive hit by the ray origin + t * direction, as
+        (index, t), or None.
+
+        :param hit_test: function(index) returning the exact ray parameter t
+            where the ray hits that primitive, or None for a miss. By default,
+            the primitive boxes are the hit surfaces.
+        """
+        best = None
+        for index, entry in zip(*self.ray_query(origin, direction, max_distance)):
+            if best is not None and entry > best[1]:
+                break  # every remaining box starts beyond the nearest hit
+            t = entry if hit_test is None else hit_test(int(index))
+            if t is not None and t <= max_distance and (best is None or t < best[1]):
+                best = (int(index), float(t))
+        return best
+
+
+class TriangleHierarchy(object):
+    """BoundingVolumeHierarchy over the triangles of a mesh, for ray picking"""
+    def __init__(self, positions, triangles, leaf_size=DEFAULT_LEAF_SIZE):
+        positions = numpy.asarray(positions, dtype=numpy.float64)
+        self.triangles = numpy.asarray(triangles, dtype=numpy.int64).reshape((-1, 3))
+        self.corners = positions[self.triangles]  # (T, 3, 3)
+        self.bvh = BoundingVolumeHierarchy(self.corners.min(axis=1), self.corners.max(axis=1), leaf_size)
+
+    def ray_cast(self, origin, direction, max_distance=numpy.inf):
+        """Nearest triangle hit by the ray origin + t * direction, as (triangle index, t), or None"""
+        candidates, entries = self.bvh.ray_query(origin, direction, max_distance)
+        if len(candidates) < 1:
+            return None
+        corners = self.corners[candidates]
+        distances = ray_triangle_distances(origin, direction, corners[:, 0], corners[:, 1], corners[:, 2])
+        best = int(numpy.argmin(distances))
+        if not distances[best] <= max_distance:
+            return None
+        return int(candidates[best]), float(distances[best])
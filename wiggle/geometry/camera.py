@@ -3,24 +3,40 @@ import math
 import numpy
 
 from wiggle.geometry import normalize
-from wiggle.geometry.matrix import Matrix4f
+from wiggle.geometry.matrix import identity_matrices, perspective_matrices
+from wiggle.geometry.quaternion import Quaternion
 
 
 class PerspectiveCamera(object):
+    """
+    Orbiting perspective camera.
+
+    The view and projection matrices are rebuilt in place, into the same
+    arrays, only after a property they depend on changes. view_version
+    counts the view matrix rebuilds. Orientation is kept as a unit
+    quaternion, so repeated small rotations stay orthonormal.
+    viewport_size is the (width, height) in pixels of the view, kept by
+    the canvas as it resizes, so draws need not query OpenGL for it.
+    """
     def __init__(self):
         self._focus = numpy.array([0, 0, 0], dtype='float32')
         # View matrix
-        self.distance = 10
-        self._rotation = numpy.identity(4, dtype='float32')
+        self._distance = 10
+        self._orientation = Quaternion()
+        self._rotation = identity_matrices()
+        self._rotation_needs_update = False
         # Projection
         self._fov_y = math.radians(45.0)
         self._aspect = 1.0
-        self.z_near = 0.1
-        self.z_far = 100.0
-        self._projection = None
+        self._z_near = 0.1
+        self._z_far = 100.0
+        self._projection = identity_matrices()
         self._projection_needs_update = True
-        self._view_matrix = None
+        self._view_matrix = identity_matrices()
         self._view_matrix_needs_update = True
+        self._focus_offset = numpy.zeros((3, ), dtype=numpy.float32)
+        self.view_version = 0
+        self.viewport_size = None
 
     @property
     def aspect(self):
@@ -31,6 +47,15 @@ class PerspectiveCamera(object):
         self._projection_needs_update = True
         self._aspect = aspect
 
+    @property
+    def distance(self):
+        return self._distance
+
+    @distance.setter
+    def distance(self, distance):
+        self._view_matrix_needs_update = True
+        self._distance = distance
+
     @property
     def focus(self):
         return self._focus
@@ -56,26 +81,56 @@ class PerspectiveCamera(object):
         return self._projection
 
     def _update_projection(self):
-        m = Matrix4f.perspective(
+        perspective_matrices(
                 fov_y=self.fov_y,
                 aspect=self.aspect,
                 z_near=self.z_near,
-                z_far=self.z_far)
-        self._projection = m.pack()
+                z_far=self.z_far,
+                out=self._projection)
         self._projection_needs_update = False
 
+    @property
+    def z_near(self):
+        return self._z_near
+
+    @z_near.setter
+    def z_near(self, z_near):
+        self._projection_needs_update = True
+        self._z_near = z_near
+
+    @property
+    def z_far(self):
+        return self._z_far
+
+    @z_far.setter
+    def z_far(self, z_far):
+        self._projection_needs_update = True
+        self._z_far = z_far
+
+    @property
+    def orientation(self):
+        return self._orientation
+
+    @orientation.setter
+    def orientation(self, orientation):
+        self._orientation = orientation.normalized()
+        self._rotation_needs_update = True
+        self._view_matrix_needs_update = True
+
     def rotate(self, axis, angle):
-        r = Matrix4f.rotation(axis, angle)
-        self.rotation = r @ self.rotation
+        self.orientation = Quaternion.from_axis_angle(axis, angle) * self._orientation
 
     @property
     def rotation(self):
+        """4x4 rotation matrix of the orientation"""
+        if self._rotation_needs_update:
+            self._orientation.matrix4(out=self._rotation)
+            self._rotation_needs_update = False
         return self._rotation
 
     @rotation.setter
     def rotation(self, rotation):
-        self._rotation[:] = rotation[:]
-        self._view_matrix_needs_update = True
+        self.orientation = Quaternion.from_matrix(rotation)
 
     def set_y_up(self):
         yy = self.rotation[1, 1]
@@ -83,14 +138,25 @@ class PerspectiveCamera(object):
             # 1) Keep y axis above center
             axis = normalize(numpy.cross((0, 1, 0), self.rotation[:3, 1]))
             angle = math.asin(yy) * 1.00001
-            rot1 = Matrix4f.rotation(axis, angle)
-            self.rotation = rot1 @ self.rotation
+            self.rotate(axis, angle)
         else:
             # 2) Rotate about center of view
             yx = self.rotation[0, 1]
             angle = math.atan2(yx, yy)
-            rot = Matrix4f.rotation((0, 0, 1), angle)
-            self.rotation = rot @ self.rotation
+            self.rotate((0, 0, 1), angle)
+
+    def ray(self, x, y):
+        """
+        World space origin and unit direction of the ray through a point on
+        screen, in normalized device coordinates from -1 to 1.
+        """
+        tan_y = math.tan(self.fov_y / 2)
+        d = numpy.array((x * tan_y * self.aspect, y * tan_y, -1.0))
+        rotation = numpy.asarray(self.rotation[:3, :3], dtype=numpy.float64)
+        # Rows of the orthonormal rotation are the camera axes in world space
+        origin = numpy.asarray(self.focus, dtype=numpy.float64) + rotation[2] * self.distance
+        direction = rotation.T @ d
+        return origin, direction / numpy.linalg.norm(direction)
 
     @property
     def view_matrix(self):
@@ -99,13 +165,15 @@ class PerspectiveCamera(object):
         return self._view_matrix
 
     def _update_view_matrix(self):
-        translation_a = Matrix4f.translation(0, 0, -self.distance)
-        translation_b = Matrix4f.translation(*-self._focus)
-        m = Matrix4f(translation_a @ self.rotation @ translation_b)
-
-        self._view_matrix = m.pack()
+        # Closed form of translation(0, 0, -distance) @ rotation @ translation(-focus)
+        m = self._view_matrix
+        rotation = self.rotation
+        m[...] = rotation
+        numpy.dot(rotation[:3, :3], self._focus, out=self._focus_offset)
+        m[:3, 3] -= self._focus_offset
+        m[2, 3] -= self.distance
         self._view_matrix_needs_update = False
+        self.view_version += 1
 
     def zoom(self, factor):
         self.distance /= factor
-        self._view_matrix_needs_update = True
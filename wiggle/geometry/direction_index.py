@@ -0,0 +1,112 @@
+"""
+Spatial index of directions, as points on the unit sphere.
+
+Directions are bucketed in a uniform grid of cubic cells over xyz, kept in
+a dict, so only cells touching the sphere surface exist. A query within
+some angle of a direction looks at the few cells within the matching
+chord length, then compares all their points at once with numpy.
+"""
+
+import math
+
+import numpy
+
+from wiggle.geometry.mesh.storage import GrowableArray
+
+DEFAULT_CELL_SIZE = 0.05  # in units of the sphere radius; about 3 degrees
+_MAX_CELL_SPAN = 5  # wider queries than this many cells per axis just test every point
+
+
+def _unit(direction):
+    d = numpy.asarray(direction, dtype=numpy.float64).reshape(3)
+    return d / numpy.linalg.norm(d)
+
+
+class DirectionIndex(object):
+    """
+    Items located by direction, with incremental add() and remove(), and
+    queries by angle in radians.
+
+    add() returns an integer key for the item, which stays valid until the
+    item is removed.
+    """
+    def __init__(self, cell_size=DEFAULT_CELL_SIZE):
+        self.cell_size = cell_size
+        self._directions = GrowableArray(numpy.float64, 3)
+        self._items = []
+        self._is_live = GrowableArray(bool)
+        self._free_keys = []
+        self._cells = dict()  # cell coordinates to list of keys
+
+    def __len__(self):
+        return len(self._items) - len(self._free_keys)
+
+    def _cell(self, direction):
+        return tuple(int(c) for c in numpy.floor(direction / self.cell_size))
+
+    def add(self, direction, item=None):
+        direction = _unit(direction)
+        if len(self._free_keys) > 0:
+            key = self._free_keys.pop()
+            self._directions.array[key] = direction
+            self._items[key] = item
+            self._is_live.array[key] = True
+        else:
+            key = self._directions.append(direction)
+            self._items.append(item)
+            self._is_live.append((True, ))
+        self._cells.setdefault(self._cell(direction), []).append(key)
+        return key
+
+    def remove(self, key):
+        direction = self._directions.array[key]
+        cell = self._cell(direction)
+        keys = self._cells[cell]
+        keys.remove(key)
+        if len(keys) < 1:
+            del self._cells[cell]
+        self._items[key] = None
+        self._is_live.array[key] = False
+        self._free_keys.append(key)
+
+    def move(self, key, direction):
+        item = self._items[key]
+        self.remove(key)
+        return self.add(direction, item)
+
+    def direction(self, key):
+        return self._directions.array[key]
+
+    def item(self, key):
+        return self._items[key]
+
+    def _candidates(self, direction, chord):
+        span = int(math.ceil(chord / self.cell_size))
+        if span > _MAX_CELL_SPAN or len(self._cells) < (2 * span + 1)**3:
+            return numpy.flatnonzero(self._is_live.array)
+        cx, cy, cz = self._cell(direction)
+        keys = []
+        for x in range(cx - span, cx + span + 1):
+            for y in range(cy - span, cy + span + 1):
+                for z in range(cz - span, cz + span + 1):
+                    keys.extend(self._cells.get((x, y, z), ()))
+        return numpy.array(keys, dtype=numpy.int64)
+
+    def within(self, direction, max_angle):
+        """Keys of the items within max_angle radians of direction, nearest first, and their angles"""
+        direction = _unit(direction)
+        chord = 2 * math.sin(min(max_angle, math.pi) / 2)
+        keys = self._candidates(direction, chord)
+        cosines = numpy.clip(self._directions.array[keys] @ direction, -1, 1)
+        angles = numpy.arccos(cosines)
+        is_near = angles <= max_angle
+        keys, angles = keys[is_near], angles[is_near]
+        nearest_first = numpy.argsort(angles, kind='stable')
+        return keys[nearest_first], angles[nearest_first]
+
+    def nearest(self, direction, max_angle):
+        """Key of the item nearest to direction, within max_angle radians, or None"""
+        keys, _ = self.within(direction, max_angle)
+        if len(keys) < 1:
+            return None
+        return int(keys[0])
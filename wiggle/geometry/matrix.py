@@ -2,20 +2,214 @@ import math
 
 import numpy
 
+from wiggle.geometry.quaternion import Quaternion
+
+
+# Batched transforms
+#
+# These functions work on stacks of 4x4 float32 matrices, shaped (..., 4, 4),
+# for transforming column vectors, so translation is in the last column.
+# Arguments broadcast against each other like numpy arrays, so one call can
+# build or apply thousands of transforms. Each accepts an optional
+# preallocated out array.
+
+
+_IDENTITY = numpy.identity(4, dtype=numpy.float32)
+
+
+def _output(shape, out):
+    if out is None:
+        return numpy.empty(shape, dtype=numpy.float32)
+    if out.shape != shape:
+        raise ValueError(f'out has shape {out.shape}, but {shape} is needed')
+    return out
+
+
+def identity_matrices(count=None, out=None):
+    """(count, 4, 4) identity matrices, or just one if count is None"""
+    shape = (4, 4) if count is None else (count, 4, 4)
+    m = _output(shape, out)
+    m[...] = _IDENTITY
+    return m
+
+
+def rotation_matrices(axes, angles, out=None):
+    """Rotations by angles, in radians, about unit length axes, shaped (..., 3)"""
+    axes = numpy.asarray(axes, dtype=numpy.float64)
+    if axes.ndim == 1 and numpy.ndim(angles) == 0:
+        return _rotation_matrix(axes.tolist(), float(angles), out)
+    angles = numpy.asarray(angles, dtype=numpy.float64)
+    shape = numpy.broadcast_shapes(axes.shape[:-1], angles.shape)
+    x, y, z = axes[..., 0], axes[..., 1], axes[..., 2]
+    c = numpy.cos(angles)
+    s = numpy.sin(angles)
+    t = 1 - c
+    m = _output(shape + (4, 4), out)
+    m[..., 0, 0] = t*x*x + c
+    m[..., 0, 1] = t*x*y - s*z
+    m[..., 0, 2] = t*x*z + s*y
+    m[..., 1, 0] = t*x*y + s*z
+    m[..., 1, 1] = t*y*y + c
+    m[..., 1, 2] = t*y*z - s*x
+    m[..., 2, 0] = t*x*z - s*y
+    m[..., 2, 1] = t*y*z + s*x
+    m[..., 2, 2] = t*z*z + c
+    m[..., :3, 3] = 0
+    m[..., 3, :] = (0, 0, 0, 1)
+    return m
+
+
+def _rotation_matrix(axis, angle, out):
+    """rotation_matrices() for just one matrix, much faster with python floats"""
+    c = math.cos(angle)
+    s = math.sin(angle)
+    t = 1 - c
+    x, y, z = axis
+    m = _output((4, 4), out)
+    m[...] = (
+        (t*x*x + c, t*x*y - s*z, t*x*z + s*y, 0),
+        (t*x*y + s*z, t*y*y + c, t*y*z - s*x, 0),
+        (t*x*z - s*y, t*y*z + s*x, t*z*z + c, 0),
+        (0, 0, 0, 1),)
+    return m
+
+
+def translation_matrices(offsets, out=None):
+    """Translations by offsets, shaped (..., 3)"""
+    offsets = numpy.asarray(offsets, dtype=numpy.float32)
+    m = _output(offsets.shape[:-1] + (4, 4), out)
+    m[...] = _IDENTITY
+    m[..., :3, 3] = offsets
+    return m
+
+
+def scale_matrices(scales, out=None):
+    """Scales, either uniform, shaped (...), or per axis, shaped (..., 3)"""
+    scales = numpy.asarray(scales, dtype=numpy.float32)
+    if scales.ndim == 0:
+        m = _output((4, 4), out)
+        m[...] = _IDENTITY
+        m[0, 0] = m[1, 1] = m[2, 2] = scales
+        return m
+    if scales.shape[-1] != 3:
+        scales = scales[..., None].repeat(3, axis=-1)
+    m = _output(scales.shape[:-1] + (4, 4), out)
+    m[...] = 0
+    m[..., 0, 0] = scales[..., 0]
+    m[..., 1, 1] = scales[..., 1]
+    m[..., 2, 2] = scales[..., 2]
+    m[..., 3, 3] = 1
+    return m
+
+
+def frustum_matrices(left, right, bottom, top, z_near, z_far, out=None):
+    """OpenGL perspective projections, like glFrustum"""
+    left, right, bottom, top, z_near, z_far = numpy.broadcast_arrays(
+        *[numpy.asarray(v, dtype=numpy.float64) for v in (left, right, bottom, top, z_near, z_far)])
+    m = _output(left.shape + (4, 4), out)
+    m[...] = 0
+    m[..., 0, 0] = 2.0 * z_near / (right - left)
+    m[..., 0, 2] = (right + left) / (right - left)
+    m[..., 1, 1] = 2.0 * z_near / (top - bottom)
+    m[..., 1, 2] = (top + bottom) / (top - bottom)
+    m[..., 2, 2] = -(z_far + z_near) / (z_far - z_near)
+    m[..., 2, 3] = -(2.0 * z_far * z_near) / (z_far - z_near)
+    m[..., 3, 2] = -1
+    return m
+
+
+def perspective_matrices(fov_y, aspect=1.0, z_near=0.1, z_far=100.0, out=None):
+    """OpenGL perspective projections, like gluPerspective but with fov_y in radians"""
+    top = numpy.asarray(z_near, dtype=numpy.float64) * numpy.tan(numpy.asarray(fov_y, dtype=numpy.float64) / 2.0)
+    right = top * aspect
+    return frustum_matrices(-right, right, -top, top, z_near, z_far, out=out)
+
+
+def compose(*matrices, out=None):
+    """Batched matrix product matrices[0] @ matrices[1] @ ..., which applies the last transform first"""
+    matrices = [numpy.asarray(m, dtype=numpy.float32) for m in matrices]
+    result = matrices[0]
+    for i in range(1, len(matrices)):
+        is_last = i == len(matrices) - 1
+        result = numpy.matmul(result, matrices[i], out=out if is_last else None)
+    if out is not None and len(matrices) == 1:
+        out[...] = result
+        result = out
+    return result
+
+
+def inverse_matrices(matrices, out=None):
+    """Batched inverse of (..., 4, 4) matrices"""
+    inverse = numpy.linalg.inv(numpy.asarray(matrices, dtype=numpy.float32))
+    if out is None:
+        return inverse
+    out[...] = inverse
+    return out
+
+
+def transform_points(matrices, points, out=None):
+    """
+    Apply (..., 4, 4) transforms to (..., 3) points, including translation
+    and the perspective divide.
+    """
+    matrices = numpy.asarray(matrices, dtype=numpy.float32)
+    points = numpy.asarray(points, dtype=numpy.float32)
+    shape = numpy.broadcast_shapes(matrices.shape[:-2], points.shape[:-1]) + (3, )
+    result = _output(shape, out)
+    result[...] = numpy.einsum('...ij,...j->...i', matrices[..., :3, :3], points)
+    result += matrices[..., :3, 3]
+    w = numpy.einsum('...j,...j->...', matrices[..., 3, :3], points) + matrices[..., 3, 3]
+    if numpy.any(w != 1):
+        result /= w[..., None]
+    return result
+
+
+def transform_directions(matrices, directions, out=None):
+    """Apply the rotation and scale of (..., 4, 4) transforms to (..., 3) direction vectors"""
+    matrices = numpy.asarray(matrices, dtype=numpy.float32)
+    directions = numpy.asarray(directions, dtype=numpy.float32)
+    shape = numpy.broadcast_shapes(matrices.shape[:-2], directions.shape[:-1]) + (3, )
+    result = _output(shape, out)
+    result[...] = numpy.einsum('...ij,...j->...i', matrices[..., :3, :3], directions)
+    return result
+
+
+# Single matrix wrappers, for one transform at a time
+
 
 class MatrixBase(object):
     def __init__(self, matrix=numpy.identity(4)[:]):
         self.m = numpy.array(matrix[:], dtype=numpy.float32)
 
+    @classmethod
+    def view(cls, array):
+        """Wrap a float32 array, without copying it"""
+        result = cls.__new__(cls)
+        result.m = array
+        return result
+
+    @classmethod
+    def _result(cls, array, out):
+        """The out argument of an out= method, if it was a matrix object, else a new view of array"""
+        if isinstance(out, MatrixBase):
+            return out
+        return cls.view(array)
+
+    def __array__(self, dtype=None, copy=None):
+        if dtype is None or dtype == self.m.dtype:
+            return self.m
+        return self.m.astype(dtype)
+
     def __getitem__(self, item):
         return self.m[item]
 
     def __imatmul__(self, other):
-        self.m @= other[:]
+        self.m @= numpy.asarray(other, dtype=numpy.float32)
+        return self
 
     def __matmul__(self, rhs):
-        result = rhs @ self.m
-        return self.__class__(result[:])
+        result = numpy.asarray(rhs, dtype=numpy.float32) @ self.m
+        return self.view(result)
 
     def __mul__(self, rhs):
         result = rhs * self.m
@@ -45,15 +239,8 @@ class Matrix3f(MatrixBase):
 
     @classmethod
     def rotation(cls, axis, radians):
-        c = math.cos(radians)
-        s = math.sin(radians)
-        t = 1 - c
-        x, y, z = axis[:]
-        return cls(
-            ((t*x*x + c,  t*x*y - s*z, t*x*z + s*y),
-             (t*x*y + s*z, t*y*y + c,  t*y*z - s*x),
-             (t*x*z - s*y, t*y*z + s*x, t*z*z + c))
-        ).transpose()
+        # Stored transposed, because MatrixBase.__matmul__ multiplies a row vector from the left
+        return cls(rotation_matrices(axis, radians)[:3, :3].T)
 
     @classmethod
     def scale(cls, scale):
@@ -65,33 +252,36 @@ class Matrix3f(MatrixBase):
 
 
 class Matrix4f(MatrixBase):
+    """
+    One 4x4 float32 transform, for column vectors.
+
+    The constructors and dot() take an optional out argument, a Matrix4f
+    or float32 array to overwrite instead of allocating a new matrix.
+    """
     def __init__(self, matrix=numpy.identity(4)[:]):
         super().__init__(matrix)
 
     def __matmul__(self, rhs):
-        if len(rhs) == 3:
+        rhs = numpy.asarray(rhs, dtype=numpy.float32)
+        if rhs.shape == (3, ):
             # homogeneous matrix times vector
-            foo = list(rhs[:])
-            foo.extend([1.0, ], )
-            rhs = numpy.array(foo, dtype=numpy.float32)
-        return Matrix4f(self.m @ rhs)
+            rhs = numpy.append(rhs, numpy.float32(1))
+        return self.view(self.m @ rhs)
+
+    def dot(self, rhs, out=None):
+        """Matrix product self @ rhs"""
+        array = None if out is None else numpy.asarray(out)
+        return self._result(numpy.dot(self.m, numpy.asarray(rhs, dtype=numpy.float32), out=array), out)
 
     @classmethod
-    def frustum(cls, left, right, bottom, top, z_near, z_far):
-        a = (right + left) / (right - left)
-        b = (top + bottom) / (top - bottom)
-        c = - (z_far + z_near) / (z_far - z_near)
-        d = - (2.0 * z_far * z_near) / (z_far - z_near)
-        return cls(
-                ((2.0 * z_near / (right - left), 0, 0, 0),
-                 (0, 2.0 * z_near / (top - bottom), 0, 0),
-                 (a, b, c, -1),
-                 (0, 0, d, 0),)
-        ).transpose()
+    def frustum(cls, left, right, bottom, top, z_near, z_far, out=None):
+        array = None if out is None else numpy.asarray(out)
+        return cls._result(frustum_matrices(left, right, bottom, top, z_near, z_far, out=array), out)
 
     @classmethod
-    def identity(cls):
-        return cls(numpy.identity(4)[:])
+    def identity(cls, out=None):
+        array = None if out is None else numpy.asarray(out)
+        return cls._result(identity_matrices(out=array), out)
 
     @classmethod
     def orthographic(cls, l, r, b, t, n, f):
@@ -102,51 +292,50 @@ class Matrix4f(MatrixBase):
             [0, 0, 0, 1]]).transpose()
 
     @classmethod
-    def perspective(cls, fov_y=math.radians(35.0), aspect=1.0, z_near=0.1, z_far=100.0):
-        # Negate vertical, because screen Y is down, and OpenGL Y is up
-        top = z_near * math.tan(fov_y / 2.0)
-        right = top * aspect
-        return cls.frustum(-right, right, -top, top, z_near, z_far)
+    def perspective(cls, fov_y=math.radians(35.0), aspect=1.0, z_near=0.1, z_far=100.0, out=None):
+        array = None if out is None else numpy.asarray(out)
+        return cls._result(perspective_matrices(fov_y, aspect, z_near, z_far, out=array), out)
 
     @classmethod
-    def rotation(cls, axis, radians):
-        c = math.cos(radians)
-        s = math.sin(radians)
-        t = 1 - c
-        x, y, z = axis[:]
-        return cls(
-            ((t*x*x + c,  t*x*y - s*z, t*x*z + s*y, 0),
-             (t*x*y + s*z, t*y*y + c,  t*y*z - s*x, 0),
-             (t*x*z - s*y, t*y*z + s*x, t*z*z + c, 0),
-             (0, 0, 0, 1),)
-        )
+    def rotation(cls, axis, radians, out=None):
+        array = None if out is None else numpy.asarray(out)
+        return cls._result(rotation_matrices(axis, radians, out=array), out)
 
     @classmethod
-    def scale(cls, scale):
-        return cls(
-            ((scale, 0, 0, 0),
-             (0, scale, 0, 0),
-             (0, 0, scale, 0),
-             (0, 0, 0, 1),)
-        )
+    def scale(cls, scale, out=None):
+        array = None if out is None else numpy.asarray(out)
+        return cls._result(scale_matrices(scale, out=array), out)
 
     @classmethod
-    def translation(cls, x, y, z):
-        return cls(
-            ((1, 0, 0, 0),
-             (0, 1, 0, 0),
-             (0, 0, 1, 0),
-             (x, y, z, 1),)
-        ).transpose()
+    def translation(cls, x, y, z, out=None):
+        array = None if out is None else numpy.asarray(out)
+        return cls._result(translation_matrices((x, y, z), out=array), out)
+
+    def inverse(self, out=None):
+        array = None if out is None else numpy.asarray(out)
+        return self._result(inverse_matrices(self.m, out=array), out)
 
 
 class ModelMatrix(object):
+    """
+    Model transform composed from center, rotation and uniform scale.
+
+    The matrix is rebuilt in place, into the same array, only after one of
+    those changes. version counts the rebuilds, so dependent values can be
+    cached too. The rotation is kept as a unit quaternion. If set, on_change
+    is called with no arguments whenever center, rotation or scale is set.
+    """
     def __init__(self):
         self._center = numpy.array([0, 0, 0], dtype='float32')
         self._scale = 1.0
+        self._orientation = Quaternion()
         self._rotation = Matrix4f.identity()
+        self._rotation_needs_update = False
         self._needs_update = True
-        self._matrix = None
+        self._matrix = identity_matrices()
+        self._translation = self._matrix[:3, 3]
+        self.version = 0
+        self.on_change = None
 
     def __matmul__(self, rhs):
         return Matrix4f(self.matrix @ rhs)
@@ -157,26 +346,60 @@ class ModelMatrix(object):
     @property
     def matrix(self):
         if self._needs_update:
-            self._matrix = (Matrix4f.translation(*self._center) @ self._rotation @ Matrix4f.scale(self._scale)).pack()
+            self._update_matrix()
         return self._matrix
 
+    def _changed(self):
+        self._needs_update = True
+        if self.on_change is not None:
+            self.on_change()
+
+    def _update_matrix(self):
+        # Closed form of translation @ rotation @ scale, element by element, so no temporary arrays are made
+        m = self._matrix
+        s = self._scale
+        (r00, r01, r02), (r10, r11, r12), (r20, r21, r22) = self._orientation.matrix3()
+        m[0, 0], m[0, 1], m[0, 2] = s * r00, s * r01, s * r02
+        m[1, 0], m[1, 1], m[1, 2] = s * r10, s * r11, s * r12
+        m[2, 0], m[2, 1], m[2, 2] = s * r20, s * r21, s * r22
+        self._translation[...] = self._center
+        m[3, 0], m[3, 1], m[3, 2], m[3, 3] = 0, 0, 0, 1
+        self._needs_update = False
+        self.version += 1
+
     @property
     def model_center(self):
         return self._center
 
     @model_center.setter
     def model_center(self, center):
-        self._needs_update = True
-        self._center[:] = center[:]
+        self._changed()
+        self._center[...] = center
+
+    @property
+    def model_orientation(self):
+        return self._orientation
+
+    @model_orientation.setter
+    def model_orientation(self, orientation):
+        self._changed()
+        self._rotation_needs_update = True
+        self._orientation = orientation.normalized()
 
     @property
     def model_rotation(self):
+        """Matrix4f of the orientation"""
+        if self._rotation_needs_update:
+            self._orientation.matrix4(out=self._rotation.m)
+            self._rotation_needs_update = False
         return self._rotation
 
     @model_rotation.setter
     def model_rotation(self, rotation):
-        self._needs_update = True
-        self._rotation = rotation
+        """Accepts a Quaternion, or a 3x3 or 4x4 rotation matrix"""
+        if not isinstance(rotation, Quaternion):
+            rotation = Quaternion.from_matrix(numpy.asarray(rotation))
+        self.model_orientation = rotation
 
     @property
     def model_scale(self):
@@ -184,5 +407,5 @@ class ModelMatrix(object):
 
     @model_scale.setter
     def model_scale(self, scale):
-        self._needs_update = True
+        self._changed()
         self._scale = scale
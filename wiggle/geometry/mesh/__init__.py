@@ -1,59 +1,233 @@
-class ObjParseError(Exception):
-    pass
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+
+from wiggle.geometry.bounds import Bounds
+from wiggle.geometry.bvh import TriangleHierarchy
+from wiggle.geometry.mesh.adjacency import MeshAdjacency
+from wiggle.geometry.mesh.obj import DEFAULT_CHUNK_SIZE, ObjArrays, ObjParseError, load_obj_arrays
+from wiggle.geometry.mesh.optimize import optimize_faces, optimize_obj_arrays
+from wiggle.geometry.mesh.primitives import DEFAULT_CACHE_SIZE, MeshPrimitives, RESTART_INDEX, TRIANGLE_STRIP, build_primitives, join_strips, \
+    triangulate
+from wiggle.geometry.mesh.cache import build_primitives_cached, load_obj_cached
+from wiggle.geometry.mesh.storage import GrowableArray, RaggedArray, RaggedRows, VertexNormalMap
+
+_executor = None
+
+
+def _submit(function, *args, **kwargs):
+    """Run function on the shared draw primitive thread, returning a concurrent.futures.Future"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='wiggle-primitives')
+    return _executor.submit(function, *args, **kwargs)
 
 
 class Mesh(object):
+    """
+    Polygon mesh stored in contiguous numpy arrays.
+
+    Vertex positions are an (N, 3) float32 array, and faces and triangle
+    strips are CSR-style RaggedArrays of uint32 vertex indexes. The list-like
+    attributes vertexes, vertex_normals, faces, triangle_strips and
+    normal_for_vertex are views of that storage; use the append_*() methods,
+    or assign whole new contents, to modify the mesh.
+    """
     def __init__(self, name='mesh'):
         self.name = name
-        self.vertexes = []
-        self.vertex_normals = []
-        self.normal_for_vertex = dict()
-        self.faces = []
-        self.triangle_strips = []
-        self._edges = []
+        self._positions = GrowableArray(numpy.float32, 3)
+        self._normals = GrowableArray(numpy.float32, 3)
+        self._vertex_normal_indexes = GrowableArray(numpy.int32)
+        self._faces = RaggedArray(numpy.uint32)
+        self._triangle_strips = RaggedArray(numpy.uint32)
+        self.groups = []
+        self.allow_strips = True
+        self._adjacency = None
         self.edges_need_update = True
+        self._primitives = None
+        self._primitives_future = None  # of the primitives, while the loader builds them
+        self._bounds = None
+        self._triangle_hierarchy = None
+
+    def _geometry_changed(self):
+        self.edges_need_update = True
+        self._primitives = None
+        self._primitives_future = None
+        self._bounds = None
+        self._triangle_hierarchy = None
+
+    # Array storage
 
     @property
-    def edges(self):
-        if self.edges_need_update:
-            self._edges.clear()
-            e = set()
-            for f in self.faces:
-                prev = f[-1]
-                for i in range(len(f)):
-                    v = f[i]
-                    e.add(tuple(sorted((v, prev))))
-                    prev = v
-            self._edges.extend(sorted(e))
-        return self._edges
-
-    def _parse_obj_line(self, line):
-        if line.startswith('#'):
-            # e.g. "# Blender v2.65 (sub 0) OBJ File"
-            return  # ignore comments
-        elif line.startswith('o '):
-            # e.g. "o teapot.005"
-            self.name = line.split()[1]
-        elif line.startswith('v '):
-            # e.g. "v -0.498530 0.712498 -0.039883"
-            vec3 = [float(x) for x in line.split()[1:4]]
-            self.vertexes.append(vec3)
-        elif line.startswith('vn '):
-            # e.g. "vn -0.901883 0.415418 0.118168"
-            vec3 = [float(x) for x in line.split()[1:4]]
-            self.vertex_normals.append(vec3)
-        elif line.startswith('s '):
-            return  # ignore whatever "s" is
-            # print(line)
-        elif line.startswith('f '):
-            face = list()
-            for c in line.split()[1:]:
-                v, n = [int(x) for x in c.split('/')[0:3:2]]
-                face.append(v - 1)  # vertex index
-                self.normal_for_vertex[v - 1] = self.vertex_normals[n - 1]
-                self.faces.append(face)
+    def positions(self):
+        """(N, 3) float32 array of vertex positions"""
+        return self._positions.array
+
+    @property
+    def vertex_normal_indexes(self):
+        """Index into vertex_normals for each vertex, or -1"""
+        return self._vertex_normal_indexes.array
+
+    @property
+    def face_offsets(self):
+        return self._faces.offsets
+
+    @property
+    def face_indexes(self):
+        return self._faces.indexes
+
+    def append_vertexes(self, positions):
+        """Append (N, 3) vertex positions, returning the index of the first new vertex"""
+        start = self._positions.append(positions)
+        self._vertex_normal_indexes.append(numpy.full(len(self._positions) - start, -1))
+        self._geometry_changed()
+        return start
+
+    def append_normals(self, normals):
+        """Append (N, 3) normal vectors, returning the index of the first new normal"""
+        return self._normals.append(normals)
+
+    def append_face(self, vertex_indexes):
+        """Append one polygon, returning its face index"""
+        self._geometry_changed()
+        return self._faces.append(vertex_indexes)
+
+    def append_faces(self, faces, counts=None):
+        """
+        Append many polygons, as a sequence of index sequences, an (F, K)
+        array, or flat indexes with per-face corner counts
+        """
+        if counts is None:
+            self._faces.extend(faces)
         else:
-            raise ObjParseError(f'unrecognized OBJ line: "{line}"')
+            self._faces.extend_flat(counts, faces)
+        self._geometry_changed()
+
+    def append_triangle_strip(self, vertex_indexes):
+        self._primitives = None
+        self._primitives_future = None
+        return self._triangle_strips.append(vertex_indexes)
+
+    def optimize(self, cache_size=DEFAULT_CACHE_SIZE):
+        """
+        Reorder faces for vertex cache locality and less overdraw, and
+        vertexes for fetch locality, returning the MeshOptimization with
+        before and after cache statistics.
+        """
+        plan = optimize_faces(
+            self.face_offsets, self.face_indexes, len(self._positions), positions=self.positions,
+            groups=self.groups, cache_size=cache_size)
+        remap = plan.vertex_remap
+        self._positions.set(self.positions[plan.vertex_order])
+        self._vertex_normal_indexes.set(self.vertex_normal_indexes[plan.vertex_order])
+        self._faces.set(plan.face_offsets, remap[self.face_indexes[plan.corner_order]])
+        if len(self._triangle_strips) > 0:
+            self._triangle_strips.set(self._triangle_strips.offsets, remap[self._triangle_strips.indexes])
+        self._geometry_changed()
+        return plan
+
+    def shrink(self):
+        """Release spare capacity left over from appending"""
+        for a in (self._positions, self._normals, self._vertex_normal_indexes):
+            a.shrink()
+
+    # List-like views, compatible with the original python container attributes
+
+    @property
+    def vertexes(self):
+        return self._positions.array
+
+    @vertexes.setter
+    def vertexes(self, positions):
+        self._positions.set(positions)
+        self._vertex_normal_indexes.set(numpy.full(len(self._positions), -1))
+        self._geometry_changed()
+
+    @property
+    def vertex_normals(self):
+        return self._normals.array
+
+    @vertex_normals.setter
+    def vertex_normals(self, normals):
+        self._normals.set(normals)
+
+    @property
+    def normal_for_vertex(self):
+        return VertexNormalMap(self.vertex_normal_indexes, self.vertex_normals)
+
+    @property
+    def faces(self):
+        return RaggedRows(self._faces)
+
+    @faces.setter
+    def faces(self, faces):
+        self._faces.clear()
+        self.append_faces(faces)
+
+    @property
+    def triangle_strips(self):
+        return RaggedRows(self._triangle_strips)
+
+    @triangle_strips.setter
+    def triangle_strips(self, strips):
+        self._primitives = None
+        self._primitives_future = None
+        self._triangle_strips.clear()
+        self._triangle_strips.extend(strips)
+
+    @property
+    def primitives(self):
+        """
+        Triangles to draw, as MeshPrimitives.
+
+        Uses the explicit triangle_strips when there are any, otherwise
+        triangulates the faces. Rebuilt only after the geometry changes.
+        Building strips takes a while for large meshes, so the OBJ loaders
+        start it on a background thread, and this waits for it to finish.
+        """
+        if self._primitives is None:
+            if self._primitives_future is not None:
+                self._primitives = self._primitives_future.result()
+                self._primitives_future = None
+            elif len(self._triangle_strips) > 0:
+                strips = list(self.triangle_strips)
+                restart_index = None if len(strips) == 1 else RESTART_INDEX
+                self._primitives = MeshPrimitives(TRIANGLE_STRIP, join_strips(strips), restart_index)
+            else:
+                self._primitives = build_primitives(
+                    self.face_offsets, self.face_indexes, allow_strips=self.allow_strips)
+        return self._primitives
+
+    @property
+    def bounds(self):
+        """Bounds of the vertex positions, recomputed only after the geometry changes"""
+        if self._bounds is None:
+            self._bounds = Bounds.from_positions(self.positions)
+        return self._bounds
+
+    def ray_cast(self, origin, direction):
+        """
+        Nearest face triangle hit by the ray origin + t * direction, as
+        (triangle index, t), or None. The triangle hierarchy is built on
+        first use, and rebuilt only after the geometry changes.
+        """
+        if self._triangle_hierarchy is None:
+            self._triangle_hierarchy = TriangleHierarchy(
+                self.positions, triangulate(self.face_offsets, self.face_indexes))
+        return self._triangle_hierarchy.ray_cast(origin, direction)
+
+    @property
+    def adjacency(self):
+        """Edges plus edge-to-face and vertex-to-face lookups, rebuilt only after the geometry changes"""
+        if self.edges_need_update:
+            self._adjacency = MeshAdjacency(self.face_offsets, self.face_indexes, len(self._positions))
+            self.edges_need_update = False
+        return self._adjacency
+
+    @property
+    def edges(self):
+        """(E, 2) uint32 array of unique edges, each in (low, high) vertex index order, sorted"""
+        return self.adjacency.edges
 
     def glsl_geometry(self):
         """Generate a GLSL string explicitly declaring this mesh geometry"""
@@ -78,7 +252,8 @@ class Mesh(object):
         return '\n'.join(lines)
 
     def glsl_edges(self):
-        ec = len(self.edges)
+        edges = self.edges
+        ec = len(edges)
         if ec < 1:
             return ''
         lines = []
@@ -87,7 +262,7 @@ class Mesh(object):
             lines.append(f'\nconst int EDGE_INDEXES[{2*ec}] = int[{2*ec}](')
             comma = ','
             for i in range(ec):
-                e = self.edges[i]
+                e = edges[i]
                 if i >= ec - 1:
                     comma = ''
                 # e.g. '  0, 1,'
@@ -95,22 +270,91 @@ class Mesh(object):
             lines.append(');\n')
         return '\n'.join(lines)
 
-    def load_obj(self, stream):
-        for line in stream:
-            self._parse_obj_line(line)
+    def load_obj(self, stream, chunk_size=DEFAULT_CHUNK_SIZE, build_draw_primitives=True):
+        """
+        Read geometry from a text or binary OBJ stream, in bulk, and with
+        build_draw_primitives, triangulate it in the background instead of
+        on first draw
+        """
+        obj = load_obj_arrays(stream, chunk_size=chunk_size)
+        self._set_obj_arrays(obj)
+        if build_draw_primitives:
+            self._primitives_future = _submit(
+                build_primitives, obj.face_offsets, obj.face_vertexes, allow_strips=self.allow_strips)
+
+    def load_obj_file(self, file_name, use_cache=True, cache_dir=None, build_draw_primitives=True, optimize=False):
+        """
+        Read geometry from an OBJ file, via a memory-mapped binary cache if use_cache.
+
+        With build_draw_primitives, triangulation runs in the background,
+        instead of on first draw, on the GL thread, and is saved in the
+        cache. With optimize, faces and vertexes are reordered for drawing,
+        as by optimize(), and that is saved in the cache too.
+        """
+        if use_cache:
+            obj = load_obj_cached(file_name, cache_dir=cache_dir, optimize=optimize, allow_strips=self.allow_strips)
+        else:
+            with open(file_name, 'rb') as stream:
+                obj = load_obj_arrays(stream)
+            if optimize:
+                optimize_obj_arrays(obj)
+        self._set_obj_arrays(obj)
+        if not build_draw_primitives or obj.primitives is not None:
+            return
+        if use_cache:
+            self._primitives_future = _submit(
+                build_primitives_cached, file_name, obj, cache_dir=cache_dir, allow_strips=self.allow_strips)
+        else:
+            self._primitives_future = _submit(
+                build_primitives, obj.face_offsets, obj.face_vertexes, allow_strips=self.allow_strips)
+
+    @classmethod
+    def from_obj_arrays(cls, obj):
+        """New mesh sharing the arrays of an ObjArrays"""
+        mesh = cls()
+        mesh._set_obj_arrays(obj)
+        return mesh
+
+    def obj_arrays(self):
+        """This geometry as an ObjArrays, e.g. for save_mesh_cache()"""
+        obj = ObjArrays()
+        obj.name = self.name
+        obj.positions = self.positions
+        obj.normals = self.vertex_normals
+        obj.face_offsets = self.face_offsets
+        obj.face_vertexes = self.face_indexes
+        obj.face_texcoords = numpy.full(len(self.face_indexes), -1, dtype=numpy.int32)
+        obj.face_normals = self.vertex_normal_indexes[self.face_indexes]
+        obj.groups = list(self.groups)
+        return obj
+
+    def _set_obj_arrays(self, obj):
+        if obj.name is not None:
+            self.name = obj.name
+        self._positions.set(obj.positions)
+        self._normals.set(obj.normals)
+        self._faces.set(obj.face_offsets, obj.face_vertexes)
+        # OBJ normals belong to face corners; keep the last one seen for each vertex
+        normal_indexes = numpy.full(len(obj.positions), -1, dtype=numpy.int32)
+        has_normal = obj.face_normals >= 0
+        normal_indexes[obj.face_vertexes[has_normal]] = obj.face_normals[has_normal]
+        self._vertex_normal_indexes.set(normal_indexes)
+        self.groups = obj.groups
+        self._geometry_changed()
+        self._primitives = obj.primitives
 
 
 class ScreenQuadMesh(Mesh):
     def __init__(self, name='plane'):
         super().__init__(name)
-        self.vertexes.extend((
+        self.append_vertexes((
             (-1, -1, 0.5),
             (1, -1, 0.5),
             (1, 1, 0.5),
             (-1, 1, 0.5),
         ), )
-        self.faces.extend(( (0, 1, 2, 3), ), )
-        self.triangle_strips.extend((0, 1, 3, 2), )
+        self.append_face((0, 1, 2, 3))
+        self.append_triangle_strip((0, 1, 3, 2))
 
 
 class CubeMesh(Mesh):
@@ -126,7 +370,7 @@ class CubeMesh(Mesh):
     def __init__(self, name='cube'):
         super().__init__(name)
         r = 0.5
-        self.vertexes.extend((
+        self.append_vertexes((
             (-r, -r, -r),  # 0: lower left far
             (+r, -r, -r),  # 1: lower right far
             (-r, +r, -r),  # 2: upper left far
@@ -136,7 +380,7 @@ class CubeMesh(Mesh):
             (-r, +r, +r),  # 6: upper left near
             (+r, +r, +r),  # 7: upper right near
         ), )
-        self.faces.extend((
+        self.append_faces((
             (4, 5, 7, 6),  # near
             (1, 3, 7, 5),  # right
             (0, 4, 6, 2),  # left
@@ -144,12 +388,8 @@ class CubeMesh(Mesh):
             (2, 6, 7, 3),  # top
             (0, 1, 5, 4),  # bottom
         ), )
-        self.triangle_strips.extend(
-            (
-                (
-                    2, 6, 3, 7, 5, 6, 4, 2, 0, 3, 1, 5, 0, 4
-                ),
-            ),
+        self.append_triangle_strip(
+            (2, 6, 3, 7, 5, 6, 4, 2, 0, 3, 1, 5, 0, 4),
         )
 
 
@@ -0,0 +1,99 @@
+"""
+Vectorized edge extraction and face adjacency for CSR polygon meshes.
+"""
+
+import numpy
+
+
+def _csr_group(keys, values, key_count):
+    """Group values by integer key, returning CSR offsets and the values sorted by key"""
+    order = numpy.argsort(keys, kind='stable')
+    counts = numpy.bincount(keys, minlength=key_count)
+    offsets = numpy.concatenate(([0], numpy.cumsum(counts))).astype(numpy.int64)
+    return offsets, values[order]
+
+
+def corner_faces(face_offsets):
+    """Face index of each corner"""
+    counts = numpy.diff(face_offsets)
+    return numpy.repeat(numpy.arange(len(counts), dtype=numpy.uint32), counts)
+
+
+def next_corners(face_offsets):
+    """Index of the following corner around each face, wrapping to the first"""
+    corner_count = int(face_offsets[-1])
+    result = numpy.arange(1, corner_count + 1, dtype=numpy.int64)
+    counts = numpy.diff(face_offsets)
+    non_empty = counts > 0
+    result[face_offsets[1:][non_empty] - 1] = face_offsets[:-1][non_empty]
+    return result
+
+
+def unique_edges(face_offsets, face_indexes):
+    """
+    Unique undirected edges of a CSR polygon mesh.
+
+    Each (min, max) vertex pair is packed into one uint64, so numpy.unique
+    does all the work. Returns an (E, 2) uint32 array of edges in sorted
+    order, and the edge index of the edge leaving each corner.
+    """
+    face_indexes = numpy.asarray(face_indexes, dtype=numpy.uint64)
+    a = face_indexes
+    b = face_indexes[next_corners(face_offsets)]
+    keys = (numpy.minimum(a, b) << numpy.uint64(32)) | numpy.maximum(a, b)
+    keys, corner_edges = numpy.unique(keys, return_inverse=True)
+    edges = numpy.empty((len(keys), 2), dtype=numpy.uint32)
+    edges[:, 0] = keys >> numpy.uint64(32)
+    edges[:, 1] = keys & numpy.uint64(0xffffffff)
+    return edges, corner_edges.reshape(-1)
+
+
+class MeshAdjacency(object):
+    """
+    Edge list plus edge-to-face and vertex-to-face lookups for a polygon mesh.
+
+    The faces adjacent to edge e are
+    edge_faces[edge_face_offsets[e]:edge_face_offsets[e+1]], and likewise
+    for vertexes.
+    """
+    def __init__(self, face_offsets, face_indexes, vertex_count=None):
+        face_offsets = numpy.asarray(face_offsets, dtype=numpy.int64)
+        face_indexes = numpy.asarray(face_indexes)
+        if vertex_count is None:
+            vertex_count = int(face_indexes.max()) + 1 if len(face_indexes) > 0 else 0
+        self.face_count = len(face_offsets) - 1
+        self.edges, self.corner_edges = unique_edges(face_offsets, face_indexes)
+        faces = corner_faces(face_offsets)
+        self.edge_face_offsets, self.edge_faces = _csr_group(
+            self.corner_edges, faces, len(self.edges))
+        self.vertex_face_offsets, self.vertex_faces = _csr_group(
+            face_indexes.astype(numpy.int64), faces, vertex_count)
+
+    def faces_for_edge(self, edge_index):
+        o = self.edge_face_offsets
+        return self.edge_faces[o[edge_index]:o[edge_index + 1]]
+
+    def faces_for_vertex(self, vertex_index):
+        o = self.vertex_face_offsets
+        return self.vertex_faces[o[vertex_index]:o[vertex_index + 1]]
+
+    def edge_face_counts(self):
+        return numpy.diff(self.edge_face_offsets)
+
+    def boundary_edges(self):
+        """Indexes of edges used by only one face"""
+        return numpy.flatnonzero(self.edge_face_counts() == 1)
+
+    def silhouette_edges(self, is_front_facing):
+        """
+        Indexes of edges between a front facing and a back facing face, plus
+        front facing boundary edges.
+
+        :param is_front_facing: boolean array, one per face
+        """
+        is_front_facing = numpy.asarray(is_front_facing, dtype=bool)
+        counts = self.edge_face_counts()
+        edge_per_face = numpy.repeat(numpy.arange(len(self.edges)), counts)
+        front = numpy.bincount(
+            edge_per_face, weights=is_front_facing[self.edge_faces], minlength=len(self.edges))
+        return numpy.flatnonzero((front > 0) & (front < counts) | (front == 1) & (counts == 1))
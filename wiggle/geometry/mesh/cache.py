@@ -0,0 +1,231 @@
+"""
+Binary sidecar cache for parsed mesh files.
+
+File layout:
+    8 bytes   magic b'WGLMESH\0'
+    4 bytes   format version, little-endian uint32
+    4 bytes   header length, little-endian uint32
+    header    utf-8 JSON: source key, mesh name, groups, draw mode and strip setting,
+              reorder flag, metadata and block table
+    blocks    raw little-endian arrays, each starting on a 64 byte boundary
+
+Blocks are loaded with numpy.memmap, so vertex and index arrays can be
+handed to OpenGL buffer uploads without parsing or copying.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import struct
+
+import numpy
+
+from wiggle.geometry.mesh.obj import ObjArrays, ObjGroup, load_obj_arrays
+from wiggle.geometry.mesh.optimize import optimize_obj_arrays
+from wiggle.geometry.mesh.primitives import MeshPrimitives, build_primitives
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'WGLMESH\0'
+VERSION = 2
+ALIGNMENT = 64
+CACHE_SUFFIX = '.wglmesh'
+
+# ObjArrays attributes stored in the cache, with their on-disk types
+_BLOCKS = (
+    ('positions', '<f4'),
+    ('texcoords', '<f4'),
+    ('normals', '<f4'),
+    ('face_offsets', '<i8'),
+    ('face_vertexes', '<u4'),
+    ('face_texcoords', '<i4'),
+    ('face_normals', '<i4'),
+)
+_PREAMBLE = struct.Struct('<8sII')
+
+
+class MeshCacheError(Exception):
+    pass
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def cache_file_name(source_file_name, cache_dir=None):
+    """Sidecar cache path for a mesh file, next to the source unless cache_dir is given"""
+    if cache_dir is None:
+        return source_file_name + CACHE_SUFFIX
+    return os.path.join(cache_dir, os.path.basename(source_file_name) + CACHE_SUFFIX)
+
+
+def file_digest(file_name, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(file_name, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_key(source_file_name):
+    """Identifies the exact contents of a source mesh file"""
+    stat = os.stat(source_file_name)
+    return {
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha256': file_digest(source_file_name),
+    }
+
+
+def _source_matches(key, source_file_name):
+    """Cheap size and mtime check first, falling back to the content hash"""
+    stat = os.stat(source_file_name)
+    if key.get('size') != stat.st_size:
+        return False
+    if key.get('mtime_ns') == stat.st_mtime_ns:
+        return True
+    return key.get('sha256') == file_digest(source_file_name)
+
+
+def save_mesh_cache(file_name, obj, source_file_name=None):
+    """Write an ObjArrays, including any draw primitives, to a binary cache file"""
+    arrays = [(name, dtype, getattr(obj, name)) for name, dtype in _BLOCKS]
+    primitives = None
+    if obj.primitives is not None:
+        primitives = {
+            'mode': obj.primitives.mode,
+            'restart_index': obj.primitives.restart_index,
+            'allow_strips': obj.allow_strips,
+        }
+        arrays.append(('draw_indexes', '<u4', obj.primitives.indexes))
+    blocks = []
+    offset = 0
+    for name, dtype, array in arrays:
+        array = numpy.ascontiguousarray(array, dtype=dtype)
+        blocks.append((name, dtype, array, offset))
+        offset = _align(offset + array.nbytes)
+    header = {
+        'source': None if source_file_name is None else source_key(source_file_name),
+        'name': obj.name,
+        'groups': [[g.name, g.material, g.first_face, g.face_count] for g in obj.groups],
+        'primitives': primitives,
+        'optimized': obj.optimized,
+        'metadata': obj.metadata,
+        'blocks': [
+            {'name': name, 'dtype': dtype, 'shape': list(array.shape), 'offset': block_offset}
+            for name, dtype, array, block_offset in blocks],
+    }
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_start = _align(_PREAMBLE.size + len(header_bytes))
+    temp_name = file_name + '.tmp'
+    with open(temp_name, 'wb') as f:
+        f.write(_PREAMBLE.pack(MAGIC, VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        for name, dtype, array, block_offset in blocks:
+            if array.size < 1:
+                continue
+            f.seek(data_start + block_offset)
+            f.write(memoryview(array).cast('B'))
+        f.truncate(data_start + offset)
+    os.replace(temp_name, file_name)
+
+
+def _read_header(f):
+    magic, version, header_length = _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+    if magic != MAGIC:
+        raise MeshCacheError('not a wiggle mesh cache file')
+    if version != VERSION:
+        raise MeshCacheError(f'unsupported mesh cache version {version}')
+    header = json.loads(f.read(header_length).decode('utf-8'))
+    return header, _align(_PREAMBLE.size + header_length)
+
+
+def load_mesh_cache(file_name, source_file_name=None):
+    """
+    Memory-map a binary mesh cache file into an ObjArrays.
+
+    Returns None if the cache was made from a different version of
+    source_file_name.
+    """
+    with open(file_name, 'rb') as f:
+        header, data_start = _read_header(f)
+    if source_file_name is not None:
+        key = header.get('source')
+        if key is None or not _source_matches(key, source_file_name):
+            return None
+    obj = ObjArrays()
+    obj.name = header['name']
+    obj.groups = [ObjGroup(*g[:3]) for g in header['groups']]
+    for group, g in zip(obj.groups, header['groups']):
+        group.face_count = g[3]
+    arrays = dict()
+    for block in header['blocks']:
+        shape = tuple(block['shape'])
+        dtype = numpy.dtype(block['dtype'])
+        if numpy.prod(shape) == 0:
+            array = numpy.empty(shape, dtype=dtype)  # mmap cannot map zero bytes
+        else:
+            array = numpy.memmap(
+                file_name, dtype=dtype, mode='r', offset=data_start + block['offset'], shape=shape)
+        arrays[block['name']] = array
+    for name, dtype in _BLOCKS:
+        setattr(obj, name, arrays[name])
+    primitives = header.get('primitives')
+    if primitives is not None:
+        obj.primitives = MeshPrimitives(primitives['mode'], arrays['draw_indexes'], primitives['restart_index'])
+        obj.allow_strips = primitives.get('allow_strips', True)
+    obj.optimized = header.get('optimized', False)
+    obj.metadata = header.get('metadata', dict())
+    return obj
+
+
+def load_obj_cached(file_name, cache_dir=None, build_draw_primitives=False, optimize=False, allow_strips=True):
+    """
+    Load an OBJ file through its binary sidecar cache.
+
+    The cache is (re)written after parsing when it is missing or stale, or
+    when build_draw_primitives or optimize ask for work the cache does not
+    contain yet. Cached primitives built with another allow_strips setting
+    are stale too. An unreadable cache logs a warning and the file is
+    parsed again; if the new cache cannot be written, that logs a warning,
+    and the parsed mesh is returned anyway.
+    """
+    cache_name = cache_file_name(file_name, cache_dir)
+    obj = None
+    if os.path.exists(cache_name):
+        try:
+            obj = load_mesh_cache(cache_name, source_file_name=file_name)
+        except (MeshCacheError, ValueError, KeyError, struct.error) as error:
+            logger.warning(f'ignoring unreadable mesh cache "{cache_name}": {error}')
+    if obj is not None and obj.primitives is not None and obj.allow_strips != allow_strips:
+        obj.primitives = None
+    if obj is not None and (obj.primitives is not None or not build_draw_primitives) and (
+            obj.optimized or not optimize):
+        return obj
+    if obj is None:
+        with open(file_name, 'rb') as stream:
+            obj = load_obj_arrays(stream)
+    if optimize and not obj.optimized:
+        optimize_obj_arrays(obj)
+    if build_draw_primitives and obj.primitives is None:
+        build_primitives_cached(file_name, obj, cache_dir=cache_dir, allow_strips=allow_strips)
+    else:
+        _save_obj_cache(file_name, obj, cache_dir)
+    return obj
+
+
+def build_primitives_cached(file_name, obj, cache_dir=None, allow_strips=True):
+    """Build the draw primitives of an ObjArrays from load_obj_cached(), and add them to its cache"""
+    obj.primitives = build_primitives(obj.face_offsets, obj.face_vertexes, allow_strips=allow_strips)
+    obj.allow_strips = allow_strips
+    _save_obj_cache(file_name, obj, cache_dir)
+    return obj.primitives
+
+
+def _save_obj_cache(file_name, obj, cache_dir):
+    cache_name = cache_file_name(file_name, cache_dir)
+    try:
+        save_mesh_cache(cache_name, obj, source_file_name=file_name)
+    except OSError as error:
+        logger.warning(f'could not write mesh cache "{cache_name}": {error}')
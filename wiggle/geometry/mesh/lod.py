@@ -0,0 +1,161 @@
+"""
+Levels of detail for a Mesh, and choosing among them by projected screen size.
+
+Simplification is slow, so build_lods_async() runs it on a background
+thread, and load_lods_cached() keeps the results in binary mesh cache
+files keyed by a digest of the source geometry.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import logging
+import os
+import struct
+
+import numpy
+
+from wiggle.geometry.mesh import Mesh
+from wiggle.geometry.mesh.cache import CACHE_SUFFIX, MeshCacheError, load_mesh_cache, save_mesh_cache
+from wiggle.geometry.mesh.primitives import build_primitives, triangulate
+from wiggle.geometry.mesh.simplify import simplify
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RATIO = 0.5  # triangle count of each level, relative to the previous one
+DEFAULT_MIN_TRIANGLE_COUNT = 64
+DEFAULT_MAX_LEVELS = 6
+DEFAULT_PIXEL_TOLERANCE = 1.0
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'wiggle', 'lod')
+
+_executor = None
+
+
+class MeshLod(object):
+    """One level of detail: a mesh, and its approximate geometric error relative to the full mesh"""
+    def __init__(self, mesh, error):
+        self.mesh = mesh
+        self.error = error
+
+    def __repr__(self):
+        return f'MeshLod({len(self.mesh.faces)} faces, error={self.error:.3g})'
+
+
+def lod_triangle_counts(triangle_count, ratio=DEFAULT_RATIO, min_triangle_count=DEFAULT_MIN_TRIANGLE_COUNT,
+                        max_levels=DEFAULT_MAX_LEVELS):
+    """Target triangle counts of the simplified levels, not including the full mesh"""
+    result = []
+    count = int(triangle_count * ratio)
+    while count >= min_triangle_count and len(result) < max_levels:
+        result.append(count)
+        count = int(count * ratio)
+    return result
+
+
+def build_lods(mesh, ratio=DEFAULT_RATIO, min_triangle_count=DEFAULT_MIN_TRIANGLE_COUNT,
+               max_levels=DEFAULT_MAX_LEVELS):
+    """
+    List of MeshLod, from the full mesh to the coarsest level, by quadric
+    error metric simplification.
+    """
+    triangles = triangulate(mesh.face_offsets, mesh.face_indexes)
+    result = [MeshLod(mesh, 0.0)]
+    targets = lod_triangle_counts(len(triangles), ratio, min_triangle_count, max_levels)
+    if len(targets) < 1:
+        return result
+    previous_count = len(triangles)
+    for level, simplified in enumerate(simplify(mesh.positions, triangles, targets)):
+        if len(simplified.triangles) >= previous_count:
+            break  # simplification got stuck
+        previous_count = len(simplified.triangles)
+        lod = Mesh(f'{mesh.name} lod {level + 1}')
+        lod.append_vertexes(simplified.positions)
+        lod.append_faces(simplified.triangles)
+        obj = lod.obj_arrays()
+        # Each simplified vertex keeps the normal of the original vertex it came from
+        obj.normals = mesh.vertex_normals
+        obj.face_normals = mesh.vertex_normal_indexes[simplified.vertex_ids][simplified.triangles.reshape(-1)]
+        # Triangulated here, on the background thread, rather than at the first draw
+        obj.primitives = build_primitives(obj.face_offsets, obj.face_vertexes)
+        result.append(MeshLod(Mesh.from_obj_arrays(obj), simplified.error))
+    return result
+
+
+def mesh_digest(mesh, *parameters):
+    """Hex digest identifying the geometry of a mesh, plus any other parameters"""
+    h = hashlib.sha256()
+    for array in (mesh.positions, mesh.face_offsets, mesh.face_indexes):
+        h.update(numpy.ascontiguousarray(array).tobytes())
+    h.update(repr(parameters).encode('utf-8'))
+    return h.hexdigest()
+
+
+def lod_cache_file_name(digest, level, cache_dir=DEFAULT_CACHE_DIR):
+    return os.path.join(cache_dir, f'{digest[:32]}_lod{level}{CACHE_SUFFIX}')
+
+
+def load_lods_cached(mesh, cache_dir=DEFAULT_CACHE_DIR, ratio=DEFAULT_RATIO,
+                     min_triangle_count=DEFAULT_MIN_TRIANGLE_COUNT, max_levels=DEFAULT_MAX_LEVELS):
+    """
+    build_lods(), through memory-mapped cache files in cache_dir.
+
+    Unreadable levels are logged and built again. Levels that cannot be
+    saved log a warning, and are returned all the same.
+    """
+    digest = mesh_digest(mesh, ratio, min_triangle_count, max_levels)
+    result = [MeshLod(mesh, 0.0)]
+    try:
+        level = 1
+        while True:
+            file_name = lod_cache_file_name(digest, level, cache_dir)
+            if not os.path.exists(file_name):
+                break
+            obj = load_mesh_cache(file_name)
+            result.append(MeshLod(Mesh.from_obj_arrays(obj), obj.metadata['error']))
+            if obj.metadata['is_last']:
+                return result
+            level += 1
+    except (MeshCacheError, ValueError, KeyError, struct.error) as error:
+        logger.warning(f'ignoring unreadable level of detail cache: {error}')
+    result = build_lods(mesh, ratio, min_triangle_count, max_levels)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        for level, lod in enumerate(result[1:], start=1):
+            obj = lod.mesh.obj_arrays()
+            obj.primitives = lod.mesh.primitives
+            obj.metadata = {'error': lod.error, 'is_last': level == len(result) - 1}
+            save_mesh_cache(lod_cache_file_name(digest, level, cache_dir), obj)
+    except OSError as error:
+        logger.warning(f'could not write level of detail cache: {error}')
+    return result
+
+
+def build_lods_async(mesh, **kwargs):
+    """Run load_lods_cached() on the shared background thread, returning a concurrent.futures.Future"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='wiggle-lod')
+    return _executor.submit(load_lods_cached, mesh, **kwargs)
+
+
+def select_lod(errors, center, radius, model_view, projection, viewport_height,
+               pixel_tolerance=DEFAULT_PIXEL_TOLERANCE):
+    """
+    Index of the coarsest level whose geometric error projects to at most
+    pixel_tolerance pixels on screen.
+
+    :param errors: increasing error of each level, in model units
+    :param center: bounding sphere center, in model coordinates
+    :param model_view: 4x4 matrix, row major, transforming column vectors
+    :param projection: 4x4 perspective projection, in the same layout
+    """
+    model_view = numpy.asarray(model_view, dtype=numpy.float64)
+    scale = numpy.linalg.norm(model_view[:3, :3], axis=0).max()
+    depth = -(model_view[2, :3] @ numpy.asarray(center) + model_view[2, 3]) - scale * radius
+    if depth <= 0:
+        return 0  # camera is inside the bounding sphere
+    pixels_per_unit = scale * projection[1][1] * viewport_height / (2.0 * depth)
+    result = 0
+    for level, error in enumerate(errors):
+        if error * pixels_per_unit <= pixel_tolerance:
+            result = level
+    return result
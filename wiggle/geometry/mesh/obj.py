@@ -0,0 +1,365 @@
+"""
+Bulk Wavefront OBJ reader.
+
+Reads the file in fixed size chunks, and converts each chunk into numpy
+arrays in a few vectorized calls, rather than building python lists one
+line at a time.
+"""
+
+import warnings
+
+import numpy
+
+
+DEFAULT_CHUNK_SIZE = 1 << 20  # bytes/characters of OBJ text per chunk
+
+
+class ObjParseError(Exception):
+    pass
+
+
+class ObjGroup(object):
+    """A run of faces sharing the same "g" group name and "usemtl" material"""
+    def __init__(self, name, material, first_face):
+        self.name = name
+        self.material = material
+        self.first_face = first_face
+        self.face_count = 0
+
+    def __repr__(self):
+        return f'ObjGroup({self.name!r}, {self.material!r}, first_face={self.first_face}, face_count={self.face_count})'
+
+
+class ObjArrays(object):
+    """
+    Geometry from an OBJ file, as contiguous numpy arrays.
+
+    Faces are stored CSR-style: the corners of face i are
+    face_*[face_offsets[i]:face_offsets[i+1]]. Corner indexes are zero-based;
+    vertex indexes are unsigned, and texture coordinate and normal indexes
+    are -1 where missing.
+    """
+    def __init__(self):
+        self.name = None
+        self.positions = numpy.empty((0, 3), dtype=numpy.float32)
+        self.texcoords = numpy.empty((0, 2), dtype=numpy.float32)
+        self.normals = numpy.empty((0, 3), dtype=numpy.float32)
+        self.face_offsets = numpy.zeros((1,), dtype=numpy.int64)
+        self.face_vertexes = numpy.empty((0,), dtype=numpy.uint32)
+        self.face_texcoords = numpy.empty((0,), dtype=numpy.int32)
+        self.face_normals = numpy.empty((0,), dtype=numpy.int32)
+        self.groups = []
+        self.primitives = None  # MeshPrimitives, when loaded from a mesh cache
+        self.allow_strips = True  # whether the primitives could use triangle strips
+        self.optimized = False  # whether faces and vertexes were reordered for drawing
+        self.metadata = dict()  # extra JSON compatible values, kept in a mesh cache
+
+    @property
+    def face_count(self):
+        return len(self.face_offsets) - 1
+
+    def corner_counts(self):
+        return numpy.diff(self.face_offsets)
+
+    def triangles(self):
+        """(T, 3) array of vertex indexes, from fan triangulation of each face"""
+        return self.face_vertexes[fan_triangulate(self.face_offsets)]
+
+
+def fan_triangulate(face_offsets):
+    """
+    Triangulates CSR polygon faces as fans around their first corner.
+
+    Returns a (T, 3) array of corner indexes, so the same result can gather
+    vertex, texture coordinate and normal indexes.
+    """
+    face_offsets = numpy.asarray(face_offsets, dtype=numpy.int64)
+    tri_counts = numpy.maximum(numpy.diff(face_offsets) - 2, 0)
+    total = int(tri_counts.sum())
+    first = numpy.repeat(face_offsets[:-1], tri_counts)
+    tri_starts = numpy.cumsum(tri_counts) - tri_counts
+    local = numpy.arange(total, dtype=numpy.int64) - numpy.repeat(tri_starts, tri_counts) + 1
+    return numpy.stack((first, first + local, first + local + 1), axis=1)
+
+
+def triangle_faces(face_offsets):
+    """Index of the source face for each triangle from fan_triangulate()"""
+    tri_counts = numpy.maximum(numpy.diff(face_offsets) - 2, 0)
+    return numpy.repeat(numpy.arange(len(tri_counts), dtype=numpy.int64), tri_counts)
+
+
+# Byte values and line kinds used by the vectorized tokenizer
+_NEWLINE = ord('\n')
+_SPACE = ord(' ')
+_SLASH = ord('/')
+_OTHER, _SKIP, _VERTEX, _TEXCOORD, _NORMAL, _FACE = range(6)
+
+
+def _parse_numbers(text, dtype):
+    """Array of the white space separated numbers in text, or None if some are not numbers"""
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        try:
+            return numpy.fromstring(text, dtype=dtype, sep=' ')
+        except ValueError:
+            return None  # callers fall back to parsing line by line, to report the bad line
+
+
+def _resolve_indexes(one_based, counts, name, is_required):
+    """
+    Convert one-based (or negative, relative) OBJ indexes to zero-based, with
+    -1 for missing. Raises ObjParseError for indexes past the counts defined
+    so far, or for missing required ones.
+    """
+    result = one_based - 1
+    negative = one_based < 0
+    if negative.any():
+        result[negative] = counts[negative] + one_based[negative]
+    missing = one_based == 0
+    bad = (result < 0) | (result >= counts)
+    if not is_required:
+        bad &= ~missing
+    if bad.any():
+        value = int(one_based[numpy.argmax(bad)])
+        raise ObjParseError(f'OBJ face {name} index {value} is out of range')
+    result[missing] = -1
+    return result.astype(numpy.int32)
+
+
+class ObjReader(object):
+    """
+    Streams OBJ text into numpy arrays, one chunk at a time.
+
+    Each chunk is classified line-by-line and tokenized with byte masks, so
+    no python objects are created for the "v", "vt", "vn" and "f" lines that
+    make up nearly all of a large file. Peak memory above the size of the
+    final arrays is a small multiple of chunk_size.
+    """
+    def __init__(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.result = ObjArrays()
+        self._group_name = None
+        self._material = None
+        self._vertex_count = 0
+        self._texcoord_count = 0
+        self._normal_count = 0
+        self._face_count = 0
+        self._positions = []
+        self._texcoords = []
+        self._normals = []
+        self._corner_counts = []
+        self._corners = []
+
+    def read(self, stream):
+        """Read an entire text or binary OBJ stream, returning ObjArrays"""
+        for chunk in self._iter_chunks(stream):
+            self._parse_chunk(chunk)
+        return self._finish()
+
+    def _iter_chunks(self, stream):
+        """Yields blocks of whole lines, as bytes"""
+        remainder = b''
+        while True:
+            data = stream.read(self.chunk_size)
+            if not data:
+                break
+            if isinstance(data, str):
+                data = data.encode('utf-8')
+            data = remainder + data
+            cut = data.rfind(b'\n') + 1
+            remainder = data[cut:]
+            if cut > 0:
+                yield data[:cut]
+        if remainder:
+            yield remainder + b'\n'
+
+    def _parse_chunk(self, data):
+        buf = numpy.frombuffer(data, dtype=numpy.uint8).copy()
+        buf[(buf == ord('\r')) | (buf == ord('\t'))] = _SPACE
+        ends = numpy.flatnonzero(buf == _NEWLINE)
+        starts = numpy.concatenate(([0], ends[:-1] + 1))
+        if (buf[starts] == _SPACE).any():
+            # Leading white space is unusual; strip it and start over
+            lines = data.decode('utf-8', errors='replace').splitlines()
+            data = '\n'.join(line.strip() for line in lines).encode('utf-8') + b'\n'
+            return self._parse_chunk(data)
+        # Classify each line by its first few characters
+        last = len(buf) - 1
+        c0 = buf[starts]
+        c1 = buf[numpy.minimum(starts + 1, last)]
+        c2 = buf[numpy.minimum(starts + 2, last)]
+        kinds = numpy.full(len(starts), _OTHER, dtype=numpy.uint8)
+        kinds[(c0 == _NEWLINE) | (c0 == ord('#'))] = _SKIP
+        is_v = c0 == ord('v')
+        kinds[is_v & (c1 == _SPACE)] = _VERTEX
+        kinds[is_v & (c1 == ord('t')) & (c2 == _SPACE)] = _TEXCOORD
+        kinds[is_v & (c1 == ord('n')) & (c2 == _SPACE)] = _NORMAL
+        kinds[(c0 == ord('f')) & (c1 == _SPACE)] = _FACE
+        # Blank out trailing comments, as in "f 1 2 3 # comment"
+        is_hash = buf == ord('#')
+        if is_hash.any():
+            hash_counts = numpy.cumsum(is_hash)
+            line_counts = numpy.repeat(hash_counts[starts] - is_hash[starts], ends - starts + 1)
+            buf[(hash_counts > line_counts) & (buf != _NEWLINE)] = _SPACE
+        # Blank out the keywords, leaving only numbers on the tokenized lines
+        buf[starts[kinds >= _VERTEX]] = _SPACE
+        buf[starts[(kinds == _TEXCOORD) | (kinds == _NORMAL)] + 1] = _SPACE
+        byte_kinds = numpy.repeat(kinds, ends - starts + 1)
+        # Running counts at each line, for groups and negative indexes
+        before = dict()
+        for kind in (_VERTEX, _TEXCOORD, _NORMAL, _FACE):
+            is_kind = kinds == kind
+            before[kind] = numpy.cumsum(is_kind) - is_kind
+        self._parse_other_lines(buf, starts, ends, kinds, before[_FACE])
+        face_bases = numpy.stack([
+            before[_VERTEX] + self._vertex_count,
+            before[_TEXCOORD] + self._texcoord_count,
+            before[_NORMAL] + self._normal_count,
+        ], axis=1)[kinds == _FACE]
+        self._append_faces(buf[byte_kinds == _FACE], face_bases)
+        self._append_coordinates(buf, starts, ends, kinds, byte_kinds)
+
+    def _parse_other_lines(self, buf, starts, ends, kinds, faces_before):
+        for line_index in numpy.flatnonzero(kinds == _OTHER):
+            line = buf[starts[line_index]:ends[line_index]].tobytes().decode('utf-8', errors='replace')
+            fields = line.split(None, 1)
+            if len(fields) < 1:
+                continue  # blank line
+            keyword = fields[0]
+            value = fields[1].strip() if len(fields) > 1 else ''
+            first_face = self._face_count + int(faces_before[line_index])
+            if keyword == 'o':
+                self.result.name = value
+            elif keyword == 'g':
+                self._start_group(value, self._material, first_face)
+            elif keyword == 'usemtl':
+                self._start_group(self._group_name, value, first_face)
+            elif keyword in ('s', 'mtllib', 'l', 'p'):
+                continue  # smoothing groups, material libraries, lines and points are not used
+            else:
+                raise ObjParseError(f'unrecognized OBJ line: "{line}"')
+
+    def _start_group(self, name, material, first_face):
+        self._group_name = name
+        self._material = material
+        groups = self.result.groups
+        if len(groups) > 0 and groups[-1].first_face == first_face:
+            groups.pop()  # previous group has no faces
+        groups.append(ObjGroup(name, material, first_face))
+
+    def _append_coordinates(self, buf, starts, ends, kinds, byte_kinds):
+        for kind, width, arrays in (
+                (_VERTEX, 3, self._positions),
+                (_TEXCOORD, 2, self._texcoords),
+                (_NORMAL, 3, self._normals)):
+            line_count = int(numpy.count_nonzero(kinds == kind))
+            values = _parse_numbers(buf[byte_kinds == kind].tobytes(), numpy.float32)
+            if values is not None and values.size == width * line_count:
+                values = values.reshape((-1, width))
+            else:
+                # Some lines carry extra fields, e.g. "v x y z w" or "vt u v w"; slow path
+                values = numpy.zeros((line_count, width), dtype=numpy.float32)
+                selected = kinds == kind
+                for i, (start, end) in enumerate(zip(starts[selected], ends[selected])):
+                    fields = buf[start:end].tobytes().split()[:width]
+                    try:
+                        values[i, :len(fields)] = [float(x) for x in fields]
+                    except ValueError as error:
+                        raise ObjParseError(f'malformed OBJ coordinate: {error}') from error
+            arrays.append(values)
+        self._vertex_count += len(self._positions[-1])
+        self._texcoord_count += len(self._texcoords[-1])
+        self._normal_count += len(self._normals[-1])
+
+    def _append_faces(self, face_bytes, face_bases):
+        face_count = len(face_bases)
+        if face_count < 1:
+            return
+        # Find the start of each corner token, and count the tokens on each line
+        is_separator = (face_bytes == _SPACE) | (face_bytes == _NEWLINE)
+        is_token_start = ~is_separator
+        is_token_start[1:] &= is_separator[:-1]
+        token_ids = numpy.cumsum(is_token_start, dtype=numpy.int32)
+        token_count = int(token_ids[-1])
+        tokens_through_line = token_ids[face_bytes == _NEWLINE]
+        counts = numpy.diff(numpy.concatenate(([0], tokens_through_line)))
+        corners = self._parse_corners(face_bytes, token_ids, token_count)
+        # Counts defined before each corner's line, for relative indexes and range checks
+        bases = numpy.repeat(face_bases, counts, axis=0)
+        resolved = numpy.stack([
+            _resolve_indexes(corners[:, 0], bases[:, 0], 'vertex', True),
+            _resolve_indexes(corners[:, 1], bases[:, 1], 'texture coordinate', False),
+            _resolve_indexes(corners[:, 2], bases[:, 2], 'normal', False),
+        ], axis=1)
+        self._corner_counts.append(counts)
+        self._corners.append(resolved)
+        self._face_count += face_count
+
+    @staticmethod
+    def _parse_corners(face_bytes, token_ids, token_count):
+        """Parse face corners into an (N, 3) array of one-based v, vt, vn indexes, zero if absent"""
+        result = numpy.zeros((token_count, 3), dtype=numpy.int64)
+        if token_count < 1:
+            return result
+        is_slash = face_bytes == _SLASH
+        slash_counts = numpy.bincount(token_ids[is_slash], minlength=token_count + 1)[1:]
+        is_double = numpy.zeros_like(is_slash)
+        is_double[1:] = is_slash[1:] & is_slash[:-1]
+        double_count = int(numpy.count_nonzero(is_double))
+        if (slash_counts == slash_counts[0]).all():
+            slashes = int(slash_counts[0])
+            if slashes == 0:
+                columns = (0, )  # v
+            elif slashes == 1:
+                columns = (0, 1)  # v/vt
+            elif slashes == 2 and double_count == token_count:
+                columns = (0, 2)  # v//vn
+            elif slashes == 2 and double_count == 0:
+                columns = (0, 1, 2)  # v/vt/vn
+            else:
+                columns = None
+            if columns is not None:
+                text = numpy.where(is_slash, numpy.uint8(_SPACE), face_bytes).tobytes()
+                values = _parse_numbers(text, numpy.int64)
+                if values is not None and values.size == len(columns) * token_count:
+                    result[:, columns] = values.reshape((-1, len(columns)))
+                    return result
+        # Mixed corner formats within one chunk; slow path
+        try:
+            for i, token in enumerate(face_bytes.tobytes().split()):
+                for j, field in enumerate(token.split(b'/')[:3]):
+                    if field:
+                        result[i, j] = int(field)
+        except ValueError as error:
+            raise ObjParseError(f'malformed OBJ face: {error}') from error
+        return result
+
+    def _finish(self):
+        result = self.result
+        if len(self._positions) > 0:
+            result.positions = numpy.concatenate(self._positions)
+            result.texcoords = numpy.concatenate(self._texcoords)
+            result.normals = numpy.concatenate(self._normals)
+        if len(self._corners) > 0:
+            counts = numpy.concatenate(self._corner_counts)
+            corners = numpy.concatenate(self._corners)
+            result.face_offsets = numpy.concatenate(([0], numpy.cumsum(counts))).astype(numpy.int64)
+            result.face_vertexes = corners[:, 0].astype(numpy.uint32)
+            result.face_texcoords = numpy.ascontiguousarray(corners[:, 1])
+            result.face_normals = numpy.ascontiguousarray(corners[:, 2])
+        for i, group in enumerate(result.groups):
+            end = result.groups[i + 1].first_face if i + 1 < len(result.groups) else self._face_count
+            group.face_count = end - group.first_face
+        if len(result.groups) > 0 and result.groups[-1].face_count == 0:
+            result.groups.pop()
+        self._positions.clear()
+        self._texcoords.clear()
+        self._normals.clear()
+        self._corner_counts.clear()
+        self._corners.clear()
+        return result
+
+
+def load_obj_arrays(stream, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Read an OBJ text or binary stream into an ObjArrays"""
+    return ObjReader(chunk_size=chunk_size).read(stream)
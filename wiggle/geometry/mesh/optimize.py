@@ -0,0 +1,330 @@
+"""
+Reorders mesh faces and vertexes for faster drawing.
+
+Faces are put in vertex cache friendly order with Tipsify (Sander, Nehab
+and Barczak, "Fast Triangle Reordering for Vertex Locality and Reduced
+Overdraw", 2007). Clusters of those faces are then sorted so that outward
+facing parts of the mesh tend to be drawn first, which reduces overdraw.
+Finally vertexes are renumbered in order of first use, for vertex fetch
+locality.
+
+Like primitives, this is independent of OpenGL, so it can run offline.
+"""
+
+from collections import deque
+import logging
+
+import numpy
+
+from wiggle.geometry.mesh.adjacency import corner_faces
+from wiggle.geometry.mesh.obj import fan_triangulate
+from wiggle.geometry.mesh.primitives import DEFAULT_CACHE_SIZE, fifo_cache_misses
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OVERDRAW_THRESHOLD = 1.05  # allowed cluster ACMR, relative to the whole mesh
+
+
+class CacheStatistics(object):
+    """Simulated post-transform vertex cache efficiency of one triangle order"""
+    def __init__(self, shaded_vertexes, triangle_count, vertex_count):
+        self.shaded_vertexes = shaded_vertexes
+        self.triangle_count = triangle_count
+        self.vertex_count = vertex_count
+
+    @property
+    def acmr(self):
+        """Average cache miss ratio: vertex shader runs per triangle, 0.5 at best for large meshes"""
+        return self.shaded_vertexes / max(self.triangle_count, 1)
+
+    @property
+    def atvr(self):
+        """Average transformed vertex ratio: vertex shader runs per vertex, 1.0 at best"""
+        return self.shaded_vertexes / max(self.vertex_count, 1)
+
+    def __repr__(self):
+        return f'CacheStatistics(acmr={self.acmr:.3f}, atvr={self.atvr:.3f})'
+
+
+def cache_statistics(triangles, cache_size=DEFAULT_CACHE_SIZE):
+    """ACMR and ATVR of (T, 3) triangle indexes drawn through a FIFO vertex cache"""
+    triangles = numpy.asarray(triangles).reshape((-1, 3))
+    vertex_count = len(numpy.unique(triangles))
+    return CacheStatistics(fifo_cache_misses(triangles, cache_size), len(triangles), vertex_count)
+
+
+def face_cache_statistics(face_offsets, face_indexes, cache_size=DEFAULT_CACHE_SIZE):
+    """cache_statistics() of fan triangulated polygon faces"""
+    face_indexes = numpy.asarray(face_indexes)
+    return cache_statistics(face_indexes[fan_triangulate(face_offsets)], cache_size)
+
+
+def tipsify(face_offsets, face_indexes, vertex_count, cache_size=DEFAULT_CACHE_SIZE):
+    """
+    Vertex cache friendly face order.
+
+    Emits all remaining faces around one "fanning" vertex at a time, then
+    moves on to the adjacent vertex that will stay in the cache longest.
+    Returns the face order, and the positions in it where the cache was
+    effectively flushed, which make good cluster boundaries.
+    """
+    face_offsets = numpy.asarray(face_offsets, dtype=numpy.int64)
+    face_indexes = numpy.asarray(face_indexes, dtype=numpy.int64)
+    use_counts = numpy.bincount(face_indexes, minlength=vertex_count)
+    vertex_offsets = numpy.concatenate(([0], numpy.cumsum(use_counts))).tolist()
+    vertex_faces = corner_faces(face_offsets)[numpy.argsort(face_indexes, kind='stable')].tolist()
+    offsets = face_offsets.tolist()
+    corners = face_indexes.tolist()
+    live = use_counts.tolist()
+    timestamps = [0] * vertex_count
+    emitted = [False] * (len(offsets) - 1)
+    dead_end = []
+    order = []
+    boundaries = []
+    time = cache_size + 1
+    cursor = 0
+    fan = -1
+    while cursor < vertex_count:
+        if live[cursor] > 0:
+            fan = cursor
+            break
+        cursor += 1
+    while fan >= 0:
+        candidates = []
+        for f in vertex_faces[vertex_offsets[fan]:vertex_offsets[fan + 1]]:
+            if emitted[f]:
+                continue
+            emitted[f] = True
+            order.append(f)
+            for v in corners[offsets[f]:offsets[f + 1]]:
+                dead_end.append(v)
+                candidates.append(v)
+                live[v] -= 1
+                if time - timestamps[v] > cache_size:
+                    timestamps[v] = time
+                    time += 1
+        # Prefer the live neighbor that entered the cache earliest, if its faces will fit
+        fan = -1
+        best = -1
+        for v in candidates:
+            if live[v] > 0:
+                priority = 0
+                if time - timestamps[v] + 2 * live[v] <= cache_size:
+                    priority = time - timestamps[v]
+                if priority > best:
+                    best = priority
+                    fan = v
+        if fan >= 0:
+            continue
+        # Dead end: back up to a recently used vertex, or else scan for any unfinished one
+        while len(dead_end) > 0:
+            v = dead_end.pop()
+            if live[v] > 0:
+                fan = v
+                break
+        while fan < 0 and cursor < vertex_count:
+            if live[cursor] > 0:
+                fan = cursor
+            else:
+                cursor += 1
+        if fan >= 0 and time - timestamps[fan] > cache_size:
+            boundaries.append(len(order))
+    return numpy.array(order, dtype=numpy.int64), numpy.array(boundaries, dtype=numpy.int64)
+
+
+def _face_cache_misses(face_offsets, face_indexes, cache_size):
+    """Number of FIFO vertex cache misses caused by each face, in order"""
+    offsets = numpy.asarray(face_offsets).tolist()
+    corners = numpy.asarray(face_indexes).tolist()
+    cache = deque()
+    cached = set()
+    result = []
+    for f in range(len(offsets) - 1):
+        misses = 0
+        for v in corners[offsets[f]:offsets[f + 1]]:
+            if v in cached:
+                continue
+            misses += 1
+            cache.append(v)
+            cached.add(v)
+            if len(cache) > cache_size:
+                cached.discard(cache.popleft())
+        result.append(misses)
+    return numpy.array(result, dtype=numpy.int64)
+
+
+def linear_clusters(face_offsets, face_indexes, boundaries, cache_size=DEFAULT_CACHE_SIZE,
+                    threshold=DEFAULT_OVERDRAW_THRESHOLD):
+    """
+    Split ordered faces into clusters, for sorting without ruining vertex cache efficiency.
+
+    Clusters always end at the given boundaries. They also end wherever a
+    face misses the cache on every corner, once the cluster so far is
+    within threshold of the mesh's average cache miss ratio. Returns the
+    first face of each cluster.
+    """
+    face_offsets = numpy.asarray(face_offsets, dtype=numpy.int64)
+    misses = _face_cache_misses(face_offsets, face_indexes, cache_size)
+    counts = numpy.diff(face_offsets)
+    triangle_counts = numpy.maximum(counts - 2, 0)
+    limit = threshold * misses.sum() / max(int(triangle_counts.sum()), 1)
+    is_hard = numpy.zeros(len(counts) + 1, dtype=bool)
+    is_hard[boundaries] = True
+    is_flush = (misses == counts).tolist()
+    misses = misses.tolist()
+    triangle_counts = triangle_counts.tolist()
+    starts = [0]
+    cluster_misses = 0
+    cluster_triangles = 0
+    for f in range(1, len(counts)):
+        cluster_misses += misses[f - 1]
+        cluster_triangles += triangle_counts[f - 1]
+        if is_hard[f] or (is_flush[f] and cluster_misses <= limit * cluster_triangles):
+            starts.append(f)
+            cluster_misses = 0
+            cluster_triangles = 0
+    return numpy.array(starts if len(counts) > 0 else [], dtype=numpy.int64)
+
+
+def sort_clusters(face_offsets, face_indexes, positions, cluster_starts):
+    """
+    Face order that draws outward facing clusters first.
+
+    Each cluster is ranked by how far its centroid lies from the mesh
+    centroid, along the cluster's average normal. This is view independent,
+    so it can be done once, offline.
+    """
+    face_offsets = numpy.asarray(face_offsets, dtype=numpy.int64)
+    face_indexes = numpy.asarray(face_indexes)
+    positions = numpy.asarray(positions, dtype=numpy.float64)
+    face_count = len(face_offsets) - 1
+    if face_count < 1:
+        return numpy.empty((0, ), dtype=numpy.int64)
+    # Area weighted face normals and centroids, from the fan triangles of each face
+    corners = fan_triangulate(face_offsets)
+    if len(corners) < 1:
+        return numpy.arange(face_count)
+    triangle_faces = numpy.repeat(numpy.arange(face_count), numpy.maximum(numpy.diff(face_offsets) - 2, 0))
+    p = positions[face_indexes[corners]]
+    normals = numpy.cross(p[:, 1] - p[:, 0], p[:, 2] - p[:, 0])
+    areas = numpy.linalg.norm(normals, axis=1) + 1e-30
+    centroids = p.mean(axis=1)
+    cluster_sizes = numpy.diff(numpy.concatenate((cluster_starts, [face_count])))
+    triangle_clusters = numpy.repeat(numpy.arange(len(cluster_starts)), cluster_sizes)[triangle_faces]
+    cluster_normals = numpy.zeros((len(cluster_starts), 3))
+    cluster_centroids = numpy.zeros((len(cluster_starts), 3))
+    for k in range(3):
+        cluster_normals[:, k] = numpy.bincount(
+            triangle_clusters, weights=normals[:, k], minlength=len(cluster_starts))
+        cluster_centroids[:, k] = numpy.bincount(
+            triangle_clusters, weights=areas * centroids[:, k], minlength=len(cluster_starts))
+    cluster_areas = numpy.bincount(triangle_clusters, weights=areas, minlength=len(cluster_starts))
+    cluster_centroids /= numpy.maximum(cluster_areas, 1e-30)[:, None]
+    mesh_centroid = (areas[:, None] * centroids).sum(axis=0) / areas.sum()
+    lengths = numpy.linalg.norm(cluster_normals, axis=1)
+    cluster_normals /= numpy.maximum(lengths, 1e-30)[:, None]
+    occlusion = ((cluster_centroids - mesh_centroid) * cluster_normals).sum(axis=1)
+    cluster_order = numpy.argsort(-occlusion, kind='stable')
+    return numpy.concatenate(
+        [numpy.arange(cluster_starts[c], cluster_starts[c] + cluster_sizes[c]) for c in cluster_order])
+
+
+def reorder_faces(face_offsets, face_order):
+    """New face offsets, and the old corner index of each new corner, for the faces taken in face_order"""
+    face_offsets = numpy.asarray(face_offsets, dtype=numpy.int64)
+    counts = numpy.diff(face_offsets)[face_order]
+    offsets = numpy.concatenate(([0], numpy.cumsum(counts))).astype(numpy.int64)
+    corner_order = numpy.arange(offsets[-1], dtype=numpy.int64)
+    corner_order += numpy.repeat(face_offsets[:-1][face_order] - offsets[:-1], counts)
+    return offsets, corner_order
+
+
+def vertex_fetch_order(face_indexes, vertex_count):
+    """
+    Vertex order by first use in face_indexes, with unused vertexes last.
+
+    Returns the old index of each new vertex, and the new index of each old vertex.
+    """
+    used, first_use = numpy.unique(numpy.asarray(face_indexes), return_index=True)
+    unused = numpy.setdiff1d(numpy.arange(vertex_count), used, assume_unique=True)
+    vertex_order = numpy.concatenate((used[numpy.argsort(first_use)], unused)).astype(numpy.int64)
+    vertex_remap = numpy.empty(vertex_count, dtype=numpy.int64)
+    vertex_remap[vertex_order] = numpy.arange(vertex_count)
+    return vertex_order, vertex_remap
+
+
+def _face_ranges(groups, face_count):
+    """(first, end) face ranges of groups, plus any faces outside of groups"""
+    ranges = []
+    start = 0
+    for g in sorted(groups, key=lambda g: g.first_face):
+        if g.first_face > start:
+            ranges.append((start, g.first_face))
+        if g.face_count > 0:
+            ranges.append((g.first_face, g.first_face + g.face_count))
+        start = max(start, g.first_face + g.face_count)
+    if face_count > start:
+        ranges.append((start, face_count))
+    return ranges
+
+
+class MeshOptimization(object):
+    """How to reorder the faces and vertexes of a mesh, from optimize_faces()"""
+    def __init__(self, face_order, face_offsets, corner_order, vertex_order, vertex_remap, before, after):
+        self.face_order = face_order  # old index of each new face
+        self.face_offsets = face_offsets  # new face offsets
+        self.corner_order = corner_order  # old index of each new face corner
+        self.vertex_order = vertex_order  # old index of each new vertex
+        self.vertex_remap = vertex_remap  # new index of each old vertex
+        self.before = before  # CacheStatistics
+        self.after = after
+
+    def __repr__(self):
+        return f'MeshOptimization({self.before} -> {self.after})'
+
+
+def optimize_faces(face_offsets, face_indexes, vertex_count, positions=None, groups=(),
+                   cache_size=DEFAULT_CACHE_SIZE, overdraw_threshold=DEFAULT_OVERDRAW_THRESHOLD):
+    """
+    Plan a vertex cache, overdraw and vertex fetch optimizing reorder of a polygon mesh.
+
+    Faces are only reordered within each group, so material runs stay
+    intact. Overdraw sorting is skipped if positions are not given.
+    """
+    face_offsets = numpy.asarray(face_offsets, dtype=numpy.int64)
+    face_indexes = numpy.asarray(face_indexes)
+    face_order = []
+    for first, end in _face_ranges(groups, len(face_offsets) - 1):
+        offsets = face_offsets[first:end + 1] - face_offsets[first]
+        indexes = face_indexes[face_offsets[first]:face_offsets[end]]
+        # Number the group's own vertexes from zero, in the same order, so per vertex work scales with the group
+        group_vertexes, group_indexes = numpy.unique(indexes, return_inverse=True)
+        order, boundaries = tipsify(offsets, group_indexes.ravel(), len(group_vertexes), cache_size)
+        if positions is not None:
+            ordered_offsets, corner_order = reorder_faces(offsets, order)
+            ordered_indexes = indexes[corner_order]
+            starts = linear_clusters(ordered_offsets, ordered_indexes, boundaries, cache_size, overdraw_threshold)
+            order = order[sort_clusters(ordered_offsets, ordered_indexes, positions, starts)]
+        face_order.append(order + first)
+    face_order = numpy.concatenate(face_order) if len(face_order) > 0 else numpy.empty((0, ), dtype=numpy.int64)
+    offsets, corner_order = reorder_faces(face_offsets, face_order)
+    vertex_order, vertex_remap = vertex_fetch_order(face_indexes[corner_order], vertex_count)
+    before = face_cache_statistics(face_offsets, face_indexes, cache_size)
+    after = face_cache_statistics(offsets, face_indexes[corner_order], cache_size)
+    return MeshOptimization(face_order, offsets, corner_order, vertex_order, vertex_remap, before, after)
+
+
+def optimize_obj_arrays(obj, cache_size=DEFAULT_CACHE_SIZE):
+    """Reorder the faces and vertexes of an ObjArrays in place, returning the MeshOptimization"""
+    plan = optimize_faces(
+        obj.face_offsets, obj.face_vertexes, len(obj.positions), positions=obj.positions,
+        groups=obj.groups, cache_size=cache_size)
+    obj.positions = numpy.ascontiguousarray(obj.positions[plan.vertex_order])
+    obj.face_offsets = plan.face_offsets
+    obj.face_vertexes = plan.vertex_remap[obj.face_vertexes[plan.corner_order]].astype(numpy.uint32)
+    obj.face_texcoords = obj.face_texcoords[plan.corner_order]
+    obj.face_normals = obj.face_normals[plan.corner_order]
+    obj.primitives = None
+    obj.optimized = True
+    logger.info(f'reordered mesh "{obj.name}": vertex cache {plan.before} -> {plan.after}')
+    return plan
@@ -0,0 +1,241 @@
+"""
+Converts polygon faces into indexed triangle primitives for drawing.
+
+This is independent of OpenGL, so it can run offline; the result is stored
+in the binary mesh cache.
+"""
+
+from collections import deque
+
+import numpy
+
+from wiggle.geometry.mesh.obj import fan_triangulate
+
+TRIANGLES = 'triangles'
+TRIANGLE_STRIP = 'triangle_strip'
+RESTART_INDEX = 0xffffffff  # primitive restart marker between strips
+DEFAULT_CACHE_SIZE = 16  # post-transform vertex cache entries to simulate
+INDEX_COST = 0.1  # cost of fetching one index, relative to shading one vertex
+
+
+class MeshPrimitives(object):
+    """Index array for one draw call, as a triangle list or restart-separated strips"""
+    def __init__(self, mode, indexes, restart_index=None):
+        self.mode = mode
+        self.indexes = numpy.asarray(indexes, dtype=numpy.uint32)
+        self.restart_index = restart_index
+
+    def __len__(self):
+        return len(self.indexes)
+
+    def __repr__(self):
+        return f'MeshPrimitives({self.mode!r}, {len(self.indexes)} indexes)'
+
+    def triangles(self):
+        """(T, 3) vertex indexes with the winding each triangle is drawn with"""
+        if self.mode == TRIANGLES:
+            return self.indexes.reshape((-1, 3))
+        result = []
+        for strip in split_strips(self.indexes, self.restart_index):
+            for i in range(len(strip) - 2):
+                if i % 2 == 0:
+                    result.append((strip[i], strip[i + 1], strip[i + 2]))
+                else:
+                    result.append((strip[i + 1], strip[i], strip[i + 2]))
+        return numpy.array(result, dtype=numpy.uint32).reshape((-1, 3))
+
+
+def split_strips(indexes, restart_index=RESTART_INDEX):
+    """Inverse of join_strips()"""
+    indexes = numpy.asarray(indexes)
+    if restart_index is None:
+        return [indexes]
+    cuts = numpy.flatnonzero(indexes == restart_index)
+    starts = numpy.concatenate(([0], cuts + 1))
+    ends = numpy.concatenate((cuts, [len(indexes)]))
+    return [indexes[s:e] for s, e in zip(starts, ends) if e > s]
+
+
+def join_strips(strips, restart_index=RESTART_INDEX):
+    """Concatenate strips into one index array, separated by restart_index"""
+    parts = []
+    for strip in strips:
+        if len(parts) > 0:
+            parts.append((restart_index, ))
+        parts.append(strip)
+    if len(parts) < 1:
+        return numpy.empty((0, ), dtype=numpy.uint32)
+    return numpy.concatenate(parts).astype(numpy.uint32)
+
+
+def index_dtype(vertex_count, has_restart=False):
+    """
+    Smallest unsigned integer type that can index vertex_count vertexes,
+    leaving the largest value free as a restart marker if needed.
+    """
+    for dtype in (numpy.uint8, numpy.uint16, numpy.uint32):
+        capacity = int(numpy.iinfo(dtype).max) + 1
+        if has_restart:
+            capacity -= 1
+        if vertex_count <= capacity:
+            return numpy.dtype(dtype)
+    raise ValueError(f'{vertex_count} vertexes cannot be indexed with 32-bit indexes')
+
+
+class IndexPartition(object):
+    """A subset of a mesh's primitives, indexing a compact local copy of the vertexes they use"""
+    def __init__(self, vertex_ids, indexes):
+        self.vertex_ids = vertex_ids  # global index of each local vertex
+        self.indexes = indexes  # (N, K) local vertex indexes
+
+
+def partition_elements(elements, max_vertexes):
+    """
+    Split (N, K) primitive indexes, e.g. triangles or lines, into consecutive
+    runs that each use no more than max_vertexes distinct vertexes.
+
+    Returns a list of IndexPartition.
+    """
+    elements = numpy.asarray(elements)
+    width = elements.shape[1]
+    if max_vertexes < width:
+        raise ValueError(f'cannot partition primitives of {width} vertexes into {max_vertexes} vertex runs')
+    partitions = []
+    start = 0
+    while start < len(elements):
+        # Count new vertexes per primitive over a window, growing it until the limit is reached
+        window = 2 * max_vertexes
+        while True:
+            flat = elements[start:start + window].reshape(-1)
+            is_first = numpy.zeros(len(flat), dtype=bool)
+            is_first[numpy.unique(flat, return_index=True)[1]] = True
+            vertex_counts = numpy.cumsum(is_first.reshape((-1, width)).sum(axis=1))
+            count = int(numpy.searchsorted(vertex_counts, max_vertexes, side='right'))
+            if count < len(vertex_counts) or start + window >= len(elements):
+                break
+            window *= 2
+        part = elements[start:start + count]
+        vertex_ids, local = numpy.unique(part, return_inverse=True)
+        partitions.append(IndexPartition(vertex_ids, local.reshape(part.shape)))
+        start += count
+    return partitions
+
+
+def triangulate(face_offsets, face_indexes):
+    """(T, 3) uint32 vertex indexes, from fan triangulation of convex polygon faces"""
+    face_indexes = numpy.asarray(face_indexes, dtype=numpy.uint32)
+    return face_indexes[fan_triangulate(face_offsets)].reshape((-1, 3))
+
+
+def triangle_neighbors(triangles):
+    """
+    (T, 3) index of the triangle across edge (k, k+1) of each triangle, or -1.
+
+    Where more than two triangles share an edge, only the first two are linked.
+    """
+    triangles = numpy.asarray(triangles, dtype=numpy.uint64)
+    a = triangles.reshape(-1)
+    b = triangles[:, (1, 2, 0)].reshape(-1)
+    keys = (numpy.minimum(a, b) << numpy.uint64(32)) | numpy.maximum(a, b)
+    order = numpy.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    is_pair = sorted_keys[1:] == sorted_keys[:-1]
+    is_first = numpy.ones(len(sorted_keys), dtype=bool)
+    is_first[1:] = sorted_keys[1:] != sorted_keys[:-1]
+    pairs = numpy.flatnonzero(is_pair & is_first[:-1])
+    neighbor_half_edges = numpy.full(len(keys), -1, dtype=numpy.int64)
+    neighbor_half_edges[order[pairs]] = order[pairs + 1]
+    neighbor_half_edges[order[pairs + 1]] = order[pairs]
+    result = numpy.where(neighbor_half_edges >= 0, neighbor_half_edges // 3, -1)
+    return result.reshape((-1, 3))
+
+
+def stripify(triangles):
+    """
+    Greedy triangle strip builder.
+
+    Starts each strip at the unused triangle with the fewest unused
+    neighbors, and walks across shared edges while it can. Winding of
+    consistently oriented meshes is preserved. Returns a list of index arrays.
+    """
+    triangles = numpy.asarray(triangles, dtype=numpy.uint32)
+    neighbor_array = triangle_neighbors(triangles)
+    neighbors = neighbor_array.tolist()
+    tris = triangles.tolist()
+    used = [False] * len(tris)
+    degree = numpy.count_nonzero(neighbor_array >= 0, axis=1)
+    strips = []
+    for start in numpy.argsort(degree, kind='stable').tolist():
+        if used[start]:
+            continue
+        used[start] = True
+        # Begin on the edge that leads to an unused neighbor, if any
+        a, b, c = tris[start]
+        for k in range(3):
+            n = neighbors[start][(k + 1) % 3]
+            if n >= 0 and not used[n]:
+                a, b, c = tris[start][k], tris[start][(k + 1) % 3], tris[start][(k + 2) % 3]
+                break
+        strip = [a, b, c]
+        current = start
+        while True:
+            x, y = strip[-2], strip[-1]
+            next_tri = -1
+            tri = tris[current]
+            for k in range(3):
+                u, v = tri[k], tri[(k + 1) % 3]
+                if (u == x and v == y) or (u == y and v == x):
+                    n = neighbors[current][k]
+                    if n >= 0 and not used[n]:
+                        next_tri = n
+                    break
+            if next_tri < 0:
+                break
+            third = [w for w in tris[next_tri] if w != x and w != y]
+            if len(third) != 1:
+                break  # degenerate triangle
+            used[next_tri] = True
+            strip.append(third[0])
+            current = next_tri
+        strips.append(numpy.array(strip, dtype=numpy.uint32))
+    return strips
+
+
+def fifo_cache_misses(indexes, cache_size=DEFAULT_CACHE_SIZE, restart_index=None):
+    """Number of vertex shader invocations for a FIFO post-transform vertex cache"""
+    cache = deque()
+    cached = set()
+    misses = 0
+    for i in numpy.asarray(indexes).reshape(-1).tolist():
+        if i == restart_index:
+            continue
+        if i in cached:
+            continue
+        misses += 1
+        cache.append(i)
+        cached.add(i)
+        if len(cache) > cache_size:
+            cached.discard(cache.popleft())
+    return misses
+
+
+def build_primitives(face_offsets, face_indexes, allow_strips=True, cache_size=DEFAULT_CACHE_SIZE):
+    """
+    Triangulate polygon faces, and choose between a triangle list and
+    restart-separated triangle strips.
+
+    Each candidate is scored by its simulated vertex cache misses plus
+    INDEX_COST per index, and the cheaper one wins.
+    """
+    triangles = triangulate(face_offsets, face_indexes)
+    best = MeshPrimitives(TRIANGLES, triangles.reshape(-1))
+    if not allow_strips or len(triangles) < 2:
+        return best
+    strips = MeshPrimitives(TRIANGLE_STRIP, join_strips(stripify(triangles)), RESTART_INDEX)
+    if len(strips) >= len(best):
+        return best
+    list_cost = fifo_cache_misses(best.indexes, cache_size) + INDEX_COST * len(best)
+    strip_cost = fifo_cache_misses(strips.indexes, cache_size, RESTART_INDEX) + INDEX_COST * len(strips)
+    if strip_cost < list_cost:
+        return strips
+    return best
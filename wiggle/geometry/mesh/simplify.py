@@ -0,0 +1,197 @@
+"""
+Quadric error metric mesh simplification, after Garland and Heckbert,
+"Surface Simplification Using Quadric Error Metrics", 1997.
+
+Each vertex carries a quadric summing the squared distances to the planes
+of its original triangles. The edge whose collapse adds the least error
+is collapsed repeatedly, so one pass can take snapshots at several target
+triangle counts. Plain python floats are used in the collapse loop, which
+is much faster than numpy for the handful of values touched per collapse.
+"""
+
+import heapq
+import math
+
+import numpy
+
+from wiggle.geometry.mesh.adjacency import unique_edges
+from wiggle.geometry.mesh.primitives import triangle_neighbors
+
+BOUNDARY_WEIGHT = 100.0  # quadric weight keeping open mesh borders in place
+
+# Upper triangle of the symmetric 4x4 plane quadric, in the order stored per vertex
+_QUADRIC_ROWS = (0, 0, 0, 0, 1, 1, 1, 2, 2, 3)
+_QUADRIC_COLUMNS = (0, 1, 2, 3, 1, 2, 3, 2, 3, 3)
+
+
+class SimplifiedMesh(object):
+    """One simplification result, with vertexes taken from the original mesh"""
+    def __init__(self, positions, triangles, vertex_ids, error):
+        self.positions = positions  # (N, 3) float32
+        self.triangles = triangles  # (T, 3) uint32
+        self.vertex_ids = vertex_ids  # original vertex index of each vertex
+        self.error = error  # approximate geometric error, in model units
+
+    def __repr__(self):
+        return f'SimplifiedMesh({len(self.triangles)} triangles, error={self.error:.3g})'
+
+
+def _plane_quadrics(planes, weights=None):
+    """(N, 10) quadric coefficients of (N, 4) planes"""
+    result = planes[:, _QUADRIC_ROWS] * planes[:, _QUADRIC_COLUMNS]
+    if weights is not None:
+        result *= weights[:, None]
+    return result
+
+
+def vertex_quadrics(positions, triangles, boundary_weight=BOUNDARY_WEIGHT):
+    """(V, 10) summed plane quadrics of the triangles around each vertex"""
+    positions = numpy.asarray(positions, dtype=numpy.float64)
+    triangles = numpy.asarray(triangles, dtype=numpy.int64).reshape((-1, 3))
+    quadrics = numpy.zeros((len(positions), 10))
+    if len(triangles) < 1:
+        return quadrics
+    p = positions[triangles]
+    normals = numpy.cross(p[:, 1] - p[:, 0], p[:, 2] - p[:, 0])
+    lengths = numpy.linalg.norm(normals, axis=1)
+    normals /= numpy.maximum(lengths, 1e-30)[:, None]
+    planes = numpy.concatenate((normals, -(normals * p[:, 0]).sum(axis=1)[:, None]), axis=1)
+    face_quadrics = _plane_quadrics(planes)
+    for k in range(3):
+        numpy.add.at(quadrics, triangles[:, k], face_quadrics)
+    # Planes through each border edge, perpendicular to its triangle, resist moving the border
+    triangle_index, corner = numpy.nonzero(triangle_neighbors(triangles) < 0)
+    if len(triangle_index) > 0 and boundary_weight > 0:
+        u = p[triangle_index, corner]
+        v = p[triangle_index, (corner + 1) % 3]
+        normals = numpy.cross(v - u, normals[triangle_index])
+        normals /= numpy.maximum(numpy.linalg.norm(normals, axis=1), 1e-30)[:, None]
+        planes = numpy.concatenate((normals, -(normals * u).sum(axis=1)[:, None]), axis=1)
+        border_quadrics = _plane_quadrics(planes, numpy.full(len(planes), boundary_weight))
+        numpy.add.at(quadrics, triangles[triangle_index, corner], border_quadrics)
+        numpy.add.at(quadrics, triangles[triangle_index, (corner + 1) % 3], border_quadrics)
+    return quadrics
+
+
+def _quadric_error(q, x, y, z):
+    a2, ab, ac, ad, b2, bc, bd, c2, cd, d2 = q
+    return (a2*x*x + 2*ab*x*y + 2*ac*x*z + 2*ad*x + b2*y*y + 2*bc*y*z + 2*bd*y
+            + c2*z*z + 2*cd*z + d2)
+
+
+def _collapse_target(q, pa, pb):
+    """Cheapest position for the merged vertex of an edge, and its error"""
+    a2, ab, ac, ad, b2, bc, bd, c2, cd, d2 = q
+    det = a2*(b2*c2 - bc*bc) - ab*(ab*c2 - bc*ac) + ac*(ab*bc - b2*ac)
+    if abs(det) > 1e-10:
+        x = (-ad*(b2*c2 - bc*bc) + ab*(bd*c2 - bc*cd) - ac*(bd*bc - b2*cd)) / det
+        y = (a2*(-bd*c2 + cd*bc) + ad*(ab*c2 - bc*ac) + ac*(-ab*cd + bd*ac)) / det
+        z = (a2*(-b2*cd + bc*bd) - ab*(-ab*cd + bd*ac) - ad*(ab*bc - b2*ac)) / det
+        # Nearly flat neighborhoods can put the optimum far away; stay near the edge
+        mx, my, mz = (pa[0] + pb[0]) / 2, (pa[1] + pb[1]) / 2, (pa[2] + pb[2]) / 2
+        reach = (pa[0] - pb[0])**2 + (pa[1] - pb[1])**2 + (pa[2] - pb[2])**2
+        if (x - mx)**2 + (y - my)**2 + (z - mz)**2 <= reach:
+            return _quadric_error(q, x, y, z), (x, y, z)
+    best = None
+    for p in (pa, pb, ((pa[0] + pb[0]) / 2, (pa[1] + pb[1]) / 2, (pa[2] + pb[2]) / 2)):
+        error = _quadric_error(q, *p)
+        if best is None or error < best[0]:
+            best = (error, tuple(p))
+    return best
+
+
+def _normal(a, b, c):
+    ux, uy, uz = b[0] - a[0], b[1] - a[1], b[2] - a[2]
+    vx, vy, vz = c[0] - a[0], c[1] - a[1], c[2] - a[2]
+    return uy*vz - uz*vy, uz*vx - ux*vz, ux*vy - uy*vx
+
+
+def _flips(triangles, positions, moving, target):
+    """Whether moving one vertex of any of these triangles to target would turn it over"""
+    for t in triangles:
+        before = [positions[v] for v in t]
+        after = [target if v == moving else positions[v] for v in t]
+        n0 = _normal(*before)
+        n1 = _normal(*after)
+        if n0[0]*n1[0] + n0[1]*n1[1] + n0[2]*n1[2] <= 0:
+            return True
+    return False
+
+
+def simplify(positions, triangles, target_triangle_counts, boundary_weight=BOUNDARY_WEIGHT):
+    """
+    Simplify a triangle mesh by edge collapse.
+
+    Returns one SimplifiedMesh per target triangle count, in decreasing order
+    of triangle count. Targets that cannot be reached without turning
+    triangles over, or without merging disconnected parts, get the
+    simplest mesh that was reached.
+    """
+    positions = numpy.asarray(positions, dtype=numpy.float64)
+    triangles = numpy.asarray(triangles, dtype=numpy.int64).reshape((-1, 3))
+    targets = sorted(target_triangle_counts, reverse=True)
+    quadrics = vertex_quadrics(positions, triangles, boundary_weight).tolist()
+    pos = positions.tolist()
+    tris = triangles.tolist()
+    tri_alive = [t[0] != t[1] and t[1] != t[2] and t[2] != t[0] for t in tris]
+    live_count = sum(tri_alive)
+    vertex_tris = [[] for _ in pos]
+    for t, (a, b, c) in enumerate(tris):
+        if tri_alive[t]:
+            vertex_tris[a].append(t)
+            vertex_tris[b].append(t)
+            vertex_tris[c].append(t)
+    version = [0] * len(pos)
+
+    def collapse(a, b):
+        q = [x + y for x, y in zip(quadrics[a], quadrics[b])]
+        error, target = _collapse_target(q, pos[a], pos[b])
+        return max(error, 0.0), a, b, version[a], version[b], target
+
+    offsets = numpy.arange(0, 3 * len(triangles) + 1, 3)
+    heap = [collapse(a, b) for a, b in unique_edges(offsets, triangles.reshape(-1))[0].tolist()]
+    heapq.heapify(heap)
+    max_error = 0.0
+    results = []
+    while len(targets) > 0:
+        if live_count <= targets[0] or len(heap) < 1:
+            results.append(_snapshot(pos, tris, tri_alive, math.sqrt(max_error)))
+            targets.pop(0)
+            continue
+        error, a, b, version_a, version_b, target = heapq.heappop(heap)
+        if version[a] != version_a or version[b] != version_b:
+            continue  # stale entry, from before either vertex last moved
+        around_a = [t for t in vertex_tris[a] if tri_alive[t]]
+        around_b = [t for t in vertex_tris[b] if tri_alive[t]]
+        shared = set(around_a).intersection(around_b)
+        if len(shared) < 1:
+            continue
+        kept_a = [t for t in around_a if t not in shared]
+        kept_b = [t for t in around_b if t not in shared]
+        if _flips([tris[t] for t in kept_a], pos, a, target) or _flips([tris[t] for t in kept_b], pos, b, target):
+            continue
+        # Merge b into a
+        pos[a] = target
+        quadrics[a] = [x + y for x, y in zip(quadrics[a], quadrics[b])]
+        for t in shared:
+            tri_alive[t] = False
+            live_count -= 1
+        for t in kept_b:
+            tris[t] = [a if v == b else v for v in tris[t]]
+        vertex_tris[a] = kept_a + kept_b
+        vertex_tris[b] = []
+        version[a] += 1
+        version[b] += 1
+        max_error = max(max_error, error)
+        neighbors = set(v for t in vertex_tris[a] for v in tris[t])
+        neighbors.discard(a)
+        for n in neighbors:
+            heapq.heappush(heap, collapse(a, n))
+    return results
+
+
+def _snapshot(pos, tris, tri_alive, error):
+    triangles = numpy.array(tris, dtype=numpy.int64).reshape((-1, 3))[numpy.array(tri_alive, dtype=bool)]
+    vertex_ids, local = numpy.unique(triangles, return_inverse=True)
+    positions = numpy.array([pos[v] for v in vertex_ids.tolist()], dtype=numpy.float32).reshape((-1, 3))
+    return SimplifiedMesh(positions, local.reshape((-1, 3)).astype(numpy.uint32), vertex_ids, error)
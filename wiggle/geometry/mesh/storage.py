@@ -0,0 +1,177 @@
+"""
+Contiguous, growable numpy storage used by Mesh.
+"""
+
+from collections.abc import Mapping, Sequence
+
+import numpy
+
+
+class GrowableArray(object):
+    """
+    A numpy array with amortized O(1) append, like a python list.
+
+    The live contents are always the contiguous view self.array; spare
+    capacity beyond it is never exposed.
+    """
+    def __init__(self, dtype, width=None, capacity=0):
+        self.dtype = numpy.dtype(dtype)
+        self.width = width
+        self._data = numpy.empty(self._shape(capacity), dtype=self.dtype)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _shape(self, count):
+        if self.width is None:
+            return (count, )
+        return count, self.width
+
+    @property
+    def array(self):
+        return self._data[:self._size]
+
+    @property
+    def capacity(self):
+        return len(self._data)
+
+    def append(self, values):
+        """Append rows, returning the index of the first new row"""
+        values = numpy.asarray(values, dtype=self.dtype).reshape(self._shape(-1))
+        start = self._size
+        end = start + len(values)
+        self.reserve(end)
+        self._data[start:end] = values
+        self._size = end
+        return start
+
+    def clear(self):
+        self._size = 0
+
+    def reserve(self, capacity):
+        if capacity <= len(self._data) and self._data.flags.writeable:
+            return
+        if capacity > len(self._data):
+            capacity = max(capacity, 2 * len(self._data), 16)
+        else:
+            capacity = len(self._data)
+        data = numpy.empty(self._shape(capacity), dtype=self.dtype)
+        data[:self._size] = self._data[:self._size]
+        self._data = data
+
+    def set(self, values):
+        """Replace the contents, adopting values without a copy if it already has the right type"""
+        values = numpy.asarray(values, dtype=self.dtype)
+        if values.size == 0:
+            values = values.reshape(self._shape(0))
+        self._data = values.reshape(self._shape(-1))
+        self._size = len(self._data)
+
+    def shrink(self):
+        """Release spare capacity"""
+        if len(self._data) > self._size:
+            self._data = self._data[:self._size].copy()
+
+
+class RaggedArray(object):
+    """
+    Variable length rows of integers, stored CSR-style as one flat index array
+    plus row offsets, so row i is indexes[offsets[i]:offsets[i+1]].
+    """
+    def __init__(self, dtype=numpy.uint32):
+        self._offsets = GrowableArray(numpy.int64)
+        self._offsets.append((0, ))
+        self._indexes = GrowableArray(dtype)
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    @property
+    def offsets(self):
+        return self._offsets.array
+
+    @property
+    def indexes(self):
+        return self._indexes.array
+
+    def append(self, row):
+        """Append one row, returning its row index"""
+        self._indexes.append(row)
+        self._offsets.append((len(self._indexes), ))
+        return len(self) - 1
+
+    def extend(self, rows):
+        """Append a sequence of rows, or an (N, K) array of N rows of K indexes"""
+        if isinstance(rows, numpy.ndarray) and rows.ndim == 2:
+            counts = numpy.full(len(rows), rows.shape[1], dtype=numpy.int64)
+            self.extend_flat(counts, rows.reshape(-1))
+            return
+        for row in rows:
+            self.append(row)
+
+    def extend_flat(self, counts, indexes):
+        """Append many rows at once, from per-row counts and the concatenated indexes"""
+        base = len(self._indexes)
+        self._indexes.append(indexes)
+        self._offsets.append(base + numpy.cumsum(counts, dtype=numpy.int64))
+
+    def clear(self):
+        self._offsets.clear()
+        self._offsets.append((0, ))
+        self._indexes.clear()
+
+    def set(self, offsets, indexes):
+        self._offsets.set(offsets)
+        self._indexes.set(indexes)
+
+    def counts(self):
+        return numpy.diff(self.offsets)
+
+
+class RaggedRows(Sequence):
+    """Read-only list-like view of a RaggedArray, one numpy row per item"""
+    def __init__(self, ragged):
+        self.ragged = ragged
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self[i] for i in range(*item.indices(len(self)))]
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError('row index out of range')
+        offsets = self.ragged.offsets
+        return self.ragged.indexes[offsets[item]:offsets[item + 1]]
+
+    def __len__(self):
+        return len(self.ragged)
+
+    @property
+    def offsets(self):
+        return self.ragged.offsets
+
+    @property
+    def indexes(self):
+        return self.ragged.indexes
+
+
+class VertexNormalMap(Mapping):
+    """Read-only dict-like view from vertex index to normal vector"""
+    def __init__(self, normal_indexes, normals):
+        self.normal_indexes = normal_indexes
+        self.normals = normals
+
+    def __getitem__(self, vertex):
+        if not 0 <= vertex < len(self.normal_indexes):
+            raise KeyError(vertex)
+        n = self.normal_indexes[vertex]
+        if n < 0:
+            raise KeyError(vertex)
+        return self.normals[n]
+
+    def __iter__(self):
+        return iter(numpy.flatnonzero(self.normal_indexes >= 0).tolist())
+
+    def __len__(self):
+        return int(numpy.count_nonzero(self.normal_indexes >= 0))
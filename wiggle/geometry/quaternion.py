@@ -0,0 +1,200 @@
+"""
+Unit quaternion rotations.
+
+Quaternions are stored (w, x, y, z). The Quaternion class holds one
+rotation as python floats, which is fastest for interactive updates; the
+module functions work on (..., 4) numpy arrays of many rotations at once.
+Rotation matrices follow wiggle.geometry.matrix, transforming column
+vectors.
+"""
+
+import math
+
+import numpy
+
+
+def quaternion_product(a, b):
+    """Batched Hamilton product a * b, which rotates by b first, then a"""
+    a = numpy.asarray(a, dtype=numpy.float64)
+    b = numpy.asarray(b, dtype=numpy.float64)
+    aw, ax, ay, az = numpy.moveaxis(a, -1, 0)
+    bw, bx, by, bz = numpy.moveaxis(b, -1, 0)
+    return numpy.stack((
+        aw*bw - ax*bx - ay*by - az*bz,
+        aw*bx + ax*bw + ay*bz - az*by,
+        aw*by - ax*bz + ay*bw + az*bx,
+        aw*bz + ax*by - ay*bx + az*bw), axis=-1)
+
+
+def normalize_quaternions(q):
+    """Scale (..., 4) quaternions to unit length"""
+    q = numpy.asarray(q, dtype=numpy.float64)
+    return q / numpy.linalg.norm(q, axis=-1, keepdims=True)
+
+
+def conjugate_quaternions(q):
+    """Inverse rotations of (..., 4) unit quaternions"""
+    return numpy.asarray(q, dtype=numpy.float64) * (1, -1, -1, -1)
+
+
+def axis_angle_quaternions(axes, angles):
+    """Rotations by angles, in radians, about (..., 3) axes"""
+    axes = numpy.asarray(axes, dtype=numpy.float64)
+    half = numpy.asarray(angles, dtype=numpy.float64)[..., None] / 2
+    axes = axes / numpy.linalg.norm(axes, axis=-1, keepdims=True)
+    xyz = numpy.sin(half) * axes
+    w = numpy.broadcast_to(numpy.cos(half), xyz.shape[:-1] + (1, ))
+    return numpy.concatenate((w, xyz), axis=-1)
+
+
+def quaternion_matrices(q, out=None):
+    """(..., 4, 4) float32 rotation matrices of (..., 4) unit quaternions"""
+    w, x, y, z = numpy.moveaxis(numpy.asarray(q, dtype=numpy.float64), -1, 0)
+    shape = w.shape + (4, 4)
+    m = numpy.empty(shape, dtype=numpy.float32) if out is None else out
+    m[..., 0, 0] = 1 - 2*(y*y + z*z)
+    m[..., 0, 1] = 2*(x*y - w*z)
+    m[..., 0, 2] = 2*(x*z + w*y)
+    m[..., 1, 0] = 2*(x*y + w*z)
+    m[..., 1, 1] = 1 - 2*(x*x + z*z)
+    m[..., 1, 2] = 2*(y*z - w*x)
+    m[..., 2, 0] = 2*(x*z - w*y)
+    m[..., 2, 1] = 2*(y*z + w*x)
+    m[..., 2, 2] = 1 - 2*(x*x + y*y)
+    m[..., :3, 3] = 0
+    m[..., 3, :] = (0, 0, 0, 1)
+    return m
+
+
+def matrix_quaternions(matrices):
+    """(..., 4) unit quaternions of (..., 3, 3) or (..., 4, 4) rotation matrices"""
+    m = numpy.asarray(matrices, dtype=numpy.float64)[..., :3, :3]
+    trace = m[..., 0, 0] + m[..., 1, 1] + m[..., 2, 2]
+    # Each candidate is well conditioned where its leading component is largest
+    candidates = numpy.stack((
+        numpy.stack((1 + trace, m[..., 2, 1] - m[..., 1, 2], m[..., 0, 2] - m[..., 2, 0], m[..., 1, 0] - m[..., 0, 1]), -1),
+        numpy.stack((m[..., 2, 1] - m[..., 1, 2], 1 + m[..., 0, 0] - m[..., 1, 1] - m[..., 2, 2],
+                     m[..., 0, 1] + m[..., 1, 0], m[..., 0, 2] + m[..., 2, 0]), -1),
+        numpy.stack((m[..., 0, 2] - m[..., 2, 0], m[..., 0, 1] + m[..., 1, 0],
+                     1 - m[..., 0, 0] + m[..., 1, 1] - m[..., 2, 2], m[..., 1, 2] + m[..., 2, 1]), -1),
+        numpy.stack((m[..., 1, 0] - m[..., 0, 1], m[..., 0, 2] + m[..., 2, 0],
+                     m[..., 1, 2] + m[..., 2, 1], 1 - m[..., 0, 0] - m[..., 1, 1] + m[..., 2, 2]), -1),
+    ), axis=-2)
+    diagonal = numpy.stack((trace, m[..., 0, 0], m[..., 1, 1], m[..., 2, 2]), -1)
+    best = numpy.take_along_axis(candidates, numpy.argmax(diagonal, axis=-1)[..., None, None], axis=-2)[..., 0, :]
+    q = normalize_quaternions(best)
+    return q * numpy.where(q[..., :1] < 0, -1, 1)
+
+
+def slerp(a, b, t):
+    """Spherical linear interpolation from (..., 4) unit quaternions a to b, by fractions t"""
+    a = numpy.asarray(a, dtype=numpy.float64)
+    b = numpy.asarray(b, dtype=numpy.float64)
+    t = numpy.asarray(t, dtype=numpy.float64)[..., None]
+    cos_theta = (a * b).sum(axis=-1, keepdims=True)
+    # q and -q are the same rotation; take the short way around
+    b = numpy.where(cos_theta < 0, -b, b)
+    cos_theta = numpy.minimum(numpy.abs(cos_theta), 1.0)
+    theta = numpy.arccos(cos_theta)
+    sin_theta = numpy.sin(theta)
+    is_close = sin_theta < 1e-6
+    safe_sin = numpy.where(is_close, 1.0, sin_theta)
+    wa = numpy.where(is_close, 1 - t, numpy.sin((1 - t) * theta) / safe_sin)
+    wb = numpy.where(is_close, t, numpy.sin(t * theta) / safe_sin)
+    return normalize_quaternions(wa * a + wb * b)
+
+
+def rotate_vectors(q, vectors):
+    """Rotate (..., 3) vectors by (..., 4) unit quaternions"""
+    q = numpy.asarray(q, dtype=numpy.float64)
+    vectors = numpy.asarray(vectors, dtype=numpy.float64)
+    w = q[..., :1]
+    u = q[..., 1:]
+    t = 2 * numpy.cross(u, vectors)
+    return vectors + w * t + numpy.cross(u, t)
+
+
+class Quaternion(object):
+    """One rotation, as a unit quaternion of python floats"""
+    __slots__ = ('w', 'x', 'y', 'z')
+
+    def __init__(self, w=1.0, x=0.0, y=0.0, z=0.0):
+        self.w = float(w)
+        self.x = float(x)
+        self.y = float(y)
+        self.z = float(z)
+
+    @classmethod
+    def from_axis_angle(cls, axis, radians):
+        x, y, z = (float(a) for a in axis)
+        length = math.sqrt(x*x + y*y + z*z)
+        if length == 0:
+            return cls()
+        s = math.sin(radians / 2) / length
+        return cls(math.cos(radians / 2), s*x, s*y, s*z)
+
+    @classmethod
+    def from_matrix(cls, matrix):
+        """Rotation of a 3x3 or 4x4 rotation matrix"""
+        return cls(*matrix_quaternions(numpy.asarray(matrix)).tolist())
+
+    def __iter__(self):
+        return iter((self.w, self.x, self.y, self.z))
+
+    def __repr__(self):
+        return f'Quaternion({self.w}, {self.x}, {self.y}, {self.z})'
+
+    def __mul__(self, rhs):
+        """Composition: rotate by rhs, then by self"""
+        aw, ax, ay, az = self.w, self.x, self.y, self.z
+        bw, bx, by, bz = rhs.w, rhs.x, rhs.y, rhs.z
+        return Quaternion(
+            aw*bw - ax*bx - ay*by - az*bz,
+            aw*bx + ax*bw + ay*bz - az*by,
+            aw*by - ax*bz + ay*bw + az*bx,
+            aw*bz + ax*by - ay*bx + az*bw)
+
+    def array(self):
+        return numpy.array((self.w, self.x, self.y, self.z))
+
+    def conjugate(self):
+        """Inverse rotation"""
+        return Quaternion(self.w, -self.x, -self.y, -self.z)
+
+    def normalized(self):
+        """Same rotation with rounding drift removed, and w >= 0"""
+        length = math.sqrt(self.w*self.w + self.x*self.x + self.y*self.y + self.z*self.z)
+        if self.w < 0:
+            length = -length
+        return Quaternion(self.w / length, self.x / length, self.y / length, self.z / length)
+
+    def matrix3(self):
+        """Rotation matrix, as nested tuples"""
+        w, x, y, z = self.w, self.x, self.y, self.z
+        return (
+            (1 - 2*(y*y + z*z), 2*(x*y - w*z), 2*(x*z + w*y)),
+            (2*(x*y + w*z), 1 - 2*(x*x + z*z), 2*(y*z - w*x)),
+            (2*(x*z - w*y), 2*(y*z + w*x), 1 - 2*(x*x + y*y)))
+
+    def matrix4(self, out=None):
+        """4x4 float32 rotation matrix, optionally written into out"""
+        m = numpy.empty((4, 4), dtype=numpy.float32) if out is None else out
+        m[:3, :3] = self.matrix3()
+        m[:3, 3] = 0
+        m[3, :] = (0, 0, 0, 1)
+        return m
+
+    def rotate(self, vector):
+        """Rotate one 3-vector, returning a tuple"""
+        w, x, y, z = self.w, self.x, self.y, self.z
+        vx, vy, vz = vector
+        # t = 2 * cross(q.xyz, v); v' = v + w * t + cross(q.xyz, t)
+        tx = 2 * (y*vz - z*vy)
+        ty = 2 * (z*vx - x*vz)
+        tz = 2 * (x*vy - y*vx)
+        return (vx + w*tx + y*tz - z*ty,
+                vy + w*ty + z*tx - x*tz,
+                vz + w*tz + x*ty - y*tx)
+
+    def slerp(self, other, t):
+        return Quaternion(*slerp(self.array(), other.array(), t).tolist())
@@ -0,0 +1,14 @@
+#version 430
+
+/*
+  Vertex shader.
+  Applies only the per-instance model matrix, leaving the rest for the
+  per_face_normals geometry shader.
+ */
+
+layout(location = 0) in vec3 position_in_world;
+layout(location = 3) in mat4 instance_model; // occupies locations 3 through 6
+
+void main() {
+	gl_Position = instance_model * vec4(position_in_world, 1);
+}
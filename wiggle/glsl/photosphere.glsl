@@ -1,21 +1,87 @@
+// Whether the rows of the image go top down, as in some KTX files, from BaseMaterial.set_image_orientation()
+uniform bool image_top_down = false;
 
-vec4 equirect_color(vec3 dir, sampler2D image)
+// Texture coordinates of an image, with v flipped where its rows go top down
+vec2 image_coord(vec2 tex_coord)
+{
+    return image_top_down ? vec2(tex_coord.x, 1.0 - tex_coord.y) : tex_coord;
+}
+
+vec2 equirect_coord(vec3 dir)
 {
     const float PI = 3.1415926535897932384626433832795;
     float longitude = 0.5 * atan(dir.x, -dir.z) / PI + 0.5; // range [0-1]
     float r = length(dir.xz);
     float latitude = atan(dir.y, r) / PI + 0.5; // range [0-1]
-    vec2 tex_coord = vec2(longitude, latitude);
+    return vec2(longitude, latitude);
+}
+
+// Screen space gradients of equirectangular texture coordinates, across the longitude seam
+void equirect_gradients(vec2 tex_coord, out vec2 dpdx, out vec2 dpdy)
+{
+    dpdx = dFdx(tex_coord);
+    dpdy = dFdy(tex_coord);
+    if (dpdx.x > 0.5) dpdx.x -= 1; // use "repeat" wrapping on gradient
+    if (dpdx.x < -0.5) dpdx.x += 1;
+    if (dpdy.x > 0.5) dpdy.x -= 1; // use "repeat" wrapping on gradient
+    if (dpdy.x < -0.5) dpdy.x += 1;
+}
+
+vec4 equirect_color(vec3 dir, sampler2D image)
+{
+    vec2 tex_coord = image_coord(equirect_coord(dir));
 
     // Use explicit gradients, to preserve anisotropic filtering during mipmap lookup
-    vec2 dpdx = dFdx(tex_coord);
-    vec2 dpdy = dFdy(tex_coord);
-    if (true) {
-        if (dpdx.x > 0.5) dpdx.x -= 1; // use "repeat" wrapping on gradient
-        if (dpdx.x < -0.5) dpdx.x += 1;
-        if (dpdy.x > 0.5) dpdy.x -= 1; // use "repeat" wrapping on gradient
-        if (dpdy.x < -0.5) dpdy.x += 1;
-    }
+    vec2 dpdx, dpdy;
+    equirect_gradients(tex_coord, dpdx, dpdy);
 
     return textureGrad(image, tex_coord, dpdx, dpdy);
 }
+
+#ifdef VIRTUAL_TEXTURE
+// Tiled panorama, from wiggle.material.virtual_texture.VirtualTexture.
+// image is the tile cache texture; tile_table maps tiles to its slots.
+#define MAX_TILE_LEVELS 16
+
+layout(binding = 1) uniform usampler2D tile_table;
+layout(location = 8) uniform int tile_level_count = 1;
+layout(location = 9) uniform ivec2 tile_layout = ivec2(256, 1); // tile size and border, in texels
+layout(location = 10) uniform ivec4 tile_levels[MAX_TILE_LEVELS]; // width, height and page table row of each level
+
+vec4 tile_color(vec2 tex_coord, int level, sampler2D image)
+{
+    vec2 image_coord = vec2(tex_coord.x, 1.0 - tex_coord.y); // tile rows go top down
+    ivec2 level_size = tile_levels[level].xy;
+    ivec2 tile = min(ivec2(image_coord * level_size) / tile_layout.x, (level_size - 1) / tile_layout.x);
+    uvec4 entry = texelFetch(tile_table, ivec2(tile.x, tile_levels[level].z + tile.y), 0);
+    if (entry.a == 0u)
+        return vec4(0.5, 0.5, 0.5, 1); // nothing loaded yet
+    int resident_level = int(entry.b);
+    if (resident_level != level) {
+        // A coarser ancestor, standing in until this tile loads
+        tile >>= resident_level - level;
+        level_size = tile_levels[resident_level].xy;
+    }
+    float tile_size = float(tile_layout.x);
+    float border = float(tile_layout.y);
+    vec2 in_tile = clamp(image_coord * level_size - tile * tile_size, vec2(0), vec2(tile_size + border - 0.5));
+    vec2 page_corner = vec2(entry.xy) * (tile_size + 2 * border) + border;
+    return textureLod(image, (page_corner + in_tile) / textureSize(image, 0), 0);
+}
+
+vec4 virtual_equirect_color(vec3 dir, sampler2D image)
+{
+    vec2 tex_coord = equirect_coord(dir);
+    vec2 dpdx, dpdy;
+    equirect_gradients(tex_coord, dpdx, dpdy);
+    // Blend the two nearest levels, as trilinear filtering would
+    vec2 level0_size = vec2(tile_levels[0].xy);
+    float lod = log2(max(length(dpdx * level0_size), length(dpdy * level0_size)));
+    lod = clamp(lod, 0.0, float(tile_level_count - 1));
+    int level = int(floor(lod));
+    vec4 color = tile_color(tex_coord, level, image);
+    if (level + 1 < tile_level_count)
+        color = mix(color, tile_color(tex_coord, level + 1, image), fract(lod));
+    return color;
+}
+#endif
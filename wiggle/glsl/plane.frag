@@ -67,9 +67,11 @@ vec4 checker_color_antialias(in vec2 uv)
     return mix(edge_color, point_color, a);
 }
 
+#pragma include "wiggle/glsl/photosphere.glsl"
+
 vec4 image_color(vec2 tc)
 {
-    return texture(image, tc);
+    return texture(image, image_coord(tc));
 }
 
 vec4 solid_color(vec2 tc)
@@ -77,8 +79,6 @@ vec4 solid_color(vec2 tc)
     return vec4(plane_color, 1);
 }
 
-#pragma include "wiggle/glsl/photosphere.glsl"
-
 vec4 equirect()
 {
     vec4 p = intersection_w; // avoid subtraction problem with negative w
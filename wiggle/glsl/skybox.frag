@@ -1,6 +1,10 @@
 #version 430
 
+#ifdef CUBE_MAP
+uniform samplerCube image;
+#else
 uniform sampler2D image;
+#endif
 
 in vec4 position_w;
 in vec4 cam_pos_w;
@@ -21,5 +25,11 @@ vec4 homog_subtract(vec4 a, vec4 b)
 void main()
 {
     vec4 view_direction = homog_subtract(position_w, cam_pos_w);
+#if defined(CUBE_MAP)
+    frag_color = texture(image, view_direction.xyz);
+#elif defined(VIRTUAL_TEXTURE)
+    frag_color = virtual_equirect_color(normalize(view_direction.xyz), image);
+#else
     frag_color = equirect_color(normalize(view_direction.xyz), image);
+#endif
 }
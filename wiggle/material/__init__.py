@@ -1,14 +1,25 @@
 from OpenGL import GL
 
 from wiggle.render.base import AutoInitRenderer
+from wiggle.render.gl_state import gl_state
 from wiggle.material.shader import ShaderProgram
 
 
 class BaseMaterial(AutoInitRenderer):
+    has_shader = True  # False for materials with no shader stages, whose actors draw nothing
+
     def __init__(self):
         super().__init__()
         self.shader = None
+        self.shader_program = None
         self.mvp_matrices = dict()
+        # Uniform locations of the standard matrices, or None where the shader does not use them
+        self.projection_location = None
+        self.view_location = None
+        self.model_location = None
+        self.model_view_location = None
+        # Uniform location of the image_top_down flag of photosphere.glsl, or -1 where the shader does not use it
+        self.image_top_down_location = -1
 
     def _query_matrices(self):
         """Note which model, view, projection, etc. matrices are needed to run this shader"""
@@ -22,6 +33,10 @@ class BaseMaterial(AutoInitRenderer):
                 continue
             location = GL.glGetUniformLocation(self.shader, name)
             self.mvp_matrices[name] = location
+        self.projection_location = self.mvp_matrices.get('projection')
+        self.view_location = self.mvp_matrices.get('view')
+        self.model_location = self.mvp_matrices.get('model')
+        self.model_view_location = self.mvp_matrices.get('model_view')
 
     def create_vertex_shader(self):
         return None
@@ -40,12 +55,45 @@ class BaseMaterial(AutoInitRenderer):
                       self.create_vertex_shader()):
             if stage is not None:
                 stages.append(stage)
-        self.shader = int(ShaderProgram(stages))
+        self.shader_program = ShaderProgram(stages)
+        self.shader = int(self.shader_program)
         self._query_matrices()
+        self.image_top_down_location = GL.glGetUniformLocation(self.shader, 'image_top_down')
+
+    def dispose_gl(self):
+        if self.shader_program is not None:
+            self.shader_program.dispose_gl()
+            self.shader_program = None
+        self.shader = None
+        super().dispose_gl()
 
     def display_gl(self, *args, **kwargs):
         super().display_gl(*args, **kwargs)
-        GL.glUseProgram(self.shader)
+        gl_state.use_program(self.shader)
+
+    def set_camera_matrices(self, camera):
+        """Upload the projection and view matrices, which stay set in the program until the camera changes"""
+        if self.projection_location is not None:
+            gl_state.uniform_matrix4(self.projection_location, camera.projection)
+        if self.view_location is not None:
+            gl_state.uniform_matrix4(self.view_location, camera.view_matrix)
+
+    def set_model_matrices(self, actor, camera):
+        if self.model_location is not None:
+            gl_state.uniform_matrix4(self.model_location, actor.world_matrix)
+        if self.model_view_location is not None:
+            gl_state.uniform_matrix4(self.model_view_location, actor.model_view_matrix(camera))
+
+    def set_image_orientation(self, texture):
+        """Tell the shader which way the rows of texture go, where it samples the image with photosphere.glsl"""
+        if self.image_top_down_location != -1:
+            GL.glUniform1i(self.image_top_down_location, int(texture.is_top_down))
+
+    def sort_key(self):
+        """(program, texture), for ordering draws to minimize state changes"""
+        texture = getattr(self, 'texture', None)
+        texture_id = 0 if texture is None or texture.texture_id is None else int(texture.texture_id)
+        return int(self.shader or 0), texture_id
 
     def primitive(self):
         return GL.GL_TRIANGLES
\ No newline at end of file
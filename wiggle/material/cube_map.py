@@ -0,0 +1,312 @@
+"""
+Conversion of equirectangular panoramas to cube maps, with an on-disk cache.
+
+A cube map sky needs one texture lookup per pixel, where the
+equirectangular sky computes two arctangents and fixes up gradients, and
+its texels are spread evenly, where equirectangular texels crowd together
+toward the poles. Conversion resamples the panorama on the CPU, once, and
+caches the faces.
+
+Cache file layout:
+    8 bytes   magic b'WGLCUBE\0'
+    4 bytes   format version, little-endian uint32
+    4 bytes   header length, little-endian uint32
+    header    utf-8 JSON: source image hash, face size and supersampling
+    faces     (6, size, size, 4) uint8 RGBA, starting on a 64 byte boundary
+
+Faces are in OpenGL order, +X, -X, +Y, -Y, +Z, -Z, each with rows in the
+order glTexSubImage2D takes them, and load with numpy.memmap.
+"""
+
+import hashlib
+import importlib.resources
+import json
+import logging
+import math
+import os
+import struct
+
+import numpy
+from OpenGL import GL
+from PIL import Image
+
+from wiggle.material.image_loader import decode_pixels, image_loader
+from wiggle.material.texture import SYNCHRONOUS_UPLOAD_BYTES, Texture, _GlTexture
+from wiggle.render.gl_state import gl_state
+from wiggle.render.resource_cache import current_resources
+from wiggle.render.texture_upload import mipmap_level_count
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'WGLCUBE\0'
+VERSION = 1
+ALIGNMENT = 64
+CACHE_SUFFIX = '.wglcube'
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'wiggle', 'cubemaps')
+DEFAULT_SUPERSAMPLE = 2  # samples across each face texel, in each direction
+_BAND_ROWS = 64  # face rows resampled at once, to bound memory use
+
+_PREAMBLE = struct.Struct('<8sII')
+
+
+class CubeMapCacheError(Exception):
+    pass
+
+
+def default_face_size(width):
+    """Face size matching the texel density of an equirectangular image width at its equator"""
+    return max(1, width // 4)
+
+
+def face_directions(face, s, t):
+    """
+    Unnormalized (x, y, z) directions that OpenGL looks up in one cube map
+    face, at face coordinates s and t, from -1 to 1.
+    """
+    one = numpy.ones_like(s)
+    return (
+        (one, -t, -s),
+        (-one, -t, s),
+        (s, one, t),
+        (s, -one, -t),
+        (s, -t, one),
+        (-s, -t, -one),
+    )[face]
+
+
+def sample_equirect(pixels, x, y, z):
+    """
+    Bilinear samples of a (height, width, 4) equirectangular image, top
+    row first, in directions x, y, z, as float32 (..., 4).
+    """
+    height, width = pixels.shape[:2]
+    # Same mapping as equirect_coord() in photosphere.glsl
+    longitude = 0.5 * numpy.arctan2(x, -z) / math.pi + 0.5
+    latitude = numpy.arctan2(y, numpy.hypot(x, z)) / math.pi + 0.5
+    px = longitude * width - 0.5
+    py = (1.0 - latitude) * height - 0.5
+    x0 = numpy.floor(px)
+    y0 = numpy.floor(py)
+    fx = (px - x0)[..., None].astype(numpy.float32)
+    fy = (py - y0)[..., None].astype(numpy.float32)
+    x0 = x0.astype(numpy.intp)
+    y0 = y0.astype(numpy.intp)
+    # Wrap around in longitude; clamp at the poles
+    x1 = (x0 + 1) % width
+    x0 %= width
+    y1 = numpy.clip(y0 + 1, 0, height - 1)
+    y0 = numpy.clip(y0, 0, height - 1)
+    top = pixels[y0, x0] * (1 - fx) + pixels[y0, x1] * fx
+    bottom = pixels[y1, x0] * (1 - fx) + pixels[y1, x1] * fx
+    return top * (1 - fy) + bottom * fy
+
+
+def prefilter_rows(pixels, footprint):
+    """
+    Box filter each row of an equirectangular image across the width one
+    sample covers there, which is footprint texels at the equator, and
+    grows as 1/cos(latitude) toward the poles.
+    """
+    height, width = pixels.shape[:2]
+    latitude = (0.5 - (numpy.arange(height) + 0.5) / height) * math.pi
+    widths = numpy.minimum(width, footprint / numpy.maximum(numpy.cos(latitude), 1e-6)).astype(int)
+    rows = numpy.nonzero(widths > 1)[0]
+    if len(rows) < 1:
+        return pixels
+    result = numpy.array(pixels)
+    for row in rows:
+        k = widths[row]
+        index = numpy.arange(-(k // 2), width + k - k // 2 - 1) % width
+        summed = numpy.zeros((len(index) + 1, pixels.shape[2]), dtype=numpy.int64)
+        numpy.cumsum(pixels[row, index], axis=0, dtype=numpy.int64, out=summed[1:])
+        result[row] = (summed[k:] - summed[:-k]) // k
+    return result
+
+
+def equirect_to_cube_map(pixels, face_size=None, supersample=DEFAULT_SUPERSAMPLE):
+    """
+    (6, face_size, face_size, 4) uint8 cube map faces of a (height, width, 4)
+    equirectangular RGBA image, top row first. Each face texel averages
+    supersample x supersample bilinear samples, from rows prefiltered
+    against aliasing near the poles.
+    """
+    height, width = pixels.shape[:2]
+    if face_size is None:
+        face_size = default_face_size(width)
+    # Equirectangular texels across one face texel, at the center of a face
+    footprint = (2.0 / face_size) / (2.0 * math.pi / width)
+    source = prefilter_rows(pixels, footprint / supersample)
+    faces = numpy.empty((6, face_size, face_size, 4), dtype=numpy.uint8)
+    offsets = (numpy.arange(supersample) + 0.5) / supersample
+    columns = numpy.arange(face_size)
+    for face in range(6):
+        for band in range(0, face_size, _BAND_ROWS):
+            rows = numpy.arange(band, min(band + _BAND_ROWS, face_size))
+            total = numpy.zeros((len(rows), face_size, 4), dtype=numpy.float32)
+            for dt in offsets:
+                t = 2.0 * (rows[:, None] + dt) / face_size - 1.0
+                for ds in offsets:
+                    s = 2.0 * (columns[None, :] + ds) / face_size - 1.0
+                    s, t_ = numpy.broadcast_arrays(s, t)
+                    total += sample_equirect(source, *face_directions(face, s, t_))
+            faces[face, rows] = numpy.clip(total / supersample ** 2 + 0.5, 0, 255).astype(numpy.uint8)
+    return faces
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def save_cube_map(file_name, header, faces):
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_start = _align(_PREAMBLE.size + len(header_bytes))
+    temp_name = file_name + '.tmp'
+    with open(temp_name, 'wb') as f:
+        f.write(_PREAMBLE.pack(MAGIC, VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        f.seek(data_start)
+        f.write(memoryview(numpy.ascontiguousarray(faces)).cast('B'))
+    os.replace(temp_name, file_name)
+
+
+def load_cube_map(file_name):
+    """(header, memory-mapped faces) of one cache file"""
+    with open(file_name, 'rb') as f:
+        magic, version, header_length = _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+        if magic != MAGIC:
+            raise CubeMapCacheError('not a wiggle cube map cache file')
+        if version != VERSION:
+            raise CubeMapCacheError(f'unsupported cube map cache version {version}')
+        header = json.loads(f.read(header_length).decode('utf-8'))
+    size = header['face_size']
+    faces = numpy.memmap(
+        file_name, dtype=numpy.uint8, mode='r', offset=_align(_PREAMBLE.size + header_length),
+        shape=(6, size, size, 4))
+    return header, faces
+
+
+def _open_source(file_name, package):
+    if package is None:
+        return open(file_name, 'rb')
+    return importlib.resources.files(package).joinpath(file_name).open('rb')
+
+
+def source_digest(file_name, package=None, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with _open_source(file_name, package) as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class CubeMapCache(object):
+    """
+    Cube maps converted from equirectangular images on earlier runs, by
+    image content hash and face size. An unreadable cache file logs a
+    warning, and the image is converted again; a conversion that cannot be
+    saved logs a warning too.
+    """
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.hit_count = 0
+        self.miss_count = 0
+
+    def file_name(self, source_hash, face_size, supersample):
+        key = f'{source_hash}\0{face_size}\0{supersample}'
+        return os.path.join(self.cache_dir, hashlib.sha256(key.encode()).hexdigest()[:32] + CACHE_SUFFIX)
+
+    def load(self, file_name, package=None, face_size=None, supersample=DEFAULT_SUPERSAMPLE):
+        """(6, size, size, 4) uint8 cube map faces of an equirectangular image file, from the cache if possible"""
+        source_hash = source_digest(file_name, package)
+        if face_size is None:
+            with _open_source(file_name, package) as f:
+                face_size = default_face_size(Image.open(f).size[0])  # reads just the header
+        cache_name = self.file_name(source_hash, face_size, supersample)
+        if os.path.exists(cache_name):
+            try:
+                header, faces = load_cube_map(cache_name)
+                if header.get('source_hash') != source_hash:
+                    raise CubeMapCacheError('cube map is from a different image')
+                self.hit_count += 1
+                return faces
+            except (OSError, ValueError, KeyError, struct.error, CubeMapCacheError) as error:
+                logger.warning(f'ignoring unreadable cube map cache "{cache_name}": {error}')
+        self.miss_count += 1
+        faces = equirect_to_cube_map(decode_pixels(file_name, package), face_size, supersample)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            save_cube_map(
+                cache_name, {'source_hash': source_hash, 'face_size': face_size, 'supersample': supersample}, faces)
+        except OSError as error:
+            logger.warning(f'could not write cube map cache "{cache_name}": {error}')
+        return faces
+
+
+# Shared by all cube map textures
+cube_map_cache = CubeMapCache()
+
+
+class _GlCubeMap(_GlTexture):
+    """GL cube map texture of one image, shared by all the CubeMapTextures of that image"""
+    placeholder = numpy.full((6, 1, 1, 4), (128, 128, 128, 255), dtype=numpy.uint8)
+
+    def create_storage(self, width, height):
+        texture_id = GL.glGenTextures(1)
+        gl_state.bind_texture(GL.GL_TEXTURE_CUBE_MAP, texture_id)
+        GL.glTexStorage2D(GL.GL_TEXTURE_CUBE_MAP, mipmap_level_count(width, height), GL.GL_RGBA8, width, height)
+        GL.glTexParameteri(GL.GL_TEXTURE_CUBE_MAP, GL.GL_TEXTURE_MAG_FILTER, GL.GL_LINEAR)
+        GL.glTexParameteri(GL.GL_TEXTURE_CUBE_MAP, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR_MIPMAP_LINEAR)
+        for wrap in (GL.GL_TEXTURE_WRAP_S, GL.GL_TEXTURE_WRAP_T, GL.GL_TEXTURE_WRAP_R):
+            GL.glTexParameteri(GL.GL_TEXTURE_CUBE_MAP, wrap, GL.GL_CLAMP_TO_EDGE)
+        return texture_id
+
+    def load(self, faces, future=None):
+        """Upload six faces, at once if they are small, or else over the coming frames"""
+        size = faces.shape[1]
+        texture_id = self.create_storage(size, size)
+        if faces.nbytes > SYNCHRONOUS_UPLOAD_BYTES:
+            def on_done(upload):
+                self.uploads = []
+                self._replace(upload.texture_id, future)
+            self.uploader = current_resources().texture_uploader
+            for face in range(6):
+                is_last = face == 5
+                # Flipped, because the uploader flips rows again, and faces are in OpenGL order already
+                self.uploads.append(self.uploader.submit(
+                    texture_id, faces[face][::-1], on_done if is_last else None, target=GL.GL_TEXTURE_CUBE_MAP,
+                    image_target=GL.GL_TEXTURE_CUBE_MAP_POSITIVE_X + face, generate_mipmap=is_last))
+            return
+        for face in range(6):
+            GL.glTexSubImage2D(
+                GL.GL_TEXTURE_CUBE_MAP_POSITIVE_X + face, 0, 0, 0, size, size, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE,
+                numpy.ascontiguousarray(faces[face]))
+        GL.glGenerateMipmap(GL.GL_TEXTURE_CUBE_MAP)
+        self._replace(texture_id, future)
+
+
+class CubeMapTexture(Texture):
+    """
+    Cube map of an equirectangular image file, for SkyBoxMaterial. The
+    image is converted on a background thread, or loaded from the cache of
+    earlier conversions. Until then the texture is flat gray.
+    """
+    target = GL.GL_TEXTURE_CUBE_MAP
+    gl_texture_class = _GlCubeMap
+
+    def __init__(self, file_name, package=None, face_size=None, cache=None):
+        """
+        :param face_size: texels across each face, by default a quarter of the image width
+        :param cache: CubeMapCache, by default cube_map_cache
+        """
+        self.face_size = face_size
+        self.cache = cube_map_cache if cache is None else cache
+        super().__init__(file_name, package, is_equirectangular=True, proxy_size=None)
+        self.key = ('cube map', package, file_name, face_size)
+
+    def _load(self, file_name, package):
+        return image_loader.submit(self.cache.load, file_name, package, self.face_size)
+
+    def init_gl(self):
+        # Filter across face edges
+        gl_state.enable(GL.GL_TEXTURE_CUBE_MAP_SEAMLESS)
+        super().init_gl()
@@ -0,0 +1,72 @@
+"""
+Image decoding on background threads.
+
+Decoding a large JPEG panorama takes long enough to freeze a window, so
+Texture asks image_loader for a concurrent.futures.Future of the decoded
+pixels, and uploads them to OpenGL once they are done. A small proxy
+image, decoded at reduced size, arrives first, to show in the meantime.
+"""
+
+import importlib.resources
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+from PIL import Image
+
+DEFAULT_PROXY_SIZE = 256  # pixels across of proxy images
+DEFAULT_WORKER_COUNT = 2
+
+
+def decode_image(file_name, package=None, max_size=None):
+    """
+    RGBA PIL image of a file, or of a python package resource. If max_size
+    is given, the image is reduced to fit within that many pixels, which
+    JPEG decodes at a fraction of the full cost.
+    """
+    if package is None:
+        stream = open(file_name, 'rb')
+    else:
+        stream = importlib.resources.files(package).joinpath(file_name).open('rb')
+    with stream:
+        image = Image.open(stream)
+        if max_size is not None:
+            image.draft('RGB', (max_size, max_size))
+            image.thumbnail((max_size, max_size))
+        return image.convert('RGBA')  # also reads the pixels, before the file closes
+
+
+def decode_pixels(file_name, package=None, max_size=None):
+    """decode_image() as a (height, width, 4) uint8 array, top row first"""
+    return numpy.asarray(decode_image(file_name, package, max_size))
+
+
+class ImageLoader(object):
+    """
+    Decodes images to pixel arrays on a thread pool, so even the copy out
+    of PIL happens off the GL thread. Requests for an image that is still
+    in use share one Future.
+    """
+    def __init__(self, worker_count=DEFAULT_WORKER_COUNT):
+        self.worker_count = worker_count
+        self._executor = None
+        self._futures = weakref.WeakValueDictionary()
+
+    def load(self, file_name, package=None, max_size=None):
+        """concurrent.futures.Future of decode_pixels(file_name, package, max_size)"""
+        key = (package, file_name, max_size)
+        future = self._futures.get(key)
+        if future is None or (future.done() and future.exception() is not None):
+            future = self.submit(decode_pixels, file_name, package, max_size)
+            self._futures[key] = future
+        return future
+
+    def submit(self, function, *args):
+        """concurrent.futures.Future of function(*args), run on the decoding threads, such as to convert an image"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.worker_count, thread_name_prefix='wiggle-image')
+        return self._executor.submit(function, *args)
+
+
+# Shared by all textures
+image_loader = ImageLoader()
@@ -0,0 +1,201 @@
+"""
+KTX and KTX2 texture container files, holding precompressed mipmap levels.
+
+Only 2D textures are read, in block compressed formats that upload as is
+with glCompressedTexSubImage2D. KTX2 files with supercompression, such as
+Basis Universal, need transcoding first, and are rejected.
+
+Levels upload as stored. OpenGL expects the bottom row first, so a file
+stored top row first comes back with KtxImage.is_top_down set, and the
+material flips the v texture coordinate instead of the blocks.
+"""
+
+import importlib.resources
+import os
+import struct
+
+KTX1_IDENTIFIER = b'\xabKTX 11\xbb\r\n\x1a\n'
+KTX2_IDENTIFIER = b'\xabKTX 20\xbb\r\n\x1a\n'
+ORIENTATION_KEY = 'KTXorientation'
+
+# OpenGL compressed internal formats
+GL_COMPRESSED_RGB_S3TC_DXT1_EXT = 0x83F0
+GL_COMPRESSED_RGBA_S3TC_DXT1_EXT = 0x83F1
+GL_COMPRESSED_RGBA_S3TC_DXT5_EXT = 0x83F3
+GL_COMPRESSED_SRGB_S3TC_DXT1_EXT = 0x8C4C
+GL_COMPRESSED_SRGB_ALPHA_S3TC_DXT1_EXT = 0x8C4D
+GL_COMPRESSED_SRGB_ALPHA_S3TC_DXT5_EXT = 0x8C4F
+GL_COMPRESSED_RGBA_BPTC_UNORM = 0x8E8C
+GL_COMPRESSED_SRGB_ALPHA_BPTC_UNORM = 0x8E8D
+GL_COMPRESSED_RGB8_ETC2 = 0x9274
+GL_COMPRESSED_SRGB8_ETC2 = 0x9275
+GL_COMPRESSED_RGBA8_ETC2_EAC = 0x9278
+GL_COMPRESSED_SRGB8_ALPHA8_ETC2_EAC = 0x9279
+
+# Bytes per 4x4 block
+BLOCK_SIZES = {
+    GL_COMPRESSED_RGB_S3TC_DXT1_EXT: 8,
+    GL_COMPRESSED_RGBA_S3TC_DXT1_EXT: 8,
+    GL_COMPRESSED_SRGB_S3TC_DXT1_EXT: 8,
+    GL_COMPRESSED_SRGB_ALPHA_S3TC_DXT1_EXT: 8,
+    GL_COMPRESSED_RGBA_S3TC_DXT5_EXT: 16,
+    GL_COMPRESSED_SRGB_ALPHA_S3TC_DXT5_EXT: 16,
+    GL_COMPRESSED_RGBA_BPTC_UNORM: 16,
+    GL_COMPRESSED_SRGB_ALPHA_BPTC_UNORM: 16,
+    GL_COMPRESSED_RGB8_ETC2: 8,
+    GL_COMPRESSED_SRGB8_ETC2: 8,
+    GL_COMPRESSED_RGBA8_ETC2_EAC: 16,
+    GL_COMPRESSED_SRGB8_ALPHA8_ETC2_EAC: 16,
+}
+
+# KTX2 VkFormat values of the same formats
+_VK_FORMATS = {
+    131: GL_COMPRESSED_RGB_S3TC_DXT1_EXT,  # VK_FORMAT_BC1_RGB_UNORM_BLOCK
+    132: GL_COMPRESSED_SRGB_S3TC_DXT1_EXT,
+    133: GL_COMPRESSED_RGBA_S3TC_DXT1_EXT,
+    134: GL_COMPRESSED_SRGB_ALPHA_S3TC_DXT1_EXT,
+    137: GL_COMPRESSED_RGBA_S3TC_DXT5_EXT,  # VK_FORMAT_BC3_UNORM_BLOCK
+    138: GL_COMPRESSED_SRGB_ALPHA_S3TC_DXT5_EXT,
+    145: GL_COMPRESSED_RGBA_BPTC_UNORM,  # VK_FORMAT_BC7_UNORM_BLOCK
+    146: GL_COMPRESSED_SRGB_ALPHA_BPTC_UNORM,
+    147: GL_COMPRESSED_RGB8_ETC2,  # VK_FORMAT_ETC2_R8G8B8_UNORM_BLOCK
+    148: GL_COMPRESSED_SRGB8_ETC2,
+    151: GL_COMPRESSED_RGBA8_ETC2_EAC,  # VK_FORMAT_ETC2_R8G8B8A8_UNORM_BLOCK
+    152: GL_COMPRESSED_SRGB8_ALPHA8_ETC2_EAC,
+}
+
+_KTX1_HEADER = struct.Struct('<13I')  # after the identifier
+_KTX2_HEADER = struct.Struct('<9I4I2Q')  # after the identifier
+_KTX2_LEVEL = struct.Struct('<3Q')
+
+
+class KtxError(Exception):
+    pass
+
+
+def is_ktx_file(file_name):
+    return file_name.lower().endswith(('.ktx', '.ktx2'))
+
+
+class KtxImage(object):
+    """
+    Compressed 2D texture: its OpenGL internal format, and each mipmap level
+    as bytes, largest first, with its rows top down if is_top_down
+    """
+    def __init__(self, internal_format, width, height, levels, key_values=None, is_top_down=False):
+        self.internal_format = internal_format
+        self.width = width
+        self.height = height
+        self.levels = levels
+        self.key_values = dict() if key_values is None else key_values
+        self.is_top_down = is_top_down
+
+    @property
+    def nbytes(self):
+        return sum(len(level) for level in self.levels)
+
+    def level_size(self, level):
+        return max(1, self.width >> level), max(1, self.height >> level)
+
+
+def _pad4(size):
+    return 3 - ((size + 3) % 4)
+
+
+def _parse_key_values(data):
+    key_values = dict()
+    offset = 0
+    while offset + 4 <= len(data):
+        size, = struct.unpack_from('<I', data, offset)
+        entry = bytes(data[offset + 4:offset + 4 + size])
+        key, _, value = entry.partition(b'\0')
+        key_values[key.decode('utf-8')] = value.rstrip(b'\0').decode('utf-8', errors='replace')
+        offset += 4 + size + _pad4(size)
+    return key_values
+
+
+def _read_ktx1(data):
+    header = data[12:12 + _KTX1_HEADER.size]
+    if struct.unpack_from('<I', header)[0] != 0x04030201:
+        raise KtxError('big-endian KTX files are not supported')
+    (_, gl_type, type_size, gl_format, internal_format, base_internal_format, width, height, depth,
+     array_count, face_count, level_count, key_value_size) = _KTX1_HEADER.unpack(header)
+    if gl_type != 0 or gl_format != 0:
+        raise KtxError('KTX file is not block compressed')
+    if depth > 0 or array_count > 0 or face_count != 1:
+        raise KtxError('only 2D KTX textures are supported')
+    offset = 12 + _KTX1_HEADER.size
+    key_values = _parse_key_values(data[offset:offset + key_value_size])
+    offset += key_value_size
+    levels = []
+    for level in range(max(1, level_count)):
+        size, = struct.unpack_from('<I', data, offset)
+        offset += 4
+        levels.append(bytes(data[offset:offset + size]))
+        offset += size + _pad4(size)
+    # Rows go up, by OpenGL convention, unless stated otherwise
+    is_top_down = 'T=d' in key_values.get(ORIENTATION_KEY, '')
+    return KtxImage(internal_format, width, height, levels, key_values, is_top_down)
+
+
+def _read_ktx2(data):
+    (vk_format, type_size, width, height, depth, layer_count, face_count, level_count, supercompression,
+     dfd_offset, dfd_size, key_value_offset, key_value_size, sgd_offset, sgd_size) = _KTX2_HEADER.unpack_from(data, 12)
+    if supercompression != 0:
+        raise KtxError('supercompressed KTX2 files, such as Basis Universal, are not supported')
+    if vk_format not in _VK_FORMATS:
+        raise KtxError(f'unsupported KTX2 format {vk_format}')
+    if depth > 0 or layer_count > 0 or face_count != 1:
+        raise KtxError('only 2D KTX2 textures are supported')
+    levels = []
+    index = 12 + _KTX2_HEADER.size
+    for level in range(max(1, level_count)):
+        offset, size, _ = _KTX2_LEVEL.unpack_from(data, index + level * _KTX2_LEVEL.size)
+        levels.append(bytes(data[offset:offset + size]))
+    key_values = _parse_key_values(data[key_value_offset:key_value_offset + key_value_size])
+    # Rows go down, by KTX2 convention, unless stated otherwise
+    is_top_down = not key_values.get(ORIENTATION_KEY, 'rd')[1:2] == 'u'
+    return KtxImage(_VK_FORMATS[vk_format], width, height, levels, key_values, is_top_down)
+
+
+def read_ktx(data):
+    """KtxImage of the contents of a KTX or KTX2 file"""
+    data = memoryview(data)
+    identifier = bytes(data[:12])
+    if identifier == KTX1_IDENTIFIER:
+        return _read_ktx1(data)
+    if identifier == KTX2_IDENTIFIER:
+        return _read_ktx2(data)
+    raise KtxError('not a KTX file')
+
+
+def load_ktx(file_name, package=None):
+    """KtxImage of a KTX or KTX2 file, or python package resource"""
+    if package is None:
+        stream = open(file_name, 'rb')
+    else:
+        stream = importlib.resources.files(package).joinpath(file_name).open('rb')
+    with stream:
+        return read_ktx(stream.read())
+
+
+def save_ktx(file_name, image):
+    """Write a KtxImage to a KTX 1 file"""
+    key_values = dict(image.key_values)
+    key_values[ORIENTATION_KEY] = 'S=r,T=d' if image.is_top_down else 'S=r,T=u'
+    key_value_data = bytearray()
+    for key, value in key_values.items():
+        entry = key.encode('utf-8') + b'\0' + value.encode('utf-8') + b'\0'
+        key_value_data += struct.pack('<I', len(entry)) + entry + b'\0' * _pad4(len(entry))
+    temp_name = file_name + '.tmp'
+    with open(temp_name, 'wb') as f:
+        f.write(KTX1_IDENTIFIER)
+        f.write(_KTX1_HEADER.pack(
+            0x04030201, 0, 1, 0, image.internal_format, 0, image.width, image.height, 0, 0, 1,
+            len(image.levels), len(key_value_data)))
+        f.write(key_value_data)
+        for data in image.levels:
+            f.write(struct.pack('<I', len(data)))
+            f.write(data)
+            f.write(b'\0' * _pad4(len(data)))
+    os.replace(temp_name, file_name)
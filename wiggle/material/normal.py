@@ -22,4 +22,12 @@ class NormalMaterial(BaseMaterial):
 
     @staticmethod
     def primitive():
-        return GL.GL_TRIANGLES
\ No newline at end of file
+        return GL.GL_TRIANGLES
+
+
+class InstancedNormalMaterial(NormalMaterial):
+    """NormalMaterial for InstancedMeshActor, with a model matrix per instance"""
+    def create_vertex_shader(self):
+        return ShaderStage(
+            [ShaderFileBlock('wiggle.glsl', 'instanced.vert'), ],
+            GL.GL_VERTEX_SHADER)
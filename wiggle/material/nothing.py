@@ -2,5 +2,8 @@ from wiggle.material import BaseMaterial
 
 
 class NothingMaterial(BaseMaterial):
+    """Material that draws nothing, such as the wireframe of a sky"""
+    has_shader = False
+
     def display_gl(self, camera, *args, **kwargs):
         pass
\ No newline at end of file
@@ -10,6 +10,7 @@ from wiggle.geometry.matrix import Matrix3f
 from wiggle.material import BaseMaterial
 from wiggle.material.shader import ShaderStage, ShaderFileBlock
 from wiggle.material.texture import Texture
+from wiggle.render.gl_state import gl_state
 
 
 class PlaneMaterial(BaseMaterial):
@@ -56,13 +57,14 @@ class PlaneMaterial(BaseMaterial):
 
     def display_gl(self, *args, **kwargs):
         super().display_gl(*args, **kwargs)
-        GL.glEnable(GL.GL_CLIP_PLANE0)
+        gl_state.enable(GL.GL_CLIP_PLANE0)
         #
         GL.glUniform3f(self.pano_pos_index, *self.pano_pos)
         GL.glUniformMatrix3fv(self.pano_rotation_index, 1, False, self.pano_rotation)
         GL.glUniform1i(self.render_mode_index, self.render_mode.value)
         if self.render_mode == self.RenderMode.TEXTURE or self.render_mode == self.RenderMode.EQUIRECTANGULAR:
             self.texture.display_gl(*args, **kwargs)
+            self.set_image_orientation(self.texture)
 
     def init_gl(self):
         super().init_gl()
@@ -0,0 +1,162 @@
+"""
+GLSL source assembly, without a GL context.
+
+ShaderPreprocessor reads shader files from python packages with
+importlib.resources, expands their #pragma include directives, and injects
+#define lines for shader variants. Expanded sources are cached by the
+content hash of their files, including the files they include, so each
+variant of a stage is assembled once per process however many materials
+use it. Files on disk are read again after they are modified.
+"""
+
+import hashlib
+import importlib.resources
+import os
+import re
+
+_include_matcher = re.compile(r'^\s*#pragma include "(\S+)".*')
+_version_matcher = re.compile(r'^\s*#version\b', re.MULTILINE)
+
+
+class ExpandedSource(object):
+    """GLSL text with includes expanded, and where each of its lines came from"""
+    def __init__(self, text, line_map, file_names):
+        self.text = text
+        # Per line of text: (file index, line number in that file), or None for generated lines
+        self.line_map = line_map
+        self.file_names = file_names  # file name of each file index, for messages
+        self.hash = hashlib.sha256(text.encode()).hexdigest()
+
+    def __str__(self):
+        return self.text
+
+    def origin(self, line_number):
+        """(file name, line number) of line_number in the expanded text, both counting from 1"""
+        location = self.line_map[line_number - 1]
+        if location is None:
+            return None
+        return self.file_names[location[0]], location[1]
+
+
+def resource_file_name(package, file_name):
+    """Full name of a file in a python package, for messages"""
+    return str(importlib.resources.files(package).joinpath(file_name))
+
+
+def _included_file(match):
+    """(package, file name) of an include directive match"""
+    path = match.group(1).split('/')
+    return '.'.join(path[:-1]), path[-1]
+
+
+def _modification_time(resource):
+    """Modification time of a package file, or None if it is not a plain file, as in a zip archive"""
+    try:
+        return os.stat(resource).st_mtime_ns
+    except (TypeError, OSError):
+        return None
+
+
+class ShaderPreprocessor(object):
+    def __init__(self):
+        self._texts = dict()  # (package, file name): (text, content hash, modification time, included files)
+        self._expanded = dict()  # (content hashes, defines): ExpandedSource
+
+    def clear(self):
+        """Forget all cached files, as after editing shaders on disk"""
+        self._texts.clear()
+        self._expanded.clear()
+
+    def _read(self, package, file_name):
+        resource = importlib.resources.files(package).joinpath(file_name)
+        modified = _modification_time(resource)
+        entry = self._texts.get((package, file_name))
+        if entry is None or entry[2] != modified:
+            text = resource.read_text()
+            includes = []
+            for line in text.splitlines():
+                m = _include_matcher.search(line)
+                if m:
+                    includes.append(_included_file(m))
+            entry = (text, hashlib.sha256(text.encode()).hexdigest(), modified, includes)
+            self._texts[(package, file_name)] = entry
+        return entry
+
+    def read(self, package, file_name):
+        """Text and content hash of one shader file, read again if the file changed"""
+        return self._read(package, file_name)[:2]
+
+    def _content_hashes(self, package, file_name):
+        """Content hashes of a file and of the files it includes, in the order they are expanded"""
+        entry = self._read(package, file_name)
+        hashes = [entry[1], ]
+        for included in entry[3]:
+            hashes.extend(self._content_hashes(*included))
+        return hashes
+
+    def expand(self, files, defines=None):
+        """
+        ExpandedSource of the (package, file name) files, joined in order.
+
+        :param defines: dict of macro names to values, or None, inserted after the #version line
+        """
+        defines = tuple(sorted((defines or dict()).items()))
+        hashes = []
+        for package, file_name in files:
+            hashes.extend(self._content_hashes(package, file_name))
+        key = (tuple(hashes), defines)
+        if key not in self._expanded:
+            self._expanded[key] = self._expand(files, defines)
+        return self._expanded[key]
+
+    def _expand(self, files, defines):
+        lines = []
+        line_map = []
+        file_names = []
+        file_indexes = dict()
+
+        def file_index(package, file_name):
+            path = resource_file_name(package, file_name)
+            if path not in file_indexes:
+                file_indexes[path] = len(file_names)
+                file_names.append(path)
+            return file_indexes[path]
+
+        def generated(line):
+            lines.append(line)
+            line_map.append(None)
+
+        def define_all():
+            for name, value in defines:
+                generated(f'#define {name} {value}')
+            pending_defines.clear()
+
+        def append_file(package, file_name):
+            index = file_index(package, file_name)
+            for line_number, line in enumerate(self.read(package, file_name)[0].splitlines(), start=1):
+                m = _include_matcher.search(line)
+                if m:
+                    included = _included_file(m)
+                    generated(f'#line 1 {file_index(*included)}')
+                    append_file(*included)
+                    generated(f'#line {line_number} {index}')
+                lines.append(line.rstrip())
+                line_map.append((index, line_number))
+                if pending_defines and _version_matcher.search(line):
+                    # Nothing but comments may precede #version
+                    define_all()
+                    generated(f'#line {line_number + 1} {index}')
+
+        for package, file_name in files:
+            file_index(package, file_name)  # the top level files come first
+        pending_defines = list(defines)
+        if pending_defines and not _version_matcher.search(self.read(*files[0])[0]):
+            define_all()
+            generated('#line 1 0')
+        for package, file_name in files:
+            append_file(package, file_name)
+        return ExpandedSource('\n'.join(lines), line_map, file_names)
+
+
+# Shared by all shader stages
+preprocessor = ShaderPreprocessor()
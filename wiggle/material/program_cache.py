@@ -0,0 +1,137 @@
+"""
+On-disk cache of linked shader program binaries.
+
+File layout:
+    8 bytes   magic b'WGLPROG\0'
+    4 bytes   format version, little-endian uint32
+    4 bytes   header length, little-endian uint32
+    header    utf-8 JSON: source hash, GL vendor, renderer and version, binary format
+    binary    the bytes from glGetProgramBinary
+
+Files are named by a hash of the expanded shader sources and the driver
+identity, so a driver update misses the cache instead of loading a binary
+it cannot use. Binaries the driver still rejects are recompiled and
+replaced.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import struct
+
+import numpy
+from OpenGL import GL
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'WGLPROG\0'
+VERSION = 1
+CACHE_SUFFIX = '.wglprog'
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'wiggle', 'programs')
+
+_PREAMBLE = struct.Struct('<8sII')
+
+
+class ProgramCacheError(Exception):
+    pass
+
+
+def driver_identity():
+    """GL vendor, renderer and version strings of the current context"""
+    return {
+        'vendor': GL.glGetString(GL.GL_VENDOR).decode(),
+        'renderer': GL.glGetString(GL.GL_RENDERER).decode(),
+        'version': GL.glGetString(GL.GL_VERSION).decode(),
+    }
+
+
+def save_program_binary(file_name, header, binary):
+    header_bytes = json.dumps(header).encode('utf-8')
+    temp_name = file_name + '.tmp'
+    with open(temp_name, 'wb') as f:
+        f.write(_PREAMBLE.pack(MAGIC, VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        f.write(memoryview(binary).cast('B'))
+    os.replace(temp_name, file_name)
+
+
+def load_program_binary(file_name):
+    """(header, binary bytes) of one cache file"""
+    with open(file_name, 'rb') as f:
+        magic, version, header_length = _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+        if magic != MAGIC:
+            raise ProgramCacheError('not a wiggle program cache file')
+        if version != VERSION:
+            raise ProgramCacheError(f'unsupported program cache version {version}')
+        header = json.loads(f.read(header_length).decode('utf-8'))
+        return header, f.read()
+
+
+class ProgramBinaryCache(object):
+    """
+    Linked program binaries from earlier runs, by expanded source hash and
+    driver. Unreadable or rejected binaries are logged and the program is
+    compiled from source; a binary that cannot be saved logs a warning.
+    """
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.hit_count = 0
+        self.miss_count = 0
+
+    def file_name(self, source_hash, identity):
+        key = '\0'.join((source_hash, identity['vendor'], identity['renderer'], identity['version']))
+        return os.path.join(self.cache_dir, hashlib.sha256(key.encode()).hexdigest()[:32] + CACHE_SUFFIX)
+
+    def load_program(self, source_hash):
+        """A new linked program from the cached binary for source_hash, or None"""
+        identity = driver_identity()
+        file_name = self.file_name(source_hash, identity)
+        if not os.path.exists(file_name):
+            self.miss_count += 1
+            return None
+        try:
+            header, binary = load_program_binary(file_name)
+            if header.get('source_hash') != source_hash or header.get('driver') != identity:
+                raise ProgramCacheError('binary is from different sources or driver')
+        except (OSError, ValueError, struct.error, ProgramCacheError) as error:
+            logger.warning(f'ignoring unreadable program binary cache: {error}')
+            self.miss_count += 1
+            return None
+        program = GL.glCreateProgram()
+        try:
+            GL.glProgramBinary(program, header['format'], numpy.frombuffer(binary, dtype=numpy.uint8), len(binary))
+            is_linked = GL.glGetProgramiv(program, GL.GL_LINK_STATUS)
+        except GL.GLError:
+            is_linked = False
+        if not is_linked:
+            # Stale binary, as after a driver change the version string does not show
+            logger.info(f'recompiling shader program with rejected cached binary "{file_name}"')
+            GL.glDeleteProgram(program)
+            self.miss_count += 1
+            return None
+        self.hit_count += 1
+        return program
+
+    def save_program(self, source_hash, program):
+        """Store the binary of a program linked with GL_PROGRAM_BINARY_RETRIEVABLE_HINT"""
+        identity = driver_identity()
+        try:
+            length = int(GL.glGetProgramiv(program, GL.GL_PROGRAM_BINARY_LENGTH))
+            if length < 1:
+                return  # driver has no binary formats
+            binary = numpy.empty((length, ), dtype=numpy.uint8)
+            written = GL.GLsizei(0)
+            binary_format = GL.GLenum(0)
+            GL.glGetProgramBinary(program, length, written, binary_format, binary)
+            os.makedirs(self.cache_dir, exist_ok=True)
+            save_program_binary(
+                self.file_name(source_hash, identity),
+                {'source_hash': source_hash, 'driver': identity, 'format': int(binary_format.value)},
+                binary[:written.value])
+        except (OSError, GL.GLError) as error:
+            logger.warning(f'could not write program binary cache: {error}')
+
+
+# Shared by all shader programs
+program_binary_cache = ProgramBinaryCache()
@@ -1,48 +1,99 @@
+import hashlib
 import sys
-import pkg_resources
 import re
 
-from OpenGL.GL.shaders import compileProgram, compileShader
+from OpenGL.GL.shaders import compileShader
 from OpenGL import GL
 
+from wiggle.material.preprocessor import preprocessor, resource_file_name
+from wiggle.material.program_cache import program_binary_cache
+from wiggle.render.resource_cache import current_resources
+
+
+def link_program(shaders, is_retrievable=False):
+    """Link compiled shaders into a new program, and delete the shaders"""
+    program = GL.glCreateProgram()
+    for shader in shaders:
+        GL.glAttachShader(program, shader)
+    if is_retrievable:
+        GL.glProgramParameteri(program, GL.GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL.GL_TRUE)
+    GL.glLinkProgram(program)
+    for shader in shaders:
+        GL.glDetachShader(program, shader)
+        GL.glDeleteShader(shader)
+    if not GL.glGetProgramiv(program, GL.GL_LINK_STATUS):
+        log = GL.glGetProgramInfoLog(program)
+        GL.glDeleteProgram(program)
+        raise RuntimeError(f'Link failure: {log}')
+    return program
+
 
 class ShaderProgram(object):
+    """
+    Linked program of some shader stages. Programs with identical stage
+    sources share one handle, from the resource cache of the current GL
+    context. Programs linked on earlier runs load from binary_cache,
+    without compiling GLSL.
+    """
+    binary_cache = program_binary_cache  # or None to always compile
+
     def __init__(self, stages):
         self.stages = stages
         self.handle = None
+        self._key = None
+        self._resources = None
 
     def __int__(self):
         if not self.handle:
             self.compile()
         return self.handle
 
+    def key(self):
+        return tuple((s.gl_stage, str(s)) for s in self.stages)
+
+    def source_hash(self):
+        digest = hashlib.sha256()
+        for stage, source in self.key():
+            digest.update(f'{stage}\0{source}\0'.encode())
+        return digest.hexdigest()
+
+    def _link(self):
+        cache = self.binary_cache
+        if cache is not None:
+            program = cache.load_program(self.source_hash())
+            if program is not None:
+                return program
+        program = link_program([s.compile() for s in self.stages], is_retrievable=cache is not None)
+        if cache is not None:
+            cache.save_program(self.source_hash(), program)
+        return program
+
     def compile(self):
-        self.handle = compileProgram(*[s.compile() for s in self.stages])
+        self._resources = current_resources()
+        self._key = self.key()
+        self.handle = self._resources.programs.acquire(self._key, self._link)
         return self.handle
 
+    def dispose_gl(self):
+        if self.handle:
+            self._resources.programs.release(self._key)
+        self.handle = None
+
 
 class BaseShaderStage(object):
     def __init__(self, stage=GL.GL_FRAGMENT_SHADER):
         super().__init__()
         self.gl_stage = stage
         self.handle = None
-        self._next_block_index = 0
-        self.file_name_for_block_index = dict()
-        self.index_for_block_file_name = dict()
 
     def __int__(self):
         if not self.handle:
             self.handle = self.compile()
         return self.handle
 
-    def index_one_block(self, block):
-        file_name = block.info.full_file_name()
-        if file_name not in self.index_for_block_file_name:
-            index = self._next_block_index
-            self._next_block_index += 1
-            self.file_name_for_block_index[index] = file_name
-            self.index_for_block_file_name[file_name] = index
-        return self.index_for_block_file_name[file_name]
+    def file_name(self, file_index):
+        """Name of the source file numbered file_index in #line directives, for messages"""
+        return f'source string {file_index}'
 
     def _format_warnings(self, log):
         log = log.replace(r'\n', '\n')
@@ -55,11 +106,12 @@ class BaseShaderStage(object):
             if len(line) < 1:
                 continue
             lines.append(f'    {line}')
-            match = re.match(r'(\d+)\((\d+)\) : .*', line)
+            # NVIDIA style "0(34) : error ...", or Mesa style "0:34(5): error ..."
+            match = re.match(r'(\d+)(?:\((\d+)\) :|:(\d+)\(\d+\):) .*', line)
             if match:
-                line_number = match.group(2)
+                line_number = match.group(2) or match.group(3)
                 file_index = int(match.group(1))
-                file_name = self.file_name_for_block_index[file_index]
+                file_name = self.file_name(file_index)
                 lines.append(f'  File "{file_name}", line {line_number}, in GLSL shader program')
             else:
                 lines.append(line)
@@ -92,79 +144,39 @@ class BaseShaderStage(object):
 
 
 class ShaderStage(BaseShaderStage):
-    def __init__(self, blocks, stage=GL.GL_FRAGMENT_SHADER):
+    def __init__(self, blocks, stage=GL.GL_FRAGMENT_SHADER, defines=None):
+        """
+        :param blocks: ShaderFileBlocks, joined in order
+        :param defines: dict of macro names to values, for compiling a variant of the shader
+        """
         super().__init__(stage=stage)
         self.blocks = blocks
-        self._index_blocks()
+        self.defines = defines
 
     def __str__(self):
-        result = []
-        for b in self.blocks:
-            result.append(b.stringify(self))
-        return '\n'.join(result)
+        return self.expanded().text
 
-    def _index_blocks(self):
-        for block in self.blocks:
-            self.index_one_block(block)
+    def expanded(self):
+        """wiggle.material.preprocessor.ExpandedSource of all the blocks"""
+        return preprocessor.expand([(b.info.package, b.info.file_name) for b in self.blocks], self.defines)
+
+    def file_name(self, file_index):
+        file_names = self.expanded().file_names
+        if 0 <= file_index < len(file_names):
+            return file_names[file_index]
+        return super().file_name(file_index)
 
 
 class ShaderBlockInfo(object):
     def __init__(self, package, file_name):
         self.package = package
         self.file_name = file_name
-        self.line_count = 0
 
     def full_file_name(self):
-        return pkg_resources.resource_filename(self.package, self.file_name)
+        return resource_file_name(self.package, self.file_name)
 
 
 class ShaderFileBlock(object):
+    """One GLSL file in a python package, with any files it includes by '#pragma include "package/path/file"'"""
     def __init__(self, package, file_name):
         self.info = ShaderBlockInfo(package, file_name)
-        self.lines = []
-        self.is_loaded = False
-        self.file_index = 0
-
-    def stringify(self, index):
-        result = []
-        self.load(index)
-        for line in self.lines:
-            result.append(str(line))
-        return '\n'.join(result)
-
-    def load(self, index):
-        if self.is_loaded:
-            return
-        self.file_index = index.index_one_block(self)
-        self.lines.clear()
-        line_index = 0
-        # todo: parse #pragma include here
-        include_matcher = re.compile(r'^\s*#pragma include "(\S+)".*')
-        for line in pkg_resources.resource_stream(self.info.package, self.info.file_name):
-            m = include_matcher.search(line.decode())
-            if m:
-                foo = m.group(1).split('/')
-                package = '.'.join(foo[:-1])
-                file_name = foo[-1]
-                inner_block = ShaderFileBlock(package, file_name)
-                inner_block.load(index)
-                self.lines.append('#line 1 %d' % inner_block.file_index)
-                for included_line in inner_block.lines:
-                    self.lines.append(included_line)
-                self.lines.append('#line %d %d' % (line_index + 1, self.file_index))
-            self.lines.append(ShaderLine(line=line.decode(), block_info=self.info, block_line_index=line_index))
-            line_index += 1
-        self.info.line_count = len(self.lines)
-        self.is_loaded = True
-
-
-class ShaderLine(object):
-    def __init__(self, line, block_info, block_line_index, shader_line_index=None):
-        self.string = str(line).rstrip()
-        self.block_info = block_info
-        self.block_line_index = block_line_index
-        self.shader_line_index = shader_line_index
-
-    def __str__(self):
-        return self.string
-
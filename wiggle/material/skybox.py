@@ -1,11 +1,14 @@
 from OpenGL import GL
 
 from wiggle.material import BaseMaterial
+from wiggle.material.cube_map import CubeMapTexture
 from wiggle.material.shader import ShaderStage, ShaderFileBlock
 from wiggle.material.texture import Texture
+from wiggle.material.virtual_texture import VirtualTexture
 
 
 class SkyBoxMaterial(BaseMaterial):
+    """Panorama in the background, from an equirectangular Texture, a CubeMapTexture, or a tiled VirtualTexture"""
     def __init__(self, texture=None):
         super().__init__()
         if texture is None:
@@ -21,10 +24,17 @@ class SkyBoxMaterial(BaseMaterial):
             GL.GL_VERTEX_SHADER)
 
     def create_fragment_shader(self):
+        defines = None
+        if isinstance(self.texture, VirtualTexture):
+            defines = {'VIRTUAL_TEXTURE': 1}
+        elif isinstance(self.texture, CubeMapTexture):
+            defines = {'CUBE_MAP': 1}
         return ShaderStage(
             [ShaderFileBlock('wiggle.glsl', 'skybox.frag'), ],
-            GL.GL_FRAGMENT_SHADER)
+            GL.GL_FRAGMENT_SHADER,
+            defines=defines)
 
     def display_gl(self, camera, *args, **kwargs):
         super().display_gl(camera, *args, **kwargs)
         self.texture.display_gl(camera=camera, *args, **kwargs)
+        self.set_image_orientation(self.texture)
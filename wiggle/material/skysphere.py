@@ -26,3 +26,4 @@ class SkySphereMaterial(BaseMaterial):
     def display_gl(self, camera, *args, **kwargs):
         super().display_gl(camera, *args, **kwargs)
         self.texture.display_gl(camera=camera, *args, **kwargs)
+        self.set_image_orientation(self.texture)
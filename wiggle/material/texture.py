@@ -1,49 +1,216 @@
-import pkg_resources
+import logging
+import os
+
+import numpy
 from OpenGL import GL
 from OpenGL.raw.GL.EXT.texture_filter_anisotropic import GL_MAX_TEXTURE_MAX_ANISOTROPY_EXT, \
     GL_TEXTURE_MAX_ANISOTROPY_EXT
-from PIL import Image
 
+from wiggle.material.image_loader import DEFAULT_PROXY_SIZE, image_loader
+from wiggle.material.ktx import KtxImage, is_ktx_file, load_ktx
+from wiggle.material.texture_compression import compressed_cache_file_name, load_texture_image
 from wiggle.render.base import AutoInitRenderer
+from wiggle.render.gl_state import gl_state
+from wiggle.render.resource_cache import current_resources
+from wiggle.render.texture_upload import create_texture_storage
 
+logger = logging.getLogger(__name__)
 
-class Texture(AutoInitRenderer):
-    def __init__(self, file_name, package=None, is_equirectangular=False):
-        super().__init__()
+# Shown until any pixels of the image arrive
+_PLACEHOLDER = numpy.full((1, 1, 4), (128, 128, 128, 255), dtype=numpy.uint8)
+# Larger images stream in over several frames, through the TextureUploader of their context
+SYNCHRONOUS_UPLOAD_BYTES = 1 << 20
+
+
+class _GlTexture(object):
+    """
+    GL texture of one image, shared by all the Textures of that image.
+    Storage is immutable, so each better image goes into a new texture id,
+    which replaces the old one once it is complete.
+    """
+    placeholder = _PLACEHOLDER
+
+    def __init__(self, is_equirectangular=False):
         self.texture_id = None
         self.is_equirectangular = is_equirectangular
-        if package is None:
-            # load a regular file name
-            img_stream = file_name
-        else:
-            # load a file from a python package
-            img_stream = pkg_resources.resource_stream(package, file_name)
-        self.image = Image.open(img_stream, 'r')
-        self.image = self.image.convert('RGBA')
+        self.uploaded = None  # the future whose pixels are in the texture, if any
+        self.uploads = []  # TextureUploads in progress
+        self.uploader = None  # TextureUploader of the context the uploads are in
+        self.is_top_down = False  # whether the rows in the texture go top down, as in some KTX files
 
-    def display_gl(self, camera, *args, **kwargs):
-        super().display_gl(camera, *args, **kwargs)
-        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture_id)
+    def create_storage(self, width, height):
+        texture_id = create_texture_storage(width, height, self.is_equirectangular)
+        largest_anisotropy = GL.glGetFloatv(GL_MAX_TEXTURE_MAX_ANISOTROPY_EXT)
+        GL.glTexParameterf(GL.GL_TEXTURE_2D, GL_TEXTURE_MAX_ANISOTROPY_EXT, largest_anisotropy)
+        return texture_id
 
-    def init_gl(self):
-        super().init_gl()
-        self.texture_id = GL.glGenTextures(1)
-        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture_id)
-        GL.glTexImage2D(
-            GL.GL_TEXTURE_2D,
-            0,  # level-of-detail
-            GL.GL_RGBA,  # internal format
-            self.image.size[0],  # width
-            self.image.size[1],  # height
-            0,  # border, must be zero
-            GL.GL_RGBA,  # format
-            GL.GL_UNSIGNED_BYTE,  # type
-            self.image.tobytes('raw', 'RGBA', 0, -1)
-        )
+    def load(self, pixels, future=None):
+        """
+        Upload pixels, at once if they are small, or else over the coming frames
+        :param pixels: RGBA array, or KtxImage of compressed mipmap levels
+        :param future: the future the pixels came from, to record as uploaded
+        """
+        if isinstance(pixels, KtxImage):
+            self.load_compressed(pixels, future)
+            return
+        height, width = pixels.shape[:2]
+        texture_id = self.create_storage(width, height)
+        self.uploader = current_resources().texture_uploader
+        if pixels.nbytes > SYNCHRONOUS_UPLOAD_BYTES:
+            def on_done(upload):
+                self.uploads = []
+                self._replace(upload.texture_id, future)
+            self.uploads = [self.uploader.submit(texture_id, pixels, on_done), ]
+            return
+        # Rows are flipped bottom up as they are copied into a pixel buffer, as in streaming
+        self.uploader.upload_now(texture_id, pixels)
+        self._replace(texture_id, future)
+
+    def load_compressed(self, image, future=None):
+        """Upload the precomputed mipmap levels of a KtxImage, at once, as they are a fraction of the size of pixels"""
+        texture_id = GL.glGenTextures(1)
+        gl_state.bind_texture(GL.GL_TEXTURE_2D, texture_id)
+        level_count = len(image.levels)
+        GL.glTexStorage2D(GL.GL_TEXTURE_2D, level_count, image.internal_format, image.width, image.height)
         GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_LINEAR)
-        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR_MIPMAP_NEAREST)
+        GL.glTexParameteri(
+            GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR_MIPMAP_NEAREST if level_count > 1 else GL.GL_LINEAR)
         if self.is_equirectangular:
             GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T, GL.GL_MIRRORED_REPEAT)
         largest_anisotropy = GL.glGetFloatv(GL_MAX_TEXTURE_MAX_ANISOTROPY_EXT)
         GL.glTexParameterf(GL.GL_TEXTURE_2D, GL_TEXTURE_MAX_ANISOTROPY_EXT, largest_anisotropy)
-        GL.glGenerateMipmap(GL.GL_TEXTURE_2D)
\ No newline at end of file
+        for level, data in enumerate(image.levels):
+            width, height = image.level_size(level)
+            GL.glCompressedTexSubImage2D(
+                GL.GL_TEXTURE_2D, level, 0, 0, width, height, image.internal_format, data)
+        self._replace(texture_id, future, image.is_top_down)
+
+    def _replace(self, texture_id, future, is_top_down=False):
+        if self.texture_id is not None:
+            GL.glDeleteTextures([self.texture_id, ])
+            gl_state.reset()  # the id may be reused
+        self.texture_id = texture_id
+        self.uploaded = future
+        self.is_top_down = is_top_down
+
+    def dispose_gl(self):
+        texture_ids = {self.texture_id, }
+        for upload in self.uploads:
+            self.uploader.cancel(upload)
+            texture_ids.add(upload.texture_id)
+        self.uploads = []
+        GL.glDeleteTextures([i for i in texture_ids if i is not None])
+        gl_state.reset()  # the ids may be reused
+        self.texture_id = None
+        self.uploaded = None
+
+
+class Texture(AutoInitRenderer):
+    """
+    2D texture of an image file. The image decodes on a background
+    thread, so constructing a Texture does not block. Until the image is
+    ready, the texture shows a low resolution proxy of it, or, before even
+    that, a flat gray placeholder. New pixels are uploaded in display_gl(),
+    on the GL thread; large images stream in over several frames.
+
+    KTX and KTX2 files upload their compressed blocks directly, as does an
+    image with a current compressed cache, from encode_texture_file().
+    """
+    target = GL.GL_TEXTURE_2D
+    gl_texture_class = _GlTexture
+
+    def __init__(self, file_name, package=None, is_equirectangular=False, proxy_size=DEFAULT_PROXY_SIZE):
+        super().__init__()
+        self.is_equirectangular = is_equirectangular
+        # Textures from the same image file share one GL texture
+        self.key = (package, file_name, is_equirectangular)
+        self._resources = None
+        self._gl_texture = self.gl_texture_class(is_equirectangular)
+        self.image_future = self._load(file_name, package)
+        self.proxy_future = None
+        if is_ktx_file(file_name):
+            proxy_size = None  # the whole file is smaller than a decoded proxy
+        if proxy_size is not None:
+            self.proxy_future = image_loader.load(file_name, package, max_size=proxy_size)
+        self.load_error = None
+
+    @property
+    def texture_id(self):
+        return self._gl_texture.texture_id
+
+    @property
+    def is_top_down(self):
+        """Whether the rows of the GL texture go top down, so shaders must flip v to sample it"""
+        return self._gl_texture.is_top_down
+
+    @property
+    def pixels(self):
+        """
+        The decoded (height, width, 4) RGBA array, top row first, or the
+        KtxImage of a compressed texture, waiting for it if need be
+        """
+        return self.image_future.result()
+
+    @property
+    def is_loaded(self):
+        """Whether the full resolution image is in the GL texture"""
+        return self._gl_texture.uploaded is self.image_future
+
+    def add_done_callback(self, callback):
+        """Call callback(future), on a background thread, as each of the proxy and the full image is decoded"""
+        for future in (self.proxy_future, self.image_future):
+            if future is not None:
+                future.add_done_callback(callback)
+
+    def display_gl(self, camera, *args, **kwargs):
+        super().display_gl(camera, *args, **kwargs)
+        self._update_gl()
+        gl_state.bind_texture(self.target, self.texture_id)
+
+    def init_gl(self):
+        super().init_gl()
+        self._resources = current_resources()
+        self._gl_texture = self._resources.textures.acquire(self.key, self._create_texture)
+        self._update_gl()
+
+    def dispose_gl(self):
+        if self._resources is not None:
+            self._resources.textures.release(self.key)
+            self._resources = None
+        self._gl_texture = self.gl_texture_class(self.is_equirectangular)
+        super().dispose_gl()
+
+    def _load(self, file_name, package):
+        """Future of the full resolution pixels"""
+        if is_ktx_file(file_name):
+            return image_loader.submit(load_ktx, file_name, package)
+        if package is None and os.path.exists(compressed_cache_file_name(file_name)):
+            return image_loader.submit(load_texture_image, file_name)
+        return image_loader.load(file_name, package)
+
+    def _ready_future(self):
+        """The future of the best decoded image that is not in the GL texture yet, or None"""
+        for future in (self.image_future, self.proxy_future):
+            if future is None or future is self._gl_texture.uploaded:
+                return None
+            if not future.done():
+                continue
+            error = future.exception()
+            if error is None:
+                return future
+            if future is self.image_future and self.load_error is None:
+                self.load_error = error
+                logger.warning(f'could not load texture image "{self.key[1]}": {error}')
+        return None
+
+    def _update_gl(self):
+        if len(self._gl_texture.uploads) > 0:
+            return  # the full image is on its way already
+        future = self._ready_future()
+        if future is not None:
+            self._gl_texture.load(future.result(), future)
+
+    def _create_texture(self):
+        gl_texture = self.gl_texture_class(self.is_equirectangular)
+        gl_texture.load(gl_texture.placeholder)
+        return gl_texture
@@ -0,0 +1,197 @@
+"""
+Block compression of images into KTX texture caches.
+
+A JPEG or PNG image uploads as uncompressed RGBA8, four bytes per pixel,
+in video memory, and each time the image is opened. Its BC1 (DXT1)
+compressed form takes half a byte per pixel, and skips decoding and
+mipmap generation. encode_texture_file() writes that form, with all its
+mipmap levels, to a sidecar KTX file; Texture loads the sidecar instead of
+the image, as long as the image has not changed since.
+
+The encoder fits each 4x4 block with a line through color space, along
+its principal axis. That is fast in numpy, but not as exact as dedicated
+encoders; KTX files made by those load just the same.
+"""
+
+import hashlib
+import logging
+import os
+import struct
+
+import numpy
+from PIL import Image
+
+from wiggle.material.image_loader import decode_image, decode_pixels
+from wiggle.material.ktx import GL_COMPRESSED_RGB_S3TC_DXT1_EXT, KtxError, KtxImage, load_ktx, save_ktx
+
+logger = logging.getLogger(__name__)
+
+CACHE_SUFFIX = '.ktx'
+SOURCE_HASH_KEY = 'wiggle.source_sha256'
+_BAND_BLOCK_ROWS = 64  # block rows encoded at once, to bound memory use
+_POWER_ITERATIONS = 4
+
+
+def compressed_cache_file_name(source_file_name, cache_dir=None):
+    """Sidecar KTX path for an image file, next to the source unless cache_dir is given"""
+    if cache_dir is None:
+        return source_file_name + CACHE_SUFFIX
+    return os.path.join(cache_dir, os.path.basename(source_file_name) + CACHE_SUFFIX)
+
+
+def file_digest(file_name, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(file_name, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _pack_rgb565(colors):
+    """uint16 RGB 5:6:5 of float colors in the range 0 to 255"""
+    rgb = numpy.rint(colors * (numpy.array([31, 63, 31]) / 255.0)).astype(numpy.uint16)
+    return (rgb[..., 0] << 11) | (rgb[..., 1] << 5) | rgb[..., 2]
+
+
+def _unpack_rgb565(packed):
+    """float32 colors in the range 0 to 255, as a decoder expands them"""
+    packed = packed.astype(numpy.uint32)
+    r = (packed >> 11) & 31
+    g = (packed >> 5) & 63
+    b = packed & 31
+    return numpy.stack([(r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2)], axis=-1).astype(numpy.float32)
+
+
+def _encode_bc1_blocks(colors):
+    """(blocks, 8) uint8 BC1 encoding of (blocks, 16, 3) float32 pixel colors"""
+    mean = colors.mean(axis=1, keepdims=True)
+    centered = colors - mean
+    covariance = numpy.einsum('bpi,bpj->bij', centered, centered)
+    axis = numpy.ones((len(colors), 3), dtype=numpy.float32)
+    for _ in range(_POWER_ITERATIONS):
+        axis = numpy.einsum('bij,bj->bi', covariance, axis)
+        axis /= numpy.maximum(numpy.linalg.norm(axis, axis=1, keepdims=True), 1e-12)
+    # Endpoints are the extreme pixels along the principal axis
+    projection = numpy.einsum('bpi,bi->bp', centered, axis)
+    block_index = numpy.arange(len(colors))
+    high = colors[block_index, projection.argmax(axis=1)]
+    low = colors[block_index, projection.argmin(axis=1)]
+    color0 = _pack_rgb565(high)
+    color1 = _pack_rgb565(low)
+    # color0 > color1 selects the four color mode; equal endpoints need only index 0
+    swap = color0 < color1
+    color0[swap], color1[swap] = color1[swap], color0[swap]
+    end0 = _unpack_rgb565(color0)
+    end1 = _unpack_rgb565(color1)
+    palette = numpy.stack([end0, end1, (2 * end0 + end1) / 3, (end0 + 2 * end1) / 3], axis=1)
+    distances = ((colors[:, :, None, :] - palette[:, None, :, :]) ** 2).sum(axis=-1)
+    indexes = distances.argmin(axis=-1).astype(numpy.uint32)
+    indexes[color0 == color1] = 0
+    # Each pixel row is one byte, first pixel in the low bits
+    shifts = (2 * numpy.arange(4, dtype=numpy.uint32))
+    row_bytes = (indexes.reshape(-1, 4, 4) << shifts).sum(axis=-1).astype(numpy.uint8)
+    result = numpy.empty((len(colors), 8), dtype=numpy.uint8)
+    result[:, 0:2] = color0.astype('<u2').view(numpy.uint8).reshape(-1, 2)
+    result[:, 2:4] = color1.astype('<u2').view(numpy.uint8).reshape(-1, 2)
+    result[:, 4:8] = row_bytes
+    return result
+
+
+def encode_bc1(pixels):
+    """
+    BC1 bytes of a (height, width, 3 or more) uint8 image, in OpenGL row
+    order. Alpha is ignored.
+    """
+    height, width = pixels.shape[:2]
+    block_rows = (height + 3) // 4
+    block_columns = (width + 3) // 4
+    # Partial blocks repeat the edge pixels
+    padded = numpy.pad(
+        pixels[..., :3], ((0, block_rows * 4 - height), (0, block_columns * 4 - width), (0, 0)), mode='edge')
+    result = numpy.empty((block_rows, block_columns, 8), dtype=numpy.uint8)
+    for start in range(0, block_rows, _BAND_BLOCK_ROWS):
+        stop = min(start + _BAND_BLOCK_ROWS, block_rows)
+        band = padded[start * 4:stop * 4].reshape(stop - start, 4, block_columns, 4, 3)
+        colors = band.transpose(0, 2, 1, 3, 4).reshape(-1, 16, 3).astype(numpy.float32)
+        result[start:stop] = _encode_bc1_blocks(colors).reshape(stop - start, block_columns, 8)
+    return result.tobytes()
+
+
+def decode_bc1(data, width, height):
+    """(height, width, 4) uint8 RGBA pixels of BC1 bytes, in OpenGL row order"""
+    block_rows = (height + 3) // 4
+    block_columns = (width + 3) // 4
+    blocks = numpy.frombuffer(data, dtype=numpy.uint8).reshape(-1, 8)
+    color0 = blocks[:, 0:2].copy().view('<u2')[:, 0]
+    color1 = blocks[:, 2:4].copy().view('<u2')[:, 0]
+    end0 = _unpack_rgb565(color0)
+    end1 = _unpack_rgb565(color1)
+    four_color = (color0 > color1)[:, None]
+    palette = numpy.stack([
+        end0, end1,
+        numpy.where(four_color, (2 * end0 + end1) / 3, (end0 + end1) / 2),
+        numpy.where(four_color, (end0 + 2 * end1) / 3, 0)], axis=1)
+    alpha = numpy.where(four_color, 255, [[255, 255, 255, 0]])
+    indexes = (blocks[:, 4:8, None] >> (2 * numpy.arange(4, dtype=numpy.uint8))) & 3
+    indexes = indexes.reshape(-1, 16).astype(numpy.intp)
+    block_index = numpy.arange(len(blocks))[:, None]
+    rgba = numpy.concatenate([
+        numpy.rint(palette[block_index, indexes]),
+        alpha[block_index, indexes][..., None]], axis=-1)
+    pixels = rgba.reshape(block_rows, block_columns, 4, 4, 4).transpose(0, 2, 1, 3, 4)
+    pixels = pixels.reshape(block_rows * 4, block_columns * 4, 4)
+    return pixels[:height, :width].astype(numpy.uint8)
+
+
+def compress_image(image):
+    """KtxImage of a PIL image, BC1 compressed, with a full mipmap chain"""
+    if image.mode in ('RGBA', 'LA', 'P') and image.convert('RGBA').getextrema()[3][0] < 255:
+        raise ValueError('image has transparent pixels, which BC1 cannot keep')
+    image = image.convert('RGB')
+    width, height = image.size
+    levels = []
+    while True:
+        levels.append(encode_bc1(numpy.asarray(image)[::-1]))  # OpenGL rows go bottom up
+        if image.size == (1, 1):
+            break
+        # OpenGL mipmap sizes round down
+        image = image.resize((max(1, image.width // 2), max(1, image.height // 2)), Image.Resampling.BOX)
+    return KtxImage(GL_COMPRESSED_RGB_S3TC_DXT1_EXT, width, height, levels)
+
+
+def encode_texture_file(file_name, cache_dir=None):
+    """Write the compressed cache of an image file, and return the KtxImage"""
+    compressed = compress_image(decode_image(file_name))
+    compressed.key_values[SOURCE_HASH_KEY] = file_digest(file_name)
+    cache_name = compressed_cache_file_name(file_name, cache_dir)
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+    save_ktx(cache_name, compressed)
+    return compressed
+
+
+def load_compressed_cached(file_name, cache_dir=None):
+    """
+    KtxImage from the compressed cache of an image file, if there is one,
+    and it is of the current contents of the file, or else None
+    """
+    cache_name = compressed_cache_file_name(file_name, cache_dir)
+    if not os.path.exists(cache_name):
+        return None
+    try:
+        compressed = load_ktx(cache_name)
+    except (OSError, ValueError, KtxError, struct.error) as error:
+        logger.warning(f'ignoring unreadable texture cache "{cache_name}": {error}')
+        return None
+    if compressed.key_values.get(SOURCE_HASH_KEY) != file_digest(file_name):
+        logger.info(f'ignoring stale texture cache "{cache_name}"')
+        return None
+    return compressed
+
+
+def load_texture_image(file_name):
+    """The compressed cache of an image file, if it is current, or else the decoded pixels"""
+    compressed = load_compressed_cached(file_name)
+    if compressed is not None:
+        return compressed
+    return decode_pixels(file_name)
@@ -0,0 +1,130 @@
+"""
+Tiled pyramids of equirectangular panoramas, for virtual texturing.
+
+A panorama too large for one texture is cut offline, by
+build_tile_pyramid(), into square tiles at successively halved
+resolutions, down to a level that fits in one tile. Each tile carries a
+border of pixels from its neighbors, wrapped around in longitude, so
+tiles filter seamlessly wherever they land in the tile cache texture.
+
+Directory layout:
+    tiles.json                   manifest: tile size, border, file format and level sizes
+    <level>/<row>_<column>.jpg   tiles, level 0 at full resolution, row 0 at the top
+"""
+
+import json
+import math
+import os
+
+import numpy
+from PIL import Image
+
+MANIFEST_NAME = 'tiles.json'
+VERSION = 1
+DEFAULT_TILE_SIZE = 256
+TILE_BORDER = 1  # pixels on each side, for bilinear filtering across tile edges
+
+
+def is_tile_pyramid(path):
+    """Whether path is a tile pyramid directory, or its manifest"""
+    if os.path.basename(path) == MANIFEST_NAME:
+        return True
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, MANIFEST_NAME))
+
+
+def _padded_tiles(pixels, tile_size, border):
+    """(row, column, tile pixels) of one level, each tile with its border"""
+    height, width = pixels.shape[:2]
+    rows = math.ceil(height / tile_size)
+    columns = math.ceil(width / tile_size)
+    # Wrap around in longitude; repeat the edge rows at the poles
+    padded = numpy.pad(pixels, ((0, 0), (border, border + columns * tile_size - width), (0, 0)), mode='wrap')
+    padded = numpy.pad(padded, ((border, border + rows * tile_size - height), (0, 0), (0, 0)), mode='edge')
+    page_size = tile_size + 2 * border
+    for row in range(rows):
+        for column in range(columns):
+            y = row * tile_size
+            x = column * tile_size
+            yield row, column, padded[y:y + page_size, x:x + page_size]
+
+
+def build_tile_pyramid(file_name, directory, tile_size=DEFAULT_TILE_SIZE, border=TILE_BORDER, format='jpg',
+                       quality=90):
+    """
+    Cut an equirectangular image file into a tile pyramid in directory.
+    The whole image is read into memory.
+    """
+    image = Image.open(file_name).convert('RGB')
+    levels = []
+    while True:
+        level = len(levels)
+        level_directory = os.path.join(directory, str(level))
+        os.makedirs(level_directory, exist_ok=True)
+        for row, column, tile in _padded_tiles(numpy.asarray(image), tile_size, border):
+            tile_image = Image.fromarray(tile)
+            tile_file_name = os.path.join(level_directory, f'{row}_{column}.{format}')
+            if format == 'jpg':
+                tile_image.save(tile_file_name, quality=quality)
+            else:
+                tile_image.save(tile_file_name)
+        levels.append(image.size)
+        if max(image.size) <= tile_size:
+            break
+        image = image.reduce(2)  # sizes round up
+    manifest = {
+        'version': VERSION,
+        'tile_size': tile_size,
+        'border': border,
+        'format': format,
+        'levels': [list(size) for size in levels],
+    }
+    with open(os.path.join(directory, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    return TilePyramid(directory)
+
+
+class TilePyramid(object):
+    """Manifest of a tile pyramid directory"""
+    def __init__(self, path):
+        """
+        :param path: the pyramid directory, or its manifest file
+        """
+        if os.path.basename(path) == MANIFEST_NAME:
+            path = os.path.dirname(path)
+        self.directory = path
+        with open(os.path.join(path, MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+        if manifest.get('version') != VERSION:
+            raise ValueError(f'unsupported tile pyramid version {manifest.get("version")}')
+        self.tile_size = manifest['tile_size']
+        self.border = manifest['border']
+        self.format = manifest['format']
+        self.levels = [tuple(size) for size in manifest['levels']]  # (width, height), finest first
+        t = self.tile_size
+        self.grid_sizes = [(math.ceil(w / t), math.ceil(h / t)) for w, h in self.levels]  # (columns, rows)
+        # Each level has a band of rows in the page table, finest first
+        self.table_rows = [0, ]
+        for columns, rows in self.grid_sizes:
+            self.table_rows.append(self.table_rows[-1] + rows)
+
+    @property
+    def level_count(self):
+        return len(self.levels)
+
+    @property
+    def page_size(self):
+        """Pixels across a tile, including its borders"""
+        return self.tile_size + 2 * self.border
+
+    @property
+    def table_shape(self):
+        """(rows, columns) of the page table, with one entry per tile of every level"""
+        return self.table_rows[-1], self.grid_sizes[0][0]
+
+    def tile_file_name(self, level, column, row):
+        return os.path.join(self.directory, str(level), f'{row}_{column}.{self.format}')
+
+    def tiles(self, level):
+        """All the (level, column, row) keys of one level"""
+        columns, rows = self.grid_sizes[level]
+        return [(level, c, r) for r in range(rows) for c in range(columns)]
@@ -0,0 +1,301 @@
+"""
+Virtual texturing of tiled panoramas, beyond GL_MAX_TEXTURE_SIZE.
+
+Only the tiles in view, at the resolutions the view needs, are in video
+memory. They occupy the slots of one cache texture, recycled least
+recently used first. A page table texture maps each tile of each level to
+its slot, or, until that tile loads, to the slot of its nearest loaded
+ancestor, so the shader always has something to show. The coarsest level
+stays loaded.
+"""
+
+import collections
+import logging
+import math
+
+import numpy
+from OpenGL import GL
+
+from wiggle.material.image_loader import image_loader
+from wiggle.material.tile_pyramid import TilePyramid
+from wiggle.render.base import AutoInitRenderer
+from wiggle.render.gl_state import gl_state
+
+logger = logging.getLogger(__name__)
+
+MAX_LEVELS = 16  # length of the tile_levels uniform array in photosphere.glsl
+DEFAULT_CACHE_SIZE = 16  # slots across the cache texture
+DEFAULT_UPLOADS_PER_FRAME = 8
+SAMPLE_COUNT = 32  # view directions across the screen, for finding the tiles in view
+# Uniforms declared in photosphere.glsl
+_LEVEL_COUNT_LOCATION = 8
+_TILE_LAYOUT_LOCATION = 9
+_LEVELS_LOCATION = 10
+_TABLE_UNIT = 1
+
+
+class TileCache(object):
+    """
+    Assignment of tiles to a fixed number of slots, evicting the least
+    recently used. Pinned tiles are never evicted, and tiles used in the
+    current frame are not evicted to make room for others.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.frame = 0
+        self._slots = collections.OrderedDict()  # key: slot, least recently used first
+        self._pinned = dict()  # key: slot
+        self._last_used = dict()  # key: frame
+        self._free = list(range(capacity - 1, -1, -1))
+
+    def __len__(self):
+        return len(self._slots) + len(self._pinned)
+
+    def __contains__(self, key):
+        return key in self._slots or key in self._pinned
+
+    def items(self):
+        """(key, slot) of every cached tile"""
+        yield from self._pinned.items()
+        yield from self._slots.items()
+
+    def begin_frame(self):
+        self.frame += 1
+
+    def touch(self, key):
+        """Mark a tile as used in the current frame"""
+        if key in self._slots:
+            self._slots.move_to_end(key)
+            self._last_used[key] = self.frame
+
+    def insert(self, key, is_pinned=False):
+        """(slot, key of the evicted tile or None) for a new tile, or None if no slot can be spared"""
+        evicted = None
+        if len(self._free) > 0:
+            slot = self._free.pop()
+        else:
+            if len(self._slots) < 1:
+                return None
+            evicted, slot = next(iter(self._slots.items()))
+            if self._last_used[evicted] >= self.frame:
+                return None  # every slot is in view
+            del self._slots[evicted]
+            del self._last_used[evicted]
+        if is_pinned:
+            self._pinned[key] = slot
+        else:
+            self._slots[key] = slot
+            self._last_used[key] = self.frame
+        return slot, evicted
+
+
+def page_table(pyramid, cache, slots_across):
+    """
+    (rows, columns, 4) uint16 page table of a TilePyramid: the slot column
+    and row, and the level, of the tile shown for each tile, and whether
+    any is loaded.
+    """
+    table = numpy.zeros(pyramid.table_shape + (4, ), dtype=numpy.uint16)
+    by_level = collections.defaultdict(list)
+    for (level, column, row), slot in cache.items():
+        by_level[level].append((column, row, slot))
+    parent = None
+    for level in reversed(range(pyramid.level_count)):
+        columns, rows = pyramid.grid_sizes[level]
+        if parent is None:
+            entries = numpy.zeros((rows, columns, 4), dtype=numpy.uint16)
+        else:
+            # Tiles not loaded show their parent, or what stands in for it
+            entries = parent[numpy.arange(rows)[:, None] // 2, numpy.arange(columns)[None, :] // 2]
+        for column, row, slot in by_level[level]:
+            entries[row, column] = (slot % slots_across, slot // slots_across, level, 1)
+        top = pyramid.table_rows[level]
+        table[top:top + rows, :columns] = entries
+        parent = entries
+    return table
+
+
+def visible_tiles(pyramid, camera, viewport_height, sample_count=SAMPLE_COUNT):
+    """
+    Set of (level, column, row) keys of the tiles a PerspectiveCamera sees,
+    at the two levels the shader blends between, from a grid of view
+    directions across the screen.
+    """
+    tan_y = math.tan(camera.fov_y / 2)
+    s = numpy.linspace(-1.0, 1.0, sample_count)
+    x, y = numpy.meshgrid(s * tan_y * camera.aspect, s * tan_y)
+    d = numpy.stack([x.ravel(), y.ravel(), numpy.full(x.size, -1.0)], axis=1)
+    length = numpy.linalg.norm(d, axis=1)
+    # Rows of the orthonormal rotation are the camera axes in world space
+    rotation = numpy.asarray(camera.rotation[:3, :3], dtype=numpy.float64)
+    direction = (d @ rotation) / length[:, None]
+    # Equirectangular coordinates, as in photosphere.glsl
+    longitude = 0.5 * numpy.arctan2(direction[:, 0], -direction[:, 2]) / math.pi + 0.5
+    latitude = numpy.arctan2(direction[:, 1], numpy.hypot(direction[:, 0], direction[:, 2]))
+    # Level 0 texels per screen pixel, in the worse of the two directions
+    pixel_angle = 2.0 * tan_y / viewport_height / length
+    width, height = pyramid.levels[0]
+    texels = pixel_angle * numpy.maximum(
+        width / (2.0 * math.pi * numpy.maximum(numpy.cos(latitude), 1e-3)), height / math.pi)
+    lod = numpy.clip(numpy.log2(numpy.maximum(texels, 1e-9)), 0, pyramid.level_count - 1)
+    finer = numpy.floor(lod).astype(int)
+    coarser = numpy.minimum(finer + 1, pyramid.level_count - 1)
+    t = pyramid.tile_size
+    keys = set()
+    for levels in (finer, coarser):
+        for level in numpy.unique(levels):
+            level = int(level)
+            mask = levels == level
+            w, h = pyramid.levels[level]
+            columns, rows = pyramid.grid_sizes[level]
+            column = numpy.minimum(longitude[mask] * w // t, columns - 1).astype(int)
+            row = numpy.clip((0.5 - latitude[mask] / math.pi) * h // t, 0, rows - 1).astype(int)  # row 0 at top
+            keys.update((level, int(c), int(r)) for c, r in zip(column, row))
+    return keys
+
+
+class VirtualTexture(AutoInitRenderer):
+    """
+    Tiled panorama texture, for SkyBoxMaterial. Each display_gl() requests
+    the tiles in view of the camera, decoded on background threads by
+    image_loader, and uploads a few of those that are ready.
+    """
+    is_top_down = False  # tile_color() in photosphere.glsl flips the rows itself
+
+    def __init__(self, path, cache_size=DEFAULT_CACHE_SIZE, uploads_per_frame=DEFAULT_UPLOADS_PER_FRAME):
+        """
+        :param path: tile pyramid directory, or its manifest, from build_tile_pyramid()
+        :param cache_size: slots across the square cache texture, if GL_MAX_TEXTURE_SIZE allows
+        """
+        super().__init__()
+        self.pyramid = TilePyramid(path)
+        if self.pyramid.level_count > MAX_LEVELS:
+            raise ValueError(f'tile pyramid has more than {MAX_LEVELS} levels')
+        self.cache_size = cache_size
+        self.uploads_per_frame = uploads_per_frame
+        self.texture_id = None  # the cache texture
+        self.table_texture_id = None
+        self.cache = None
+        self.slots_across = None
+        self._pending = dict()  # key: Future of tile pixels
+        self._failed = set()
+        self._is_table_dirty = True
+        self._callbacks = []
+        self._level_uniform = numpy.array(
+            [(w, h, self.pyramid.table_rows[level], 0) for level, (w, h) in enumerate(self.pyramid.levels)],
+            dtype=numpy.int32)
+        # Start on the coarsest level, which stays loaded
+        self._request(self.pyramid.tiles(self.pyramid.level_count - 1))
+
+    @property
+    def is_loaded(self):
+        """Whether the coarsest level, at least, is showing"""
+        return self.cache is not None and all(k in self.cache for k in self.pyramid.tiles(self.pyramid.level_count - 1))
+
+    def add_done_callback(self, callback):
+        """Call callback(future), on a background thread, as each tile is decoded"""
+        self._callbacks.append(callback)
+        for future in self._pending.values():
+            future.add_done_callback(callback)
+
+    def display_gl(self, camera, *args, **kwargs):
+        super().display_gl(camera, *args, **kwargs)
+        self.update(camera, max(camera.viewport_size[1], 1))
+        gl_state.bind_texture(GL.GL_TEXTURE_2D, self.table_texture_id, unit=_TABLE_UNIT)
+        gl_state.bind_texture(GL.GL_TEXTURE_2D, self.texture_id)
+        # Uniforms of the current program
+        GL.glUniform1i(_LEVEL_COUNT_LOCATION, self.pyramid.level_count)
+        GL.glUniform2i(_TILE_LAYOUT_LOCATION, self.pyramid.tile_size, self.pyramid.border)
+        GL.glUniform4iv(_LEVELS_LOCATION, self.pyramid.level_count, self._level_uniform)
+
+    def init_gl(self):
+        super().init_gl()
+        page_size = self.pyramid.page_size
+        largest = int(GL.glGetIntegerv(GL.GL_MAX_TEXTURE_SIZE))
+        self.slots_across = max(1, min(self.cache_size, largest // page_size))
+        self.cache = TileCache(self.slots_across ** 2)
+        self.texture_id = GL.glGenTextures(1)
+        gl_state.bind_texture(GL.GL_TEXTURE_2D, self.texture_id)
+        size = self.slots_across * page_size
+        GL.glTexStorage2D(GL.GL_TEXTURE_2D, 1, GL.GL_RGBA8, size, size)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_LINEAR)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_S, GL.GL_CLAMP_TO_EDGE)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T, GL.GL_CLAMP_TO_EDGE)
+        self.table_texture_id = GL.glGenTextures(1)
+        gl_state.bind_texture(GL.GL_TEXTURE_2D, self.table_texture_id, unit=_TABLE_UNIT)
+        rows, columns = self.pyramid.table_shape
+        GL.glTexStorage2D(GL.GL_TEXTURE_2D, 1, GL.GL_RGBA16UI, columns, rows)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_NEAREST)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_NEAREST)
+        self._is_table_dirty = True
+
+    def dispose_gl(self):
+        if self.texture_id is not None:
+            GL.glDeleteTextures([self.texture_id, self.table_texture_id])
+            gl_state.reset()  # the ids may be reused
+        self.texture_id = None
+        self.table_texture_id = None
+        self.cache = None
+        super().dispose_gl()
+
+    def update(self, camera, viewport_height):
+        """Request the tiles in view, and upload those that are decoded, coarsest first"""
+        self.cache.begin_frame()
+        top = self.pyramid.level_count - 1
+        wanted = visible_tiles(self.pyramid, camera, viewport_height)
+        wanted.update(self.pyramid.tiles(top))
+        for key in wanted:
+            self.cache.touch(key)
+        self._request(wanted)
+        # Tiles that left the view before they loaded can wait until they return
+        for key in [k for k in self._pending if k not in wanted]:
+            del self._pending[key]
+        upload_count = 0
+        for key in sorted(self._pending, reverse=True):
+            if upload_count >= self.uploads_per_frame:
+                break
+            future = self._pending[key]
+            if not future.done():
+                continue
+            del self._pending[key]
+            error = future.exception()
+            if error is not None:
+                self._failed.add(key)
+                logger.warning(f'could not load tile {key} of "{self.pyramid.directory}": {error}')
+                continue
+            placement = self.cache.insert(key, is_pinned=key[0] == top)
+            if placement is None:
+                continue  # the cache is full of tiles in view
+            self._upload_tile(placement[0], future.result())
+            upload_count += 1
+            self._is_table_dirty = True
+        if self._is_table_dirty:
+            self._upload_table()
+
+    def _request(self, keys):
+        for key in keys:
+            if key in self._pending or key in self._failed:
+                continue
+            if self.cache is not None and key in self.cache:
+                continue
+            future = image_loader.load(self.pyramid.tile_file_name(*key))
+            for callback in self._callbacks:
+                future.add_done_callback(callback)
+            self._pending[key] = future
+
+    def _upload_tile(self, slot, pixels):
+        page_size = self.pyramid.page_size
+        x = (slot % self.slots_across) * page_size
+        y = (slot // self.slots_across) * page_size
+        gl_state.bind_texture(GL.GL_TEXTURE_2D, self.texture_id)
+        # Rows stay top down; the shader flips latitude to match
+        GL.glTexSubImage2D(GL.GL_TEXTURE_2D, 0, x, y, page_size, page_size, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, pixels)
+
+    def _upload_table(self):
+        table = page_table(self.pyramid, self.cache, self.slots_across)
+        gl_state.bind_texture(GL.GL_TEXTURE_2D, self.table_texture_id, unit=_TABLE_UNIT)
+        rows, columns = self.pyramid.table_shape
+        GL.glTexSubImage2D(
+            GL.GL_TEXTURE_2D, 0, 0, 0, columns, rows, GL.GL_RGBA_INTEGER, GL.GL_UNSIGNED_SHORT, table)
+        self._is_table_dirty = False
@@ -27,6 +27,14 @@ class WireframeMaterial(BaseMaterial):
         return GL.GL_LINES
 
 
+class InstancedWireframeMaterial(WireframeMaterial):
+    """WireframeMaterial for InstancedMeshActor, with a model matrix per instance"""
+    def create_vertex_shader(self):
+        return ShaderStage(
+            [ShaderFileBlock('wiggle.glsl', 'instanced_positions.vert'), ],
+            GL.GL_VERTEX_SHADER)
+
+
 def main():
     print(WireframeMaterial.create_vertex_shader())
 
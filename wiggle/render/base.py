@@ -3,6 +3,8 @@ import enum
 
 from OpenGL import GL
 
+from wiggle.render.gl_state import gl_state
+
 
 class RenderPassType(enum.Enum):
     """
@@ -57,9 +59,16 @@ class ParentRenderer(AbstractRenderable):
         super().__init__()
         self.children = list()
 
+    def visible_children(self, *args, **kwargs):
+        """Children to display, given the display_gl() arguments"""
+        return self.children
+
     def display_gl(self, *args, **kwargs):
         super().display_gl(*args, **kwargs)
-        for c in self.children:
+        self.display_children_gl(self.visible_children(*args, **kwargs), *args, **kwargs)
+
+    def display_children_gl(self, children, *args, **kwargs):
+        for c in children:
             c.display_gl(*args, **kwargs)
 
     def dispose_gl(self):
@@ -76,16 +85,17 @@ class VaoRenderer(AbstractRenderable):
 
     def init_gl(self):
         self.vao = GL.glGenVertexArrays(1)
-        GL.glBindVertexArray(self.vao)
+        gl_state.bind_vertex_array(self.vao)
         super().init_gl()
 
     def display_gl(self, *args, **kwargs):
-        GL.glBindVertexArray(self.vao)
+        gl_state.bind_vertex_array(self.vao)
         super().display_gl(*args, **kwargs)
 
     def dispose_gl(self):
         super().dispose_gl()
         if self.vao is not None:
             GL.glDeleteVertexArrays(1, (self.vao,))
+            gl_state.reset()  # the id may be reused
         self.vao = None
 
@@ -1,14 +1,18 @@
+import numpy
 from OpenGL import GL
 
+from wiggle.geometry.bvh import ray_box_distance
 from wiggle.render.renderer import AutoInitRenderer
-from wiggle.geometry.matrix import ModelMatrix
+from wiggle.geometry.matrix import ModelMatrix, identity_matrices
 
 
 class BaseActor(AutoInitRenderer):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.model_matrix = ModelMatrix()
+        self.scene_node = None  # set when added to a Renderer
         self.is_visible = True
+        self._model_view = identity_matrices()
 
     def display_gl(self, camera, *args, **kwargs):
         if not self.is_visible:
@@ -18,6 +22,33 @@ class BaseActor(AutoInitRenderer):
     def dispose_gl(self):
         super().dispose_gl()
 
+    @property
+    def local_bounds(self):
+        """wiggle.geometry.bounds.Bounds in model coordinates, for culling, or None to always draw"""
+        return None
+
+    def ray_intersection(self, origin, direction):
+        """
+        Ray parameter t of the nearest hit of origin + t * direction, in
+        model coordinates, or None. By default the bounding box is hit.
+        """
+        bounds = self.local_bounds
+        if bounds is None:
+            return None
+        return ray_box_distance(origin, direction, bounds.box_min, bounds.box_max)
+
+    @property
+    def world_matrix(self):
+        """Model matrix, including the transforms of any parent scene nodes"""
+        if self.scene_node is None:
+            return self.model_matrix.matrix
+        return self.scene_node.world_matrix
+
+    def model_view_matrix(self, camera):
+        """camera.view_matrix @ world matrix, computed into the same array every frame"""
+        view = numpy.asarray(camera.view_matrix, dtype=numpy.float32)
+        return numpy.dot(view, self.world_matrix, out=self._model_view)
+
     @property
     def model_center(self):
         return self.model_matrix.model_center
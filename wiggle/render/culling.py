@@ -0,0 +1,144 @@
+import numpy
+
+from wiggle.geometry.bounds import frustum_planes, spheres_in_frustum, transform_boxes, transform_spheres
+from wiggle.geometry.bvh import BoundingVolumeHierarchy
+
+
+class ActorHierarchy(object):
+    """
+    Bounding volume hierarchy over the world bounds of some actors, for
+    frustum culling and ray picking.
+
+    Actors with a local_bounds attribute that is not None are included.
+    update() refits the hierarchy to the current world matrices, which is
+    skipped when they all come from one scene graph that has not changed.
+    Actors whose local bounds can change, such as InstancedMeshActor,
+    have a bounds_version attribute that update() also checks.
+    """
+    def __init__(self, actors):
+        self.actors = [a for a in actors if getattr(a, 'local_bounds', None) is not None]
+        bounds = [a.local_bounds for a in self.actors]
+        self._box_mins = numpy.array([b.box_min for b in bounds], dtype=numpy.float64).reshape((-1, 3))
+        self._box_maxs = numpy.array([b.box_max for b in bounds], dtype=numpy.float64).reshape((-1, 3))
+        self._centers = numpy.array([b.center for b in bounds], dtype=numpy.float64).reshape((-1, 3))
+        self._radii = numpy.array([b.radius for b in bounds], dtype=numpy.float64)
+        self._versioned = [i for i, a in enumerate(self.actors) if hasattr(a, 'bounds_version')]
+        self._bounds_versions = [self.actors[i].bounds_version for i in self._versioned]
+        nodes = [getattr(a, 'scene_node', None) for a in self.actors]
+        graphs = set(id(n.graph) if n is not None else None for n in nodes)
+        if len(nodes) > 0 and None not in graphs and len(graphs) == 1:
+            self._graph = nodes[0].graph
+            self._node_indexes = numpy.array([n.index for n in nodes], dtype=numpy.int64)
+        else:
+            self._graph = None
+            self._node_indexes = None
+        self._graph_version = None
+        self.bvh = None
+        self.world_matrices = None
+        self.world_centers = None
+        self.world_radii = None
+
+    def __len__(self):
+        return len(self.actors)
+
+    def _update_local_bounds(self):
+        """Re-read the local bounds of actors whose bounds_version changed; True if any did"""
+        is_changed = False
+        for n, i in enumerate(self._versioned):
+            actor = self.actors[i]
+            if actor.bounds_version == self._bounds_versions[n]:
+                continue
+            self._bounds_versions[n] = actor.bounds_version
+            bounds = actor.local_bounds
+            if bounds is None:
+                continue
+            self._box_mins[i] = bounds.box_min
+            self._box_maxs[i] = bounds.box_max
+            self._centers[i] = bounds.center
+            self._radii[i] = bounds.radius
+            is_changed = True
+        return is_changed
+
+    def update(self):
+        is_bounds_changed = self._update_local_bounds()
+        if self._graph is not None:
+            self._graph.update()
+            if self.bvh is not None and self._graph.version == self._graph_version and not is_bounds_changed:
+                return
+            self._graph_version = self._graph.version
+            world = self._graph.world_matrices()[self._node_indexes]
+        else:
+            world = numpy.array([a.world_matrix for a in self.actors], dtype=numpy.float32).reshape((-1, 4, 4))
+        self.world_matrices = world
+        self.world_centers, self.world_radii = transform_spheres(world, self._centers, self._radii)
+        box_mins, box_maxs = transform_boxes(world, self._box_mins, self._box_maxs)
+        if self.bvh is None:
+            self.bvh = BoundingVolumeHierarchy(box_mins, box_maxs)
+        else:
+            self.bvh.refit(box_mins, box_maxs)
+
+    def frustum_query(self, planes):
+        """Sorted indexes into actors of those whose bounds might be inside the (6, 4) frustum planes"""
+        self.update()
+        candidates = self.bvh.frustum_query(planes)
+        # Spheres are tighter for round objects near frustum corners
+        return candidates[spheres_in_frustum(planes, self.world_centers[candidates], self.world_radii[candidates])]
+
+    def ray_cast(self, origin, direction):
+        """
+        Nearest actor hit by the world space ray origin + t * direction, as
+        (actor, t), or None. Each actor's ray_intersection() makes the exact
+        test, in its model coordinates.
+        """
+        self.update()
+        origin = numpy.asarray(origin, dtype=numpy.float64)
+        direction = numpy.asarray(direction, dtype=numpy.float64)
+
+        def hit_test(index):
+            # An unnormalized model space direction keeps t the same as in world space
+            inverse = numpy.linalg.inv(numpy.asarray(self.world_matrices[index], dtype=numpy.float64))
+            local_origin = inverse[:3, :3] @ origin + inverse[:3, 3]
+            return self.actors[index].ray_intersection(local_origin, inverse[:3, :3] @ direction)
+
+        hit = self.bvh.ray_cast(origin, direction, hit_test)
+        if hit is None:
+            return None
+        return self.actors[hit[0]], hit[1]
+
+
+class FrustumCuller(object):
+    """
+    Chooses which children of a render pass intersect the camera view frustum.
+
+    Children without bounds are always kept. The ActorHierarchy is rebuilt
+    only when the list of children changes.
+    """
+    def __init__(self):
+        self._children = list()
+        self._hierarchy = None
+        self._bounded = None  # index into children of each actor in the hierarchy
+        self.culled_count = 0  # children skipped by the last call to visible()
+
+    def hierarchy(self, children):
+        if self._hierarchy is None or children != self._children:
+            self._children = list(children)
+            self._hierarchy = ActorHierarchy(children)
+            positions = {id(c): i for i, c in enumerate(children)}
+            self._bounded = numpy.array([positions[id(a)] for a in self._hierarchy.actors], dtype=numpy.int64)
+        return self._hierarchy
+
+    def visible(self, children, camera):
+        """Children that might be visible, in their original order"""
+        hierarchy = self.hierarchy(children)
+        self.culled_count = 0
+        if len(hierarchy) < 1:
+            return children
+        planes = frustum_planes(numpy.dot(camera.projection, camera.view_matrix))
+        is_visible = numpy.zeros(len(hierarchy), dtype=bool)
+        is_visible[hierarchy.frustum_query(planes)] = True
+        self.culled_count = len(is_visible) - int(numpy.count_nonzero(is_visible))
+        if self.culled_count < 1:
+            return children
+        keep = numpy.ones(len(children), dtype=bool)
+        keep[self._bounded] = is_visible
+        return [c for c, k in zip(children, keep.tolist()) if k]
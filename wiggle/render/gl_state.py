@@ -0,0 +1,122 @@
+"""
+Cache of the current OpenGL state, to skip redundant state changes.
+
+All rendering code shares the module level instance, gl_state, just as it
+shares the one current GL context. Code that changes cached state with
+OpenGL.GL directly should call gl_state.reset() afterwards.
+
+Every call made through the cache is counted, per frame, so the effect of
+state sorting can be measured. The gl attribute can be any object with
+the OpenGL.GL functions, such as a recorder in tests without a context.
+"""
+
+from collections import Counter
+
+from OpenGL import GL
+
+
+class GlState(object):
+    def __init__(self, gl=GL):
+        self.gl = gl
+        self.call_counts = Counter()  # GL calls issued since begin_frame(), by function name
+        self.skipped_count = 0  # redundant calls skipped since begin_frame()
+        self.reset()
+
+    def reset(self):
+        """Forget the cached state, as after GL state was changed outside this cache"""
+        self._program = None
+        self._vertex_array = None
+        self._active_texture_unit = None
+        self._textures = dict()  # (unit, target): texture
+        self._capabilities = dict()  # capability: is enabled
+        self._depth_mask = None
+        self._depth_func = None
+
+    def begin_frame(self):
+        """Reset the cache and the call counters. GL state may have changed between frames."""
+        self.reset()
+        self.call_counts.clear()
+        self.skipped_count = 0
+
+    @property
+    def call_count(self):
+        """Total GL calls issued since begin_frame()"""
+        return sum(self.call_counts.values())
+
+    def _call(self, name, *args):
+        self.call_counts[name] += 1
+        return getattr(self.gl, name)(*args)
+
+    def use_program(self, program):
+        if program == self._program:
+            self.skipped_count += 1
+            return
+        self._call('glUseProgram', program)
+        self._program = program
+
+    def bind_vertex_array(self, vertex_array):
+        if vertex_array == self._vertex_array:
+            self.skipped_count += 1
+            return
+        self._call('glBindVertexArray', vertex_array)
+        self._vertex_array = vertex_array
+
+    def bind_texture(self, target, texture, unit=0):
+        """Bind texture to unit, and leave that unit active, so calls that modify the texture find it"""
+        if unit != self._active_texture_unit:
+            self._call('glActiveTexture', GL.GL_TEXTURE0 + unit)
+            self._active_texture_unit = unit
+        key = (unit, target)
+        if self._textures.get(key) == texture:
+            self.skipped_count += 1
+            return
+        self._call('glBindTexture', target, texture)
+        self._textures[key] = texture
+
+    def enable(self, capability):
+        if self._capabilities.get(capability) is True:
+            self.skipped_count += 1
+            return
+        self._call('glEnable', capability)
+        self._capabilities[capability] = True
+
+    def disable(self, capability):
+        if self._capabilities.get(capability) is False:
+            self.skipped_count += 1
+            return
+        self._call('glDisable', capability)
+        self._capabilities[capability] = False
+
+    def depth_mask(self, flag):
+        flag = bool(flag)
+        if flag == self._depth_mask:
+            self.skipped_count += 1
+            return
+        self._call('glDepthMask', flag)
+        self._depth_mask = flag
+
+    def depth_func(self, func):
+        if func == self._depth_func:
+            self.skipped_count += 1
+            return
+        self._call('glDepthFunc', func)
+        self._depth_func = func
+
+    def uniform_matrix4(self, location, matrix):
+        """Upload one row major 4x4 matrix"""
+        self._call('glUniformMatrix4fv', location, 1, True, matrix)
+
+    def draw_elements(self, mode, count, index_type, offset, base_vertex=0, instance_count=1):
+        if instance_count != 1:
+            if base_vertex == 0:
+                self._call('glDrawElementsInstanced', mode, count, index_type, offset, instance_count)
+            else:
+                self._call(
+                    'glDrawElementsInstancedBaseVertex', mode, count, index_type, offset, instance_count, base_vertex)
+        elif base_vertex == 0:
+            self._call('glDrawElements', mode, count, index_type, offset)
+        else:
+            self._call('glDrawElementsBaseVertex', mode, count, index_type, offset, base_vertex)
+
+
+gl_state = GlState()
@@ -4,12 +4,12 @@ import numpy
 from OpenGL import GL
 from OpenGL.arrays import vbo
 
-from wiggle.geometry.matrix import Matrix4f
 from wiggle.material import BaseMaterial
 from wiggle.material.texture import Texture
 from wiggle.material.shader import ShaderStage, ShaderFileBlock
 from wiggle.render.base import RenderPassType
 from wiggle.render.base_actor import BaseActor
+from wiggle.render.gl_state import gl_state
 from wiggle.render.renderer import VaoRenderer
 
 
@@ -82,17 +82,10 @@ class InfinitePointActor(BaseActor, VaoRenderer):
             return
         super().display_gl(camera=camera, *args, **kwargs)
         self.material.display_gl(camera=camera, *args, **kwargs)
-        for name, location in self.material.mvp_matrices.items():
-            if name == 'projection':
-                GL.glUniformMatrix4fv(location, 1, True, camera.projection)
-            elif name == 'model':
-                GL.glUniformMatrix4fv(location, 1, True, self.model_matrix.matrix)
-            elif name == 'view':
-                GL.glUniformMatrix4fv(location, 1, True, camera.view_matrix)
-            elif name == 'model_view':
-                GL.glUniformMatrix4fv(location, 1, True, Matrix4f(camera.view_matrix @ self.model_matrix.matrix).pack())
+        self.material.set_camera_matrices(camera)
+        self.material.set_model_matrices(self, camera)
         self.vbo.bind()
         self.vbo_styles.bind()
-        GL.glEnable(GL.GL_POINT_SPRITE)
-        GL.glEnable(GL.GL_VERTEX_PROGRAM_POINT_SIZE)
+        gl_state.enable(GL.GL_POINT_SPRITE)
+        gl_state.enable(GL.GL_VERTEX_PROGRAM_POINT_SIZE)
         GL.glDrawArrays(GL.GL_POINTS, 0, self.points.size//3)
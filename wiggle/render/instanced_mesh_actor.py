@@ -0,0 +1,170 @@
+import numpy
+from OpenGL import GL
+from OpenGL.arrays import vbo
+
+from wiggle.geometry.bounds import Bounds, transform_boxes, transform_spheres
+from wiggle.geometry.bvh import ray_box_distances
+from wiggle.geometry.mesh import CubeMesh
+from wiggle.material.normal import InstancedNormalMaterial
+from wiggle.material.wireframe import InstancedWireframeMaterial
+from wiggle.render.gl_state import gl_state
+from wiggle.render.mesh_actor import MeshActor
+
+_MATRIX_BYTES = 16 * 4
+
+
+class InstancedMeshActor(MeshActor):
+    """
+    Many copies of one mesh and material, drawn with a single instanced
+    draw call. Each instance has its own model matrix, in a per-instance
+    vertex attribute, applied before the actor's own model matrix.
+
+    Materials must read the instance matrix from vertex attribute
+    locations 3 through 6, like InstancedNormalMaterial does.
+    """
+    instance_location = 3
+
+    def __init__(self, mesh=CubeMesh(), instance_matrices=None, material=InstancedNormalMaterial(),
+                 wireframe_material=InstancedWireframeMaterial(), *args, **kwargs):
+        """
+        :param instance_matrices: (N, 4, 4) model matrices, row major like wiggle.geometry.matrix
+        """
+        super().__init__(mesh=mesh, material=material, wireframe_material=wireframe_material, *args, **kwargs)
+        # Stored transposed, because GLSL reads a mat4 attribute one column at a time
+        self._columns = numpy.zeros((0, 4, 4), dtype=numpy.float32)
+        self.instance_vbo = None
+        self._is_resized = True
+        self._dirty_range = None  # (start, stop) of instances changed since the last upload
+        self._bounds = None
+        self.bounds_version = 0  # increments when local_bounds changes
+        if instance_matrices is not None:
+            self.instance_matrices = instance_matrices
+
+    @property
+    def instance_count(self):
+        return len(self._columns)
+
+    @property
+    def instance_matrices(self):
+        """Read only (N, 4, 4) row major view of the instance model matrices"""
+        matrices = self._columns.transpose(0, 2, 1)
+        matrices.flags.writeable = False
+        return matrices
+
+    @instance_matrices.setter
+    def instance_matrices(self, matrices):
+        matrices = numpy.asarray(matrices, dtype=numpy.float32).reshape((-1, 4, 4))
+        self._columns = numpy.ascontiguousarray(matrices.transpose(0, 2, 1))
+        self._is_resized = True
+        self._dirty_range = None
+        self._bounds_changed()
+
+    def set_instance_matrices(self, matrices, start=0):
+        """
+        Replace the model matrices of instances start, start + 1, ... in
+        place. Changes are uploaded with one buffer sub-upload before the
+        next draw.
+        """
+        matrices = numpy.asarray(matrices, dtype=numpy.float32).reshape((-1, 4, 4))
+        stop = start + len(matrices)
+        if start < 0 or stop > self.instance_count:
+            raise IndexError(f'instances {start} to {stop} are not all in range 0 to {self.instance_count}')
+        self._columns[start:stop] = matrices.transpose(0, 2, 1)
+        if self._dirty_range is not None:
+            start, stop = min(start, self._dirty_range[0]), max(stop, self._dirty_range[1])
+        self._dirty_range = (start, stop)
+        self._bounds_changed()
+
+    def _bounds_changed(self):
+        self._bounds = None
+        self.bounds_version += 1
+
+    @property
+    def local_bounds(self):
+        """Bounds enclosing every instance, in the model coordinates of the actor"""
+        if not self.is_cullable:
+            return None
+        if self._bounds is None:
+            mesh_bounds = self.mesh.bounds
+            if self.instance_count < 1:
+                self._bounds = Bounds.from_positions(())
+                return self._bounds
+            matrices = self.instance_matrices
+            box_mins, box_maxs = transform_boxes(matrices, mesh_bounds.box_min, mesh_bounds.box_max)
+            centers, radii = transform_spheres(matrices, mesh_bounds.center, mesh_bounds.radius)
+            box_min, box_max = box_mins.min(axis=0), box_maxs.max(axis=0)
+            center = (box_min + box_max) / 2
+            radius = float((numpy.linalg.norm(centers - center, axis=1) + radii).max())
+            self._bounds = Bounds(box_min, box_max, center, radius)
+        return self._bounds
+
+    def ray_intersection(self, origin, direction):
+        """Nearest hit of origin + t * direction on any instance, in actor model coordinates"""
+        if not self.is_cullable or self.instance_count < 1:
+            return None
+        mesh = self.mesh
+        inverse = numpy.linalg.inv(numpy.asarray(self.instance_matrices, dtype=numpy.float64))
+        # Unnormalized instance space directions keep t the same for every instance
+        origins = numpy.einsum('nij,j->ni', inverse[:, :3, :3], origin) + inverse[:, :3, 3]
+        directions = numpy.einsum('nij,j->ni', inverse[:, :3, :3], direction)
+        bounds = mesh.bounds
+        near, far = ray_box_distances(origins, directions, bounds.box_min, bounds.box_max)
+        candidates = numpy.flatnonzero((near <= far) & (far >= 0))
+        best = None
+        for i in candidates[numpy.argsort(near[candidates], kind='stable')]:
+            if best is not None and near[i] > best:
+                break
+            hit = mesh.ray_cast(origins[i], directions[i])
+            if hit is not None and (best is None or hit[1] < best):
+                best = hit[1]
+        return best
+
+    def _select_lod_vbo(self, camera):
+        # Instances spread over the scene have no single screen size
+        return self.mesh_vbo
+
+    def _upload_instances(self):
+        if self.instance_vbo is None:
+            self.instance_vbo = vbo.VBO(self._columns, usage=GL.GL_DYNAMIC_DRAW)
+        elif self._is_resized:
+            self.instance_vbo.set_array(self._columns)
+        self.instance_vbo.bind()  # uploads the whole array, after creation or resizing
+        if self._dirty_range is not None and not self._is_resized:
+            start, stop = self._dirty_range
+            GL.glBufferSubData(
+                GL.GL_ARRAY_BUFFER, start * _MATRIX_BYTES, (stop - start) * _MATRIX_BYTES, self._columns[start:stop])
+        self._is_resized = False
+        self._dirty_range = None
+
+    def _enable_instance_attributes(self):
+        for column in range(4):
+            location = self.instance_location + column
+            GL.glEnableVertexAttribArray(location)
+            GL.glVertexAttribPointer(
+                location, 4, GL.GL_FLOAT, False, _MATRIX_BYTES, self.instance_vbo + column * 16)
+            GL.glVertexAttribDivisor(location, 1)
+
+    def _disable_instance_attributes(self):
+        # The vertex array object is shared with actors that are not instanced
+        for column in range(4):
+            GL.glDisableVertexAttribArray(self.instance_location + column)
+
+    def draw_gl(self, camera, material, mesh_vbo):
+        if self.instance_count < 1:
+            return
+        material.set_model_matrices(self, camera)
+        mesh_vbo.primitive = material.primitive()
+        if not mesh_vbo.is_initialized:
+            mesh_vbo.init_gl()
+        gl_state.bind_vertex_array(mesh_vbo.vao)
+        self._upload_instances()
+        self._enable_instance_attributes()
+        mesh_vbo.display_gl(camera=camera, instance_count=self.instance_count)
+        self._disable_instance_attributes()
+
+    def dispose_gl(self):
+        if self.instance_vbo is not None:
+            self.instance_vbo.delete()
+            self.instance_vbo = None
+        self._is_resized = True
+        super().dispose_gl()
@@ -1,49 +1,145 @@
+import ctypes
+import logging
+
 import numpy
 from OpenGL import GL
 from OpenGL.arrays import vbo
 
 from wiggle.geometry.mesh import CubeMesh
+from wiggle.geometry.mesh.lod import DEFAULT_PIXEL_TOLERANCE, build_lods_async, select_lod
+from wiggle.geometry.mesh.primitives import TRIANGLE_STRIP, index_dtype, partition_elements
 from wiggle.render.base_actor import BaseActor
 from wiggle.render.base import AutoInitRenderer, VaoRenderer
+from wiggle.render.gl_state import gl_state
+from wiggle.render.resource_cache import array_key, current_resources
 from wiggle.material.wireframe import WireframeMaterial
 from wiggle.material.normal import NormalMaterial
-from wiggle.geometry.matrix import Matrix4f
+
+logger = logging.getLogger(__name__)
+
+_gl_index_types = {
+    numpy.dtype(numpy.uint8): GL.GL_UNSIGNED_BYTE,
+    numpy.dtype(numpy.uint16): GL.GL_UNSIGNED_SHORT,
+    numpy.dtype(numpy.uint32): GL.GL_UNSIGNED_INT,
+}
 
 
 class MeshIndexBuffer(AutoInitRenderer):
-    def __init__(self, mesh, primitive_type):
+    """
+    Element buffer for drawing one mesh as lines or triangles.
+
+    The index type is the smallest of uint8, uint16 and uint32 that fits the
+    mesh. Meshes with more vertexes than max_index_type can address are
+    split into sub-draws, each with its own compact block of vertexes.
+    """
+    max_index_type = numpy.uint32
+
+    def __init__(self, mesh, primitive_type, vertex_location=0):
         super().__init__()
         self.mesh = mesh
         self.primitive_type = primitive_type
         self.out_primitive_type = primitive_type
+        self.vertex_location = vertex_location
         self.ibo = None
+        self._ibo_key = None
+        self._resources = None
         self.index_type_gl = GL.GL_UNSIGNED_SHORT
         self.index_type_numpy = numpy.uint16
         self.primitive_count = 0
+        self.restart_index = None
+        self.vertex_vbo = None  # only for partitioned meshes
+        self.sub_draws = []  # (index count, byte offset, base vertex)
 
     def init_gl(self):
         super().init_gl()
         if self.primitive_type == GL.GL_LINES:
             indexes = self.mesh.edges
+            self.restart_index = None
         elif self.primitive_type == GL.GL_TRIANGLES:
-            indexes = self.mesh.triangle_strips
-            self.out_primitive_type = GL.GL_TRIANGLE_STRIP
+            primitives = self.mesh.primitives
+            indexes = primitives.indexes
+            if primitives.mode == TRIANGLE_STRIP:
+                self.out_primitive_type = GL.GL_TRIANGLE_STRIP
+            else:
+                self.out_primitive_type = GL.GL_TRIANGLES
+            self.restart_index = primitives.restart_index
         else:
             raise ValueError('primitive type not supported')
-        self.primitive_count = len(indexes)
-        index_array = numpy.array(indexes, dtype=numpy.uint16).flatten()
+        max_dtype = numpy.dtype(self.max_index_type)
+        try:
+            dtype = index_dtype(len(self.mesh.vertexes), self.restart_index is not None)
+        except ValueError:
+            dtype = None  # too many vertexes for any index type
+        if dtype is not None and dtype.itemsize <= max_dtype.itemsize:
+            index_array = self._single_draw(indexes, dtype)
+        else:
+            index_array = self._partitioned_draws(indexes, max_dtype)
+        self.index_type_gl = _gl_index_types[numpy.dtype(self.index_type_numpy)]
         self.primitive_count = len(index_array)
-        self.ibo = vbo.VBO(index_array, target=GL.GL_ELEMENT_ARRAY_BUFFER)
+        # Identical index arrays, as of meshes with the same topology, share one buffer
+        self._resources = current_resources()
+        self._ibo_key = array_key(index_array, GL.GL_ELEMENT_ARRAY_BUFFER)
+        self.ibo = self._resources.buffers.acquire(
+            self._ibo_key, lambda: vbo.VBO(index_array, target=GL.GL_ELEMENT_ARRAY_BUFFER))
+
+    def _single_draw(self, indexes, dtype):
+        self.index_type_numpy = dtype.type
+        indexes = numpy.asarray(indexes).reshape(-1)
+        index_array = indexes.astype(self.index_type_numpy)
+        if self.restart_index is not None:
+            # Restart marker is the largest value of whatever index type is used
+            index_array[indexes == self.restart_index] = numpy.iinfo(self.index_type_numpy).max
+        self.sub_draws = [(len(index_array), 0, 0), ]
+        return index_array
 
-    def display_gl(self, *args, **kwargs):
+    def _partitioned_draws(self, indexes, max_dtype):
+        if self.out_primitive_type == GL.GL_TRIANGLE_STRIP:
+            # Strips cannot be cut at arbitrary points, so partition the equivalent triangle list
+            elements = self.mesh.primitives.triangles()
+            self.out_primitive_type = GL.GL_TRIANGLES
+            self.restart_index = None
+        elif self.out_primitive_type == GL.GL_LINES:
+            elements = numpy.asarray(indexes).reshape((-1, 2))
+        else:
+            elements = numpy.asarray(indexes).reshape((-1, 3))
+        self.index_type_numpy = max_dtype.type
+        partitions = partition_elements(elements, int(numpy.iinfo(max_dtype).max) + 1)
+        self.sub_draws = []
+        index_arrays = []
+        byte_offset = 0
+        base_vertex = 0
+        for p in partitions:
+            index_arrays.append(p.indexes.reshape(-1).astype(self.index_type_numpy))
+            self.sub_draws.append((p.indexes.size, byte_offset, base_vertex))
+            byte_offset += index_arrays[-1].nbytes
+            base_vertex += len(p.vertex_ids)
+        positions = numpy.asarray(self.mesh.vertexes, dtype=numpy.float32)
+        self.vertex_vbo = vbo.VBO(positions[numpy.concatenate([p.vertex_ids for p in partitions])])
+        return numpy.concatenate(index_arrays)
+
+    def display_gl(self, *args, instance_count=1, **kwargs):
         super().display_gl(*args, **kwargs)
+        if self.vertex_vbo is not None:
+            self.vertex_vbo.bind()
+            GL.glVertexAttribPointer(self.vertex_location, 3, GL.GL_FLOAT, False, 0, self.vertex_vbo)
         self.ibo.bind()
-        GL.glDrawElements(self.out_primitive_type, self.primitive_count, self.index_type_gl, None)
+        if self.restart_index is not None:
+            gl_state.enable(GL.GL_PRIMITIVE_RESTART)
+            GL.glPrimitiveRestartIndex(int(numpy.iinfo(self.index_type_numpy).max))
+        else:
+            gl_state.disable(GL.GL_PRIMITIVE_RESTART)
+        for count, byte_offset, base_vertex in self.sub_draws:
+            gl_state.draw_elements(
+                self.out_primitive_type, count, self.index_type_gl, ctypes.c_void_p(byte_offset), base_vertex,
+                instance_count)
 
     def dispose_gl(self):
         if self.ibo is not None:
-            self.ibo.delete()
+            self._resources.buffers.release(self._ibo_key)
             self.ibo = None
+        if self.vertex_vbo is not None:
+            self.vertex_vbo.delete()
+            self.vertex_vbo = None
         super().dispose_gl()
 
 
@@ -52,31 +148,40 @@ class MeshVbo(AutoInitRenderer, VaoRenderer):
         super().__init__()
         self.mesh = mesh
         self.vbo = None
+        self._vbo_key = None
+        self._resources = None
         self.ibos = dict()
         self._primitive = None
+        self.vpos_location = 0  # todo: less hard coded please
 
     def init_gl(self):
         super().init_gl()
-        vpos_location = 0  # todo: less hard coded please
-        vertex_array = numpy.array(self.mesh.vertexes, dtype=numpy.float32)
-        self.vbo = vbo.VBO(vertex_array)
-        GL.glEnableVertexAttribArray(vpos_location)
+        # No copy when the mesh is already float32, e.g. memory-mapped from a mesh cache
+        vertex_array = numpy.asarray(self.mesh.vertexes, dtype=numpy.float32)
+        self._resources = current_resources()
+        self._vbo_key = array_key(vertex_array, GL.GL_ARRAY_BUFFER)
+        self.vbo = self._resources.buffers.acquire(self._vbo_key, lambda: vbo.VBO(vertex_array))
+        GL.glEnableVertexAttribArray(self.vpos_location)
         self.vbo.bind()
-        GL.glVertexAttribPointer(vpos_location, 3, GL.GL_FLOAT, False, 0, self.vbo)
+        GL.glVertexAttribPointer(self.vpos_location, 3, GL.GL_FLOAT, False, 0, self.vbo)
 
-    def display_gl(self, camera, *args, **kwargs):
+    def display_gl(self, camera, *args, instance_count=1, **kwargs):
         if self._primitive is None:
             raise ValueError()
         super().display_gl(camera=camera, *args, **kwargs)
-        self.vbo.bind()
+        # The vertex attribute pointer is already recorded in the vertex array object
         if self._primitive not in self.ibos:
-            self.ibos[self._primitive] = MeshIndexBuffer(self.mesh, self._primitive)
+            self.ibos[self._primitive] = MeshIndexBuffer(self.mesh, self._primitive, self.vpos_location)
         ibo = self.ibos[self._primitive]
-        ibo.display_gl(camera=camera, *args, **kwargs)
+        ibo.display_gl(camera=camera, *args, instance_count=instance_count, **kwargs)
+        if ibo.vertex_vbo is not None:
+            # Partitioned index buffers point the vertex attribute at their own vertexes
+            self.vbo.bind()
+            GL.glVertexAttribPointer(self.vpos_location, 3, GL.GL_FLOAT, False, 0, self.vbo)
 
     def dispose_gl(self):
         if self.vbo is not None:
-            self.vbo.delete()
+            self._resources.buffers.release(self._vbo_key)
             self.vbo = None
         for i in self.ibos.values():
             i.dispose_gl()
@@ -102,30 +207,120 @@ class MeshActor(BaseActor):
         super().__init__(*args, **kwargs)
         self.material = material
         self.wireframe_material = wireframe_material
-        self.mesh_vbo = MeshVbo(mesh)
+        self.mesh = mesh
+        self.mesh_vbo = None  # shared with the other actors of the mesh in the same GL context, by init_gl()
+        self._resources = None
         self.wireframe = False
+        self.is_cullable = True
+        # Levels of detail, finest first; just the full mesh until enable_lods() is done
+        self.lod_vbos = [None, ]
+        self.lod_errors = [0.0, ]
+        self.lod_level = 0
+        self.lod_pixel_tolerance = DEFAULT_PIXEL_TOLERANCE
+        self._lod_future = None
+
+    def _acquire_mesh_vbo(self):
+        """Share one MeshVbo among the actors of a mesh in the current GL context"""
+        self._resources = current_resources()
+        self.mesh_vbo = self._resources.mesh_vbos.acquire(id(self.mesh), lambda: MeshVbo(self.mesh))
+        self.lod_vbos[0] = self.mesh_vbo
+
+    @property
+    def local_bounds(self):
+        """Bounds of the full mesh, in model coordinates, or None if it should never be culled"""
+        if not self.is_cullable:
+            return None
+        return self.mesh.bounds
+
+    def ray_intersection(self, origin, direction):
+        if not self.is_cullable:
+            return None
+        hit = self.mesh.ray_cast(origin, direction)
+        if hit is None:
+            return None
+        return hit[1]
+
+    def enable_lods(self, **kwargs):
+        """
+        Start simplifying the mesh on a background thread. Once that is
+        done, display_gl() draws the coarsest level whose error stays within
+        lod_pixel_tolerance on screen.
+
+        :param kwargs: passed to wiggle.geometry.mesh.lod.load_lods_cached()
+        """
+        self._lod_future = build_lods_async(self.mesh, **kwargs)
+
+    def _update_lods(self):
+        if self._lod_future is None or not self._lod_future.done():
+            return
+        future = self._lod_future
+        self._lod_future = None
+        try:
+            lods = future.result()
+        except Exception as error:
+            logger.warning(f'could not build levels of detail for mesh "{self.mesh.name}": {error}')
+            return
+        for v in self.lod_vbos[1:]:
+            v.dispose_gl()
+        self.lod_vbos = [self.mesh_vbo, ] + [MeshVbo(lod.mesh) for lod in lods[1:]]
+        self.lod_errors = [lod.error for lod in lods]
+
+    def _select_lod_vbo(self, camera):
+        self._update_lods()
+        if len(self.lod_vbos) < 2:
+            return self.mesh_vbo
+        bounds = self.mesh.bounds
+        model_view = self.model_view_matrix(camera)
+        self.lod_level = select_lod(
+            self.lod_errors, bounds.center, bounds.radius, model_view, camera.projection, camera.viewport_size[1],
+            self.lod_pixel_tolerance)
+        return self.lod_vbos[self.lod_level]
 
     def init_gl(self):
         super().init_gl()
-        self.mesh_vbo.init_gl()
+        if self.mesh_vbo is None:
+            self._acquire_mesh_vbo()
+        if not self.mesh_vbo.is_initialized:
+            self.mesh_vbo.init_gl()
+
+    @property
+    def current_material(self):
+        return self.wireframe_material if self.wireframe else self.material
 
     def display_gl(self, camera, *args, **kwargs):
         super().display_gl(camera=camera, *args, **kwargs)
-        mat = self.wireframe_material if self.wireframe else self.material
+        mat = self.current_material
+        if not mat.has_shader:
+            return
         mat.display_gl(camera, *args, **kwargs)
-        for name, location in mat.mvp_matrices.items():
-            if name == 'projection':
-                GL.glUniformMatrix4fv(location, 1, True, camera.projection)
-            elif name == 'model':
-                GL.glUniformMatrix4fv(location, 1, True, self.model_matrix.matrix)
-            elif name == 'view':
-                GL.glUniformMatrix4fv(location, 1, True, camera.view_matrix)
-            elif name == 'model_view':
-                GL.glUniformMatrix4fv(location, 1, True, Matrix4f(camera.view_matrix @ self.model_matrix.matrix).pack())
-        self.mesh_vbo.primitive = mat.primitive()
-        self.mesh_vbo.display_gl(camera=camera, *args, **kwargs)
+        mat.set_camera_matrices(camera)
+        self.draw_gl(camera, mat, self._select_lod_vbo(camera))
+
+    def enqueue_gl(self, queue, camera):
+        """Add this actor's draw to a RenderQueue, instead of drawing it immediately"""
+        mat = self.current_material
+        if not self.is_visible or not mat.has_shader:
+            return
+        if not self.is_initialized:
+            self.init_gl()
+        if not mat.is_initialized:
+            mat.init_gl()
+        mesh_vbo = self._select_lod_vbo(camera)
+        if not mesh_vbo.is_initialized:
+            mesh_vbo.init_gl()
+        queue.add(self, mat, mesh_vbo)
+
+    def draw_gl(self, camera, material, mesh_vbo):
+        """Draw with material already in use, and its camera matrices set"""
+        material.set_model_matrices(self, camera)
+        mesh_vbo.primitive = material.primitive()
+        mesh_vbo.display_gl(camera=camera)
 
     def dispose_gl(self):
         if self.mesh_vbo is not None:
-            self.mesh_vbo.dispose_gl()
+            self._resources.mesh_vbos.release(id(self.mesh))
+            self.mesh_vbo = None
+            self._resources = None
+        for v in self.lod_vbos[1:]:
+            v.dispose_gl()
         super().dispose_gl()
@@ -12,3 +12,5 @@ class PlaneActor(MeshActor):
             wireframe_material=PlaneHorizonLineMaterial(),
             render_pass=wiggle.render.base.RenderPassType.GROUND,
         )
+        # Screen quad geometry is not in model coordinates
+        self.is_cullable = False
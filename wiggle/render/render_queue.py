@@ -0,0 +1,47 @@
+from operator import attrgetter
+
+
+class DrawItem(object):
+    """One actor's draw call, with the state it needs"""
+    __slots__ = ('key', 'actor', 'material', 'mesh_vbo')
+
+    def __init__(self, actor, material, mesh_vbo):
+        self.actor = actor
+        self.material = material
+        self.mesh_vbo = mesh_vbo
+        program, texture = material.sort_key()
+        self.key = (program, texture, mesh_vbo.vao or 0)
+
+
+class RenderQueue(object):
+    """
+    Draw items collected from the children of one render pass.
+
+    flush() can sort them by (program, texture, vertex array), so each
+    material is bound, and its camera matrices uploaded, once per run of
+    items sharing it.
+    """
+    def __init__(self):
+        self.items = list()
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, actor, material, mesh_vbo):
+        self.items.append(DrawItem(actor, material, mesh_vbo))
+
+    def clear(self):
+        self.items.clear()
+
+    def flush(self, camera, sort=True):
+        """Draw, and then remove, all the items"""
+        if sort:
+            self.items.sort(key=attrgetter('key'))
+        material = None
+        for item in self.items:
+            if item.material is not material:
+                material = item.material
+                material.display_gl(camera)
+                material.set_camera_matrices(camera)
+            item.actor.draw_gl(camera, material, item.mesh_vbo)
+        self.items.clear()
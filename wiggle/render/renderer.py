@@ -1,6 +1,11 @@
 from OpenGL import GL
 
 from wiggle.render.base import AbstractRenderable, AutoInitRenderer, ParentRenderer, VaoRenderer, RenderPassType
+from wiggle.render.culling import FrustumCuller
+from wiggle.render.gl_state import gl_state
+from wiggle.render.render_queue import RenderQueue
+from wiggle.render.resource_cache import current_resources
+from wiggle.render.scene_graph import SceneGraph, SceneNode
 
 
 class ScreenClearer(AbstractRenderable):
@@ -19,14 +24,20 @@ class ScreenClearer(AbstractRenderable):
 
 
 class RenderPass(AutoInitRenderer, ParentRenderer):
-    def __init__(self, pass_type):
+    def __init__(self, pass_type, is_culling=False, is_sorting=False):
         """
 
         :type pass_type: RenderPassType
+        :param is_culling: skip children whose bounds are outside the view frustum
+        :param is_sorting: reorder draws to minimize state changes, where drawing order does not matter
         """
         super().__init__()
         self.pass_type = pass_type
         self._is_wireframe = False
+        self.is_culling = is_culling
+        self.culler = FrustumCuller()
+        self.is_sorting = is_sorting
+        self.render_queue = RenderQueue()
 
     def __eq__(self, other):
         return self.pass_type.value == other.pass_type.value
@@ -46,6 +57,36 @@ class RenderPass(AutoInitRenderer, ParentRenderer):
     def __ge__(self, other):
         return self.pass_type.value >= other.pass_type.value
 
+    def visible_children(self, camera=None, *args, **kwargs):
+        if not self.is_culling or camera is None:
+            return self.children
+        return self.culler.visible(self.children, camera)
+
+    def display_children_gl(self, children, camera=None, *args, **kwargs):
+        """
+        Queue the draws of children that support it, to flush at the end.
+        Others draw immediately, outside the GL state cache. Unless sorting,
+        the queue is flushed before each of those, to keep the list order.
+        """
+        if camera is None:
+            return super().display_children_gl(children, *args, **kwargs)
+        for c in children:
+            if hasattr(c, 'enqueue_gl'):
+                c.enqueue_gl(self.render_queue, camera)
+            else:
+                if not self.is_sorting:
+                    self.render_queue.flush(camera, sort=False)
+                c.display_gl(camera, *args, **kwargs)
+                gl_state.reset()
+        self.render_queue.flush(camera, sort=self.is_sorting)
+
+    def pick(self, origin, direction):
+        """Nearest child hit by the world space ray origin + t * direction, as (actor, t), or None"""
+        hierarchy = self.culler.hierarchy(self.children)
+        if len(hierarchy) < 1:
+            return None
+        return hierarchy.ray_cast(origin, direction)
+
     @property
     def wireframe(self):
         return self._is_wireframe
@@ -73,39 +114,40 @@ class SkyPass(RenderPass):
 
     def display_gl(self, *args, **kwargs):
         # The sky has no finite depth
-        GL.glDisable(GL.GL_DEPTH_TEST)  # Last to paint anywhere wins
-        GL.glDepthMask(False)
-        GL.glEnable(GL.GL_SAMPLE_ALPHA_TO_COVERAGE)  # Blend using MSAA
+        gl_state.disable(GL.GL_DEPTH_TEST)  # Last to paint anywhere wins
+        gl_state.depth_mask(False)
+        gl_state.enable(GL.GL_SAMPLE_ALPHA_TO_COVERAGE)  # Blend using MSAA
         super().display_gl(*args, **kwargs)
 
 
 class GroundPass(RenderPass):
     def __init__(self):
-        super().__init__(RenderPassType.GROUND)
+        super().__init__(RenderPassType.GROUND, is_culling=True)
 
     def display_gl(self, *args, **kwargs):
         # The sky has no finite depth
-        GL.glEnable(GL.GL_DEPTH_TEST)
-        GL.glDepthMask(True)
-        GL.glDepthFunc(GL.GL_LEQUAL)  # Paint over existing background, even at infinity.
+        gl_state.enable(GL.GL_DEPTH_TEST)
+        gl_state.depth_mask(True)
+        gl_state.depth_func(GL.GL_LEQUAL)  # Paint over existing background, even at infinity.
         super().display_gl(*args, **kwargs)
 
 
 class OpaquePass(RenderPass):
     def __init__(self):
-        super().__init__(RenderPassType.OPAQUE)
+        super().__init__(RenderPassType.OPAQUE, is_culling=True, is_sorting=True)
 
     def display_gl(self, *args, **kwargs):
-        GL.glEnable(GL.GL_DEPTH_TEST)
-        GL.glDepthMask(True)
-        GL.glDepthFunc(GL.GL_LESS)  # First to paint at a particular depth wins
+        gl_state.enable(GL.GL_DEPTH_TEST)
+        gl_state.depth_mask(True)
+        gl_state.depth_func(GL.GL_LESS)  # First to paint at a particular depth wins
         super().display_gl(*args, **kwargs)
 
 
 class Renderer(AutoInitRenderer, VaoRenderer, ParentRenderer):
-    """Organizes render passes and creates a default VBO"""
+    """Organizes render passes, the scene graph of actor transforms, and creates a default VBO"""
     def __init__(self):
         super().__init__()
+        self.scene = SceneGraph()
         self.clear_pass = ClearPass()
         self.sky_pass = SkyPass()
         self.ground_pass = GroundPass()
@@ -114,7 +156,17 @@ class Renderer(AutoInitRenderer, VaoRenderer, ParentRenderer):
         self.children.append(self.clear_pass)
         self._is_wireframe = False
 
-    def add_actor(self, actor, append=True):
+    def add_actor(self, actor, append=True, parent=None):
+        """
+        Add an actor to its default render pass.
+
+        :param parent: SceneNode, or an actor already added, whose transform
+            the actor's model matrix is relative to
+        """
+        if hasattr(actor, 'scene_node'):
+            if parent is not None and not isinstance(parent, SceneNode):
+                parent = parent.scene_node
+            actor.scene_node = self.scene.add_node(actor.model_matrix, parent)
         pass_switcher = {
             RenderPassType.CLEAR: self.clear_pass,
             RenderPassType.SKY: self.sky_pass,
@@ -130,6 +182,24 @@ class Renderer(AutoInitRenderer, VaoRenderer, ParentRenderer):
             self.children.append(pass_)
             self.children[:] = sorted(self.children[:])
 
+    def pick(self, origin, direction):
+        """Nearest actor in the ground and opaque passes hit by a world space ray, as (actor, t), or None"""
+        hits = [p.pick(origin, direction) for p in (self.ground_pass, self.opaque_pass)]
+        hits = [h for h in hits if h is not None]
+        if len(hits) < 1:
+            return None
+        return min(hits, key=lambda h: h[1])
+
+    def display_gl(self, *args, **kwargs):
+        camera = kwargs.get('camera', args[0] if len(args) > 0 else None)
+        if camera is not None and getattr(camera, 'viewport_size', None) is None:
+            # Cameras whose canvas never set viewport_size read the GL viewport once, on their first frame
+            camera.viewport_size = tuple(int(v) for v in GL.glGetIntegerv(GL.GL_VIEWPORT)[2:])
+        gl_state.begin_frame()
+        current_resources().texture_uploader.run()
+        self.scene.update()
+        super().display_gl(*args, **kwargs)
+
     @property
     def wireframe(self):
         return self._is_wireframe
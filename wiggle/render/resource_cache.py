@@ -0,0 +1,129 @@
+"""
+Sharing of GPU resources with identical contents.
+
+Each GL context has a ResourceManager, from current_resources(), with one
+ResourceCache each for buffers, textures and linked shader programs.
+Resources are keyed by their contents, such as a hash of the vertex array
+or the shader source text, so identical inputs are uploaded or compiled
+once. Mesh vertex array objects, which contexts cannot share, are cached
+per mesh object instead. Each manager also streams the texture uploads of
+its context. Owners acquire() a resource in init_gl(), and release() it in
+dispose_gl(); the last release deletes it.
+"""
+
+import hashlib
+
+import numpy
+from OpenGL import GL, contextdata, error
+
+from wiggle.render.gl_state import gl_state
+from wiggle.render.texture_upload import TextureUploader
+
+
+class ResourceCache(object):
+    """
+    Resources shared by several owners. Each is created by the first
+    acquire() of its key, and disposed when the last owner releases it.
+    """
+    def __init__(self, dispose=None):
+        """
+        :param dispose: function to delete one resource; by default its dispose_gl() method
+        """
+        self._resources = dict()  # key: [resource, reference count]
+        self._dispose = dispose
+
+    def __len__(self):
+        return len(self._resources)
+
+    def __contains__(self, key):
+        return key in self._resources
+
+    def acquire(self, key, create):
+        """The resource for key, made with create() if there is none yet"""
+        entry = self._resources.get(key)
+        if entry is None:
+            entry = self._resources[key] = [create(), 0]
+        entry[1] += 1
+        return entry[0]
+
+    def release(self, key):
+        entry = self._resources[key]
+        entry[1] -= 1
+        if entry[1] < 1:
+            del self._resources[key]
+            if self._dispose is None:
+                entry[0].dispose_gl()
+            else:
+                self._dispose(entry[0])
+
+    def reference_count(self, key):
+        entry = self._resources.get(key)
+        return 0 if entry is None else entry[1]
+
+
+def array_key(array, *extra):
+    """Content key of a numpy array, for caching resources made from it"""
+    array = numpy.ascontiguousarray(array)
+    digest = hashlib.blake2b(array.view(numpy.uint8).reshape(-1), digest_size=16).hexdigest()
+    return (digest, array.dtype.str, array.shape) + extra
+
+
+def _delete_buffer(buffer):
+    buffer.delete()
+
+
+def _delete_program(program):
+    GL.glDeleteProgram(program)
+    gl_state.reset()  # the id may be reused
+
+
+class ResourceManager(object):
+    """Shared resources of one GL context"""
+    def __init__(self):
+        self.buffers = ResourceCache(dispose=_delete_buffer)  # OpenGL.arrays.vbo.VBO
+        self.textures = ResourceCache()  # objects with a texture_id and dispose_gl()
+        self.programs = ResourceCache(dispose=_delete_program)  # linked program ids
+        # MeshVbos by id of their mesh; each MeshVbo keeps its mesh alive, so the id stays unique.
+        # These hold vertex array objects, so their buffers, not they, are shared by content.
+        self.mesh_vbos = ResourceCache()
+        self.texture_uploader = TextureUploader()  # Renderer.display_gl() runs it each frame
+
+    def dispose_gl(self):
+        """Delete what the manager owns itself, rather than shares, before its context is destroyed"""
+        self.texture_uploader.dispose_gl()
+
+
+_managers = dict()  # by context
+
+
+def _current_context():
+    try:
+        return contextdata.getContext()
+    except error.Error:
+        return None  # no current context, as in tests
+
+
+def current_resources():
+    """ResourceManager of the current GL context"""
+    context = _current_context()
+    manager = _managers.get(context)
+    if manager is None:
+        manager = _managers[context] = ResourceManager()
+    return manager
+
+
+def forget_context(context=None):
+    """
+    Drop the resources of a destroyed GL context, by default the current one,
+    without deleting them. That includes its mesh VBOs and texture uploads.
+    """
+    if context is None:
+        context = _current_context()
+    _managers.pop(context, None)
+
+
+def dispose_context():
+    """Dispose and forget the ResourceManager of the current GL context, just before destroying it"""
+    manager = _managers.pop(_current_context(), None)
+    if manager is not None:
+        manager.dispose_gl()
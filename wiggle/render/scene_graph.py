@@ -0,0 +1,167 @@
+"""
+Hierarchy of model transforms.
+
+Each SceneNode has a local ModelMatrix, relative to its parent node. The
+SceneGraph keeps the local and world matrices of all its nodes in two
+stacked arrays. Setting a node's center, rotation or scale marks it dirty,
+and update() recomputes world matrices for only the dirty nodes and their
+descendants, one numpy matmul per tree depth.
+"""
+
+import numpy
+
+from wiggle.geometry.matrix import ModelMatrix, identity_matrices
+
+
+class SceneNode(object):
+    """One transform in a SceneGraph"""
+    def __init__(self, graph, index, model_matrix):
+        self.graph = graph
+        self.index = index
+        self.model_matrix = model_matrix
+        self.parent = None
+        self.children = list()
+        model_matrix.on_change = self._changed
+
+    def __repr__(self):
+        return f'SceneNode({self.index})'
+
+    def _changed(self):
+        self.graph._dirty_nodes.add(self.index)
+
+    def add_child(self, model_matrix=None):
+        """New node, with this one as its parent"""
+        return self.graph.add_node(model_matrix, parent=self)
+
+    def set_parent(self, parent):
+        self.graph.set_parent(self, parent)
+
+    @property
+    def world_matrix(self):
+        """
+        Parent world matrix @ model matrix, as a view into the graph's
+        world matrix array, valid until more nodes are added.
+        """
+        return self.graph.world_matrix(self.index)
+
+
+class SceneGraph(object):
+    def __init__(self, capacity=64):
+        self.nodes = list()
+        self._local = identity_matrices(capacity)
+        self._world = identity_matrices(capacity)
+        self._parents = numpy.full(capacity, -1, dtype=numpy.int64)
+        self._dirty = numpy.zeros(capacity, dtype=bool)
+        self._dirty_nodes = set()
+        self._levels = None  # node indexes at each depth, roots first
+        self.updated_node_count = 0  # world matrices recomputed by the last update()
+        self.version = 0  # counts the updates that recomputed any world matrix
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def _grow(self, capacity):
+        count = len(self.nodes)
+        local = identity_matrices(capacity)
+        local[:count] = self._local[:count]
+        world = identity_matrices(capacity)
+        world[:count] = self._world[:count]
+        parents = numpy.full(capacity, -1, dtype=numpy.int64)
+        parents[:count] = self._parents[:count]
+        self._local, self._world, self._parents = local, world, parents
+        self._dirty = numpy.zeros(capacity, dtype=bool)
+
+    def add_node(self, model_matrix=None, parent=None):
+        """
+        New SceneNode, with its own ModelMatrix unless one is given.
+
+        :param parent: SceneNode, or None for a new root node
+        """
+        if model_matrix is None:
+            model_matrix = ModelMatrix()
+        index = len(self.nodes)
+        if index >= len(self._local):
+            self._grow(2 * len(self._local))
+        node = SceneNode(self, index, model_matrix)
+        self.nodes.append(node)
+        self._attach(node, parent)
+        self._levels = None
+        self._dirty_nodes.add(index)
+        return node
+
+    def _attach(self, node, parent):
+        node.parent = parent
+        if parent is None:
+            self._parents[node.index] = -1
+        else:
+            if parent.graph is not self:
+                raise ValueError('parent node belongs to a different scene graph')
+            parent.children.append(node)
+            self._parents[node.index] = parent.index
+
+    def set_parent(self, node, parent):
+        """Move node, and its descendants, under a different parent, or None to make it a root"""
+        ancestor = parent
+        while ancestor is not None:
+            if ancestor is node:
+                raise ValueError('a scene node cannot be its own ancestor')
+            ancestor = ancestor.parent
+        if node.parent is not None:
+            node.parent.children.remove(node)
+        self._attach(node, parent)
+        self._levels = None
+        self._dirty_nodes.add(node.index)
+
+    def _compute_levels(self):
+        count = len(self.nodes)
+        parents = self._parents[:count]
+        depths = numpy.zeros(count, dtype=numpy.int64)
+        ancestors = parents.copy()
+        has_ancestor = ancestors >= 0
+        while numpy.any(has_ancestor):
+            depths[has_ancestor] += 1
+            ancestors[has_ancestor] = parents[ancestors[has_ancestor]]
+            has_ancestor = ancestors >= 0
+        order = numpy.argsort(depths, kind='stable')
+        boundaries = numpy.flatnonzero(numpy.diff(depths[order])) + 1
+        return numpy.split(order, boundaries)
+
+    def update(self):
+        """Recompute world matrices of dirty nodes and their descendants"""
+        self.updated_node_count = 0
+        if len(self._dirty_nodes) < 1:
+            return
+        self.version += 1
+        if self._levels is None:
+            self._levels = self._compute_levels()
+        count = len(self.nodes)
+        dirty = self._dirty[:count]
+        dirty[:] = False
+        for index in self._dirty_nodes:
+            self._local[index] = self.nodes[index].model_matrix.matrix
+            dirty[index] = True
+        self._dirty_nodes.clear()
+        roots = self._levels[0]
+        changed = roots[dirty[roots]]
+        self._world[changed] = self._local[changed]
+        self.updated_node_count += len(changed)
+        for level in self._levels[1:]:
+            parents = self._parents[level]
+            # A node is also dirty if its parent is, so dirt flows down one level at a time
+            level_dirty = dirty[level] | dirty[parents]
+            dirty[level] = level_dirty
+            changed = level[level_dirty]
+            if len(changed) > 0:
+                self._world[changed] = numpy.matmul(self._world[parents[level_dirty]], self._local[changed])
+                self.updated_node_count += len(changed)
+
+    def world_matrix(self, index):
+        if len(self._dirty_nodes) > 0:
+            self.update()
+        return self._world[index]
+
+    def world_matrices(self):
+        """(N, 4, 4) world matrices of all nodes, in node order"""
+        if len(self._dirty_nodes) > 0:
+            self.update()
+        return self._world[:len(self.nodes)]
@@ -15,3 +15,5 @@ class SkyBoxActor(MeshActor):
             wireframe_material=NothingMaterial(),
             render_pass=wiggle.render.base.RenderPassType.SKY,
         )
+        # Screen quad geometry is not in model coordinates
+        self.is_cullable = False
@@ -13,3 +13,5 @@ class SkySphereActor(MeshActor):
             wireframe_material=NothingMaterial(),
             render_pass=wiggle.render.base.RenderPassType.OPAQUE,
         )
+        # Screen quad geometry is not in model coordinates
+        self.is_cullable = False
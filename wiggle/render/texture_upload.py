@@ -0,0 +1,171 @@
+"""
+Streaming of large images into textures over several frames.
+
+A 16K panorama takes hundreds of milliseconds to upload in one call,
+which drops frames, in VR especially. TextureUploader instead copies a
+band of rows at a time into a pixel buffer object, which the driver
+transfers to the texture asynchronously, and stops each frame once a
+budget of bytes or milliseconds is spent. Rows are flipped bottom up,
+as OpenGL expects, by the same copy that fills the pixel buffer.
+"""
+
+import ctypes
+import math
+import time
+
+import numpy
+from OpenGL import GL
+
+from wiggle.render.gl_state import gl_state
+
+DEFAULT_BUDGET_BYTES = 16 << 20
+DEFAULT_BUDGET_MS = 2.0
+DEFAULT_CHUNK_BYTES = 4 << 20
+_BUFFER_COUNT = 2  # pixel buffers in rotation, so filling one need not wait for the last transfer
+
+
+def mipmap_level_count(width, height):
+    return int(math.floor(math.log2(max(width, height, 1)))) + 1
+
+
+def create_texture_storage(width, height, is_equirectangular=False):
+    """New immutable RGBA8 texture with a full mipmap chain, left bound"""
+    texture_id = GL.glGenTextures(1)
+    gl_state.bind_texture(GL.GL_TEXTURE_2D, texture_id)
+    GL.glTexStorage2D(GL.GL_TEXTURE_2D, mipmap_level_count(width, height), GL.GL_RGBA8, width, height)
+    GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_LINEAR)
+    GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR_MIPMAP_NEAREST)
+    if is_equirectangular:
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T, GL.GL_MIRRORED_REPEAT)
+    return texture_id
+
+
+class TextureUpload(object):
+    """One image on its way into level 0 of a texture, then mipmapped"""
+    def __init__(self, texture_id, pixels, on_done=None, target=GL.GL_TEXTURE_2D, image_target=None,
+                 generate_mipmap=True):
+        """
+        :param pixels: (height, width, 4) uint8 RGBA array, top row first
+        :param image_target: the image within target to fill, such as one face of a cube map
+        :param generate_mipmap: whether the texture is complete after this upload
+        """
+        self.texture_id = texture_id
+        self.rows = pixels
+        self.on_done = on_done  # called with this upload, once the texture is complete
+        self.target = target
+        self.image_target = target if image_target is None else image_target
+        self.generate_mipmap = generate_mipmap
+        self.next_row = 0  # rows are sent from the bottom of the image up
+        self.is_done = False
+        self.is_cancelled = False
+
+    @property
+    def height(self):
+        return self.rows.shape[0]
+
+    @property
+    def remaining_bytes(self):
+        return (self.height - self.next_row) * self.rows.shape[1] * 4
+
+
+class TextureUploader(object):
+    """
+    Queue of TextureUploads, advanced by run() once per frame on the GL
+    thread, within budget_bytes and budget_ms. At least one band of rows
+    is sent each frame, so every upload finishes eventually.
+    """
+    def __init__(self, budget_bytes=DEFAULT_BUDGET_BYTES, budget_ms=DEFAULT_BUDGET_MS,
+                 chunk_bytes=DEFAULT_CHUNK_BYTES):
+        self.budget_bytes = budget_bytes
+        self.budget_ms = budget_ms
+        self.chunk_bytes = chunk_bytes
+        self.uploads = []
+        self._buffers = None
+        self._next_buffer = 0
+        self.uploaded_bytes = 0  # by the last run()
+
+    def __len__(self):
+        return len(self.uploads)
+
+    def submit(self, texture_id, pixels, on_done=None, **kwargs):
+        """Queue a TextureUpload, with keyword arguments as for its constructor"""
+        upload = TextureUpload(texture_id, pixels, on_done, **kwargs)
+        self.uploads.append(upload)
+        return upload
+
+    def upload_now(self, texture_id, pixels, **kwargs):
+        """Send a whole small image at once, through the pixel buffers, returning the finished TextureUpload"""
+        upload = TextureUpload(texture_id, pixels, **kwargs)
+        while upload.next_row < upload.height:
+            self._send_chunk(upload)
+        self._complete(upload)
+        return upload
+
+    def cancel(self, upload):
+        upload.is_cancelled = True
+        if upload in self.uploads:
+            self.uploads.remove(upload)
+
+    def run(self):
+        """Send rows of the queued uploads until this frame's budget is spent"""
+        self.uploaded_bytes = 0
+        if len(self.uploads) < 1:
+            return
+        start = time.perf_counter()
+        while len(self.uploads) > 0:
+            upload = self.uploads[0]
+            self.uploaded_bytes += self._send_chunk(upload)
+            if upload.next_row >= upload.height:
+                self._finish(upload)
+            if self.uploaded_bytes >= self.budget_bytes:
+                break
+            if (time.perf_counter() - start) * 1000.0 >= self.budget_ms:
+                break
+
+    def _chunk_row_count(self, upload):
+        row_bytes = upload.rows.shape[1] * 4
+        return max(1, min(self.chunk_bytes // row_bytes, upload.height - upload.next_row))
+
+    def _send_chunk(self, upload):
+        row_count = self._chunk_row_count(upload)
+        width = upload.rows.shape[1]
+        size = row_count * width * 4
+        # GL row y is image row height - 1 - y
+        bottom = upload.height - upload.next_row
+        band = upload.rows[bottom - row_count:bottom][::-1]
+        if self._buffers is None:
+            self._buffers = GL.glGenBuffers(_BUFFER_COUNT)
+        buffer = self._buffers[self._next_buffer]
+        self._next_buffer = (self._next_buffer + 1) % _BUFFER_COUNT
+        GL.glBindBuffer(GL.GL_PIXEL_UNPACK_BUFFER, buffer)
+        # Orphan the previous contents, rather than wait for their transfer
+        GL.glBufferData(GL.GL_PIXEL_UNPACK_BUFFER, size, None, GL.GL_STREAM_DRAW)
+        address = GL.glMapBufferRange(
+            GL.GL_PIXEL_UNPACK_BUFFER, 0, size, GL.GL_MAP_WRITE_BIT | GL.GL_MAP_INVALIDATE_BUFFER_BIT)
+        mapped = numpy.ctypeslib.as_array((ctypes.c_ubyte * size).from_address(address))
+        mapped.reshape(band.shape)[...] = band
+        GL.glUnmapBuffer(GL.GL_PIXEL_UNPACK_BUFFER)
+        gl_state.bind_texture(upload.target, upload.texture_id)
+        GL.glTexSubImage2D(
+            upload.image_target, 0, 0, upload.next_row, width, row_count, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE,
+            ctypes.c_void_p(0))
+        GL.glBindBuffer(GL.GL_PIXEL_UNPACK_BUFFER, 0)
+        upload.next_row += row_count
+        return size
+
+    def _finish(self, upload):
+        self.uploads.remove(upload)
+        self._complete(upload)
+
+    def _complete(self, upload):
+        if upload.generate_mipmap:
+            gl_state.bind_texture(upload.target, upload.texture_id)
+            GL.glGenerateMipmap(upload.target)
+        upload.is_done = True
+        if upload.on_done is not None:
+            upload.on_done(upload)
+
+    def dispose_gl(self):
+        if self._buffers is not None:
+            GL.glDeleteBuffers(_BUFFER_COUNT, self._buffers)
+            self._buffers = None